@@ -41,6 +41,17 @@ def displayhook(value: Any) -> None:
     setattr(builtins, '_', value)
 
 
+def nonnegative_int(value: str) -> int:
+    # argparse reports ArgumentTypeError with parser.error().
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid int value: {value!r}')
+    if n < 0:
+        raise argparse.ArgumentTypeError(f'must not be negative: {value!r}')
+    return n
+
+
 def main() -> None:
     python_version = '.'.join(str(v) for v in sys.version_info[:3])
     libkdumpfile = f'with{"" if drgn._with_libkdumpfile else "out"} libkdumpfile'
@@ -68,6 +79,18 @@ def main() -> None:
     symbol_group.add_argument(
         '--no-default-symbols', dest='default_symbols', action='store_false',
         help="don't load any debugging symbols that were not explicitly added with -s")
+    symbol_group.add_argument(
+        '--kallsyms', action='store_true',
+        help="get kernel symbols from kallsyms instead of loading debugging symbols; implies --no-default-symbols")
+    symbol_group.add_argument(
+        '--btf', metavar='PATH', nargs='?', const='', type=str,
+        help="get kernel types from BTF (from PATH or /sys/kernel/btf/vmlinux) instead of loading debugging symbols; implies --no-default-symbols")
+    symbol_group.add_argument(
+        '--lazy-modules', dest='lazy_modules', action='store_true',
+        help="don't index debugging symbols for loaded kernel modules until they are needed")
+    symbol_group.add_argument(
+        '--threads', metavar='N', type=nonnegative_int,
+        help='index debugging symbols with N threads (default: number of CPUs)')
 
     parser.add_argument(
         '-q', '--quiet', action='store_true',
@@ -86,8 +109,26 @@ def main() -> None:
         prog.set_pid(args.pid or os.getpid())
     else:
         prog.set_kernel()
+    if args.threads is not None:
+        prog.num_threads = args.threads
+    if args.lazy_modules:
+        prog.lazy_kernel_modules = True
+    if args.kallsyms:
+        try:
+            prog.load_kallsyms()
+        except Exception as e:
+            if not args.quiet:
+                print(f'could not load kallsyms: {e}', file=sys.stderr)
+    if args.btf is not None:
+        try:
+            prog.load_btf(args.btf or None)
+        except Exception as e:
+            if not args.quiet:
+                print(f'could not load BTF: {e}', file=sys.stderr)
     try:
-        prog.load_debug_info(args.symbols or [], args.default_symbols)
+        prog.load_debug_info(args.symbols or [],
+                             args.default_symbols and not args.kallsyms and
+                             args.btf is None)
     except drgn.MissingDebugInfoError as e:
         if not args.quiet:
             print(str(e), file=sys.stderr)
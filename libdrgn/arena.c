@@ -0,0 +1,102 @@
+// Copyright 2019 - Omar Sandoval
+// SPDX-License-Identifier: GPL-3.0+
+
+#include <stdalign.h>
+#include <stdlib.h>
+
+#include "arena.h"
+
+/*
+ * Allocations larger than this get a dedicated chunk so that they don't waste
+ * the remainder of the current chunk.
+ */
+#define DRGN_ARENA_LARGE_ALLOC 4096
+#define DRGN_ARENA_CHUNK_SIZE (64 * 1024)
+
+struct drgn_arena_chunk {
+	struct drgn_arena_chunk *next;
+	alignas(max_align_t) char data[];
+};
+
+void drgn_arena_init(struct drgn_arena *arena)
+{
+	arena->chunks = NULL;
+	arena->ptr = arena->end = NULL;
+	arena->capacity = arena->size = 0;
+}
+
+void drgn_arena_deinit(struct drgn_arena *arena)
+{
+	struct drgn_arena_chunk *chunk, *next;
+
+	for (chunk = arena->chunks; chunk; chunk = next) {
+		next = chunk->next;
+		free(chunk);
+	}
+}
+
+static struct drgn_arena_chunk *drgn_arena_new_chunk(struct drgn_arena *arena,
+						     size_t size)
+{
+	struct drgn_arena_chunk *chunk;
+
+	if (__builtin_add_overflow(size, sizeof(*chunk), &size))
+		return NULL;
+	chunk = malloc(size);
+	if (!chunk)
+		return NULL;
+	arena->capacity += size;
+	return chunk;
+}
+
+void *drgn_arena_alloc(struct drgn_arena *arena, size_t size)
+{
+	struct drgn_arena_chunk *chunk;
+	void *ret;
+
+	/* Round up to keep every allocation maximally aligned. */
+	if (__builtin_add_overflow(size, alignof(max_align_t) - 1, &size))
+		return NULL;
+	size &= ~(alignof(max_align_t) - 1);
+
+	if (size > (size_t)(arena->end - arena->ptr)) {
+		if (size > DRGN_ARENA_LARGE_ALLOC) {
+			chunk = drgn_arena_new_chunk(arena, size);
+			if (!chunk)
+				return NULL;
+			/*
+			 * Link it behind the current chunk so that we keep
+			 * allocating from the current one.
+			 */
+			if (arena->chunks) {
+				chunk->next = arena->chunks->next;
+				arena->chunks->next = chunk;
+			} else {
+				chunk->next = NULL;
+				arena->chunks = chunk;
+			}
+			arena->size += size;
+			return chunk->data;
+		}
+		chunk = drgn_arena_new_chunk(arena, DRGN_ARENA_CHUNK_SIZE);
+		if (!chunk)
+			return NULL;
+		chunk->next = arena->chunks;
+		arena->chunks = chunk;
+		arena->ptr = chunk->data;
+		arena->end = chunk->data + DRGN_ARENA_CHUNK_SIZE;
+	}
+	ret = arena->ptr;
+	arena->ptr += size;
+	arena->size += size;
+	return ret;
+}
+
+void *drgn_arena_alloc_flex(struct drgn_arena *arena, size_t size, size_t n,
+			    size_t element_size)
+{
+	if (__builtin_mul_overflow(n, element_size, &n) ||
+	    __builtin_add_overflow(size, n, &size))
+		return NULL;
+	return drgn_arena_alloc(arena, size);
+}
@@ -0,0 +1,79 @@
+// Copyright 2019 - Omar Sandoval
+// SPDX-License-Identifier: GPL-3.0+
+
+/**
+ * @file
+ *
+ * Arena allocator.
+ *
+ * See @ref Arenas.
+ */
+
+#ifndef DRGN_ARENA_H
+#define DRGN_ARENA_H
+
+#include <stddef.h>
+
+/**
+ * @ingroup Internals
+ *
+ * @defgroup Arenas Arenas
+ *
+ * Allocator for many small objects with the same lifetime.
+ *
+ * An arena allocates memory from @c malloc() in large chunks and carves
+ * allocations out of them. This avoids the per-allocation overhead of @c
+ * malloc(). Allocations cannot be freed individually; all of the memory in an
+ * arena is freed at once by @ref drgn_arena_deinit().
+ *
+ * @{
+ */
+
+struct drgn_arena_chunk;
+
+/** Arena allocator instance. */
+struct drgn_arena {
+	/** Chunks allocated by this arena, most recent first. */
+	struct drgn_arena_chunk *chunks;
+	/** Next free byte in the current chunk. */
+	char *ptr;
+	/** End of the current chunk. */
+	char *end;
+	/** Total number of bytes allocated from @c malloc(). */
+	size_t capacity;
+	/** Total number of bytes handed out by @ref drgn_arena_alloc(). */
+	size_t size;
+};
+
+/** Initialize a @ref drgn_arena. */
+void drgn_arena_init(struct drgn_arena *arena);
+
+/** Free all memory allocated by a @ref drgn_arena. */
+void drgn_arena_deinit(struct drgn_arena *arena);
+
+/**
+ * Allocate memory from a @ref drgn_arena.
+ *
+ * The returned memory is suitably aligned for any type and is valid until the
+ * arena is deinitialized.
+ *
+ * @return The allocated memory, or @c NULL if out of memory.
+ */
+void *drgn_arena_alloc(struct drgn_arena *arena, size_t size);
+
+/**
+ * Allocate memory for a structure with a trailing array from a @ref
+ * drgn_arena.
+ *
+ * @param[in] size Size of the structure.
+ * @param[in] n Number of array elements.
+ * @param[in] element_size Size of each array element.
+ * @return The allocated memory, or @c NULL if out of memory or the size
+ * overflows.
+ */
+void *drgn_arena_alloc_flex(struct drgn_arena *arena, size_t size, size_t n,
+			    size_t element_size);
+
+/** @} */
+
+#endif /* DRGN_ARENA_H */
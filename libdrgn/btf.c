@@ -0,0 +1,1418 @@
+// Copyright 2019 - Omar Sandoval
+// SPDX-License-Identifier: GPL-3.0+
+
+#include <byteswap.h>
+#include <elfutils/libdwelf.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <gelf.h>
+#include <inttypes.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/stat.h>
+
+#include "internal.h"
+#include "arena.h"
+#include "btf.h"
+#include "hash_table.h"
+#include "program.h"
+#include "type.h"
+#include "type_index.h"
+#include "vector.h"
+
+/*
+ * The BTF format is defined in the Linux kernel's include/uapi/linux/btf.h. We
+ * don't want to depend on the kernel headers being recent enough, so we define
+ * what we need here.
+ */
+
+#define BTF_MAGIC 0xeb9f
+#define BTF_VERSION 1
+
+enum {
+	BTF_KIND_UNKN,
+	BTF_KIND_INT,
+	BTF_KIND_PTR,
+	BTF_KIND_ARRAY,
+	BTF_KIND_STRUCT,
+	BTF_KIND_UNION,
+	BTF_KIND_ENUM,
+	BTF_KIND_FWD,
+	BTF_KIND_TYPEDEF,
+	BTF_KIND_VOLATILE,
+	BTF_KIND_CONST,
+	BTF_KIND_RESTRICT,
+	BTF_KIND_FUNC,
+	BTF_KIND_FUNC_PROTO,
+	BTF_KIND_VAR,
+	BTF_KIND_DATASEC,
+	BTF_KIND_FLOAT,
+	BTF_KIND_DECL_TAG,
+	BTF_KIND_TYPE_TAG,
+	BTF_KIND_ENUM64,
+};
+
+#define BTF_INFO_KIND(info) (((info) >> 24) & 0x1f)
+#define BTF_INFO_VLEN(info) ((info) & 0xffff)
+#define BTF_INFO_KFLAG(info) ((info) >> 31)
+
+#define BTF_INT_ENCODING(val) (((val) & 0x0f000000) >> 24)
+#define BTF_INT_OFFSET(val) (((val) & 0x00ff0000) >> 16)
+#define BTF_INT_BITS(val) ((val) & 0x000000ff)
+
+#define BTF_INT_SIGNED (1 << 0)
+#define BTF_INT_CHAR (1 << 1)
+#define BTF_INT_BOOL (1 << 2)
+
+#define BTF_MEMBER_BITFIELD_SIZE(val) ((val) >> 24)
+#define BTF_MEMBER_BIT_OFFSET(val) ((val) & 0xffffff)
+
+struct btf_header {
+	uint16_t magic;
+	uint8_t version;
+	uint8_t flags;
+	uint32_t hdr_len;
+	uint32_t type_off;
+	uint32_t type_len;
+	uint32_t str_off;
+	uint32_t str_len;
+};
+
+/*
+ * Every BTF type and the data following it consists of 32-bit words, so once
+ * the type section is in host byte order, these can be accessed directly.
+ */
+struct btf_type {
+	uint32_t name_off;
+	uint32_t info;
+	union {
+		uint32_t size;
+		uint32_t type;
+	};
+};
+
+struct btf_array {
+	uint32_t type;
+	uint32_t index_type;
+	uint32_t nelems;
+};
+
+struct btf_member {
+	uint32_t name_off;
+	uint32_t type;
+	uint32_t offset;
+};
+
+struct btf_enum {
+	uint32_t name_off;
+	int32_t val;
+};
+
+struct btf_enum64 {
+	uint32_t name_off;
+	uint32_t val_lo32;
+	uint32_t val_hi32;
+};
+
+struct btf_param {
+	uint32_t name_off;
+	uint32_t type;
+};
+
+DEFINE_VECTOR(btf_type_offset_vector, uint32_t)
+DEFINE_HASH_MAP(drgn_btf_name_map, struct string, uint32_t, string_hash,
+		string_eq)
+
+/* Namespaces of the names indexed from BTF. */
+enum drgn_btf_namespace {
+	/* Integer, boolean, and floating-point types. */
+	DRGN_BTF_BASE,
+	DRGN_BTF_STRUCT,
+	DRGN_BTF_UNION,
+	DRGN_BTF_ENUM,
+	DRGN_BTF_TYPEDEF,
+	DRGN_BTF_ENUMERATOR,
+	DRGN_BTF_FUNC,
+	DRGN_BTF_NUM_NAMESPACES,
+};
+
+struct drgn_btf {
+	struct drgn_program *prog;
+	/* Raw BTF with the type section converted to host byte order. */
+	char *data;
+	size_t size;
+	const uint32_t *types;
+	const char *strs;
+	uint32_t strs_len;
+	/*
+	 * Offset of each type in types, in 32-bit words, indexed by type ID.
+	 * Type ID 0 is void, so its entry is unused.
+	 */
+	uint32_t *type_offsets;
+	uint32_t num_types;
+	/*
+	 * Types which have already been parsed, indexed by type ID. The type
+	 * is NULL if it hasn't been parsed yet.
+	 */
+	struct drgn_qualified_type *cache;
+	/*
+	 * Map from name to the ID of the type defining it for each @ref
+	 * drgn_btf_namespace.
+	 */
+	struct drgn_btf_name_map names[DRGN_BTF_NUM_NAMESPACES];
+	/* Arena which parsed types and lazy types are allocated from. */
+	struct drgn_arena arena;
+	/* Current parsing recursion depth. */
+	int depth;
+};
+
+static inline const struct btf_type *btf_type(struct drgn_btf *btf,
+					      uint32_t id)
+{
+	return (const struct btf_type *)&btf->types[btf->type_offsets[id]];
+}
+
+static struct drgn_error *btf_name(struct drgn_btf *btf, uint32_t name_off,
+				   const char **ret)
+{
+	if (name_off >= btf->strs_len) {
+		return drgn_error_format(DRGN_ERROR_OTHER,
+					 "BTF string offset %" PRIu32 " is out of bounds",
+					 name_off);
+	}
+	*ret = &btf->strs[name_off];
+	return NULL;
+}
+
+/* Like btf_name(), but returns NULL for an anonymous type. */
+static struct drgn_error *btf_tag(struct drgn_btf *btf, uint32_t name_off,
+				  const char **ret)
+{
+	struct drgn_error *err;
+
+	err = btf_name(btf, name_off, ret);
+	if (!err && !**ret)
+		*ret = NULL;
+	return err;
+}
+
+static bool btf_type_is_incomplete(const struct btf_type *t)
+{
+	switch (BTF_INFO_KIND(t->info)) {
+	case BTF_KIND_FWD:
+		return true;
+	case BTF_KIND_ENUM:
+	case BTF_KIND_ENUM64:
+		/* A forward-declared enum is encoded without enumerators. */
+		return BTF_INFO_VLEN(t->info) == 0;
+	default:
+		return false;
+	}
+}
+
+static struct drgn_error *
+drgn_type_from_btf_internal(struct drgn_btf *btf, uint32_t id,
+			    bool can_be_incomplete_array,
+			    struct drgn_qualified_type *ret);
+
+static inline struct drgn_error *
+drgn_type_from_btf(struct drgn_btf *btf, uint32_t id,
+		   struct drgn_qualified_type *ret)
+{
+	return drgn_type_from_btf_internal(btf, id, false, ret);
+}
+
+struct drgn_type_from_btf_thunk {
+	struct drgn_type_thunk thunk;
+	struct drgn_btf *btf;
+	uint32_t id;
+	bool can_be_incomplete_array;
+};
+
+static struct drgn_error *
+drgn_type_from_btf_thunk_evaluate_fn(struct drgn_type_thunk *thunk,
+				     struct drgn_qualified_type *ret)
+{
+	struct drgn_type_from_btf_thunk *t;
+
+	t = container_of(thunk, struct drgn_type_from_btf_thunk, thunk);
+	return drgn_type_from_btf_internal(t->btf, t->id,
+					   t->can_be_incomplete_array, ret);
+}
+
+static void drgn_type_from_btf_thunk_free_fn(struct drgn_type_thunk *thunk)
+{
+	/* Thunks are allocated from the arena. */
+}
+
+static struct drgn_error *drgn_lazy_type_from_btf(struct drgn_btf *btf,
+						  uint32_t id,
+						  bool can_be_incomplete_array,
+						  struct drgn_lazy_type *ret)
+{
+	struct drgn_type_from_btf_thunk *thunk;
+
+	if (id == 0) {
+		drgn_lazy_type_init_evaluated(ret, &drgn_void_type, 0);
+		return NULL;
+	}
+
+	thunk = drgn_arena_alloc(&btf->arena, sizeof(*thunk));
+	if (!thunk)
+		return &drgn_enomem;
+
+	thunk->thunk.evaluate_fn = drgn_type_from_btf_thunk_evaluate_fn;
+	thunk->thunk.free_fn = drgn_type_from_btf_thunk_free_fn;
+	thunk->btf = btf;
+	thunk->id = id;
+	thunk->can_be_incomplete_array = can_be_incomplete_array;
+	drgn_lazy_type_init_thunk(ret, &thunk->thunk);
+	return NULL;
+}
+
+static struct drgn_error *drgn_int_type_from_btf(struct drgn_btf *btf,
+						 const struct btf_type *t,
+						 struct drgn_type **ret)
+{
+	struct drgn_error *err;
+	struct drgn_type *type;
+	uint32_t encoding = *(const uint32_t *)(t + 1);
+	const char *name;
+
+	err = btf_tag(btf, t->name_off, &name);
+	if (err)
+		return err;
+	if (!name) {
+		return drgn_error_create(DRGN_ERROR_OTHER,
+					 "BTF_KIND_INT has no name");
+	}
+
+	type = drgn_arena_alloc(&btf->arena, sizeof(*type));
+	if (!type)
+		return &drgn_enomem;
+	if (BTF_INT_ENCODING(encoding) & BTF_INT_BOOL) {
+		drgn_bool_type_init(type, name, t->size);
+	} else {
+		drgn_int_type_init(type, name, t->size,
+				   BTF_INT_ENCODING(encoding) & BTF_INT_SIGNED);
+	}
+	*ret = type;
+	return NULL;
+}
+
+static struct drgn_error *drgn_float_type_from_btf(struct drgn_btf *btf,
+						   const struct btf_type *t,
+						   struct drgn_type **ret)
+{
+	struct drgn_error *err;
+	struct drgn_type *type;
+	const char *name;
+
+	err = btf_tag(btf, t->name_off, &name);
+	if (err)
+		return err;
+	if (!name) {
+		return drgn_error_create(DRGN_ERROR_OTHER,
+					 "BTF_KIND_FLOAT has no name");
+	}
+
+	type = drgn_arena_alloc(&btf->arena, sizeof(*type));
+	if (!type)
+		return &drgn_enomem;
+	drgn_float_type_init(type, name, t->size);
+	*ret = type;
+	return NULL;
+}
+
+static struct drgn_error *drgn_pointer_type_from_btf(struct drgn_btf *btf,
+						     const struct btf_type *t,
+						     struct drgn_type **ret)
+{
+	struct drgn_error *err;
+	struct drgn_qualified_type referenced_type;
+
+	err = drgn_type_from_btf(btf, t->type, &referenced_type);
+	if (err)
+		return err;
+	return drgn_type_index_pointer_type(&btf->prog->tindex,
+					    referenced_type, ret);
+}
+
+static struct drgn_error *drgn_array_type_from_btf(struct drgn_btf *btf,
+						   const struct btf_type *t,
+						   bool can_be_incomplete_array,
+						   struct drgn_type **ret)
+{
+	struct drgn_error *err;
+	const struct btf_array *array = (const struct btf_array *)(t + 1);
+	struct drgn_qualified_type element_type;
+
+	err = drgn_type_from_btf(btf, array->type, &element_type);
+	if (err)
+		return err;
+	/*
+	 * BTF doesn't distinguish between zero-length and incomplete arrays;
+	 * assume that a flexible array member was intended where one is
+	 * allowed.
+	 */
+	if (array->nelems == 0 && can_be_incomplete_array) {
+		return drgn_type_index_incomplete_array_type(&btf->prog->tindex,
+							     element_type, ret);
+	}
+	return drgn_type_index_array_type(&btf->prog->tindex, array->nelems,
+					  element_type, ret);
+}
+
+static struct drgn_error *drgn_compound_type_from_btf(struct drgn_btf *btf,
+						      const struct btf_type *t,
+						      bool is_struct,
+						      struct drgn_type **ret)
+{
+	struct drgn_error *err;
+	const struct btf_member *members = (const struct btf_member *)(t + 1);
+	size_t num_members = BTF_INFO_VLEN(t->info), i;
+	struct drgn_type *type;
+	const char *tag;
+
+	err = btf_tag(btf, t->name_off, &tag);
+	if (err)
+		return err;
+
+	type = drgn_arena_alloc_flex(&btf->arena, sizeof(*type), num_members,
+				     sizeof(struct drgn_type_member));
+	if (!type)
+		return &drgn_enomem;
+
+	for (i = 0; i < num_members; i++) {
+		struct drgn_lazy_type member_type;
+		const char *name;
+		uint64_t bit_offset, bit_field_size;
+
+		err = btf_tag(btf, members[i].name_off, &name);
+		if (err)
+			return err;
+
+		if (BTF_INFO_KFLAG(t->info)) {
+			bit_offset = BTF_MEMBER_BIT_OFFSET(members[i].offset);
+			bit_field_size =
+				BTF_MEMBER_BITFIELD_SIZE(members[i].offset);
+		} else {
+			bit_offset = members[i].offset;
+			bit_field_size = 0;
+			/*
+			 * Without kind_flag, a bit field is encoded in the
+			 * integer type of the member.
+			 */
+			if (members[i].type &&
+			    members[i].type < btf->num_types) {
+				const struct btf_type *member_t;
+
+				member_t = btf_type(btf, members[i].type);
+				if (BTF_INFO_KIND(member_t->info) ==
+				    BTF_KIND_INT) {
+					uint32_t encoding;
+
+					encoding = *(const uint32_t *)(member_t + 1);
+					if (BTF_INT_BITS(encoding) !=
+					    (uint64_t)member_t->size * 8) {
+						bit_offset += BTF_INT_OFFSET(encoding);
+						bit_field_size = BTF_INT_BITS(encoding);
+					}
+				}
+			}
+		}
+
+		/*
+		 * Flexible array members are only allowed as the last member
+		 * of a structure with more than one named member.
+		 */
+		err = drgn_lazy_type_from_btf(btf, members[i].type,
+					      is_struct && num_members > 1 &&
+					      i == num_members - 1,
+					      &member_type);
+		if (err)
+			return err;
+		drgn_type_member_init(type, i, member_type, name, bit_offset,
+				      bit_field_size);
+	}
+
+	if (is_struct)
+		drgn_struct_type_init(type, tag, t->size, num_members);
+	else
+		drgn_union_type_init(type, tag, t->size, num_members);
+	*ret = type;
+	return NULL;
+}
+
+/*
+ * A forward declaration or an enum without enumerators may be completed by
+ * another type with the same name. This tries to find the complete type. If it
+ * can't, it returns &drgn_not_found.
+ */
+static struct drgn_error *
+drgn_btf_find_complete(struct drgn_btf *btf, enum drgn_btf_namespace ns,
+		       const char *tag, struct drgn_type **ret)
+{
+	struct drgn_error *err;
+	struct string key = { tag, strlen(tag) };
+	struct drgn_btf_name_map_iterator it;
+	struct drgn_qualified_type qualified_type;
+
+	it = drgn_btf_name_map_search(&btf->names[ns], &key);
+	if (!it.entry || btf_type_is_incomplete(btf_type(btf, it.entry->value)))
+		return &drgn_not_found;
+	err = drgn_type_from_btf(btf, it.entry->value, &qualified_type);
+	if (err)
+		return err;
+	*ret = qualified_type.type;
+	return NULL;
+}
+
+static struct drgn_error *drgn_fwd_type_from_btf(struct drgn_btf *btf,
+						 const struct btf_type *t,
+						 struct drgn_type **ret)
+{
+	struct drgn_error *err;
+	bool is_union = BTF_INFO_KFLAG(t->info);
+	struct drgn_type *type;
+	const char *tag;
+
+	err = btf_tag(btf, t->name_off, &tag);
+	if (err)
+		return err;
+	if (tag) {
+		err = drgn_btf_find_complete(btf,
+					     is_union ?
+					     DRGN_BTF_UNION : DRGN_BTF_STRUCT,
+					     tag, ret);
+		if (err != &drgn_not_found)
+			return err;
+	}
+
+	type = drgn_arena_alloc(&btf->arena, sizeof(*type));
+	if (!type)
+		return &drgn_enomem;
+	if (is_union)
+		drgn_union_type_init_incomplete(type, tag);
+	else
+		drgn_struct_type_init_incomplete(type, tag);
+	*ret = type;
+	return NULL;
+}
+
+static struct drgn_error *
+enum_compatible_type_from_btf(struct drgn_btf *btf, uint32_t size,
+			      bool is_signed, struct drgn_type **ret)
+{
+	static const enum drgn_primitive_type compatible_types[2][4] = {
+		{
+			DRGN_C_TYPE_UNSIGNED_CHAR,
+			DRGN_C_TYPE_UNSIGNED_SHORT,
+			DRGN_C_TYPE_UNSIGNED_INT,
+			DRGN_C_TYPE_UNSIGNED_LONG_LONG,
+		},
+		{
+			DRGN_C_TYPE_SIGNED_CHAR,
+			DRGN_C_TYPE_SHORT,
+			DRGN_C_TYPE_INT,
+			DRGN_C_TYPE_LONG_LONG,
+		},
+	};
+	struct drgn_error *err;
+	size_t i;
+
+	/* BTF doesn't record the compatible type, so use the matching C type. */
+	for (i = 0; i < ARRAY_SIZE(compatible_types[0]); i++) {
+		err = drgn_type_index_find_primitive(&btf->prog->tindex,
+						     compatible_types[is_signed][i],
+						     ret);
+		if (err)
+			return err;
+		if (drgn_type_size(*ret) == size)
+			return NULL;
+	}
+	return drgn_error_format(DRGN_ERROR_OTHER,
+				 "BTF_KIND_ENUM has unsupported size %" PRIu32,
+				 size);
+}
+
+static struct drgn_error *drgn_enum_type_from_btf(struct drgn_btf *btf,
+						  const struct btf_type *t,
+						  struct drgn_type **ret)
+{
+	struct drgn_error *err;
+	bool is_enum64 = BTF_INFO_KIND(t->info) == BTF_KIND_ENUM64;
+	size_t num_enumerators = BTF_INFO_VLEN(t->info), i;
+	bool is_signed = BTF_INFO_KFLAG(t->info);
+	struct drgn_type *type;
+	struct drgn_type *compatible_type;
+	const char *tag;
+
+	err = btf_tag(btf, t->name_off, &tag);
+	if (err)
+		return err;
+
+	if (!num_enumerators) {
+		if (tag) {
+			err = drgn_btf_find_complete(btf, DRGN_BTF_ENUM, tag,
+						     ret);
+			if (err != &drgn_not_found)
+				return err;
+		}
+		type = drgn_arena_alloc(&btf->arena, sizeof(*type));
+		if (!type)
+			return &drgn_enomem;
+		drgn_enum_type_init_incomplete(type, tag);
+		*ret = type;
+		return NULL;
+	}
+
+	type = drgn_arena_alloc_flex(&btf->arena, sizeof(*type),
+				     num_enumerators,
+				     sizeof(struct drgn_type_enumerator));
+	if (!type)
+		return &drgn_enomem;
+
+	/*
+	 * Before Linux 6.0, kind_flag wasn't used to mark signed enums, so
+	 * guess that an enum with a negative value is signed.
+	 */
+	if (!is_enum64 && !is_signed) {
+		const struct btf_enum *enumerators;
+
+		enumerators = (const struct btf_enum *)(t + 1);
+		for (i = 0; i < num_enumerators; i++) {
+			if (enumerators[i].val < 0) {
+				is_signed = true;
+				break;
+			}
+		}
+	}
+
+	for (i = 0; i < num_enumerators; i++) {
+		uint32_t name_off;
+		uint64_t value;
+		const char *name;
+
+		if (is_enum64) {
+			const struct btf_enum64 *enumerator;
+
+			enumerator = &((const struct btf_enum64 *)(t + 1))[i];
+			name_off = enumerator->name_off;
+			value = ((uint64_t)enumerator->val_hi32 << 32 |
+				 enumerator->val_lo32);
+		} else {
+			const struct btf_enum *enumerator;
+
+			enumerator = &((const struct btf_enum *)(t + 1))[i];
+			name_off = enumerator->name_off;
+			if (is_signed)
+				value = (int64_t)enumerator->val;
+			else
+				value = (uint32_t)enumerator->val;
+		}
+
+		err = btf_name(btf, name_off, &name);
+		if (err)
+			return err;
+		if (is_signed) {
+			drgn_type_enumerator_init_signed(type, i, name,
+							 (int64_t)value);
+		} else {
+			drgn_type_enumerator_init_unsigned(type, i, name,
+							   value);
+		}
+	}
+
+	err = enum_compatible_type_from_btf(btf, t->size, is_signed,
+					    &compatible_type);
+	if (err)
+		return err;
+	drgn_enum_type_init(type, tag, compatible_type, num_enumerators);
+	*ret = type;
+	return NULL;
+}
+
+static struct drgn_error *drgn_typedef_type_from_btf(struct drgn_btf *btf,
+						     const struct btf_type *t,
+						     struct drgn_type **ret)
+{
+	struct drgn_error *err;
+	struct drgn_type *type;
+	struct drgn_qualified_type aliased_type;
+	const char *name;
+
+	err = btf_tag(btf, t->name_off, &name);
+	if (err)
+		return err;
+	if (!name) {
+		return drgn_error_create(DRGN_ERROR_OTHER,
+					 "BTF_KIND_TYPEDEF has no name");
+	}
+
+	type = drgn_arena_alloc(&btf->arena, sizeof(*type));
+	if (!type)
+		return &drgn_enomem;
+
+	err = drgn_type_from_btf(btf, t->type, &aliased_type);
+	if (err)
+		return err;
+
+	drgn_typedef_type_init(type, name, aliased_type);
+	*ret = type;
+	return NULL;
+}
+
+static struct drgn_error *drgn_function_type_from_btf(struct drgn_btf *btf,
+						      const struct btf_type *t,
+						      struct drgn_type **ret)
+{
+	struct drgn_error *err;
+	const struct btf_param *params = (const struct btf_param *)(t + 1);
+	size_t num_parameters = BTF_INFO_VLEN(t->info), i;
+	bool is_variadic = false;
+	struct drgn_qualified_type return_type;
+	struct drgn_type *type;
+
+	/* A variadic function has a final parameter with no name or type. */
+	if (num_parameters &&
+	    params[num_parameters - 1].name_off == 0 &&
+	    params[num_parameters - 1].type == 0) {
+		is_variadic = true;
+		num_parameters--;
+	}
+
+	type = drgn_arena_alloc_flex(&btf->arena, sizeof(*type),
+				     num_parameters,
+				     sizeof(struct drgn_type_parameter));
+	if (!type)
+		return &drgn_enomem;
+
+	for (i = 0; i < num_parameters; i++) {
+		struct drgn_lazy_type parameter_type;
+		const char *name;
+
+		err = btf_tag(btf, params[i].name_off, &name);
+		if (err)
+			return err;
+		err = drgn_lazy_type_from_btf(btf, params[i].type, false,
+					      &parameter_type);
+		if (err)
+			return err;
+		drgn_type_parameter_init(type, i, parameter_type, name);
+	}
+
+	err = drgn_type_from_btf(btf, t->type, &return_type);
+	if (err)
+		return err;
+
+	drgn_function_type_init(type, return_type, num_parameters,
+				is_variadic);
+	*ret = type;
+	return NULL;
+}
+
+static struct drgn_error *
+drgn_type_from_btf_internal(struct drgn_btf *btf, uint32_t id,
+			    bool can_be_incomplete_array,
+			    struct drgn_qualified_type *ret)
+{
+	struct drgn_error *err;
+	const struct btf_type *t;
+	bool incomplete_array;
+
+	if (id == 0) {
+		ret->type = &drgn_void_type;
+		ret->qualifiers = 0;
+		return NULL;
+	}
+	if (id >= btf->num_types) {
+		return drgn_error_format(DRGN_ERROR_OTHER,
+					 "BTF type ID %" PRIu32 " is out of bounds",
+					 id);
+	}
+
+	t = btf_type(btf, id);
+	/*
+	 * An array that may be incomplete is created differently, and the type
+	 * index already caches it.
+	 */
+	incomplete_array = (can_be_incomplete_array &&
+			    BTF_INFO_KIND(t->info) == BTF_KIND_ARRAY &&
+			    ((const struct btf_array *)(t + 1))->nelems == 0);
+	if (!incomplete_array && btf->cache[id].type) {
+		*ret = btf->cache[id];
+		return NULL;
+	}
+
+	if (btf->depth >= 1000) {
+		return drgn_error_create(DRGN_ERROR_RECURSION,
+					 "maximum BTF type parsing depth exceeded");
+	}
+
+	ret->qualifiers = 0;
+	btf->depth++;
+	switch (BTF_INFO_KIND(t->info)) {
+	case BTF_KIND_CONST:
+		err = drgn_type_from_btf(btf, t->type, ret);
+		ret->qualifiers |= DRGN_QUALIFIER_CONST;
+		break;
+	case BTF_KIND_RESTRICT:
+		err = drgn_type_from_btf(btf, t->type, ret);
+		ret->qualifiers |= DRGN_QUALIFIER_RESTRICT;
+		break;
+	case BTF_KIND_VOLATILE:
+		err = drgn_type_from_btf(btf, t->type, ret);
+		ret->qualifiers |= DRGN_QUALIFIER_VOLATILE;
+		break;
+	/* Type tags only matter to BPF programs. */
+	case BTF_KIND_TYPE_TAG:
+	/* A function is described by its prototype. */
+	case BTF_KIND_FUNC:
+		err = drgn_type_from_btf(btf, t->type, ret);
+		break;
+	case BTF_KIND_INT:
+		err = drgn_int_type_from_btf(btf, t, &ret->type);
+		break;
+	case BTF_KIND_FLOAT:
+		err = drgn_float_type_from_btf(btf, t, &ret->type);
+		break;
+	case BTF_KIND_PTR:
+		err = drgn_pointer_type_from_btf(btf, t, &ret->type);
+		break;
+	case BTF_KIND_ARRAY:
+		err = drgn_array_type_from_btf(btf, t, incomplete_array,
+					       &ret->type);
+		break;
+	case BTF_KIND_STRUCT:
+		err = drgn_compound_type_from_btf(btf, t, true, &ret->type);
+		break;
+	case BTF_KIND_UNION:
+		err = drgn_compound_type_from_btf(btf, t, false, &ret->type);
+		break;
+	case BTF_KIND_FWD:
+		err = drgn_fwd_type_from_btf(btf, t, &ret->type);
+		break;
+	case BTF_KIND_ENUM:
+	case BTF_KIND_ENUM64:
+		err = drgn_enum_type_from_btf(btf, t, &ret->type);
+		break;
+	case BTF_KIND_TYPEDEF:
+		err = drgn_typedef_type_from_btf(btf, t, &ret->type);
+		break;
+	case BTF_KIND_FUNC_PROTO:
+		err = drgn_function_type_from_btf(btf, t, &ret->type);
+		break;
+	default:
+		err = drgn_error_format(DRGN_ERROR_OTHER,
+					"BTF type %" PRIu32 " has kind %" PRIu32 ", which is not a type",
+					id, BTF_INFO_KIND(t->info));
+		break;
+	}
+	btf->depth--;
+	if (err)
+		return err;
+
+	if (!incomplete_array)
+		btf->cache[id] = *ret;
+	return NULL;
+}
+
+static struct drgn_error *drgn_btf_type_find(enum drgn_type_kind kind,
+					     const char *name, size_t name_len,
+					     const char *filename, void *arg,
+					     struct drgn_qualified_type *ret)
+{
+	struct drgn_error *err;
+	struct drgn_btf *btf = arg;
+	struct string key = { name, name_len };
+	enum drgn_btf_namespace ns;
+	struct drgn_btf_name_map_iterator it;
+
+	/* BTF doesn't record which file a type was defined in. */
+	if (filename)
+		return &drgn_not_found;
+
+	switch (kind) {
+	case DRGN_TYPE_INT:
+	case DRGN_TYPE_BOOL:
+	case DRGN_TYPE_FLOAT:
+		ns = DRGN_BTF_BASE;
+		break;
+	case DRGN_TYPE_STRUCT:
+		ns = DRGN_BTF_STRUCT;
+		break;
+	case DRGN_TYPE_UNION:
+		ns = DRGN_BTF_UNION;
+		break;
+	case DRGN_TYPE_ENUM:
+		ns = DRGN_BTF_ENUM;
+		break;
+	case DRGN_TYPE_TYPEDEF:
+		ns = DRGN_BTF_TYPEDEF;
+		break;
+	default:
+		DRGN_UNREACHABLE();
+	}
+
+	it = drgn_btf_name_map_search(&btf->names[ns], &key);
+	if (!it.entry)
+		return &drgn_not_found;
+	err = drgn_type_from_btf(btf, it.entry->value, ret);
+	if (err)
+		return err;
+	/*
+	 * Integer, boolean, and floating-point types share a namespace, so we
+	 * need to check that the type we found was the right kind.
+	 */
+	if (drgn_type_kind(ret->type) != kind)
+		return &drgn_not_found;
+	return NULL;
+}
+
+static struct drgn_error *
+drgn_object_from_btf_enumerator(struct drgn_btf *btf, uint32_t id,
+				const char *name, size_t name_len,
+				struct drgn_object *ret)
+{
+	struct drgn_error *err;
+	struct drgn_qualified_type qualified_type;
+	const struct drgn_type_enumerator *enumerators;
+	size_t num_enumerators, i;
+
+	err = drgn_type_from_btf(btf, id, &qualified_type);
+	if (err)
+		return err;
+	enumerators = drgn_type_enumerators(qualified_type.type);
+	num_enumerators = drgn_type_num_enumerators(qualified_type.type);
+	for (i = 0; i < num_enumerators; i++) {
+		if (strncmp(enumerators[i].name, name, name_len) != 0 ||
+		    enumerators[i].name[name_len])
+			continue;
+
+		if (drgn_enum_type_is_signed(qualified_type.type)) {
+			return drgn_object_set_signed(ret, qualified_type,
+						      enumerators[i].svalue, 0);
+		} else {
+			return drgn_object_set_unsigned(ret, qualified_type,
+							enumerators[i].uvalue,
+							0);
+		}
+	}
+	DRGN_UNREACHABLE();
+}
+
+static struct drgn_error *drgn_object_from_btf_func(struct drgn_btf *btf,
+						   uint32_t id,
+						   struct drgn_object *ret)
+{
+	struct drgn_error *err;
+	struct drgn_qualified_type qualified_type;
+	struct drgn_symbol *sym;
+	uint64_t address;
+	const char *name;
+
+	err = btf_name(btf, btf_type(btf, id)->name_off, &name);
+	if (err)
+		return err;
+	err = drgn_type_from_btf(btf, id, &qualified_type);
+	if (err)
+		return err;
+	/* BTF doesn't record addresses, so get it from the symbol table. */
+	err = drgn_program_find_symbol_by_name(btf->prog, name, &sym);
+	if (err && err->code == DRGN_ERROR_LOOKUP) {
+		drgn_error_destroy(err);
+		return drgn_error_format(DRGN_ERROR_LOOKUP,
+					 "could not find address of '%s'",
+					 name);
+	} else if (err) {
+		return err;
+	}
+	address = sym->address;
+	drgn_symbol_destroy(sym);
+	return drgn_object_set_reference(ret, qualified_type, address, 0,
+					 0, DRGN_PROGRAM_ENDIAN);
+}
+
+static struct drgn_error *
+drgn_btf_object_find(const char *name, size_t name_len, const char *filename,
+		     enum drgn_find_object_flags flags, void *arg,
+		     struct drgn_object *ret)
+{
+	struct drgn_btf *btf = arg;
+	struct string key = { name, name_len };
+	struct drgn_btf_name_map_iterator it;
+
+	if (filename)
+		return &drgn_not_found;
+
+	if (flags & DRGN_FIND_OBJECT_CONSTANT) {
+		it = drgn_btf_name_map_search(&btf->names[DRGN_BTF_ENUMERATOR],
+					      &key);
+		if (it.entry) {
+			return drgn_object_from_btf_enumerator(btf,
+							       it.entry->value,
+							       name, name_len,
+							       ret);
+		}
+	}
+	if (flags & DRGN_FIND_OBJECT_FUNCTION) {
+		it = drgn_btf_name_map_search(&btf->names[DRGN_BTF_FUNC], &key);
+		if (it.entry)
+			return drgn_object_from_btf_func(btf, it.entry->value,
+							 ret);
+	}
+	return &drgn_not_found;
+}
+
+static struct drgn_error *drgn_btf_index_name(struct drgn_btf *btf,
+					      enum drgn_btf_namespace ns,
+					      uint32_t name_off, uint32_t id)
+{
+	struct drgn_error *err;
+	struct drgn_btf_name_map_entry entry = {
+		.value = id,
+	};
+	struct hash_pair hp;
+	struct drgn_btf_name_map_iterator it;
+
+	err = btf_name(btf, name_off, &entry.key.str);
+	if (err)
+		return err;
+	if (!entry.key.str[0])
+		return NULL;
+	entry.key.len = strlen(entry.key.str);
+
+	hp = drgn_btf_name_map_hash(&entry.key);
+	it = drgn_btf_name_map_search_hashed(&btf->names[ns], &entry.key, hp);
+	if (it.entry) {
+		/* Prefer a complete type over a forward declaration. */
+		if (btf_type_is_incomplete(btf_type(btf, it.entry->value)) &&
+		    !btf_type_is_incomplete(btf_type(btf, id)))
+			it.entry->value = id;
+		return NULL;
+	}
+	if (drgn_btf_name_map_insert_searched(&btf->names[ns], &entry, hp,
+					      NULL) == -1)
+		return &drgn_enomem;
+	return NULL;
+}
+
+static struct drgn_error *drgn_btf_index_enumerators(struct drgn_btf *btf,
+						     const struct btf_type *t,
+						     uint32_t id)
+{
+	struct drgn_error *err;
+	size_t vlen = BTF_INFO_VLEN(t->info), i;
+	/* Each enumerator starts with its name, followed by its value. */
+	size_t stride = BTF_INFO_KIND(t->info) == BTF_KIND_ENUM64 ? 3 : 2;
+	const uint32_t *enumerators = (const uint32_t *)(t + 1);
+
+	for (i = 0; i < vlen; i++) {
+		err = drgn_btf_index_name(btf, DRGN_BTF_ENUMERATOR,
+					  enumerators[i * stride], id);
+		if (err)
+			return err;
+	}
+	return NULL;
+}
+
+/* Find every type in the type section and index the names of the types. */
+static struct drgn_error *drgn_btf_index(struct drgn_btf *btf,
+					 size_t num_words)
+{
+	struct drgn_error *err;
+	struct btf_type_offset_vector offsets;
+	size_t pos = 0;
+	uint32_t id;
+
+	btf_type_offset_vector_init(&offsets);
+	/* Type ID 0 is void. */
+	if (!btf_type_offset_vector_append(&offsets, &(uint32_t){0})) {
+		err = &drgn_enomem;
+		goto err;
+	}
+	while (pos < num_words) {
+		const struct btf_type *t;
+		size_t vlen, len;
+
+		if (num_words - pos < 3)
+			goto truncated;
+		t = (const struct btf_type *)&btf->types[pos];
+		vlen = BTF_INFO_VLEN(t->info);
+		switch (BTF_INFO_KIND(t->info)) {
+		case BTF_KIND_PTR:
+		case BTF_KIND_FWD:
+		case BTF_KIND_TYPEDEF:
+		case BTF_KIND_VOLATILE:
+		case BTF_KIND_CONST:
+		case BTF_KIND_RESTRICT:
+		case BTF_KIND_FUNC:
+		case BTF_KIND_FLOAT:
+		case BTF_KIND_TYPE_TAG:
+			len = 0;
+			break;
+		case BTF_KIND_INT:
+		case BTF_KIND_VAR:
+		case BTF_KIND_DECL_TAG:
+			len = 1;
+			break;
+		case BTF_KIND_ARRAY:
+			len = 3;
+			break;
+		case BTF_KIND_ENUM:
+		case BTF_KIND_FUNC_PROTO:
+			len = 2 * vlen;
+			break;
+		case BTF_KIND_STRUCT:
+		case BTF_KIND_UNION:
+		case BTF_KIND_DATASEC:
+		case BTF_KIND_ENUM64:
+			len = 3 * vlen;
+			break;
+		default:
+			err = drgn_error_format(DRGN_ERROR_OTHER,
+						"BTF type %zu has unknown kind %" PRIu32,
+						offsets.size,
+						BTF_INFO_KIND(t->info));
+			goto err;
+		}
+		if (len > num_words - pos - 3)
+			goto truncated;
+		if (offsets.size > UINT32_MAX) {
+			err = drgn_error_create(DRGN_ERROR_OTHER,
+						"BTF has too many types");
+			goto err;
+		}
+		if (!btf_type_offset_vector_append(&offsets,
+						   &(uint32_t){pos})) {
+			err = &drgn_enomem;
+			goto err;
+		}
+		pos += 3 + len;
+	}
+	btf_type_offset_vector_shrink_to_fit(&offsets);
+	btf->type_offsets = offsets.data;
+	btf->num_types = offsets.size;
+
+	btf->cache = calloc(btf->num_types, sizeof(btf->cache[0]));
+	if (!btf->cache)
+		return &drgn_enomem;
+
+	for (id = 1; id < btf->num_types; id++) {
+		const struct btf_type *t = btf_type(btf, id);
+		enum drgn_btf_namespace ns;
+
+		switch (BTF_INFO_KIND(t->info)) {
+		case BTF_KIND_INT:
+		case BTF_KIND_FLOAT:
+			ns = DRGN_BTF_BASE;
+			break;
+		case BTF_KIND_STRUCT:
+			ns = DRGN_BTF_STRUCT;
+			break;
+		case BTF_KIND_UNION:
+			ns = DRGN_BTF_UNION;
+			break;
+		case BTF_KIND_FWD:
+			ns = (BTF_INFO_KFLAG(t->info) ?
+			      DRGN_BTF_UNION : DRGN_BTF_STRUCT);
+			break;
+		case BTF_KIND_ENUM:
+		case BTF_KIND_ENUM64:
+			err = drgn_btf_index_enumerators(btf, t, id);
+			if (err)
+				return err;
+			ns = DRGN_BTF_ENUM;
+			break;
+		case BTF_KIND_TYPEDEF:
+			ns = DRGN_BTF_TYPEDEF;
+			break;
+		case BTF_KIND_FUNC:
+			ns = DRGN_BTF_FUNC;
+			break;
+		default:
+			continue;
+		}
+		err = drgn_btf_index_name(btf, ns, t->name_off, id);
+		if (err)
+			return err;
+	}
+	return NULL;
+
+truncated:
+	err = drgn_error_format(DRGN_ERROR_OTHER, "BTF type %zu is truncated",
+				offsets.size);
+err:
+	btf_type_offset_vector_deinit(&offsets);
+	return err;
+}
+
+/*
+ * Parse the BTF header, convert the type section to host byte order, and index
+ * the types. This takes ownership of data.
+ */
+static struct drgn_error *drgn_btf_init(struct drgn_btf *btf, char *data,
+					size_t size)
+{
+	struct btf_header hdr;
+	bool bswap;
+	uint64_t types_start, strs_start;
+	size_t i;
+	uint32_t *types;
+
+	btf->data = data;
+	btf->size = size;
+
+	if (size < sizeof(hdr))
+		goto invalid;
+	memcpy(&hdr, data, sizeof(hdr));
+	if (hdr.magic == BTF_MAGIC)
+		bswap = false;
+	else if (hdr.magic == bswap_16(BTF_MAGIC))
+		bswap = true;
+	else
+		goto invalid;
+	if (bswap) {
+		hdr.hdr_len = bswap_32(hdr.hdr_len);
+		hdr.type_off = bswap_32(hdr.type_off);
+		hdr.type_len = bswap_32(hdr.type_len);
+		hdr.str_off = bswap_32(hdr.str_off);
+		hdr.str_len = bswap_32(hdr.str_len);
+	}
+	if (hdr.version != BTF_VERSION) {
+		return drgn_error_format(DRGN_ERROR_OTHER,
+					 "unknown BTF version %" PRIu8,
+					 hdr.version);
+	}
+
+	types_start = (uint64_t)hdr.hdr_len + hdr.type_off;
+	strs_start = (uint64_t)hdr.hdr_len + hdr.str_off;
+	if (hdr.hdr_len < sizeof(hdr) || types_start % 4 || hdr.type_len % 4 ||
+	    types_start + hdr.type_len > size ||
+	    strs_start + hdr.str_len > size ||
+	    !hdr.str_len || data[strs_start + hdr.str_len - 1])
+		goto invalid;
+
+	types = (uint32_t *)(data + types_start);
+	if (bswap) {
+		for (i = 0; i < hdr.type_len / 4; i++)
+			types[i] = bswap_32(types[i]);
+	}
+	btf->types = types;
+	btf->strs = data + strs_start;
+	btf->strs_len = hdr.str_len;
+	return drgn_btf_index(btf, hdr.type_len / 4);
+
+invalid:
+	return drgn_error_create(DRGN_ERROR_OTHER, "invalid BTF header");
+}
+
+static struct drgn_error *read_btf_section(const char *path, int fd,
+					   char **data_ret, size_t *size_ret)
+{
+	struct drgn_error *err;
+	Elf *elf;
+	size_t shstrndx;
+	Elf_Scn *scn = NULL;
+	Elf_Data *data;
+
+	elf_version(EV_CURRENT);
+
+	elf = dwelf_elf_begin(fd);
+	if (!elf)
+		return drgn_error_libelf();
+
+	if (elf_getshdrstrndx(elf, &shstrndx)) {
+		err = drgn_error_libelf();
+		goto out;
+	}
+	while ((scn = elf_nextscn(elf, scn))) {
+		GElf_Shdr *shdr, shdr_mem;
+		const char *scnname;
+
+		shdr = gelf_getshdr(scn, &shdr_mem);
+		if (!shdr)
+			continue;
+
+		scnname = elf_strptr(elf, shstrndx, shdr->sh_name);
+		if (scnname && strcmp(scnname, ".BTF") == 0)
+			break;
+	}
+	if (!scn) {
+		err = drgn_error_format(DRGN_ERROR_OTHER,
+					"%s: no .BTF section", path);
+		goto out;
+	}
+
+	err = read_elf_section(scn, &data);
+	if (err)
+		goto out;
+	*data_ret = malloc(data->d_size);
+	if (!*data_ret) {
+		err = &drgn_enomem;
+		goto out;
+	}
+	memcpy(*data_ret, data->d_buf, data->d_size);
+	*size_ret = data->d_size;
+	err = NULL;
+out:
+	elf_end(elf);
+	return err;
+}
+
+/*
+ * Read a raw BTF file. Files in sysfs don't necessarily report their size, so
+ * this reads until the end of the file.
+ */
+static struct drgn_error *read_btf_raw(const char *path, int fd,
+				       char **data_ret, size_t *size_ret)
+{
+	struct stat st;
+	char *data = NULL;
+	size_t size = 0, capacity;
+
+	if (fstat(fd, &st) == -1)
+		return drgn_error_create_os("fstat", errno, path);
+	capacity = st.st_size > 0 ? (size_t)st.st_size + 1 : 4096;
+	for (;;) {
+		ssize_t r;
+
+		if (size == capacity || !data) {
+			char *tmp;
+
+			if (data)
+				capacity *= 2;
+			tmp = realloc(data, capacity);
+			if (!tmp) {
+				free(data);
+				return &drgn_enomem;
+			}
+			data = tmp;
+		}
+		r = read(fd, data + size, capacity - size);
+		if (r == -1) {
+			if (errno == EINTR)
+				continue;
+			free(data);
+			return drgn_error_create_os("read", errno, path);
+		} else if (r == 0) {
+			break;
+		}
+		size += r;
+	}
+	*data_ret = data;
+	*size_ret = size;
+	return NULL;
+}
+
+static struct drgn_error *read_btf(const char *path, char **data_ret,
+				   size_t *size_ret)
+{
+	struct drgn_error *err;
+	int fd;
+	char ident[SELFMAG];
+	ssize_t r;
+
+	fd = open(path, O_RDONLY);
+	if (fd == -1)
+		return drgn_error_create_os("open", errno, path);
+
+	/* The BTF can either be raw or in the .BTF section of an ELF file. */
+	r = pread(fd, ident, sizeof(ident), 0);
+	if (r == -1) {
+		err = drgn_error_create_os("pread", errno, path);
+	} else if (r == sizeof(ident) && memcmp(ident, ELFMAG, SELFMAG) == 0) {
+		err = read_btf_section(path, fd, data_ret, size_ret);
+	} else {
+		err = read_btf_raw(path, fd, data_ret, size_ret);
+	}
+	close(fd);
+	return err;
+}
+
+void drgn_btf_destroy(struct drgn_btf *btf)
+{
+	size_t i;
+
+	if (!btf)
+		return;
+
+	/* All of the types are allocated from the arena. */
+	drgn_arena_deinit(&btf->arena);
+	for (i = 0; i < DRGN_BTF_NUM_NAMESPACES; i++)
+		drgn_btf_name_map_deinit(&btf->names[i]);
+	free(btf->cache);
+	free(btf->type_offsets);
+	free(btf->data);
+	free(btf);
+}
+
+void drgn_btf_memory_usage(struct drgn_btf *btf,
+			   struct drgn_program_memory_usage *usage)
+{
+	size_t i;
+
+	usage->types += btf->arena.capacity;
+	usage->caches += btf->size;
+	usage->caches += btf->num_types * (sizeof(btf->type_offsets[0]) +
+					   sizeof(btf->cache[0]));
+	for (i = 0; i < DRGN_BTF_NUM_NAMESPACES; i++)
+		usage->caches += drgn_btf_name_map_memory_usage(&btf->names[i]);
+}
+
+LIBDRGN_PUBLIC struct drgn_error *
+drgn_program_load_btf(struct drgn_program *prog, const char *path)
+{
+	struct drgn_error *err;
+	struct drgn_btf *btf;
+	char *data;
+	size_t size, i;
+
+	if (prog->_btf) {
+		return drgn_error_create(DRGN_ERROR_INVALID_ARGUMENT,
+					 "BTF was already loaded");
+	}
+	if (!path) {
+		if ((prog->flags &
+		     (DRGN_PROGRAM_IS_LINUX_KERNEL | DRGN_PROGRAM_IS_LIVE)) !=
+		    (DRGN_PROGRAM_IS_LINUX_KERNEL | DRGN_PROGRAM_IS_LIVE)) {
+			return drgn_error_create(DRGN_ERROR_INVALID_ARGUMENT,
+						 "BTF path must be given if program is not the running kernel");
+		}
+		path = "/sys/kernel/btf/vmlinux";
+	}
+
+	btf = calloc(1, sizeof(*btf));
+	if (!btf)
+		return &drgn_enomem;
+	btf->prog = prog;
+	for (i = 0; i < DRGN_BTF_NUM_NAMESPACES; i++)
+		drgn_btf_name_map_init(&btf->names[i]);
+	drgn_arena_init(&btf->arena);
+
+	err = read_btf(path, &data, &size);
+	if (err)
+		goto err;
+	err = drgn_btf_init(btf, data, size);
+	if (err)
+		goto err;
+
+	err = drgn_type_index_add_finder(&prog->tindex, drgn_btf_type_find, btf,
+					 true);
+	if (err)
+		goto err;
+	err = drgn_object_index_add_finder(&prog->oindex, drgn_btf_object_find,
+					   btf, true);
+	if (err) {
+		drgn_type_index_remove_finder(&prog->tindex);
+		goto err;
+	}
+	prog->_btf = btf;
+	return NULL;
+
+err:
+	drgn_btf_destroy(btf);
+	return err;
+}
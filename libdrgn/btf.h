@@ -0,0 +1,45 @@
+// Copyright 2019 - Omar Sandoval
+// SPDX-License-Identifier: GPL-3.0+
+
+/**
+ * @file
+ *
+ * BPF Type Format.
+ *
+ * See @ref BtfInternals.
+ */
+
+#ifndef DRGN_BTF_H
+#define DRGN_BTF_H
+
+#include "drgn.h"
+
+/**
+ * @ingroup Internals
+ *
+ * @defgroup BtfInternals BTF
+ *
+ * Types from the BPF Type Format (BTF).
+ *
+ * BTF is a compact, deduplicated encoding of C types which the Linux kernel
+ * embeds in its @c .BTF section and exports in @c /sys/kernel/btf/vmlinux. It
+ * is much cheaper to load than DWARF: @ref drgn_btf only indexes the names of
+ * the types in the blob, and @ref drgn_type%s are created lazily as they are
+ * looked up. It is registered as both a type finder and an object finder (for
+ * enumerators and, with the help of the symbol table, functions).
+ *
+ * @{
+ */
+
+struct drgn_btf;
+
+/** Destroy a @ref drgn_btf. */
+void drgn_btf_destroy(struct drgn_btf *btf);
+
+/** Add the memory used by a @ref drgn_btf to @p usage. */
+void drgn_btf_memory_usage(struct drgn_btf *btf,
+			   struct drgn_program_memory_usage *usage);
+
+/** @} */
+
+#endif /* DRGN_BTF_H */
@@ -1036,6 +1036,9 @@ typedef struct drgn_error *
  * Callbacks are called in reverse order of the order they were added until the
  * type is found. So, more recently added callbacks take precedence.
  *
+ * Results found with callbacks registered with this function are not cached,
+ * so @p fn is called for every lookup that reaches it.
+ *
  * @param[in] fn The callback.
  * @param[in] arg Argument to pass to @p fn.
  * @return @c NULL on success, non-@c NULL on error.
@@ -1081,6 +1084,9 @@ typedef struct drgn_error *
  * Callbacks are called in reverse order of the order they were added until the
  * object is found. So, more recently added callbacks take precedence.
  *
+ * Results found with callbacks registered with this function are not cached,
+ * so @p fn is called for every lookup that reaches it.
+ *
  * @param[in] fn The callback.
  * @param[in] arg Argument to pass to @p fn.
  * @return @c NULL on success, non-@c NULL on error.
@@ -1121,11 +1127,60 @@ struct drgn_error *drgn_program_set_pid(struct drgn_program *prog, pid_t pid);
  * Load debugging information for a list of executable or library files.
  *
  * @param[in] load_default Whether to also load debugging information which can
- * automatically be determined from the program.
+ * automatically be determined from the program. For the Linux kernel, loaded
+ * kernel modules found this way are deferred if @ref
+ * drgn_program_lazy_kernel_modules() is set.
+ * @param[in] lazy Whether to defer indexing the files in @p paths until a type
+ * or object lookup doesn't find anything in the debugging information that is
+ * already indexed, or until an address in one of them is looked up. vmlinux is
+ * never deferred.
  */
 struct drgn_error *drgn_program_load_debug_info(struct drgn_program *prog,
 						const char **paths, size_t n,
-						bool load_default);
+						bool load_default, bool lazy);
+
+/**
+ * Load symbols from the Linux kernel's kallsyms.
+ *
+ * This makes symbol lookups work without any debugging information. The
+ * symbols are decoded from the kernel's compressed kallsyms tables in memory if
+ * VMCOREINFO contains their locations (since Linux 6.0). Otherwise, for the
+ * running kernel, they are parsed from @c /proc/kallsyms.
+ *
+ * Symbols from debugging information take precedence over symbols from
+ * kallsyms. kallsyms does not record symbol sizes, so each symbol is assumed to
+ * extend to the next symbol.
+ *
+ * kallsyms can only be loaded once.
+ *
+ * @return @c NULL on success, non-@c NULL on error.
+ */
+struct drgn_error *drgn_program_load_kallsyms(struct drgn_program *prog);
+
+/**
+ * Load types from BPF Type Format (BTF).
+ *
+ * BTF is a compact encoding of C types which the Linux kernel can embed in
+ * itself. It is much faster to load than DWARF debugging information. Only the
+ * names of the types are indexed when this is called; types are parsed when
+ * they are looked up.
+ *
+ * Structure, union, enumerated, typedef, and base types can be found by name.
+ * Enumeration constants and functions can also be found as objects; the address
+ * of a function is looked up in the program's symbols (e.g., from @ref
+ * drgn_program_load_kallsyms()).
+ *
+ * BTF is added as a type and object finder. More recently added finders take
+ * precedence, so BTF is preferred over debugging information if debugging
+ * information was loaded first and is only used as a fallback otherwise.
+ *
+ * @param[in] path Path to a raw BTF file or an ELF file containing a @c .BTF
+ * section. If @c NULL, @c /sys/kernel/btf/vmlinux is used, which is only
+ * allowed for the running kernel.
+ * @return @c NULL on success, non-@c NULL on error.
+ */
+struct drgn_error *drgn_program_load_btf(struct drgn_program *prog,
+					 const char *path);
 
 /**
  * Create a @ref drgn_program from a core dump file.
@@ -1173,6 +1228,90 @@ enum drgn_program_flags drgn_program_flags(struct drgn_program *prog);
  */
 const struct drgn_platform *drgn_program_platform(struct drgn_program *prog);
 
+/** Memory used by a @ref drgn_program, in bytes. */
+struct drgn_program_memory_usage {
+	/** Types parsed from debugging information or created by the program. */
+	size_t types;
+	/** Index of debugging information. */
+	size_t dwarf_index;
+	/** Caches of type and object lookups, parsed types, and members. */
+	size_t caches;
+};
+
+/**
+ * Get the approximate amount of memory used by a @ref drgn_program.
+ *
+ * This only accounts for data structures allocated by libdrgn. It does not
+ * include memory used by libdw or memory-mapped files.
+ *
+ * @param[out] ret Returned memory usage.
+ */
+void drgn_program_memory_usage(struct drgn_program *prog,
+			       struct drgn_program_memory_usage *ret);
+
+/** Statistics about the index of debugging information in a program. */
+struct drgn_dwarf_index_stats {
+	/** Number of shards that the index is split into. */
+	size_t num_shards;
+	/** Number of distinct names in the index. */
+	size_t num_names;
+	/** Number of indexed DIEs. */
+	size_t num_dies;
+	/** Fewest DIEs in any shard. */
+	size_t min_shard_dies;
+	/** Most DIEs in any shard. */
+	size_t max_shard_dies;
+	/** Size of the entry for one DIE, in bytes. */
+	size_t die_size;
+	/** Bytes allocated for the name maps and DIE arrays of all shards. */
+	size_t shard_bytes;
+	/** Number of threads used for indexing. */
+	int num_threads;
+	/** Number of compressed debugging sections that were decompressed. */
+	size_t num_decompressed_sections;
+	/**
+	 * Time spent finding compilation units and loading cached indexes, in
+	 * nanoseconds.
+	 */
+	uint64_t cu_discovery_ns;
+	/**
+	 * Time spent decompressing compressed debugging sections, in
+	 * nanoseconds, summed over all threads. This is part of @ref
+	 * cu_discovery_ns.
+	 */
+	uint64_t decompression_ns;
+	/**
+	 * Time spent applying ELF relocations to debugging sections (or loading
+	 * them from the cache), in nanoseconds, summed over all threads. This is
+	 * part of @ref cu_discovery_ns.
+	 */
+	uint64_t relocation_ns;
+	/**
+	 * Time spent parsing abbreviation tables, in nanoseconds, summed over
+	 * all threads.
+	 */
+	uint64_t abbrev_parsing_ns;
+	/**
+	 * Time spent scanning DIEs and adding them to shards, in nanoseconds,
+	 * summed over all threads.
+	 */
+	uint64_t die_scan_ns;
+	/** Time spent writing cached indexes, in nanoseconds. */
+	uint64_t cache_write_ns;
+};
+
+/**
+ * Get statistics about the index of debugging information in a @ref
+ * drgn_program.
+ *
+ * If no debugging information has been loaded, all of the statistics are zero.
+ * Timings accumulate over every call to load debugging information.
+ *
+ * @param[out] ret Returned statistics.
+ */
+void drgn_program_dwarf_index_stats(struct drgn_program *prog,
+				    struct drgn_dwarf_index_stats *ret);
+
 /**
  * Read from a program's memory.
  *
@@ -1188,6 +1327,76 @@ struct drgn_error *drgn_program_read_memory(struct drgn_program *prog,
 					    void *buf, uint64_t address,
 					    size_t count, bool physical);
 
+/**
+ * Configure the memory cache of a @ref drgn_program.
+ *
+ * If enabled, memory is read from the program in page-sized blocks which are
+ * cached and evicted in least recently used order. This makes many small reads
+ * much faster. Caching is disabled by default.
+ *
+ * The memory of a live program (@ref DRGN_PROGRAM_IS_LIVE) can change at any
+ * time, so caching is only enabled for a live program if @p max_age is
+ * non-zero.
+ *
+ * This also flushes the cache.
+ *
+ * @param[in] prog Program.
+ * @param[in] size Maximum number of bytes to cache, or zero to disable caching.
+ * @param[in] max_age Time in nanoseconds after which cached memory is read
+ * again, or zero if cached memory never expires.
+ */
+void drgn_program_set_memory_cache(struct drgn_program *prog, size_t size,
+				   uint64_t max_age);
+
+/**
+ * Set the number of threads that a @ref drgn_program uses to index debugging
+ * information.
+ *
+ * This applies to debugging information loaded after it is called.
+ *
+ * @param[in] prog Program.
+ * @param[in] num_threads Number of threads, or zero to use the OpenMP default
+ * (which can be controlled with the @c OMP_NUM_THREADS environment variable).
+ */
+void drgn_program_set_num_threads(struct drgn_program *prog, int num_threads);
+
+/**
+ * Get the number of threads that a @ref drgn_program uses to index debugging
+ * information, or zero if it uses the OpenMP default.
+ *
+ * @sa drgn_program_set_num_threads()
+ */
+int drgn_program_num_threads(struct drgn_program *prog);
+
+/**
+ * Set whether a @ref drgn_program defers indexing the debugging information of
+ * loaded Linux kernel modules that it finds automatically.
+ *
+ * Deferred modules are indexed once a type or object lookup doesn't find
+ * anything in the debugging information that is already indexed, or once an
+ * address in the module is looked up. This applies to debugging information
+ * loaded after it is called. The default is taken from the @c
+ * DRGN_LAZY_KERNEL_MODULES environment variable.
+ *
+ * @sa drgn_program_load_debug_info()
+ */
+void drgn_program_set_lazy_kernel_modules(struct drgn_program *prog,
+					  bool lazy);
+
+/**
+ * Get whether a @ref drgn_program defers indexing loaded Linux kernel modules.
+ *
+ * @sa drgn_program_set_lazy_kernel_modules()
+ */
+bool drgn_program_lazy_kernel_modules(struct drgn_program *prog);
+
+/**
+ * Discard all memory cached by a @ref drgn_program.
+ *
+ * @sa drgn_program_set_memory_cache()
+ */
+void drgn_program_flush_memory_cache(struct drgn_program *prog);
+
 /**
  * Read a C string from a program's memory.
  *
@@ -1266,6 +1475,65 @@ struct drgn_error *drgn_program_find_symbol(struct drgn_program *prog,
 					    uint64_t address,
 					    struct drgn_symbol **ret);
 
+/**
+ * Get the symbols containing each of an array of addresses.
+ *
+ * This is equivalent to calling @ref drgn_program_find_symbol() for each
+ * address, except that addresses which are not in any symbol are not an error.
+ * Symbols are looked up in a sorted table which is built from the symbol table
+ * of each module the first time that the module is searched.
+ *
+ * @param[in] addresses Addresses to look up.
+ * @param[in] num_addresses Number of addresses.
+ * @param[out] ret Array of @p num_addresses returned symbols. Each one should
+ * be freed with @ref drgn_symbol_destroy(). An element is @c NULL if no symbol
+ * contains the corresponding address. On error, its contents are undefined and
+ * no symbols need to be freed.
+ * @return @c NULL on success, non-@c NULL on error.
+ */
+struct drgn_error *drgn_program_find_symbols(struct drgn_program *prog,
+					     const uint64_t *addresses,
+					     size_t num_addresses,
+					     struct drgn_symbol **ret);
+
+/**
+ * Get the symbol with the given name.
+ *
+ * Unlike @ref drgn_program_find_object(), this searches the ELF symbol tables
+ * rather than the debugging information, so it also finds symbols with no
+ * DWARF description, like symbols defined in assembly. If multiple symbols have
+ * the name, then a global symbol is preferred over a weak symbol over a local
+ * symbol.
+ *
+ * @param[in] name Symbol name.
+ * @param[out] ret The returned symbol. It should be freed with @ref
+ * drgn_symbol_destroy().
+ * @return @c NULL on success, non-@c NULL on error.
+ */
+struct drgn_error *drgn_program_find_symbol_by_name(struct drgn_program *prog,
+						    const char *name,
+						    struct drgn_symbol **ret);
+
+/**
+ * Get every symbol whose name matches a shell wildcard pattern.
+ *
+ * The pattern is matched as with @c fnmatch(3), so, e.g., <tt>"foo*"</tt>
+ * matches every symbol with the prefix @c foo. Unlike @ref
+ * drgn_program_find_symbol_by_name(), this returns all symbols with a matching
+ * name, including multiple symbols with the same name.
+ *
+ * @param[in] pattern Pattern to match.
+ * @param[out] syms_ret Returned array of symbols, sorted by address. Each
+ * symbol should be freed with @ref drgn_symbol_destroy(), and the array should
+ * be freed with @c free().
+ * @param[out] count_ret Returned number of symbols.
+ * @return @c NULL on success, non-@c NULL on error.
+ */
+struct drgn_error *drgn_program_search_symbols(struct drgn_program *prog,
+					       const char *pattern,
+					       struct drgn_symbol ***syms_ret,
+					       size_t *count_ret);
+
 /** Element type and size. */
 struct drgn_element_info {
 	/** Type of the element. */
@@ -2294,6 +2562,35 @@ struct drgn_error *drgn_stack_frame_symbol(struct drgn_stack_frame *frame,
 struct drgn_error *drgn_object_stack_trace(const struct drgn_object *obj,
 					   struct drgn_stack_trace **ret);
 
+/**
+ * Get stack traces for the threads represented by an array of objects.
+ *
+ * This is more efficient than calling @ref drgn_object_stack_trace() for each
+ * object, as the unwinder state, module lookups, and call frame information
+ * are shared between all of the threads.
+ *
+ * A thread whose stack trace can't be unwound doesn't stop the others. Its
+ * error is returned in @p errs instead.
+ *
+ * @param[in] objs Array of thread objects. They must all be from @p prog.
+ * @param[in] n Number of objects in @p objs.
+ * @param[out] ret Array of @p n returned stack traces, in the same order as
+ * @p objs. On success, each one is either @c NULL, if the corresponding entry
+ * of @p errs is set, or should be freed with @ref drgn_stack_trace_destroy().
+ * On error, its contents are undefined.
+ * @param[out] errs Array of @p n returned errors for the threads whose stack
+ * traces couldn't be unwound. On success, each one is either @c NULL or should
+ * be freed with @ref drgn_error_destroy(). On error, its contents are
+ * undefined.
+ * @return @c NULL on success, non-@c NULL on error (e.g., if memory couldn't
+ * be allocated).
+ */
+struct drgn_error *
+drgn_program_stack_traces(struct drgn_program *prog,
+			  const struct drgn_object * const *objs, size_t n,
+			  struct drgn_stack_trace **ret,
+			  struct drgn_error **errs);
+
 /** @} */
 
 #endif /* DRGN_H */
@@ -3,6 +3,7 @@
 
 #include <assert.h>
 #include <dwarf.h>
+#include <errno.h>
 #include <elfutils/libdw.h>
 #include <elfutils/libdwelf.h>
 #include <fcntl.h>
@@ -10,9 +11,11 @@
 #include <inttypes.h>
 #include <libelf.h>
 #include <stdbool.h>
+#include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
 #include <unistd.h>
+#include <sys/mman.h>
 #include <sys/stat.h>
 #include <sys/types.h>
 
@@ -24,6 +27,7 @@
 
 DEFINE_VECTOR_FUNCTIONS(dwfl_module_vector)
 DEFINE_VECTOR_FUNCTIONS(drgn_dwarf_module_vector)
+DEFINE_VECTOR_FUNCTIONS(drgn_dwarf_index_cache_file_vector)
 
 static inline struct hash_pair
 drgn_dwarf_module_hash(const struct drgn_dwarf_module_key *key)
@@ -164,6 +168,7 @@ enum {
 	SECTION_DEBUG_ABBREV,
 	SECTION_DEBUG_STR,
 	SECTION_DEBUG_LINE,
+	SECTION_DEBUG_NAMES,
 	DRGN_DWARF_INDEX_NUM_SECTIONS,
 };
 
@@ -172,6 +177,7 @@ static const char * const section_name[DRGN_DWARF_INDEX_NUM_SECTIONS] = {
 	[SECTION_DEBUG_ABBREV] = ".debug_abbrev",
 	[SECTION_DEBUG_STR] = ".debug_str",
 	[SECTION_DEBUG_LINE] = ".debug_line",
+	[SECTION_DEBUG_NAMES] = ".debug_names",
 };
 
 /*
@@ -254,8 +260,100 @@ static void abbrev_table_deinit(struct abbrev_table *abbrev)
 	uint32_vector_deinit(&abbrev->decls);
 }
 
+/* A DIE indexed from a module whose index will be written to the cache. */
+struct drgn_dwarf_index_cache_die {
+	struct string name;
+	uint64_t tag;
+	uint64_t file_name_hash;
+	uint64_t offset;
+};
+
+DEFINE_VECTOR(drgn_dwarf_index_cache_die_vector,
+	      struct drgn_dwarf_index_cache_die)
+
+/*
+ * DIEs are deduplicated by name, tag, and file name hash, like in the index
+ * itself.
+ */
+static inline struct hash_pair
+drgn_dwarf_index_cache_die_hash(const struct drgn_dwarf_index_cache_die *die)
+{
+	size_t hash;
+
+	hash = cityhash_size_t(die->name.str, die->name.len);
+	hash = hash_combine(hash, die->tag);
+	hash = hash_combine(hash, die->file_name_hash);
+	return hash_pair_from_avalanching_hash(hash);
+}
+
+static inline bool
+drgn_dwarf_index_cache_die_eq(const struct drgn_dwarf_index_cache_die *a,
+			      const struct drgn_dwarf_index_cache_die *b)
+{
+	return (a->tag == b->tag && a->file_name_hash == b->file_name_hash &&
+		string_eq(&a->name, &b->name));
+}
+
+DEFINE_HASH_SET(drgn_dwarf_index_cache_die_set,
+		struct drgn_dwarf_index_cache_die,
+		drgn_dwarf_index_cache_die_hash, drgn_dwarf_index_cache_die_eq)
+
+/* A module which missed the cache and will be written to it once indexed. */
+struct drgn_dwarf_index_cache_writer {
+	/* Path of the cache file. */
+	char *path;
+	const void *build_id;
+	size_t build_id_len;
+	/* Size and modification time of the file containing the DWARF. */
+	uint64_t file_size;
+	struct timespec mtime;
+};
+
+DEFINE_VECTOR(drgn_dwarf_index_cache_writer_vector,
+	      struct drgn_dwarf_index_cache_writer *)
+
+static void
+drgn_dwarf_index_cache_writer_destroy(struct drgn_dwarf_index_cache_writer *writer)
+{
+	if (writer) {
+		free(writer->path);
+		free(writer);
+	}
+}
+
+/*
+ * The cache file for a module is named by the hexadecimal build ID of the
+ * module. It consists of a struct drgn_dwarf_index_cache_header, the build ID
+ * padded to a multiple of 8 bytes, an array of struct
+ * drgn_dwarf_index_cache_entry, and finally a string table containing the
+ * null-terminated names of the entries. All fields are in native byte order.
+ */
+#define DRGN_DWARF_INDEX_CACHE_MAGIC "drgndix"
+#define DRGN_DWARF_INDEX_CACHE_VERSION 1
+
+struct drgn_dwarf_index_cache_header {
+	char magic[8];
+	uint32_t version;
+	uint32_t build_id_len;
+	/* Size and modification time of the file containing the DWARF. */
+	uint64_t file_size;
+	int64_t mtime_sec;
+	int64_t mtime_nsec;
+	uint64_t num_entries;
+	uint64_t strtab_size;
+};
+
+struct drgn_dwarf_index_cache_entry {
+	uint64_t offset;
+	uint64_t file_name_hash;
+	uint64_t name_offset;
+	uint32_t name_len;
+	uint32_t tag;
+};
+
 struct compilation_unit {
-	Dwfl_Module *module;
+	/* Index of the module in drgn_dwarf_index::indexed_modules. */
+	uint32_t module_id;
 	Elf_Data *sections[DRGN_DWARF_INDEX_NUM_SECTIONS];
 	const char *ptr;
 	uint64_t unit_length;
@@ -263,6 +361,21 @@ struct compilation_unit {
 	uint8_t address_size;
 	bool is_64_bit;
 	bool bswap;
+	/*
+	 * If the module is going to be written to the cache, the writer for
+	 * the module and the DIEs indexed from this unit. Otherwise, NULL and
+	 * empty.
+	 */
+	struct drgn_dwarf_index_cache_writer *cache;
+	struct drgn_dwarf_index_cache_die_vector cache_dies;
+	/*
+	 * If the unit is indexed from .debug_names instead of by scanning it,
+	 * the section offsets of the top-level DIEs and of the enumerators
+	 * whose DW_TAG_enumeration_type isn't in the name index.
+	 */
+	bool from_debug_names;
+	struct uint64_vector debug_names_dies;
+	struct uint64_vector debug_names_enumerators;
 };
 
 static inline const char *section_ptr(Elf_Data *data, size_t offset)
@@ -282,19 +395,27 @@ static inline const char *section_end(Elf_Data *data)
  * We only compare the hash of the file name, not the string value, because a
  * 64-bit collision is unlikely enough, especially when also considering the
  * name and tag.
+ *
+ * There is one of these for every named DIE in every indexed module, so it is
+ * packed into 24 bytes.
  */
 struct drgn_dwarf_index_die {
-	uint64_t tag;
 	uint64_t file_name_hash;
+	/* Offset of the DIE in .debug_info. */
+	uint64_t offset : 48;
+	/* DWARF tags are at most 16 bits (DW_TAG_hi_user is 0xffff). */
+	uint64_t tag : 16;
 	/*
 	 * The next DIE with the same name (as an index into
-	 * drgn_dwarf_index_shard::dies), or SIZE_MAX if this is the last DIE.
+	 * drgn_dwarf_index_shard::dies), or UINT32_MAX if this is the last DIE.
 	 */
-	size_t next;
-	Dwfl_Module *module;
-	uint64_t offset;
+	uint32_t next;
+	/* Index of the module in drgn_dwarf_index::indexed_modules. */
+	uint32_t module_id;
 };
 
+#define DRGN_DWARF_INDEX_MAX_OFFSET ((UINT64_C(1) << 48) - 1)
+
 /*
  * The key is the DIE name. The value is the first DIE with that name (as an
  * index into drgn_dwarf_index_shard::dies).
@@ -424,14 +545,15 @@ static int drgn_dwfl_module_removed(Dwfl_Module *dwfl_module, void *userdatap,
 	    userdata->state == DRGN_DWARF_MODULE_INDEXING)
 		userdata->state = DRGN_DWARF_MODULE_INDEXED;
 	if (arg->free_all || !userdata ||
-	    userdata->state != DRGN_DWARF_MODULE_INDEXED) {
+	    (userdata->state != DRGN_DWARF_MODULE_INDEXED &&
+	     userdata->state != DRGN_DWARF_MODULE_DEFERRED)) {
 		drgn_dwfl_module_userdata_destroy(userdata);
 	} else {
 		Dwarf_Addr end;
 
 		/*
-		 * The module was already indexed. Report it again so libdwfl
-		 * doesn't remove it.
+		 * The module was already indexed or is deferred. Report it
+		 * again so libdwfl doesn't remove it.
 		 */
 		dwfl_module_info(dwfl_module, NULL, NULL, &end, NULL, NULL,
 				 NULL, NULL);
@@ -460,6 +582,34 @@ static void drgn_dwarf_module_finish_indexing(struct drgn_dwarf_index *dindex,
 	}
 }
 
+static void drgn_dwarf_module_set_state(struct drgn_dwarf_module *module,
+					enum drgn_dwarf_module_state state)
+{
+	size_t i;
+
+	module->state = state;
+	for (i = 0; i < module->dwfl_modules.size; i++) {
+		void **userdatap;
+		struct drgn_dwfl_module_userdata *userdata;
+
+		dwfl_module_info(module->dwfl_modules.data[i], &userdatap, NULL,
+				 NULL, NULL, NULL, NULL, NULL);
+		userdata = *userdatap;
+		userdata->state = state;
+	}
+}
+
+static bool drgn_dwarf_module_is_kept(struct drgn_dwarf_module *module)
+{
+	/*
+	 * Deferred modules are kept until they are indexed, unless none of
+	 * their files were successfully reported.
+	 */
+	return (module->state == DRGN_DWARF_MODULE_INDEXED ||
+		(module->state == DRGN_DWARF_MODULE_DEFERRED &&
+		 module->dwfl_modules.size));
+}
+
 static void drgn_dwarf_index_free_modules(struct drgn_dwarf_index *dindex,
 					  bool finish_indexing, bool free_all)
 {
@@ -478,7 +628,7 @@ static void drgn_dwarf_index_free_modules(struct drgn_dwarf_index *dindex,
 		if (finish_indexing &&
 		    module->state == DRGN_DWARF_MODULE_INDEXING)
 			drgn_dwarf_module_finish_indexing(dindex, module);
-		if (free_all || module->state != DRGN_DWARF_MODULE_INDEXED) {
+		if (free_all || !drgn_dwarf_module_is_kept(module)) {
 			it = drgn_dwarf_module_table_delete_iterator(&dindex->module_table,
 								     it);
 			drgn_dwarf_module_destroy(module);
@@ -493,7 +643,7 @@ static void drgn_dwarf_index_free_modules(struct drgn_dwarf_index *dindex,
 		if (finish_indexing &&
 		    module->state == DRGN_DWARF_MODULE_INDEXING)
 			drgn_dwarf_module_finish_indexing(dindex, module);
-		if (free_all || module->state != DRGN_DWARF_MODULE_INDEXED) {
+		if (free_all || !drgn_dwarf_module_is_kept(module)) {
 			dindex->no_build_id.size--;
 			if (i != dindex->no_build_id.size) {
 				dindex->no_build_id.data[i] =
@@ -511,7 +661,7 @@ struct drgn_error *drgn_dwarf_index_init(struct drgn_dwarf_index *dindex,
 					 const Dwfl_Callbacks *callbacks)
 {
 	size_t i;
-	char *max_errors;
+	char *max_errors, *cache_dir;
 
 	dindex->dwfl = dwfl_begin(callbacks);
 	if (!dindex->dwfl)
@@ -530,14 +680,38 @@ struct drgn_error *drgn_dwarf_index_init(struct drgn_dwarf_index *dindex,
 		dindex->max_errors = atoi(max_errors);
 	else
 		dindex->max_errors = 5;
+	cache_dir = getenv("DRGN_DWARF_INDEX_CACHE_DIR");
+	if (cache_dir && cache_dir[0]) {
+		dindex->cache_dir = strdup(cache_dir);
+		if (!dindex->cache_dir) {
+			free_shards(dindex, ARRAY_SIZE(dindex->shards));
+			dwfl_end(dindex->dwfl);
+			return &drgn_enomem;
+		}
+	} else {
+		dindex->cache_dir = NULL;
+	}
+	drgn_dwarf_index_cache_file_vector_init(&dindex->cache_files);
 	drgn_dwarf_module_table_init(&dindex->module_table);
 	drgn_dwarf_module_vector_init(&dindex->no_build_id);
 	c_string_set_init(&dindex->names);
+	dwfl_module_vector_init(&dindex->indexed_modules);
+	dindex->num_threads = 0;
+	dindex->reporting = false;
+	dindex->cu_discovery_ns = 0;
+	dindex->num_decompressed_sections = 0;
+	dindex->decompression_ns = 0;
+	dindex->relocation_ns = 0;
+	dindex->abbrev_parsing_ns = 0;
+	dindex->index_cus_ns = 0;
+	dindex->cache_write_ns = 0;
 	return NULL;
 }
 
 void drgn_dwarf_index_deinit(struct drgn_dwarf_index *dindex)
 {
+	size_t i;
+
 	if (!dindex)
 		return;
 	c_string_set_deinit(&dindex->names);
@@ -547,12 +721,80 @@ void drgn_dwarf_index_deinit(struct drgn_dwarf_index *dindex)
 	drgn_dwarf_module_vector_deinit(&dindex->no_build_id);
 	drgn_dwarf_module_table_deinit(&dindex->module_table);
 	free_shards(dindex, ARRAY_SIZE(dindex->shards));
+	dwfl_module_vector_deinit(&dindex->indexed_modules);
 	dwfl_end(dindex->dwfl);
+	for (i = 0; i < dindex->cache_files.size; i++) {
+		munmap(dindex->cache_files.data[i].map,
+		       dindex->cache_files.data[i].size);
+	}
+	drgn_dwarf_index_cache_file_vector_deinit(&dindex->cache_files);
+	free(dindex->cache_dir);
+}
+
+size_t drgn_dwarf_index_memory_usage(struct drgn_dwarf_index *dindex)
+{
+	size_t usage = 0, i;
+
+	for (i = 0; i < ARRAY_SIZE(dindex->shards); i++) {
+		struct drgn_dwarf_index_shard *shard = &dindex->shards[i];
+
+		usage += drgn_dwarf_index_die_map_memory_usage(&shard->map);
+		usage += (shard->dies.capacity *
+			  sizeof(struct drgn_dwarf_index_die));
+	}
+	usage += drgn_dwarf_module_table_memory_usage(&dindex->module_table);
+	usage += (drgn_dwarf_module_table_size(&dindex->module_table) +
+		  dindex->no_build_id.size) * sizeof(struct drgn_dwarf_module);
+	usage += dindex->no_build_id.capacity * sizeof(struct drgn_dwarf_module *);
+	usage += c_string_set_memory_usage(&dindex->names);
+	return usage;
+}
+
+int drgn_dwarf_index_num_threads(struct drgn_dwarf_index *dindex)
+{
+	return dindex->num_threads ? dindex->num_threads : omp_get_max_threads();
+}
+
+void drgn_dwarf_index_stats(struct drgn_dwarf_index *dindex,
+			    struct drgn_dwarf_index_stats *ret)
+{
+	size_t i;
+
+	ret->num_shards = ARRAY_SIZE(dindex->shards);
+	ret->num_names = 0;
+	ret->num_dies = 0;
+	ret->min_shard_dies = SIZE_MAX;
+	ret->max_shard_dies = 0;
+	ret->die_size = sizeof(struct drgn_dwarf_index_die);
+	ret->shard_bytes = 0;
+	ret->num_threads = drgn_dwarf_index_num_threads(dindex);
+	ret->num_decompressed_sections = dindex->num_decompressed_sections;
+	ret->cu_discovery_ns = dindex->cu_discovery_ns;
+	ret->decompression_ns = dindex->decompression_ns;
+	ret->relocation_ns = dindex->relocation_ns;
+	ret->abbrev_parsing_ns = dindex->abbrev_parsing_ns;
+	ret->die_scan_ns = dindex->index_cus_ns - dindex->abbrev_parsing_ns;
+	ret->cache_write_ns = dindex->cache_write_ns;
+	for (i = 0; i < ARRAY_SIZE(dindex->shards); i++) {
+		struct drgn_dwarf_index_shard *shard = &dindex->shards[i];
+
+		ret->num_names += drgn_dwarf_index_die_map_size(&shard->map);
+		ret->num_dies += shard->dies.size;
+		ret->min_shard_dies = min(ret->min_shard_dies,
+					  shard->dies.size);
+		ret->max_shard_dies = max(ret->max_shard_dies,
+					  shard->dies.size);
+		ret->shard_bytes +=
+			drgn_dwarf_index_die_map_memory_usage(&shard->map);
+		ret->shard_bytes += (shard->dies.capacity *
+				     sizeof(struct drgn_dwarf_index_die));
+	}
 }
 
 void drgn_dwarf_index_report_begin(struct drgn_dwarf_index *dindex)
 {
 	dwfl_report_begin_add(dindex->dwfl);
+	dindex->reporting = true;
 }
 
 struct drgn_error *
@@ -696,7 +938,7 @@ struct drgn_error *drgn_dwarf_index_report_elf(struct drgn_dwarf_index *dindex,
 					       const char *path, int fd,
 					       Elf *elf, uint64_t start,
 					       uint64_t end, const char *name,
-					       bool *new_ret)
+					       bool defer, bool *new_ret)
 {
 	struct drgn_error *err;
 	const void *build_id;
@@ -726,6 +968,17 @@ struct drgn_error *drgn_dwarf_index_report_elf(struct drgn_dwarf_index *dindex,
 		err = NULL;
 		goto free;
 	}
+	if (defer) {
+		/*
+		 * Only defer the module if it wasn't already reported without
+		 * deferring.
+		 */
+		if (module->state == DRGN_DWARF_MODULE_NEW &&
+		    !module->dwfl_modules.size)
+			module->state = DRGN_DWARF_MODULE_DEFERRED;
+	} else if (module->state == DRGN_DWARF_MODULE_DEFERRED) {
+		drgn_dwarf_module_set_state(module, DRGN_DWARF_MODULE_NEW);
+	}
 
 	path_key = realpath(path, NULL);
 	if (!path_key) {
@@ -757,7 +1010,7 @@ struct drgn_error *drgn_dwarf_index_report_elf(struct drgn_dwarf_index *dindex,
 	userdata->path = path_key;
 	userdata->fd = fd;
 	userdata->elf = elf;
-	userdata->state = DRGN_DWARF_MODULE_NEW;
+	userdata->state = module->state;
 	*userdatap = userdata;
 	if (new_ret)
 		*new_ret = true;
@@ -834,6 +1087,10 @@ static int drgn_dwarf_index_report_dwfl_module(Dwfl_Module *dwfl_module,
 		 */
 		userdata->state = DRGN_DWARF_MODULE_INDEXING;
 	} else {
+		if (module->state == DRGN_DWARF_MODULE_DEFERRED) {
+			drgn_dwarf_module_set_state(module,
+						    DRGN_DWARF_MODULE_NEW);
+		}
 		userdata->state = DRGN_DWARF_MODULE_NEW;
 		if (!dwfl_module_vector_append(&module->dwfl_modules,
 					       &dwfl_module))
@@ -847,8 +1104,12 @@ append_unindexed_module(struct drgn_dwarf_module *module,
 			struct drgn_dwarf_module_vector *unindexed,
 			size_t *num_names)
 {
-	if (!module->dwfl_modules.size) {
-		/* This was either already indexed or had no new files. */
+	if (!module->dwfl_modules.size ||
+	    module->state == DRGN_DWARF_MODULE_DEFERRED) {
+		/*
+		 * This was either already indexed, had no new files, or is
+		 * deferred.
+		 */
 		return NULL;
 	}
 	if (!drgn_dwarf_module_vector_append(unindexed, &module))
@@ -869,7 +1130,7 @@ drgn_dwarf_index_get_unindexed(struct drgn_dwarf_index *dindex,
 	/*
 	 * Walk the module table and no build ID lists, but skip modules with no
 	 * Dwfl_Module (which may be because they were already indexed or
-	 * because the files were already reported).
+	 * because the files were already reported) and deferred modules.
 	 */
 	for (it = drgn_dwarf_module_table_first(&dindex->module_table);
 	     it.entry; it = drgn_dwarf_module_table_next(it)) {
@@ -877,17 +1138,14 @@ drgn_dwarf_index_get_unindexed(struct drgn_dwarf_index *dindex,
 		if (err)
 			return err;
 	}
-	for (i = dindex->no_build_id.size; i-- > 0; ) {
-		struct drgn_dwarf_module *module = dindex->no_build_id.data[i];
-
-		if (module->state == DRGN_DWARF_MODULE_INDEXED) {
-			/*
-			 * If this module is indexed, then every module before
-			 * it must be indexed, so we can stop looking.
-			 */
-			break;
-		}
-		err = append_unindexed_module(module, unindexed, &num_names);
+	/*
+	 * Note that a deferred module which is now being indexed may come
+	 * before modules that are already indexed, so we have to check all of
+	 * them.
+	 */
+	for (i = 0; i < dindex->no_build_id.size; i++) {
+		err = append_unindexed_module(dindex->no_build_id.data[i],
+					      unindexed, &num_names);
 		if (err)
 			return err;
 	}
@@ -898,328 +1156,1655 @@ drgn_dwarf_index_get_unindexed(struct drgn_dwarf_index *dindex,
 	return NULL;
 }
 
-static struct drgn_error *apply_relocation(Elf_Data *data, uint64_t r_offset,
-					   uint32_t r_type, int64_t r_addend,
-					   uint64_t st_value)
+/*
+ * Decompress the SHF_COMPRESSED debugging sections (and their relocation
+ * sections) in an ELF file. Otherwise, libdw decompresses them one at a time
+ * when dwfl_module_getdwarf() opens the file. This is called from the parallel
+ * region in read_cus(), so each section is decompressed in a task that idle
+ * threads can pick up.
+ *
+ * Sections in the legacy .zdebug format are left to libdw, which fails if they
+ * were already decompressed.
+ */
+static struct drgn_error *
+decompress_debug_sections(struct drgn_dwarf_index *dindex, Elf *elf)
 {
-	char *p;
-
-	p = (char *)data->d_buf + r_offset;
-	switch (r_type) {
-	case R_X86_64_NONE:
-		break;
-	case R_X86_64_32:
-		if (r_offset > SIZE_MAX - sizeof(uint32_t) ||
-		    r_offset + sizeof(uint32_t) > data->d_size) {
-			return drgn_error_create(DRGN_ERROR_OTHER,
-						 "invalid relocation offset");
-		}
-		*(uint32_t *)p = st_value + r_addend;
-		break;
-	case R_X86_64_64:
-		if (r_offset > SIZE_MAX - sizeof(uint64_t) ||
-		    r_offset + sizeof(uint64_t) > data->d_size) {
-			return drgn_error_create(DRGN_ERROR_OTHER,
-						 "invalid relocation offset");
-		}
-		*(uint64_t *)p = st_value + r_addend;
-		break;
-	default:
-		return drgn_error_format(DRGN_ERROR_OTHER,
-					 "unimplemented relocation type %" PRIu32,
-					 r_type);
-	}
-	return NULL;
-}
+	struct drgn_error *err = NULL, *task_err = NULL;
+	size_t shstrndx;
+	Elf_Scn *scn = NULL;
 
-static struct drgn_error *relocate_section(Elf_Scn *scn, Elf_Scn *rela_scn,
-					   Elf_Scn *symtab_scn,
-					   uint64_t *sh_addrs, size_t shdrnum)
-{
-	struct drgn_error *err;
-	Elf_Data *data, *rela_data, *symtab_data;
-	const Elf64_Rela *relocs;
-	const Elf64_Sym *syms;
-	size_t num_relocs, num_syms;
-	size_t i;
-	GElf_Shdr *shdr, shdr_mem;
+	if (elf_getshdrstrndx(elf, &shstrndx))
+		return drgn_error_libelf();
 
-	err = read_elf_section(scn, &data);
-	if (err)
-		return err;
-	err = read_elf_section(rela_scn, &rela_data);
-	if (err)
-		return err;
-	err = read_elf_section(symtab_scn, &symtab_data);
-	if (err)
-		return err;
+	while ((scn = elf_nextscn(elf, scn))) {
+		GElf_Shdr *shdr, shdr_mem;
+		const char *scnname;
 
-	relocs = (Elf64_Rela *)rela_data->d_buf;
-	num_relocs = rela_data->d_size / sizeof(Elf64_Rela);
-	syms = (Elf64_Sym *)symtab_data->d_buf;
-	num_syms = symtab_data->d_size / sizeof(Elf64_Sym);
+		shdr = gelf_getshdr(scn, &shdr_mem);
+		if (!shdr) {
+			err = drgn_error_libelf();
+			break;
+		}
 
-	for (i = 0; i < num_relocs; i++) {
-		const Elf64_Rela *reloc = &relocs[i];
-		uint32_t r_sym, r_type;
-		uint16_t st_shndx;
-		uint64_t sh_addr;
+		if (shdr->sh_type == SHT_NOBITS ||
+		    !(shdr->sh_flags & SHF_COMPRESSED))
+			continue;
 
-		r_sym = ELF64_R_SYM(reloc->r_info);
-		r_type = ELF64_R_TYPE(reloc->r_info);
+		scnname = elf_strptr(elf, shstrndx, shdr->sh_name);
+		if (!scnname ||
+		    (strncmp(scnname, ".debug_", 7) != 0 &&
+		     strncmp(scnname, ".rela.debug_", 12) != 0))
+			continue;
 
-		if (r_sym >= num_syms) {
-			return drgn_error_create(DRGN_ERROR_OTHER,
-						 "invalid relocation symbol");
-		}
-		st_shndx = syms[r_sym].st_shndx;
-		if (st_shndx == 0) {
-			sh_addr = 0;
-		} else if (st_shndx < shdrnum) {
-			sh_addr = sh_addrs[st_shndx - 1];
-		} else {
-			return drgn_error_create(DRGN_ERROR_OTHER,
-						 "invalid symbol section index");
+		#pragma omp task firstprivate(scn) shared(task_err)
+		{
+			struct drgn_error *scn_err = NULL;
+			uint64_t start, elapsed;
+
+			start = monotonic_time_ns();
+			if (elf_compress(scn, 0, 0) < 0)
+				scn_err = drgn_error_libelf();
+			elapsed = monotonic_time_ns() - start;
+			#pragma omp atomic
+			dindex->decompression_ns += elapsed;
+			if (scn_err) {
+				#pragma omp critical(drgn_decompress_debug_sections)
+				if (task_err)
+					drgn_error_destroy(scn_err);
+				else
+					task_err = scn_err;
+			} else {
+				#pragma omp atomic
+				dindex->num_decompressed_sections++;
+			}
 		}
-		err = apply_relocation(data, reloc->r_offset, r_type,
-				       reloc->r_addend,
-				       sh_addr + syms[r_sym].st_value);
-		if (err)
-			return err;
 	}
-
-	/*
-	 * Mark the relocation section as empty so that libdwfl doesn't try to
-	 * apply it again.
-	 */
-	shdr = gelf_getshdr(rela_scn, &shdr_mem);
-	if (!shdr)
-		return drgn_error_libelf();
-	shdr->sh_size = 0;
-	if (!gelf_update_shdr(rela_scn, shdr))
-		return drgn_error_libelf();
-	rela_data->d_size = 0;
-	return NULL;
+	#pragma omp taskwait
+	if (err) {
+		drgn_error_destroy(task_err);
+		return err;
+	}
+	return task_err;
 }
 
 /*
- * Before the debugging information in a relocatable ELF file (e.g., Linux
- * kernel module) can be used, it must have ELF relocations applied. This is
- * usually done by libdwfl. However, libdwfl is relatively slow at it. This is a
- * much faster implementation. It is only implemented for x86-64; for other
- * architectures, we can fall back to libdwfl.
+ * Get the data for a section in the legacy GNU .zdebug format, decompressing
+ * it if libdw didn't already.
  */
-static struct drgn_error *apply_elf_relocations(Elf *elf)
+static struct drgn_error *read_zdebug_section(struct drgn_dwarf_index *dindex,
+					      Elf_Scn *scn, Elf_Data **ret)
 {
-	struct drgn_error *err;
-	GElf_Ehdr ehdr_mem, *ehdr;
-	size_t shdrnum, shstrndx;
-	uint64_t *sh_addrs;
-	Elf_Scn *scn;
+	Elf_Data *data;
 
-	ehdr = gelf_getehdr(elf, &ehdr_mem);
-	if (!ehdr)
+	data = elf_getdata(scn, NULL);
+	if (!data)
 		return drgn_error_libelf();
+	if (data->d_size >= 12 && memcmp(data->d_buf, "ZLIB", 4) == 0) {
+		uint64_t start, elapsed;
 
-	if (ehdr->e_type != ET_REL ||
-	    ehdr->e_machine != EM_X86_64 ||
-	    ehdr->e_ident[EI_CLASS] != ELFCLASS64 ||
-	    ehdr->e_ident[EI_DATA] !=
-	    (__BYTE_ORDER__ == __ORDER_LITTLE_ENDIAN__ ?
-	     ELFDATA2LSB : ELFDATA2MSB)) {
-		/* Unsupported; fall back to libdwfl. */
-		return NULL;
+		start = monotonic_time_ns();
+		if (elf_compress_gnu(scn, 0, 0) < 0)
+			return drgn_error_libelf();
+		elapsed = monotonic_time_ns() - start;
+		#pragma omp atomic
+		dindex->decompression_ns += elapsed;
+		#pragma omp atomic
+		dindex->num_decompressed_sections++;
+		data = elf_getdata(scn, NULL);
+		if (!data)
+			return drgn_error_libelf();
 	}
+	*ret = data;
+	return NULL;
+}
 
-	if (elf_getshdrnum(elf, &shdrnum))
-		return drgn_error_libelf();
-	if (shdrnum > 1) {
-		sh_addrs = calloc(shdrnum - 1, sizeof(*sh_addrs));
-		if (!sh_addrs)
-			return &drgn_enomem;
-
-		scn = NULL;
-		while ((scn = elf_nextscn(elf, scn))) {
-			size_t ndx;
-
-			ndx = elf_ndxscn(scn);
-			if (ndx > 0 && ndx < shdrnum) {
-				GElf_Shdr *shdr, shdr_mem;
-
-				shdr = gelf_getshdr(scn, &shdr_mem);
-				if (!shdr) {
-					err = drgn_error_libelf();
-					goto out;
-				}
-				sh_addrs[ndx - 1] = shdr->sh_addr;
-			}
-		}
-	} else {
-		sh_addrs = NULL;
-	}
+static struct drgn_error *get_debug_sections(struct drgn_dwarf_index *dindex,
+					     Elf *elf, Elf_Data **sections)
+{
+	struct drgn_error *err;
+	size_t shstrndx;
+	Elf_Scn *scn = NULL;
+	size_t i;
+	Elf_Data *debug_str;
 
-	if (elf_getshdrstrndx(elf, &shstrndx)) {
-		err = drgn_error_libelf();
-		goto out;
-	}
+	if (elf_getshdrstrndx(elf, &shstrndx))
+		return drgn_error_libelf();
 
-	scn = NULL;
 	while ((scn = elf_nextscn(elf, scn))) {
 		GElf_Shdr *shdr, shdr_mem;
 		const char *scnname;
+		bool zdebug;
 
 		shdr = gelf_getshdr(scn, &shdr_mem);
-		if (!shdr) {
-			err = drgn_error_libelf();
-			goto out;
-		}
+		if (!shdr)
+			return drgn_error_libelf();
 
-		if (shdr->sh_type != SHT_RELA)
+		if (shdr->sh_type == SHT_NOBITS || (shdr->sh_flags & SHF_GROUP))
 			continue;
 
 		scnname = elf_strptr(elf, shstrndx, shdr->sh_name);
 		if (!scnname)
 			continue;
+		/* .zdebug_foo is .debug_foo compressed in the GNU format. */
+		if (strncmp(scnname, ".debug_", 7) == 0) {
+			zdebug = false;
+			scnname++;
+		} else if (strncmp(scnname, ".zdebug_", 8) == 0) {
+			zdebug = true;
+			scnname += 2;
+		} else {
+			continue;
+		}
+
+		for (i = 0; i < DRGN_DWARF_INDEX_NUM_SECTIONS; i++) {
+			if (sections[i])
+				continue;
+
+			if (strcmp(scnname, section_name[i] + 1) != 0)
+				continue;
+
+			if (zdebug)
+				err = read_zdebug_section(dindex, scn,
+							  &sections[i]);
+			else
+				err = read_elf_section(scn, &sections[i]);
+			if (err)
+				return err;
+		}
+	}
+
+	for (i = 0; i < DRGN_DWARF_INDEX_NUM_SECTIONS; i++) {
+		if (i != SECTION_DEBUG_LINE && i != SECTION_DEBUG_NAMES &&
+		    !sections[i]) {
+			return drgn_error_format(DRGN_ERROR_OTHER,
+						 "no %s section",
+						 section_name[i]);
+		}
+	}
+
+	debug_str = sections[SECTION_DEBUG_STR];
+	if (debug_str->d_size == 0 ||
+	    ((char *)debug_str->d_buf)[debug_str->d_size - 1] != '\0') {
+		return drgn_error_create(DRGN_ERROR_OTHER,
+					 ".debug_str is not null terminated");
+	}
+	return NULL;
+}
+
+static struct drgn_error *read_compilation_unit_header(const char *ptr,
+						       const char *end,
+						       struct compilation_unit *cu)
+{
+	uint32_t tmp;
+	uint16_t version;
+
+	if (!read_u32(&ptr, end, cu->bswap, &tmp))
+		return drgn_eof();
+	cu->is_64_bit = tmp == UINT32_C(0xffffffff);
+	if (cu->is_64_bit) {
+		if (!read_u64(&ptr, end, cu->bswap, &cu->unit_length))
+			return drgn_eof();
+	} else {
+		cu->unit_length = tmp;
+	}
+
+	if (!read_u16(&ptr, end, cu->bswap, &version))
+		return drgn_eof();
+	if (version != 2 && version != 3 && version != 4) {
+		return drgn_error_format(DRGN_ERROR_OTHER,
+					 "unknown DWARF CU version %" PRIu16,
+					 version);
+	}
+
+	if (cu->is_64_bit) {
+		if (!read_u64(&ptr, end, cu->bswap, &cu->debug_abbrev_offset))
+			return drgn_eof();
+	} else {
+		if (!read_u32_into_u64(&ptr, end, cu->bswap,
+				       &cu->debug_abbrev_offset))
+			return drgn_eof();
+	}
+
+	if (!read_u8(&ptr, end, &cu->address_size))
+		return drgn_eof();
+
+	return NULL;
+}
+
+DEFINE_VECTOR(compilation_unit_vector, struct compilation_unit)
+
+static void compilation_unit_deinit(struct compilation_unit *cu)
+{
+	uint64_vector_deinit(&cu->debug_names_enumerators);
+	uint64_vector_deinit(&cu->debug_names_dies);
+	drgn_dwarf_index_cache_die_vector_deinit(&cu->cache_dies);
+}
+
+static struct drgn_error *index_die(struct drgn_dwarf_index *dindex,
+				    const char *name, size_t name_len,
+				    uint64_t tag, uint64_t file_name_hash,
+				    uint32_t module_id, uint64_t offset);
+
+static char *dwarf_index_cache_path(struct drgn_dwarf_index *dindex,
+				    const void *build_id, size_t build_id_len,
+				    const char *suffix)
+{
+	struct string_builder sb = {};
+	size_t i;
+	char *path;
+
+	if (!string_builder_append(&sb, dindex->cache_dir) ||
+	    !string_builder_appendc(&sb, '/'))
+		goto err;
+	for (i = 0; i < build_id_len; i++) {
+		if (!string_builder_appendf(&sb, "%02x",
+					    ((const uint8_t *)build_id)[i]))
+			goto err;
+	}
+	if (!string_builder_append(&sb, suffix) ||
+	    !string_builder_finalize(&sb, &path))
+		goto err;
+	return path;
+
+err:
+	free(sb.str);
+	return NULL;
+}
+
+/*
+ * Load the index of a module from the cache file at the given path if it
+ * matches the module. The file is only checked here; it is not read (or even
+ * paged in) until the entries are indexed.
+ */
+static struct drgn_error *
+load_dwarf_index_cache(struct drgn_dwarf_index *dindex,
+		       uint32_t module_id, const char *path,
+		       const void *build_id, size_t build_id_len,
+		       const struct stat *st, bool *hit_ret)
+{
+	struct drgn_error *err;
+	int fd;
+	struct stat cache_st;
+	struct drgn_dwarf_index_cache_file file;
+	const struct drgn_dwarf_index_cache_header *header;
+	const struct drgn_dwarf_index_cache_entry *entries;
+	const char *strtab;
+	size_t entries_offset, strtab_offset, i;
+	bool ok;
+
+	*hit_ret = false;
+
+	fd = open(path, O_RDONLY);
+	if (fd == -1)
+		return NULL;
+	if (fstat(fd, &cache_st) == -1 ||
+	    cache_st.st_size < sizeof(*header)) {
+		close(fd);
+		return NULL;
+	}
+	file.size = cache_st.st_size;
+	file.map = mmap(NULL, file.size, PROT_READ, MAP_PRIVATE, fd, 0);
+	close(fd);
+	if (file.map == MAP_FAILED)
+		return NULL;
+
+	header = file.map;
+	if (memcmp(header->magic, DRGN_DWARF_INDEX_CACHE_MAGIC,
+		   sizeof(header->magic)) != 0 ||
+	    header->version != DRGN_DWARF_INDEX_CACHE_VERSION ||
+	    header->build_id_len != build_id_len ||
+	    header->file_size != st->st_size ||
+	    header->mtime_sec != st->st_mtim.tv_sec ||
+	    header->mtime_nsec != st->st_mtim.tv_nsec)
+		goto miss;
+	entries_offset = sizeof(*header) + ((build_id_len + 7) & ~(size_t)7);
+	if (entries_offset > file.size ||
+	    memcmp(header + 1, build_id, build_id_len) != 0 ||
+	    header->num_entries > (file.size - entries_offset) /
+				  sizeof(*entries))
+		goto miss;
+	strtab_offset = entries_offset + header->num_entries * sizeof(*entries);
+	if (header->strtab_size != file.size - strtab_offset)
+		goto miss;
+	entries = (void *)((char *)file.map + entries_offset);
+	strtab = (char *)file.map + strtab_offset;
+	/*
+	 * Check every entry before indexing any of them so that we don't have
+	 * to undo anything if the file is corrupted.
+	 */
+	for (i = 0; i < header->num_entries; i++) {
+		if (entries[i].name_offset >= header->strtab_size ||
+		    entries[i].name_len >=
+		    header->strtab_size - entries[i].name_offset ||
+		    strtab[entries[i].name_offset + entries[i].name_len] ||
+		    entries[i].tag > UINT16_MAX ||
+		    entries[i].offset > DRGN_DWARF_INDEX_MAX_OFFSET)
+			goto miss;
+	}
+
+	#pragma omp critical(drgn_dwarf_index_cache_files)
+	ok = drgn_dwarf_index_cache_file_vector_append(&dindex->cache_files,
+						       &file);
+	if (!ok) {
+		munmap(file.map, file.size);
+		return &drgn_enomem;
+	}
+	/*
+	 * Entries may be indexed from here on, so report a hit even if we fail
+	 * partway through.
+	 */
+	*hit_ret = true;
+	for (i = 0; i < header->num_entries; i++) {
+		err = index_die(dindex, &strtab[entries[i].name_offset],
+				entries[i].name_len, entries[i].tag,
+				entries[i].file_name_hash, module_id,
+				entries[i].offset);
+		if (err)
+			return err;
+	}
+	return NULL;
+
+miss:
+	munmap(file.map, file.size);
+	return NULL;
+}
+
+/*
+ * Look up a module in the cache. On a hit, the cached index is loaded (if this
+ * fails, *hit_ret is still set, as part of it may have been indexed).
+ * Otherwise, a writer is returned which can be used to add the module to the
+ * cache once it is indexed (or NULL if that is not possible).
+ */
+static struct drgn_error *
+read_dwarf_index_cache(struct drgn_dwarf_index *dindex,
+		       struct drgn_dwarf_module *module,
+		       Dwfl_Module *dwfl_module, uint32_t module_id,
+		       bool *hit_ret,
+		       struct drgn_dwarf_index_cache_writer **writer_ret)
+{
+	struct drgn_error *err;
+	const char *mainfile, *debugfile;
+	struct stat st;
+	char *path;
+	struct drgn_dwarf_index_cache_writer *writer;
+
+	*hit_ret = false;
+	*writer_ret = NULL;
+
+	dwfl_module_info(dwfl_module, NULL, NULL, NULL, NULL, NULL, &mainfile,
+			 &debugfile);
+	if (!debugfile)
+		debugfile = mainfile;
+	if (!debugfile || stat(debugfile, &st) == -1)
+		return NULL;
+
+	path = dwarf_index_cache_path(dindex, module->build_id,
+				      module->build_id_len, "");
+	if (!path)
+		return &drgn_enomem;
+	err = load_dwarf_index_cache(dindex, module_id, path,
+				     module->build_id, module->build_id_len,
+				     &st, hit_ret);
+	if (err || *hit_ret) {
+		free(path);
+		return err;
+	}
+
+	writer = malloc(sizeof(*writer));
+	if (!writer) {
+		free(path);
+		return &drgn_enomem;
+	}
+	writer->path = path;
+	writer->build_id = module->build_id;
+	writer->build_id_len = module->build_id_len;
+	writer->file_size = st.st_size;
+	writer->mtime = st.st_mtim;
+	*writer_ret = writer;
+	return NULL;
+}
+
+static bool write_all(FILE *file, const void *buf, size_t size)
+{
+	return size == 0 || fwrite(buf, size, 1, file) == 1;
+}
+
+/*
+ * Write the index of a module to the cache. The cache is only an optimization,
+ * so errors are ignored.
+ */
+static void write_dwarf_index_cache(struct drgn_dwarf_index_cache_writer *writer,
+				    struct compilation_unit *cus,
+				    size_t num_cus)
+{
+	static const char zeroes[8];
+	struct drgn_dwarf_index_cache_die_set dies;
+	struct drgn_dwarf_index_cache_die_set_iterator it;
+	struct drgn_dwarf_index_cache_header header = {
+		.magic = DRGN_DWARF_INDEX_CACHE_MAGIC,
+		.version = DRGN_DWARF_INDEX_CACHE_VERSION,
+		.build_id_len = writer->build_id_len,
+		.file_size = writer->file_size,
+		.mtime_sec = writer->mtime.tv_sec,
+		.mtime_nsec = writer->mtime.tv_nsec,
+	};
+	struct drgn_dwarf_index_cache_entry *entries = NULL;
+	struct string_builder strtab = {};
+	char *tmp_path = NULL;
+	int fd;
+	FILE *file;
+	size_t i, j;
+	bool ok;
+
+	drgn_dwarf_index_cache_die_set_init(&dies);
+	for (i = 0; i < num_cus; i++) {
+		if (cus[i].cache != writer)
+			continue;
+		for (j = 0; j < cus[i].cache_dies.size; j++) {
+			if (drgn_dwarf_index_cache_die_set_insert(&dies,
+								  &cus[i].cache_dies.data[j],
+								  NULL) == -1)
+				goto out;
+		}
+	}
+
+	header.num_entries = drgn_dwarf_index_cache_die_set_size(&dies);
+	entries = malloc_array(header.num_entries, sizeof(*entries));
+	if (!entries && header.num_entries)
+		goto out;
+	i = 0;
+	for (it = drgn_dwarf_index_cache_die_set_first(&dies); it.entry;
+	     it = drgn_dwarf_index_cache_die_set_next(it)) {
+		if (it.entry->name.len > UINT32_MAX)
+			goto out;
+		entries[i].offset = it.entry->offset;
+		entries[i].file_name_hash = it.entry->file_name_hash;
+		entries[i].name_offset = strtab.len;
+		entries[i].name_len = it.entry->name.len;
+		entries[i].tag = it.entry->tag;
+		if (!string_builder_appendn(&strtab, it.entry->name.str,
+					    it.entry->name.len) ||
+		    !string_builder_appendc(&strtab, '\0'))
+			goto out;
+		i++;
+	}
+	header.strtab_size = strtab.len;
+
+	if (asprintf(&tmp_path, "%s.XXXXXX", writer->path) == -1) {
+		tmp_path = NULL;
+		goto out;
+	}
+	fd = mkstemp(tmp_path);
+	if (fd == -1)
+		goto out;
+	file = fdopen(fd, "w");
+	if (!file) {
+		close(fd);
+		goto out_unlink;
+	}
+	ok = (write_all(file, &header, sizeof(header)) &&
+	      write_all(file, writer->build_id, writer->build_id_len) &&
+	      write_all(file, zeroes, -writer->build_id_len & 7) &&
+	      write_all(file, entries, header.num_entries * sizeof(*entries)) &&
+	      write_all(file, strtab.str, strtab.len));
+	if (fclose(file) == 0 && ok && rename(tmp_path, writer->path) == 0)
+		goto out;
+out_unlink:
+	unlink(tmp_path);
+out:
+	free(tmp_path);
+	free(strtab.str);
+	free(entries);
+	drgn_dwarf_index_cache_die_set_deinit(&dies);
+}
+
+static void write_dwarf_index_caches(struct drgn_dwarf_index *dindex,
+				     struct drgn_dwarf_index_cache_writer **writers,
+				     size_t num_writers,
+				     struct compilation_unit *cus,
+				     size_t num_cus)
+{
+	size_t i;
+	uint64_t start;
+
+	if (!num_writers)
+		return;
+
+	start = monotonic_time_ns();
+	/* The directory may not exist yet. */
+	mkdir(dindex->cache_dir, 0777);
+	#pragma omp parallel for schedule(dynamic) \
+		num_threads(drgn_dwarf_index_num_threads(dindex))
+	for (i = 0; i < num_writers; i++)
+		write_dwarf_index_cache(writers[i], cus, num_cus);
+	dindex->cache_write_ns += monotonic_time_ns() - start;
+}
+
+static struct drgn_error *apply_relocation(Elf_Data *data, uint64_t r_offset,
+					   uint32_t r_type, int64_t r_addend,
+					   uint64_t st_value)
+{
+	char *p;
+
+	p = (char *)data->d_buf + r_offset;
+	switch (r_type) {
+	case R_X86_64_NONE:
+		break;
+	case R_X86_64_32:
+		if (r_offset > SIZE_MAX - sizeof(uint32_t) ||
+		    r_offset + sizeof(uint32_t) > data->d_size) {
+			return drgn_error_create(DRGN_ERROR_OTHER,
+						 "invalid relocation offset");
+		}
+		*(uint32_t *)p = st_value + r_addend;
+		break;
+	case R_X86_64_64:
+		if (r_offset > SIZE_MAX - sizeof(uint64_t) ||
+		    r_offset + sizeof(uint64_t) > data->d_size) {
+			return drgn_error_create(DRGN_ERROR_OTHER,
+						 "invalid relocation offset");
+		}
+		*(uint64_t *)p = st_value + r_addend;
+		break;
+	default:
+		return drgn_error_format(DRGN_ERROR_OTHER,
+					 "unimplemented relocation type %" PRIu32,
+					 r_type);
+	}
+	return NULL;
+}
+
+/* A debugging section to be relocated. */
+struct relocation_section {
+	Elf_Scn *scn;
+	Elf_Data *data;
+	/* Section containing the relocations. */
+	Elf_Scn *rela_scn;
+	Elf_Data *rela_data;
+	const Elf64_Rela *relocs;
+	size_t num_relocs;
+	const Elf64_Sym *syms;
+	size_t num_syms;
+	/* Error returned by relocate_section(). */
+	struct drgn_error *err;
+};
+
+DEFINE_VECTOR(relocation_section_vector, struct relocation_section)
+
+static struct drgn_error *
+read_relocation_section(Elf *elf, Elf_Scn *rela_scn, const GElf_Shdr *rela_shdr,
+			struct relocation_section *section)
+{
+	struct drgn_error *err;
+	Elf_Scn *symtab_scn;
+	Elf_Data *symtab_data;
+
+	section->scn = elf_getscn(elf, rela_shdr->sh_info);
+	if (!section->scn)
+		return drgn_error_libelf();
+	symtab_scn = elf_getscn(elf, rela_shdr->sh_link);
+	if (!symtab_scn)
+		return drgn_error_libelf();
+
+	err = read_elf_section(section->scn, &section->data);
+	if (err)
+		return err;
+	err = read_elf_section(rela_scn, &section->rela_data);
+	if (err)
+		return err;
+	err = read_elf_section(symtab_scn, &symtab_data);
+	if (err)
+		return err;
+
+	section->rela_scn = rela_scn;
+	section->relocs = (Elf64_Rela *)section->rela_data->d_buf;
+	section->num_relocs = section->rela_data->d_size / sizeof(Elf64_Rela);
+	section->syms = (Elf64_Sym *)symtab_data->d_buf;
+	section->num_syms = symtab_data->d_size / sizeof(Elf64_Sym);
+	section->err = NULL;
+	return NULL;
+}
+
+/*
+ * Apply the relocations to a section. This only modifies the section data, so
+ * different sections may be relocated concurrently.
+ */
+static struct drgn_error *
+relocate_section(const struct relocation_section *section,
+		 const uint64_t *sh_addrs, size_t shdrnum)
+{
+	struct drgn_error *err;
+	size_t i;
+
+	for (i = 0; i < section->num_relocs; i++) {
+		const Elf64_Rela *reloc = &section->relocs[i];
+		uint32_t r_sym, r_type;
+		uint16_t st_shndx;
+		uint64_t sh_addr;
+
+		r_sym = ELF64_R_SYM(reloc->r_info);
+		r_type = ELF64_R_TYPE(reloc->r_info);
+
+		if (r_sym >= section->num_syms) {
+			return drgn_error_create(DRGN_ERROR_OTHER,
+						 "invalid relocation symbol");
+		}
+		st_shndx = section->syms[r_sym].st_shndx;
+		if (st_shndx == 0) {
+			sh_addr = 0;
+		} else if (st_shndx < shdrnum) {
+			sh_addr = sh_addrs[st_shndx - 1];
+		} else {
+			return drgn_error_create(DRGN_ERROR_OTHER,
+						 "invalid symbol section index");
+		}
+		err = apply_relocation(section->data, reloc->r_offset, r_type,
+				       reloc->r_addend,
+				       sh_addr + section->syms[r_sym].st_value);
+		if (err)
+			return err;
+	}
+	return NULL;
+}
+
+/*
+ * Mark the relocation section of a relocated section as empty so that libdwfl
+ * doesn't try to apply it again.
+ */
+static struct drgn_error *
+finish_relocation_section(struct relocation_section *section)
+{
+	GElf_Shdr *shdr, shdr_mem;
+
+	shdr = gelf_getshdr(section->rela_scn, &shdr_mem);
+	if (!shdr)
+		return drgn_error_libelf();
+	shdr->sh_size = 0;
+	if (!gelf_update_shdr(section->rela_scn, shdr))
+		return drgn_error_libelf();
+	section->rela_data->d_size = 0;
+	return NULL;
+}
+
+/*
+ * The relocation cache file for a module is named by the hexadecimal build ID
+ * of the module followed by ".rel". It consists of a struct
+ * drgn_dwarf_index_reloc_cache_header, the build ID padded to a multiple of 8
+ * bytes, the address of every section in the file (which the relocated contents
+ * depend on), an array of struct drgn_dwarf_index_reloc_cache_section, and
+ * finally the relocated contents of each section, each padded to a multiple of
+ * 8 bytes. All fields are in native byte order.
+ */
+#define DRGN_DWARF_INDEX_RELOC_CACHE_MAGIC "drgnrel"
+#define DRGN_DWARF_INDEX_RELOC_CACHE_VERSION 1
+
+struct drgn_dwarf_index_reloc_cache_header {
+	char magic[8];
+	uint32_t version;
+	uint32_t build_id_len;
+	/* Size and modification time of the relocated file. */
+	uint64_t file_size;
+	int64_t mtime_sec;
+	int64_t mtime_nsec;
+	uint64_t num_sh_addrs;
+	uint64_t num_sections;
+};
+
+struct drgn_dwarf_index_reloc_cache_section {
+	uint64_t index;
+	uint64_t offset;
+	uint64_t size;
+};
+
+/*
+ * Replace the contents of the sections to relocate with the relocated contents
+ * from the cache file at the given path if it matches the module.
+ */
+static struct drgn_error *
+load_relocation_cache(struct drgn_dwarf_index *dindex, const char *path,
+		      struct drgn_dwarf_module *module, const struct stat *st,
+		      const uint64_t *sh_addrs, size_t num_sh_addrs,
+		      struct relocation_section *sections, size_t num_sections,
+		      bool *hit_ret)
+{
+	int fd;
+	struct stat cache_st;
+	struct drgn_dwarf_index_cache_file file;
+	const struct drgn_dwarf_index_reloc_cache_header *header;
+	const struct drgn_dwarf_index_reloc_cache_section *cached;
+	size_t offset, i;
+	bool ok;
+
+	*hit_ret = false;
+
+	fd = open(path, O_RDONLY);
+	if (fd == -1)
+		return NULL;
+	if (fstat(fd, &cache_st) == -1 ||
+	    cache_st.st_size < sizeof(*header)) {
+		close(fd);
+		return NULL;
+	}
+	file.size = cache_st.st_size;
+	file.map = mmap(NULL, file.size, PROT_READ, MAP_PRIVATE, fd, 0);
+	close(fd);
+	if (file.map == MAP_FAILED)
+		return NULL;
+
+	header = file.map;
+	if (memcmp(header->magic, DRGN_DWARF_INDEX_RELOC_CACHE_MAGIC,
+		   sizeof(header->magic)) != 0 ||
+	    header->version != DRGN_DWARF_INDEX_RELOC_CACHE_VERSION ||
+	    header->build_id_len != module->build_id_len ||
+	    header->file_size != st->st_size ||
+	    header->mtime_sec != st->st_mtim.tv_sec ||
+	    header->mtime_nsec != st->st_mtim.tv_nsec ||
+	    header->num_sh_addrs != num_sh_addrs ||
+	    header->num_sections != num_sections)
+		goto miss;
+	offset = sizeof(*header) + ((module->build_id_len + 7) & ~(size_t)7);
+	if (offset > file.size ||
+	    memcmp(header + 1, module->build_id, module->build_id_len) != 0 ||
+	    num_sh_addrs > (file.size - offset) / sizeof(*sh_addrs) ||
+	    memcmp((char *)file.map + offset, sh_addrs,
+		   num_sh_addrs * sizeof(*sh_addrs)) != 0)
+		goto miss;
+	offset += num_sh_addrs * sizeof(*sh_addrs);
+	if (num_sections > (file.size - offset) / sizeof(*cached))
+		goto miss;
+	cached = (void *)((char *)file.map + offset);
+	for (i = 0; i < num_sections; i++) {
+		if (cached[i].index != elf_ndxscn(sections[i].scn) ||
+		    cached[i].size != sections[i].data->d_size ||
+		    cached[i].offset > file.size ||
+		    cached[i].size > file.size - cached[i].offset)
+			goto miss;
+	}
+
+	#pragma omp critical(drgn_dwarf_index_cache_files)
+	ok = drgn_dwarf_index_cache_file_vector_append(&dindex->cache_files,
+						       &file);
+	if (!ok) {
+		munmap(file.map, file.size);
+		return &drgn_enomem;
+	}
+	for (i = 0; i < num_sections; i++)
+		sections[i].data->d_buf = (char *)file.map + cached[i].offset;
+	*hit_ret = true;
+	return NULL;
+
+miss:
+	munmap(file.map, file.size);
+	return NULL;
+}
+
+/*
+ * Write the relocated contents of the sections of a module to the cache. The
+ * cache is only an optimization, so errors are ignored.
+ */
+static void write_relocation_cache(struct drgn_dwarf_index *dindex,
+				   const char *path,
+				   struct drgn_dwarf_module *module,
+				   const struct stat *st,
+				   const uint64_t *sh_addrs,
+				   size_t num_sh_addrs,
+				   struct relocation_section *sections,
+				   size_t num_sections)
+{
+	static const char zeroes[8];
+	struct drgn_dwarf_index_reloc_cache_header header = {
+		.magic = DRGN_DWARF_INDEX_RELOC_CACHE_MAGIC,
+		.version = DRGN_DWARF_INDEX_RELOC_CACHE_VERSION,
+		.build_id_len = module->build_id_len,
+		.file_size = st->st_size,
+		.mtime_sec = st->st_mtim.tv_sec,
+		.mtime_nsec = st->st_mtim.tv_nsec,
+		.num_sh_addrs = num_sh_addrs,
+		.num_sections = num_sections,
+	};
+	struct drgn_dwarf_index_reloc_cache_section *cached;
+	char *tmp_path = NULL;
+	uint64_t offset;
+	int fd;
+	FILE *file;
+	size_t i;
+	bool ok;
+
+	cached = malloc_array(num_sections, sizeof(*cached));
+	if (!cached)
+		return;
+	offset = (sizeof(header) + ((module->build_id_len + 7) & ~(size_t)7) +
+		  num_sh_addrs * sizeof(*sh_addrs) +
+		  num_sections * sizeof(*cached));
+	for (i = 0; i < num_sections; i++) {
+		cached[i].index = elf_ndxscn(sections[i].scn);
+		cached[i].offset = offset;
+		cached[i].size = sections[i].data->d_size;
+		offset += (cached[i].size + 7) & ~(uint64_t)7;
+	}
+
+	/* The directory may not exist yet. */
+	mkdir(dindex->cache_dir, 0777);
+	if (asprintf(&tmp_path, "%s.XXXXXX", path) == -1) {
+		tmp_path = NULL;
+		goto out;
+	}
+	fd = mkstemp(tmp_path);
+	if (fd == -1)
+		goto out;
+	file = fdopen(fd, "w");
+	if (!file) {
+		close(fd);
+		goto out_unlink;
+	}
+	ok = (write_all(file, &header, sizeof(header)) &&
+	      write_all(file, module->build_id, module->build_id_len) &&
+	      write_all(file, zeroes, -module->build_id_len & 7) &&
+	      write_all(file, sh_addrs, num_sh_addrs * sizeof(*sh_addrs)) &&
+	      write_all(file, cached, num_sections * sizeof(*cached)));
+	for (i = 0; ok && i < num_sections; i++) {
+		ok = (write_all(file, sections[i].data->d_buf,
+				cached[i].size) &&
+		      write_all(file, zeroes, -cached[i].size & 7));
+	}
+	if (fclose(file) == 0 && ok && rename(tmp_path, path) == 0)
+		goto out;
+out_unlink:
+	unlink(tmp_path);
+out:
+	free(tmp_path);
+	free(cached);
+}
+
+/*
+ * Before the debugging information in a relocatable ELF file (e.g., Linux
+ * kernel module) can be used, it must have ELF relocations applied. This is
+ * usually done by libdwfl. However, libdwfl is relatively slow at it. This is a
+ * much faster implementation. It is only implemented for x86-64; for other
+ * architectures, we can fall back to libdwfl.
+ *
+ * This is called from the parallel region in read_cus(), so each section is
+ * relocated in a task that idle threads can pick up. If caching is enabled,
+ * the relocated sections are also cached, since they only depend on the file
+ * and the addresses that its sections were loaded at.
+ */
+static struct drgn_error *
+apply_elf_relocations(struct drgn_dwarf_index *dindex,
+		      struct drgn_dwarf_module *module,
+		      struct drgn_dwfl_module_userdata *userdata)
+{
+	struct drgn_error *err = NULL;
+	Elf *elf = userdata->elf;
+	GElf_Ehdr ehdr_mem, *ehdr;
+	size_t shdrnum, shstrndx;
+	uint64_t *sh_addrs;
+	struct relocation_section_vector sections;
+	Elf_Scn *scn;
+	struct stat st;
+	char *cache_path = NULL;
+	uint64_t start, elapsed;
+	bool hit = false, relocated_all = true;
+	size_t i;
+
+	ehdr = gelf_getehdr(elf, &ehdr_mem);
+	if (!ehdr)
+		return drgn_error_libelf();
+
+	if (ehdr->e_type != ET_REL ||
+	    ehdr->e_machine != EM_X86_64 ||
+	    ehdr->e_ident[EI_CLASS] != ELFCLASS64 ||
+	    ehdr->e_ident[EI_DATA] !=
+	    (__BYTE_ORDER__ == __ORDER_LITTLE_ENDIAN__ ?
+	     ELFDATA2LSB : ELFDATA2MSB)) {
+		/* Unsupported; fall back to libdwfl. */
+		return NULL;
+	}
+
+	if (elf_getshdrnum(elf, &shdrnum))
+		return drgn_error_libelf();
+	if (shdrnum <= 1)
+		return NULL;
+
+	start = monotonic_time_ns();
+	relocation_section_vector_init(&sections);
+	sh_addrs = calloc(shdrnum - 1, sizeof(*sh_addrs));
+	if (!sh_addrs) {
+		err = &drgn_enomem;
+		goto out;
+	}
+
+	scn = NULL;
+	while ((scn = elf_nextscn(elf, scn))) {
+		size_t ndx;
+
+		ndx = elf_ndxscn(scn);
+		if (ndx > 0 && ndx < shdrnum) {
+			GElf_Shdr *shdr, shdr_mem;
+
+			shdr = gelf_getshdr(scn, &shdr_mem);
+			if (!shdr) {
+				err = drgn_error_libelf();
+				goto out;
+			}
+			sh_addrs[ndx - 1] = shdr->sh_addr;
+		}
+	}
+
+	if (elf_getshdrstrndx(elf, &shstrndx)) {
+		err = drgn_error_libelf();
+		goto out;
+	}
+
+	scn = NULL;
+	while ((scn = elf_nextscn(elf, scn))) {
+		GElf_Shdr *shdr, shdr_mem;
+		const char *scnname;
+		struct relocation_section *section;
+
+		shdr = gelf_getshdr(scn, &shdr_mem);
+		if (!shdr) {
+			err = drgn_error_libelf();
+			goto out;
+		}
+
+		if (shdr->sh_type != SHT_RELA)
+			continue;
+
+		scnname = elf_strptr(elf, shstrndx, shdr->sh_name);
+		if (!scnname || strncmp(scnname, ".rela.debug_", 12) != 0)
+			continue;
+
+		section = relocation_section_vector_append_entry(&sections);
+		if (!section) {
+			err = &drgn_enomem;
+			goto out;
+		}
+		err = read_relocation_section(elf, scn, shdr, section);
+		if (err) {
+			sections.size--;
+			goto out;
+		}
+	}
+	if (!sections.size)
+		goto out;
+
+	if (dindex->cache_dir && module->build_id_len &&
+	    userdata->fd != -1 && fstat(userdata->fd, &st) == 0) {
+		cache_path = dwarf_index_cache_path(dindex, module->build_id,
+						    module->build_id_len,
+						    ".rel");
+		if (!cache_path) {
+			err = &drgn_enomem;
+			goto out;
+		}
+		err = load_relocation_cache(dindex, cache_path, module, &st,
+					    sh_addrs, shdrnum - 1,
+					    sections.data, sections.size,
+					    &hit);
+		if (err)
+			goto out;
+	}
+
+	if (!hit) {
+		for (i = 0; i < sections.size; i++) {
+			#pragma omp task shared(sections)
+			sections.data[i].err = relocate_section(&sections.data[i],
+								sh_addrs,
+								shdrnum);
+		}
+		#pragma omp taskwait
+	}
+
+	/*
+	 * If a section couldn't be relocated (e.g., because it uses a
+	 * relocation type that we don't implement), then leave it for libdwfl.
+	 */
+	for (i = 0; i < sections.size; i++) {
+		if (sections.data[i].err) {
+			drgn_error_destroy(sections.data[i].err);
+			sections.data[i].err = NULL;
+			relocated_all = false;
+			continue;
+		}
+		err = finish_relocation_section(&sections.data[i]);
+		if (err)
+			goto out;
+	}
+	if (cache_path && !hit && relocated_all) {
+		write_relocation_cache(dindex, cache_path, module, &st,
+				       sh_addrs, shdrnum - 1, sections.data,
+				       sections.size);
+	}
+
+out:
+	for (i = 0; i < sections.size; i++)
+		drgn_error_destroy(sections.data[i].err);
+	relocation_section_vector_deinit(&sections);
+	free(cache_path);
+	free(sh_addrs);
+	elapsed = monotonic_time_ns() - start;
+	#pragma omp atomic
+	dindex->relocation_ns += elapsed;
+	return err;
+}
+
+/*
+ * Index attributes used in .debug_names abbreviations (DWARF 5 section
+ * 6.1.1.4.7).
+ */
+enum {
+	IDX_COMPILE_UNIT = 1,
+	IDX_TYPE_UNIT = 2,
+	IDX_DIE_OFFSET = 3,
+	IDX_PARENT = 4,
+};
+
+struct debug_names_abbrev {
+	uint64_t code;
+	uint64_t tag;
+	/*
+	 * Index of the first (index attribute, form) pair in
+	 * debug_names_index::attribs.
+	 */
+	size_t attribs;
+	size_t num_attribs;
+};
+
+DEFINE_VECTOR(debug_names_abbrev_vector, struct debug_names_abbrev)
+
+/* A name index in a .debug_names section. */
+struct debug_names_index {
+	const char *entry_pool;
+	const char *end;
+	bool bswap;
+	uint32_t comp_unit_count;
+	struct debug_names_abbrev_vector abbrevs;
+	struct uint64_vector attribs;
+};
+
+/*
+ * Where the parent of a .debug_names entry is. Like LLVM, we interpret a
+ * missing DW_IDX_parent as meaning that the DIE is a child of the unit.
+ * Otherwise, DW_IDX_parent either refers to the parent's entry or, as
+ * DW_FORM_flag_present, says that the parent isn't in the name index (e.g.,
+ * because it is a lexical block or an anonymous type).
+ */
+enum debug_names_parent {
+	DEBUG_NAMES_PARENT_UNIT,
+	DEBUG_NAMES_PARENT_INDEXED,
+	DEBUG_NAMES_PARENT_NOT_INDEXED,
+};
+
+struct debug_names_entry {
+	uint64_t tag;
+	uint64_t cu;
+	uint64_t die_offset;
+	enum debug_names_parent parent;
+	bool type_unit;
+};
+
+/* The DIEs listed in .debug_names for a compilation unit. */
+struct debug_names_cu {
+	/* Offset of the unit in .debug_info. */
+	uint64_t offset;
+	/* Whether the unit has to be scanned anyways. */
+	bool scan;
+	/* Offsets of DIEs relative to the unit. */
+	struct uint64_vector dies;
+	struct uint64_vector enumerators;
+};
+
+DEFINE_VECTOR(debug_names_cu_vector, struct debug_names_cu)
+
+static void debug_names_cu_vector_deinit_all(struct debug_names_cu_vector *cus)
+{
+	size_t i;
+
+	for (i = 0; i < cus->size; i++) {
+		uint64_vector_deinit(&cus->data[i].dies);
+		uint64_vector_deinit(&cus->data[i].enumerators);
+	}
+	debug_names_cu_vector_deinit(cus);
+}
+
+/* Return whether DIEs with the given tag are indexed. */
+static bool is_indexed_tag(uint64_t tag)
+{
+	switch (tag) {
+	/* Types. */
+	case DW_TAG_base_type:
+	case DW_TAG_class_type:
+	case DW_TAG_enumeration_type:
+	case DW_TAG_structure_type:
+	case DW_TAG_typedef:
+	case DW_TAG_union_type:
+	/* Variables. */
+	case DW_TAG_variable:
+	/* Constants. */
+	case DW_TAG_enumerator:
+	/* Functions. */
+	case DW_TAG_subprogram:
+		return true;
+	default:
+		return false;
+	}
+}
 
-		if (strncmp(scnname, ".rela.debug_", 12) == 0) {
-			Elf_Scn *info_scn, *link_scn;
-
-			info_scn = elf_getscn(elf, shdr->sh_info);
-			if (!info_scn) {
-				err = drgn_error_libelf();
-				goto out;
-			}
+static struct drgn_error *
+read_debug_names_abbrevs(const char *ptr, const char *end,
+			 struct debug_names_index *index)
+{
+	struct drgn_error *err;
 
-			link_scn = elf_getscn(elf, shdr->sh_link);
-			if (!link_scn) {
-				err = drgn_error_libelf();
-				goto out;
-			}
+	for (;;) {
+		struct debug_names_abbrev *abbrev;
+		uint64_t code;
 
-			err = relocate_section(info_scn, scn, link_scn,
-					       sh_addrs, shdrnum);
-			if (err)
-				goto out;
+		if ((err = read_uleb128(&ptr, end, &code)))
+			return err;
+		if (code == 0)
+			return NULL;
+
+		abbrev = debug_names_abbrev_vector_append_entry(&index->abbrevs);
+		if (!abbrev)
+			return &drgn_enomem;
+		abbrev->code = code;
+		if ((err = read_uleb128(&ptr, end, &abbrev->tag)))
+			return err;
+		abbrev->attribs = index->attribs.size;
+		for (;;) {
+			uint64_t *attrib;
+
+			attrib = uint64_vector_append_entry(&index->attribs);
+			if (!attrib)
+				return &drgn_enomem;
+			if ((err = read_uleb128(&ptr, end, attrib)))
+				return err;
+			attrib = uint64_vector_append_entry(&index->attribs);
+			if (!attrib)
+				return &drgn_enomem;
+			if ((err = read_uleb128(&ptr, end, attrib)))
+				return err;
+			if (attrib[-1] == 0 && attrib[0] == 0) {
+				index->attribs.size -= 2;
+				break;
+			}
 		}
+		abbrev->num_attribs = (index->attribs.size - abbrev->attribs) / 2;
 	}
-out:
-	free(sh_addrs);
-	return NULL;
 }
 
-static struct drgn_error *get_debug_sections(Elf *elf, Elf_Data **sections)
+/*
+ * Check that we can use a name index: every abbreviation for a DIE that we
+ * index must say where the DIE is, and the name index must include enumerators
+ * (otherwise, we would miss enumerators of anonymous enumeration types).
+ * Additionally, some abbreviation must use DW_IDX_parent. Older producers
+ * don't record parents at all, in which case we can't tell which DIEs are
+ * nested.
+ */
+static bool debug_names_index_usable(const struct debug_names_index *index)
 {
-	struct drgn_error *err;
-	size_t shstrndx;
-	Elf_Scn *scn = NULL;
-	size_t i;
-	Elf_Data *debug_str;
-
-	if (elf_getshdrstrndx(elf, &shstrndx))
-		return drgn_error_libelf();
-
-	while ((scn = elf_nextscn(elf, scn))) {
-		GElf_Shdr *shdr, shdr_mem;
-		const char *scnname;
+	bool has_enumerators = false, has_parents = false;
+	size_t i, j;
 
-		shdr = gelf_getshdr(scn, &shdr_mem);
-		if (!shdr)
-			return drgn_error_libelf();
+	for (i = 0; i < index->abbrevs.size; i++) {
+		const struct debug_names_abbrev *abbrev = &index->abbrevs.data[i];
+		bool has_cu = index->comp_unit_count <= 1;
+		bool has_die_offset = false;
 
-		if (shdr->sh_type == SHT_NOBITS || (shdr->sh_flags & SHF_GROUP))
+		if (!is_indexed_tag(abbrev->tag))
 			continue;
+		if (abbrev->tag == DW_TAG_enumerator)
+			has_enumerators = true;
+		for (j = 0; j < abbrev->num_attribs; j++) {
+			uint64_t idx = index->attribs.data[abbrev->attribs + 2 * j];
+
+			switch (idx) {
+			case IDX_COMPILE_UNIT:
+				has_cu = true;
+				break;
+			case IDX_TYPE_UNIT:
+				/* Type unit entries are skipped. */
+				has_cu = true;
+				break;
+			case IDX_DIE_OFFSET:
+				has_die_offset = true;
+				break;
+			case IDX_PARENT:
+				has_parents = true;
+				break;
+			}
+		}
+		if (!has_cu || !has_die_offset)
+			return false;
+	}
+	return has_enumerators && has_parents;
+}
 
-		scnname = elf_strptr(elf, shstrndx, shdr->sh_name);
-		if (!scnname)
-			continue;
+static struct drgn_error *read_debug_names_form(const char **ptr,
+						const char *end, bool bswap,
+						uint64_t form, uint64_t *ret)
+{
+	uint8_t tmp;
 
-		for (i = 0; i < DRGN_DWARF_INDEX_NUM_SECTIONS; i++) {
-			if (sections[i])
-				continue;
+	switch (form) {
+	case DW_FORM_flag_present:
+		*ret = 1;
+		return NULL;
+	case DW_FORM_data1:
+	case DW_FORM_ref1:
+	case DW_FORM_flag:
+		if (!read_u8(ptr, end, &tmp))
+			return drgn_eof();
+		*ret = tmp;
+		return NULL;
+	case DW_FORM_data2:
+	case DW_FORM_ref2:
+		if (!read_u16_into_u64(ptr, end, bswap, ret))
+			return drgn_eof();
+		return NULL;
+	case DW_FORM_data4:
+	case DW_FORM_ref4:
+		if (!read_u32_into_u64(ptr, end, bswap, ret))
+			return drgn_eof();
+		return NULL;
+	case DW_FORM_data8:
+	case DW_FORM_ref8:
+		if (!read_u64(ptr, end, bswap, ret))
+			return drgn_eof();
+		return NULL;
+	case DW_FORM_udata:
+	case DW_FORM_ref_udata:
+		return read_uleb128(ptr, end, ret);
+	case DW_FORM_data16:
+		if (!read_in_bounds(*ptr, end, 16))
+			return drgn_eof();
+		*ptr += 16;
+		*ret = 0;
+		return NULL;
+	default:
+		return drgn_error_format(DRGN_ERROR_OTHER,
+					 "unknown .debug_names attribute form %" PRIu64,
+					 form);
+	}
+}
 
-			if (strcmp(scnname, section_name[i]) != 0)
-				continue;
+static struct drgn_error *
+read_debug_names_entry(const struct debug_names_index *index, const char **ptr,
+		       struct debug_names_entry *ret)
+{
+	struct drgn_error *err;
+	uint64_t code;
+	const struct debug_names_abbrev *abbrev;
+	size_t i;
 
-			err = read_elf_section(scn, &sections[i]);
-			if (err)
-				return err;
-		}
-	}
+	if ((err = read_uleb128(ptr, index->end, &code)))
+		return err;
+	if (code == 0)
+		return &drgn_stop;
 
-	for (i = 0; i < DRGN_DWARF_INDEX_NUM_SECTIONS; i++) {
-		if (i != SECTION_DEBUG_LINE && !sections[i]) {
+	/* Abbreviation codes are almost always sequential. */
+	if (code <= index->abbrevs.size &&
+	    index->abbrevs.data[code - 1].code == code) {
+		abbrev = &index->abbrevs.data[code - 1];
+	} else {
+		for (i = 0; i < index->abbrevs.size; i++) {
+			if (index->abbrevs.data[i].code == code)
+				break;
+		}
+		if (i == index->abbrevs.size) {
 			return drgn_error_format(DRGN_ERROR_OTHER,
-						 "no %s section",
-						 section_name[i]);
+						 "unknown .debug_names abbreviation code %" PRIu64,
+						 code);
 		}
+		abbrev = &index->abbrevs.data[i];
 	}
 
-	debug_str = sections[SECTION_DEBUG_STR];
-	if (debug_str->d_size == 0 ||
-	    ((char *)debug_str->d_buf)[debug_str->d_size - 1] != '\0') {
-		return drgn_error_create(DRGN_ERROR_OTHER,
-					 ".debug_str is not null terminated");
+	ret->tag = abbrev->tag;
+	ret->cu = 0;
+	ret->die_offset = 0;
+	ret->parent = DEBUG_NAMES_PARENT_UNIT;
+	ret->type_unit = false;
+	for (i = 0; i < abbrev->num_attribs; i++) {
+		uint64_t idx = index->attribs.data[abbrev->attribs + 2 * i];
+		uint64_t form = index->attribs.data[abbrev->attribs + 2 * i + 1];
+		uint64_t value;
+
+		err = read_debug_names_form(ptr, index->end, index->bswap,
+					    form, &value);
+		if (err)
+			return err;
+		switch (idx) {
+		case IDX_COMPILE_UNIT:
+			ret->cu = value;
+			break;
+		case IDX_TYPE_UNIT:
+			ret->type_unit = true;
+			break;
+		case IDX_DIE_OFFSET:
+			ret->die_offset = value;
+			break;
+		case IDX_PARENT:
+			if (form == DW_FORM_flag_present)
+				ret->parent = DEBUG_NAMES_PARENT_NOT_INDEXED;
+			else
+				ret->parent = DEBUG_NAMES_PARENT_INDEXED;
+			break;
+		}
 	}
 	return NULL;
 }
 
-static struct drgn_error *read_compilation_unit_header(const char *ptr,
-						       const char *end,
-						       struct compilation_unit *cu)
+static bool skip_debug_names(const char **ptr, const char *end, uint64_t size)
+{
+	if (size > (uint64_t)(end - *ptr))
+		return false;
+	*ptr += size;
+	return true;
+}
+
+/*
+ * Read the name index starting at *ptr in .debug_names, adding the compilation
+ * units it covers to cus.
+ */
+static struct drgn_error *read_debug_names_index(const char **ptr,
+						 const char *end, bool bswap,
+						 struct debug_names_cu_vector *cus)
 {
+	struct drgn_error *err;
+	struct debug_names_index index = { .bswap = bswap };
+	const char *p = *ptr, *unit_end, *cu_offsets, *entry_offsets;
 	uint32_t tmp;
+	uint64_t unit_length;
 	uint16_t version;
+	uint32_t local_type_unit_count, foreign_type_unit_count;
+	uint32_t bucket_count, name_count, abbrev_table_size;
+	uint32_t augmentation_string_size;
+	size_t offset_size, base, i;
+	bool is_64_bit;
 
-	if (!read_u32(&ptr, end, cu->bswap, &tmp))
+	debug_names_abbrev_vector_init(&index.abbrevs);
+	uint64_vector_init(&index.attribs);
+
+	if (!read_u32(&p, end, bswap, &tmp))
 		return drgn_eof();
-	cu->is_64_bit = tmp == UINT32_C(0xffffffff);
-	if (cu->is_64_bit) {
-		if (!read_u64(&ptr, end, cu->bswap, &cu->unit_length))
+	is_64_bit = tmp == UINT32_C(0xffffffff);
+	if (is_64_bit) {
+		if (!read_u64(&p, end, bswap, &unit_length))
 			return drgn_eof();
 	} else {
-		cu->unit_length = tmp;
+		unit_length = tmp;
 	}
+	if (unit_length > (uint64_t)(end - p))
+		return drgn_eof();
+	unit_end = p + unit_length;
+	*ptr = unit_end;
+	offset_size = is_64_bit ? 8 : 4;
 
-	if (!read_u16(&ptr, end, cu->bswap, &version))
+	if (!read_u16(&p, unit_end, bswap, &version))
 		return drgn_eof();
-	if (version != 2 && version != 3 && version != 4) {
+	if (version != 5) {
 		return drgn_error_format(DRGN_ERROR_OTHER,
-					 "unknown DWARF CU version %" PRIu16,
+					 "unknown .debug_names version %" PRIu16,
 					 version);
 	}
+	if (!skip_debug_names(&p, unit_end, 2) || /* padding */
+	    !read_u32(&p, unit_end, bswap, &index.comp_unit_count) ||
+	    !read_u32(&p, unit_end, bswap, &local_type_unit_count) ||
+	    !read_u32(&p, unit_end, bswap, &foreign_type_unit_count) ||
+	    !read_u32(&p, unit_end, bswap, &bucket_count) ||
+	    !read_u32(&p, unit_end, bswap, &name_count) ||
+	    !read_u32(&p, unit_end, bswap, &abbrev_table_size) ||
+	    !read_u32(&p, unit_end, bswap, &augmentation_string_size) ||
+	    !skip_debug_names(&p, unit_end, augmentation_string_size))
+		return drgn_eof();
+	cu_offsets = p;
+	if (!skip_debug_names(&p, unit_end,
+			      (uint64_t)index.comp_unit_count * offset_size) ||
+	    !skip_debug_names(&p, unit_end,
+			      (uint64_t)local_type_unit_count * offset_size) ||
+	    !skip_debug_names(&p, unit_end,
+			      (uint64_t)foreign_type_unit_count * 8) ||
+	    !skip_debug_names(&p, unit_end, (uint64_t)bucket_count * 4) ||
+	    !skip_debug_names(&p, unit_end,
+			      bucket_count ? (uint64_t)name_count * 4 : 0) ||
+	    /* String offsets. We use the names from the DIEs instead. */
+	    !skip_debug_names(&p, unit_end,
+			      (uint64_t)name_count * offset_size))
+		return drgn_eof();
+	entry_offsets = p;
+	if (!skip_debug_names(&p, unit_end,
+			      (uint64_t)name_count * offset_size) ||
+	    !read_in_bounds(p, unit_end, abbrev_table_size))
+		return drgn_eof();
+	index.entry_pool = p + abbrev_table_size;
+	index.end = unit_end;
 
-	if (cu->is_64_bit) {
-		if (!read_u64(&ptr, end, cu->bswap, &cu->debug_abbrev_offset))
-			return drgn_eof();
-	} else {
-		if (!read_u32_into_u64(&ptr, end, cu->bswap,
-				       &cu->debug_abbrev_offset))
-			return drgn_eof();
+	err = read_debug_names_abbrevs(p, index.entry_pool, &index);
+	if (err)
+		goto out;
+	if (!debug_names_index_usable(&index)) {
+		err = NULL;
+		goto out;
 	}
 
-	if (!read_u8(&ptr, end, &cu->address_size))
-		return drgn_eof();
+	base = cus->size;
+	if (!debug_names_cu_vector_reserve(cus, base + index.comp_unit_count)) {
+		err = &drgn_enomem;
+		goto out;
+	}
+	for (i = 0; i < index.comp_unit_count; i++) {
+		struct debug_names_cu *cu = &cus->data[cus->size++];
+
+		if (is_64_bit)
+			read_u64_nocheck(&cu_offsets, bswap, &cu->offset);
+		else
+			read_u32_into_u64_nocheck(&cu_offsets, bswap, &cu->offset);
+		cu->scan = false;
+		uint64_vector_init(&cu->dies);
+		uint64_vector_init(&cu->enumerators);
+	}
+
+	for (i = 0; i < name_count; i++) {
+		uint64_t entry_offset;
+		const char *entry_ptr;
+
+		if (is_64_bit)
+			read_u64_nocheck(&entry_offsets, bswap, &entry_offset);
+		else
+			read_u32_into_u64_nocheck(&entry_offsets, bswap,
+						  &entry_offset);
+		entry_ptr = index.entry_pool;
+		if (!skip_debug_names(&entry_ptr, unit_end, entry_offset)) {
+			err = drgn_eof();
+			goto out;
+		}
+		for (;;) {
+			struct debug_names_entry entry;
+			struct debug_names_cu *cu;
+			struct uint64_vector *offsets;
+
+			err = read_debug_names_entry(&index, &entry_ptr,
+						     &entry);
+			if (err == &drgn_stop)
+				break;
+			else if (err)
+				goto out;
+			if (entry.type_unit || !is_indexed_tag(entry.tag))
+				continue;
+			if (entry.cu >= index.comp_unit_count) {
+				err = drgn_error_format(DRGN_ERROR_OTHER,
+							"invalid .debug_names compilation unit %" PRIu64,
+							entry.cu);
+				goto out;
+			}
+			cu = &cus->data[base + entry.cu];
+			if (entry.tag == DW_TAG_enumerator) {
+				/*
+				 * If the enumeration type is in the name
+				 * index, then we'll find the enumerator that
+				 * way. Otherwise, we find the enumeration type
+				 * from the enumerator, which skips enumerators
+				 * nested more deeply than the top level.
+				 */
+				if (entry.parent == DEBUG_NAMES_PARENT_INDEXED)
+					continue;
+				offsets = &cu->enumerators;
+			} else {
+				/*
+				 * This is nested in another DIE, whether or
+				 * not that DIE is in the name index, so it
+				 * isn't a global name.
+				 */
+				if (entry.parent != DEBUG_NAMES_PARENT_UNIT)
+					continue;
+				offsets = &cu->dies;
+			}
+			if (!uint64_vector_append(offsets, &entry.die_offset)) {
+				err = &drgn_enomem;
+				goto out;
+			}
+		}
+	}
+	err = NULL;
+out:
+	uint64_vector_deinit(&index.attribs);
+	debug_names_abbrev_vector_deinit(&index.abbrevs);
+	return err;
+}
+
+static int debug_names_cu_cmp(const void *_a, const void *_b)
+{
+	const struct debug_names_cu *a = _a, *b = _b;
+
+	if (a->offset < b->offset)
+		return -1;
+	else if (a->offset > b->offset)
+		return 1;
+	else
+		return 0;
+}
+
+/*
+ * Read the name indexes in .debug_names. Returns the compilation units that
+ * they cover sorted by offset.
+ */
+static struct drgn_error *read_debug_names(Elf_Data *debug_names, bool bswap,
+					   struct debug_names_cu_vector *cus)
+{
+	struct drgn_error *err;
+	const char *ptr = section_ptr(debug_names, 0);
+	const char *end = section_end(debug_names);
+	size_t i;
 
+	while (ptr < end) {
+		err = read_debug_names_index(&ptr, end, bswap, cus);
+		if (err)
+			return err;
+	}
+	qsort(cus->data, cus->size, sizeof(*cus->data), debug_names_cu_cmp);
+	/* A unit covered by more than one name index is scanned. */
+	for (i = 1; i < cus->size; i++) {
+		if (cus->data[i].offset == cus->data[i - 1].offset) {
+			cus->data[i - 1].scan = true;
+			cus->data[i].scan = true;
+		}
+	}
 	return NULL;
 }
 
-DEFINE_VECTOR(compilation_unit_vector, struct compilation_unit)
+static int uint64_cmp(const void *_a, const void *_b)
+{
+	uint64_t a = *(const uint64_t *)_a, b = *(const uint64_t *)_b;
+
+	if (a < b)
+		return -1;
+	else if (a > b)
+		return 1;
+	else
+		return 0;
+}
+
+/*
+ * Convert the offsets in a vector from relative to the unit to relative to
+ * .debug_info, sorting them and removing duplicates (a DIE may be listed under
+ * more than one name, e.g., its linkage name). Returns false if an offset
+ * isn't in the unit.
+ */
+static bool debug_names_cu_offsets(struct uint64_vector *offsets,
+				   uint64_t cu_offset, uint64_t header_size,
+				   uint64_t unit_size)
+{
+	size_t i, j;
+
+	qsort(offsets->data, offsets->size, sizeof(*offsets->data),
+	      uint64_cmp);
+	for (i = j = 0; i < offsets->size; i++) {
+		if (offsets->data[i] < header_size ||
+		    offsets->data[i] >= unit_size)
+			return false;
+		if (j == 0 ||
+		    offsets->data[i] + cu_offset != offsets->data[j - 1])
+			offsets->data[j++] = offsets->data[i] + cu_offset;
+	}
+	offsets->size = j;
+	return true;
+}
+
+/*
+ * Use the DIEs from .debug_names for a compilation unit if possible. This takes
+ * the offsets from names_cu.
+ */
+static void use_debug_names_cu(struct compilation_unit *cu, uint64_t cu_offset,
+			       struct debug_names_cu *names_cu)
+{
+	uint64_t header_size = cu->is_64_bit ? 23 : 11;
+	uint64_t unit_size = (cu->is_64_bit ? 12 : 4) + cu->unit_length;
+
+	if (names_cu->scan ||
+	    !debug_names_cu_offsets(&names_cu->dies, cu_offset, header_size,
+				    unit_size) ||
+	    !debug_names_cu_offsets(&names_cu->enumerators, cu_offset,
+				    header_size, unit_size))
+		return;
+	cu->from_debug_names = true;
+	cu->debug_names_dies = names_cu->dies;
+	cu->debug_names_enumerators = names_cu->enumerators;
+	uint64_vector_init(&names_cu->dies);
+	uint64_vector_init(&names_cu->enumerators);
+}
 
+/*
+ * Read the units of a Dwfl_Module, or index it from the cache. *indexed_ret is
+ * set if any DIEs from the module were indexed, in which case an error cannot
+ * be recovered from without rolling back the update.
+ */
 static struct drgn_error *
-read_dwfl_module_cus(Dwfl_Module *dwfl_module,
+read_dwfl_module_cus(struct drgn_dwarf_index *dindex,
+		     struct drgn_dwarf_module *module,
+		     Dwfl_Module *dwfl_module, uint32_t module_id,
 		     struct drgn_dwfl_module_userdata *userdata,
-		     struct compilation_unit_vector *cus)
+		     struct compilation_unit_vector *cus,
+		     struct drgn_dwarf_index_cache_writer_vector *writers,
+		     bool *indexed_ret)
 {
 	struct drgn_error *err;
 	Dwarf *dwarf;
 	Dwarf_Addr bias;
 	Elf *elf;
 	Elf_Data *sections[DRGN_DWARF_INDEX_NUM_SECTIONS] = {};
+	struct drgn_dwarf_index_cache_writer *writer = NULL;
+	struct debug_names_cu_vector names_cus;
+	size_t names_i = 0;
 	bool bswap;
 	const char *ptr, *end;
 
+	*indexed_ret = false;
 	if (userdata->elf) {
-		err = apply_elf_relocations(userdata->elf);
+		err = decompress_debug_sections(dindex, userdata->elf);
+		if (err)
+			return err;
+		err = apply_elf_relocations(dindex, module, userdata);
 		if (err)
 			return err;
 	}
@@ -1236,43 +2821,125 @@ read_dwfl_module_cus(Dwfl_Module *dwfl_module,
 	if (!elf)
 		return drgn_error_libdw();
 
-	err = get_debug_sections(elf, sections);
+	err = get_debug_sections(dindex, elf, sections);
 	if (err)
 		return err;
 
+	if (dindex->cache_dir && module->build_id_len) {
+		bool hit;
+
+		err = read_dwarf_index_cache(dindex, module, dwfl_module,
+					     module_id, &hit, &writer);
+		*indexed_ret = hit;
+		if (err || hit)
+			return err;
+	}
+
 	bswap = (elf_getident(elf, NULL)[EI_DATA] !=
 		 (__BYTE_ORDER__ == __ORDER_LITTLE_ENDIAN__ ?
 		  ELFDATA2LSB : ELFDATA2MSB));
 
+	debug_names_cu_vector_init(&names_cus);
+	if (sections[SECTION_DEBUG_NAMES]) {
+		err = read_debug_names(sections[SECTION_DEBUG_NAMES], bswap,
+				       &names_cus);
+		if (err == &drgn_enomem) {
+			goto err;
+		} else if (err) {
+			/* Fall back to scanning every unit. */
+			drgn_error_destroy(err);
+			debug_names_cu_vector_deinit_all(&names_cus);
+			debug_names_cu_vector_init(&names_cus);
+		}
+	}
+
 	ptr = section_ptr(sections[SECTION_DEBUG_INFO], 0);
 	end = section_end(sections[SECTION_DEBUG_INFO]);
 	while (ptr < end) {
 		struct compilation_unit *cu;
+		uint64_t cu_offset;
 
 		cu = compilation_unit_vector_append_entry(cus);
-		if (!cu)
-			return &drgn_enomem;
-		cu->module = dwfl_module;
+		if (!cu) {
+			err = &drgn_enomem;
+			goto err;
+		}
+		cu->module_id = module_id;
 		memcpy(cu->sections, sections, sizeof(cu->sections));
 		cu->ptr = ptr;
 		cu->bswap = bswap;
+		cu->cache = writer;
+		drgn_dwarf_index_cache_die_vector_init(&cu->cache_dies);
+		cu->from_debug_names = false;
+		uint64_vector_init(&cu->debug_names_dies);
+		uint64_vector_init(&cu->debug_names_enumerators);
 		err = read_compilation_unit_header(ptr, end, cu);
 		if (err)
-			return err;
+			goto err;
+
+		cu_offset = ptr - section_ptr(sections[SECTION_DEBUG_INFO], 0);
+		while (names_i < names_cus.size &&
+		       names_cus.data[names_i].offset < cu_offset)
+			names_i++;
+		if (names_i < names_cus.size &&
+		    names_cus.data[names_i].offset == cu_offset)
+			use_debug_names_cu(cu, cu_offset, &names_cus.data[names_i]);
 
 		ptr += (cu->is_64_bit ? 12 : 4) + cu->unit_length;
 	}
-	return NULL;
+	if (writer &&
+	    !drgn_dwarf_index_cache_writer_vector_append(writers, &writer)) {
+		err = &drgn_enomem;
+		goto err;
+	}
+	debug_names_cu_vector_deinit_all(&names_cus);
+	return NULL;
+
+err:
+	debug_names_cu_vector_deinit_all(&names_cus);
+	drgn_dwarf_index_cache_writer_destroy(writer);
+	return err;
+}
+
+/*
+ * Assign an ID to a Dwfl_Module that is about to be indexed. The ID is stored
+ * in each drgn_dwarf_index_die instead of the (larger) Dwfl_Module pointer.
+ */
+static struct drgn_error *add_indexed_module(struct drgn_dwarf_index *dindex,
+					     Dwfl_Module *dwfl_module,
+					     uint32_t *ret)
+{
+	struct drgn_error *err;
+
+	#pragma omp critical(drgn_dwarf_index_indexed_modules)
+	{
+		*ret = dindex->indexed_modules.size;
+		if (dindex->indexed_modules.size >= UINT32_MAX) {
+			err = drgn_error_create(DRGN_ERROR_OVERFLOW,
+						"too many modules to index");
+		} else if (!dwfl_module_vector_append(&dindex->indexed_modules,
+						      &dwfl_module)) {
+			err = &drgn_enomem;
+		} else {
+			err = NULL;
+		}
+	}
+	return err;
 }
 
-static struct drgn_error *read_module_cus(struct drgn_dwarf_module *module,
-					  struct compilation_unit_vector *cus,
-					  const char **name_ret)
+static struct drgn_error *
+read_module_cus(struct drgn_dwarf_index *dindex,
+		struct drgn_dwarf_module *module,
+		struct compilation_unit_vector *cus,
+		struct drgn_dwarf_index_cache_writer_vector *writers,
+		const char **name_ret, bool *indexed_ret)
 {
 	struct drgn_error *err;
 	const size_t orig_cus_size = cus->size;
 	size_t i;
+	uint32_t module_id;
 
+	*indexed_ret = false;
 	for (i = 0; i < module->dwfl_modules.size; i++) {
 		Dwfl_Module *dwfl_module;
 		void **userdatap;
@@ -1282,16 +2949,27 @@ static struct drgn_error *read_module_cus(struct drgn_dwarf_module *module,
 		*name_ret = dwfl_module_info(dwfl_module, &userdatap, NULL,
 					     NULL, NULL, NULL, NULL, NULL);
 		userdata = *userdatap;
-		err = read_dwfl_module_cus(dwfl_module, userdata, cus);
+		err = add_indexed_module(dindex, dwfl_module, &module_id);
+		if (err)
+			return err;
+		err = read_dwfl_module_cus(dindex, module, dwfl_module,
+					   module_id, userdata, cus, writers,
+					   indexed_ret);
 		if (err) {
+			#pragma omp critical(drgn_dwarf_index_indexed_modules)
+			dindex->indexed_modules.data[module_id] = NULL;
 			/*
 			 * Ignore the error unless we have no more Dwfl_Modules
-			 * to try.
+			 * to try. If we ran out of memory or already indexed
+			 * DIEs from this module, then give up; the caller has
+			 * to roll back the update in the latter case.
 			 */
-			if (i == module->dwfl_modules.size - 1)
+			if (*indexed_ret || err == &drgn_enomem ||
+			    i == module->dwfl_modules.size - 1)
 				return err;
 			drgn_error_destroy(err);
-			cus->size = orig_cus_size;
+			while (cus->size > orig_cus_size)
+				compilation_unit_deinit(&cus->data[--cus->size]);
 			continue;
 		}
 		userdata->state = DRGN_DWARF_MODULE_INDEXING;
@@ -1301,32 +2979,46 @@ static struct drgn_error *read_module_cus(struct drgn_dwarf_module *module,
 	DRGN_UNREACHABLE();
 }
 
-static struct drgn_error *read_cus(struct drgn_dwarf_index *dindex,
-				   struct drgn_dwarf_module **unindexed,
-				   size_t num_unindexed,
-				   struct compilation_unit_vector *all_cus)
+static struct drgn_error *
+read_cus(struct drgn_dwarf_index *dindex, struct drgn_dwarf_module **unindexed,
+	 size_t num_unindexed, struct compilation_unit_vector *all_cus,
+	 struct drgn_dwarf_index_cache_writer_vector *all_writers)
 {
 	struct drgn_error *err = NULL;
+	uint64_t start = monotonic_time_ns();
 
-	#pragma omp parallel
+	#pragma omp parallel num_threads(drgn_dwarf_index_num_threads(dindex))
 	{
 		struct compilation_unit_vector cus;
+		struct drgn_dwarf_index_cache_writer_vector writers;
 		size_t i;
 
 		compilation_unit_vector_init(&cus);
+		drgn_dwarf_index_cache_writer_vector_init(&writers);
 		#pragma omp for schedule(dynamic)
 		for (i = 0; i < num_unindexed; i++) {
 			struct drgn_error *module_err;
 			const char *name;
+			bool indexed;
 
 			if (err)
 				continue;
 
-			module_err = read_module_cus(unindexed[i], &cus, &name);
+			module_err = read_module_cus(dindex, unindexed[i],
+						     &cus, &writers, &name,
+						     &indexed);
 			if (module_err) {
+				/*
+				 * If DIEs from the module were already indexed,
+				 * then the error is fatal so that they are
+				 * rolled back.
+				 */
 				#pragma omp critical(drgn_read_cus)
 				if (err) {
 					drgn_error_destroy(module_err);
+				} else if (module_err == &drgn_enomem ||
+					   indexed) {
+					err = module_err;
 				} else {
 					err = drgn_dwarf_index_report_error(dindex,
 									    name,
@@ -1346,13 +3038,34 @@ static struct drgn_error *read_cus(struct drgn_dwarf_index *dindex,
 					       cus.data,
 					       cus.size * sizeof(*cus.data));
 					all_cus->size += cus.size;
+					cus.size = 0;
 				} else {
 					err = &drgn_enomem;
 				}
 			}
 		}
+		for (i = 0; i < cus.size; i++)
+			compilation_unit_deinit(&cus.data[i]);
+		if (writers.size) {
+			#pragma omp critical(drgn_read_cus)
+			if (!err &&
+			    drgn_dwarf_index_cache_writer_vector_reserve(all_writers,
+									 all_writers->size + writers.size)) {
+				memcpy(all_writers->data + all_writers->size,
+				       writers.data,
+				       writers.size * sizeof(*writers.data));
+				all_writers->size += writers.size;
+				writers.size = 0;
+			} else if (!err) {
+				err = &drgn_enomem;
+			}
+		}
+		for (i = 0; i < writers.size; i++)
+			drgn_dwarf_index_cache_writer_destroy(writers.data[i]);
+		drgn_dwarf_index_cache_writer_vector_deinit(&writers);
 		compilation_unit_vector_deinit(&cus);
 	}
+	dindex->cu_discovery_ns += monotonic_time_ns() - start;
 	return err;
 }
 
@@ -1389,27 +3102,7 @@ static struct drgn_error *read_abbrev_decl(const char **ptr, const char *end,
 	if ((err = read_uleb128(ptr, end, &tag)))
 		return err;
 
-	switch (tag) {
-	/* Types. */
-	case DW_TAG_base_type:
-	case DW_TAG_class_type:
-	case DW_TAG_enumeration_type:
-	case DW_TAG_structure_type:
-	case DW_TAG_typedef:
-	case DW_TAG_union_type:
-	/* Variables. */
-	case DW_TAG_variable:
-	/* Constants. */
-	case DW_TAG_enumerator:
-	/* Functions. */
-	case DW_TAG_subprogram:
-		should_index = true;
-		break;
-	default:
-		should_index = false;
-		break;
-	}
-
+	should_index = is_indexed_tag(tag);
 	if (should_index || tag == DW_TAG_compile_unit)
 		die_flags = tag;
 	else
@@ -1643,6 +3336,25 @@ static struct drgn_error *read_abbrev_table(const char *ptr, const char *end,
 	return NULL;
 }
 
+/* Read the abbreviation table of a compilation unit and time it. */
+static struct drgn_error *read_cu_abbrev_table(struct drgn_dwarf_index *dindex,
+					       const struct compilation_unit *cu,
+					       struct abbrev_table *abbrev)
+{
+	Elf_Data *debug_abbrev = cu->sections[SECTION_DEBUG_ABBREV];
+	struct drgn_error *err;
+	uint64_t start, elapsed;
+
+	start = monotonic_time_ns();
+	err = read_abbrev_table(section_ptr(debug_abbrev,
+					    cu->debug_abbrev_offset),
+				section_end(debug_abbrev), cu, abbrev);
+	elapsed = monotonic_time_ns() - start;
+	#pragma omp atomic
+	dindex->abbrev_parsing_ns += elapsed;
+	return err;
+}
+
 static struct drgn_error *skip_lnp_header(struct compilation_unit *cu,
 					  const char **ptr, const char *end)
 {
@@ -1796,33 +3508,46 @@ out:
 	return err;
 }
 
-static bool append_die_entry(struct drgn_dwarf_index_shard *shard, uint64_t tag,
-			     uint64_t file_name_hash, Dwfl_Module *module,
-			     uint64_t offset)
+static struct drgn_error *
+append_die_entry(struct drgn_dwarf_index_shard *shard, uint64_t tag,
+		 uint64_t file_name_hash, uint32_t module_id, uint64_t offset)
 {
 	struct drgn_dwarf_index_die *die;
 
+	if (tag > UINT16_MAX) {
+		return drgn_error_format(DRGN_ERROR_OTHER,
+					 "invalid DWARF tag 0x%" PRIx64, tag);
+	}
+	if (offset > DRGN_DWARF_INDEX_MAX_OFFSET) {
+		return drgn_error_create(DRGN_ERROR_OVERFLOW,
+					 "DIE offset is too large to index");
+	}
+	/* UINT32_MAX is reserved for drgn_dwarf_index_die::next. */
+	if (shard->dies.size >= UINT32_MAX) {
+		return drgn_error_create(DRGN_ERROR_OVERFLOW,
+					 "too many DIEs to index");
+	}
 	die = drgn_dwarf_index_die_vector_append_entry(&shard->dies);
 	if (!die)
-		return false;
+		return &drgn_enomem;
 	die->tag = tag;
 	die->file_name_hash = file_name_hash;
-	die->module = module;
+	die->module_id = module_id;
 	die->offset = offset;
-	die->next = SIZE_MAX;
-	return true;
+	die->next = UINT32_MAX;
+	return NULL;
 }
 
 static struct drgn_error *index_die(struct drgn_dwarf_index *dindex,
-				    const char *name, uint64_t tag,
-				    uint64_t file_name_hash,
-				    Dwfl_Module *module, uint64_t offset)
+				    const char *name, size_t name_len,
+				    uint64_t tag, uint64_t file_name_hash,
+				    uint32_t module_id, uint64_t offset)
 {
 	struct drgn_error *err;
 	struct drgn_dwarf_index_die_map_entry entry = {
 		.key = {
 			.str = name,
-			.len = strlen(name),
+			.len = name_len,
 		},
 	};
 	struct hash_pair hp;
@@ -1837,11 +3562,10 @@ static struct drgn_error *index_die(struct drgn_dwarf_index *dindex,
 	it = drgn_dwarf_index_die_map_search_hashed(&shard->map, &entry.key,
 						    hp);
 	if (!it.entry) {
-		if (!append_die_entry(shard, tag, file_name_hash, module,
-				      offset)) {
-			err = &drgn_enomem;
+		err = append_die_entry(shard, tag, file_name_hash, module_id,
+				       offset);
+		if (err)
 			goto out;
-		}
 		entry.value = shard->dies.size - 1;
 		if (drgn_dwarf_index_die_map_insert_searched(&shard->map,
 							     &entry, hp,
@@ -1860,18 +3584,16 @@ static struct drgn_error *index_die(struct drgn_dwarf_index *dindex,
 			goto out;
 		}
 
-		if (die->next == SIZE_MAX)
+		if (die->next == UINT32_MAX)
 			break;
 		die = &shard->dies.data[die->next];
 	}
 
 	index = die - shard->dies.data;
-	if (!append_die_entry(shard, tag, file_name_hash, module, offset)) {
-		err = &drgn_enomem;
+	err = append_die_entry(shard, tag, file_name_hash, module_id, offset);
+	if (err)
 		goto out;
-	}
 	shard->dies.data[index].next = shard->dies.size - 1;
-	err = NULL;
 out:
 	omp_unset_lock(&shard->lock);
 	return err;
@@ -2053,14 +3775,71 @@ skip:
 	return NULL;
 }
 
+/*
+ * Index a DIE at the top level of a compilation unit, or an enumerator (in which
+ * case die_offset is the offset of its DW_TAG_enumeration_type).
+ */
+static struct drgn_error *
+index_cu_die(struct drgn_dwarf_index *dindex, struct compilation_unit *cu,
+	     const struct abbrev_table *abbrev, const char *end,
+	     const char *debug_str_buffer, const char *debug_str_end,
+	     const struct uint64_vector *file_name_table, struct die *die,
+	     uint64_t tag, uint64_t die_offset)
+{
+	struct drgn_error *err;
+	uint64_t file_name_hash;
+	size_t name_len;
+
+	if (die->specification && (!die->name || !die->decl_file)) {
+		struct die decl = {};
+		const char *decl_ptr = die->specification;
+
+		if ((err = read_die(cu, abbrev, &decl_ptr, end,
+				    debug_str_buffer, debug_str_end, &decl)))
+			return err;
+		if (!die->name && decl.name)
+			die->name = decl.name;
+		if (!die->decl_file && decl.decl_file)
+			die->decl_file = decl.decl_file;
+	}
+
+	if (!die->name)
+		return NULL;
+
+	if (die->decl_file > file_name_table->size) {
+		return drgn_error_format(DRGN_ERROR_OTHER,
+					 "invalid DW_AT_decl_file %zu",
+					 die->decl_file);
+	}
+	if (die->decl_file)
+		file_name_hash = file_name_table->data[die->decl_file - 1];
+	else
+		file_name_hash = 0;
+	name_len = strlen(die->name);
+	if ((err = index_die(dindex, die->name, name_len, tag, file_name_hash,
+			     cu->module_id, die_offset)))
+		return err;
+	if (cu->cache) {
+		struct drgn_dwarf_index_cache_die *cache_die;
+
+		cache_die = drgn_dwarf_index_cache_die_vector_append_entry(&cu->cache_dies);
+		if (!cache_die)
+			return &drgn_enomem;
+		cache_die->name.str = die->name;
+		cache_die->name.len = name_len;
+		cache_die->tag = tag;
+		cache_die->file_name_hash = file_name_hash;
+		cache_die->offset = die_offset;
+	}
+	return NULL;
+}
+
 static struct drgn_error *index_cu(struct drgn_dwarf_index *dindex,
 				   struct compilation_unit *cu)
 {
 	struct drgn_error *err;
 	struct abbrev_table abbrev;
 	struct uint64_vector file_name_table;
-	Elf_Data *debug_abbrev = cu->sections[SECTION_DEBUG_ABBREV];
-	const char *debug_abbrev_end = section_end(debug_abbrev);
 	const char *ptr = &cu->ptr[cu->is_64_bit ? 23 : 11];
 	const char *end = &cu->ptr[(cu->is_64_bit ? 12 : 4) + cu->unit_length];
 	Elf_Data *debug_info = cu->sections[SECTION_DEBUG_INFO];
@@ -2074,9 +3853,7 @@ static struct drgn_error *index_cu(struct drgn_dwarf_index *dindex,
 	abbrev_table_init(&abbrev);
 	uint64_vector_init(&file_name_table);
 
-	if ((err = read_abbrev_table(section_ptr(debug_abbrev,
-						 cu->debug_abbrev_offset),
-				     debug_abbrev_end, cu, &abbrev)))
+	if ((err = read_cu_abbrev_table(dindex, cu, &abbrev)))
 		goto out;
 
 	for (;;) {
@@ -2107,8 +3884,6 @@ static struct drgn_error *index_cu(struct drgn_dwarf_index *dindex,
 							&file_name_table)))
 				goto out;
 		} else if (tag && !(die.flags & TAG_FLAG_DECLARATION)) {
-			uint64_t file_name_hash;
-
 			/*
 			 * NB: the enumerator name points to the
 			 * enumeration_type DIE instead of the enumerator DIE.
@@ -2121,36 +3896,12 @@ static struct drgn_error *index_cu(struct drgn_dwarf_index *dindex,
 			else if (depth != 1)
 				goto next;
 
-			if (die.specification && (!die.name || !die.decl_file)) {
-				struct die decl = {};
-				const char *decl_ptr = die.specification;
-
-				if ((err = read_die(cu, &abbrev, &decl_ptr, end,
-						    debug_str_buffer,
-						    debug_str_end, &decl)))
-					goto out;
-				if (!die.name && decl.name)
-					die.name = decl.name;
-				if (!die.decl_file && decl.decl_file)
-					die.decl_file = decl.decl_file;
-			}
-
-			if (die.name) {
-				if (die.decl_file > file_name_table.size) {
-					err = drgn_error_format(DRGN_ERROR_OTHER,
-								"invalid DW_AT_decl_file %zu",
-								die.decl_file);
-					goto out;
-				}
-				if (die.decl_file)
-					file_name_hash = file_name_table.data[die.decl_file - 1];
-				else
-					file_name_hash = 0;
-				if ((err = index_die(dindex, die.name, tag,
-						     file_name_hash, cu->module,
-						     die_offset)))
-					goto out;
-			}
+			if ((err = index_cu_die(dindex, cu, &abbrev, end,
+						debug_str_buffer,
+						debug_str_end,
+						&file_name_table, &die, tag,
+						die_offset)))
+				goto out;
 		}
 
 next:
@@ -2171,6 +3922,240 @@ out:
 	return err;
 }
 
+/*
+ * Skip the children of a DIE; *ptr must point to the first child. If
+ * enum_die_offset is not zero, then the DIE is the DW_TAG_enumeration_type at
+ * that offset, and its enumerators are indexed.
+ */
+static struct drgn_error *
+skip_die_children(struct drgn_dwarf_index *dindex, struct compilation_unit *cu,
+		  const struct abbrev_table *abbrev, const char **ptr,
+		  const char *end, const char *debug_str_buffer,
+		  const char *debug_str_end,
+		  const struct uint64_vector *file_name_table,
+		  uint64_t enum_die_offset)
+{
+	struct drgn_error *err;
+	unsigned int depth = 0;
+
+	for (;;) {
+		struct die die = {
+			.stmt_list = SIZE_MAX,
+		};
+		uint64_t tag;
+
+		err = read_die(cu, abbrev, ptr, end, debug_str_buffer,
+			       debug_str_end, &die);
+		if (err && err->code == DRGN_ERROR_STOP) {
+			if (depth-- == 0)
+				return NULL;
+			continue;
+		} else if (err) {
+			return err;
+		}
+
+		tag = die.flags & TAG_MASK;
+		if (depth == 0 && enum_die_offset &&
+		    tag == DW_TAG_enumerator &&
+		    !(die.flags & TAG_FLAG_DECLARATION) &&
+		    (err = index_cu_die(dindex, cu, abbrev, end,
+					debug_str_buffer, debug_str_end,
+					file_name_table, &die, tag,
+					enum_die_offset)))
+			return err;
+
+		if (die.flags & TAG_FLAG_CHILDREN) {
+			if (die.sibling)
+				*ptr = die.sibling;
+			else
+				depth++;
+		}
+	}
+}
+
+/*
+ * Index a compilation unit from the DIEs listed for it in .debug_names instead
+ * of scanning every DIE.
+ */
+static struct drgn_error *index_cu_from_debug_names(struct drgn_dwarf_index *dindex,
+						    struct compilation_unit *cu)
+{
+	struct drgn_error *err;
+	struct abbrev_table abbrev;
+	struct uint64_vector file_name_table;
+	const char *first_die = &cu->ptr[cu->is_64_bit ? 23 : 11];
+	const char *end = &cu->ptr[(cu->is_64_bit ? 12 : 4) + cu->unit_length];
+	Elf_Data *debug_info = cu->sections[SECTION_DEBUG_INFO];
+	const char *debug_info_buffer = section_ptr(debug_info, 0);
+	Elf_Data *debug_str = cu->sections[SECTION_DEBUG_STR];
+	const char *debug_str_buffer = section_ptr(debug_str, 0);
+	const char *debug_str_end = section_end(debug_str);
+	const char *ptr = first_die;
+	struct die cu_die = {
+		.stmt_list = SIZE_MAX,
+	};
+	const char *enum_end = NULL;
+	size_t i, j;
+
+	abbrev_table_init(&abbrev);
+	uint64_vector_init(&file_name_table);
+
+	if ((err = read_cu_abbrev_table(dindex, cu, &abbrev)))
+		goto out;
+
+	err = read_die(cu, &abbrev, &ptr, end, debug_str_buffer, debug_str_end,
+		       &cu_die);
+	if (err && err->code == DRGN_ERROR_STOP) {
+		err = NULL;
+		goto out;
+	} else if (err) {
+		goto out;
+	}
+	if ((cu_die.flags & TAG_MASK) == DW_TAG_compile_unit &&
+	    cu_die.stmt_list != SIZE_MAX &&
+	    (err = read_file_name_table(dindex, cu, cu_die.stmt_list,
+					&file_name_table)))
+		goto out;
+	/* The top-level DIEs start after the DW_TAG_compile_unit DIE. */
+	first_die = ptr;
+
+	for (i = 0; i < cu->debug_names_dies.size; i++) {
+		struct die die = {
+			.stmt_list = SIZE_MAX,
+		};
+		uint64_t die_offset = cu->debug_names_dies.data[i];
+		uint64_t tag;
+
+		ptr = debug_info_buffer + die_offset;
+		err = read_die(cu, &abbrev, &ptr, end, debug_str_buffer,
+			       debug_str_end, &die);
+		if (err && err->code == DRGN_ERROR_STOP)
+			continue;
+		else if (err)
+			goto out;
+
+		/*
+		 * Enumerators are indexed through their enumeration type, so
+		 * they shouldn't be here (nor should the unit DIE).
+		 */
+		tag = die.flags & TAG_MASK;
+		if (!tag || tag == DW_TAG_compile_unit ||
+		    tag == DW_TAG_enumerator ||
+		    (die.flags & TAG_FLAG_DECLARATION))
+			continue;
+		if ((err = index_cu_die(dindex, cu, &abbrev, end,
+					debug_str_buffer, debug_str_end,
+					&file_name_table, &die, tag,
+					die_offset)))
+			goto out;
+		if (tag == DW_TAG_enumeration_type &&
+		    (die.flags & TAG_FLAG_CHILDREN) &&
+		    (err = skip_die_children(dindex, cu, &abbrev, &ptr, end,
+					     debug_str_buffer, debug_str_end,
+					     &file_name_table, die_offset)))
+			goto out;
+	}
+
+	/*
+	 * The enumeration types of the remaining enumerators aren't in the name
+	 * index (usually because they are anonymous). Find them by walking the
+	 * top-level DIEs starting from the closest preceding DIE that we know
+	 * is at the top level.
+	 */
+	j = 0;
+	for (i = 0; i < cu->debug_names_enumerators.size; i++) {
+		const char *enumerator = (debug_info_buffer +
+					  cu->debug_names_enumerators.data[i]);
+
+		/* Enumerators of the last enumeration type were indexed. */
+		if (enumerator < enum_end)
+			continue;
+
+		while (j < cu->debug_names_dies.size &&
+		       debug_info_buffer + cu->debug_names_dies.data[j] <
+		       enumerator)
+			j++;
+		if (j > 0)
+			ptr = debug_info_buffer + cu->debug_names_dies.data[j - 1];
+		else
+			ptr = first_die;
+		for (;;) {
+			struct die die = {
+				.stmt_list = SIZE_MAX,
+			};
+			const char *die_ptr = ptr;
+
+			if (ptr >= enumerator)
+				goto scan;
+			err = read_die(cu, &abbrev, &ptr, end,
+				       debug_str_buffer, debug_str_end, &die);
+			if (err && err->code == DRGN_ERROR_STOP)
+				goto scan;
+			else if (err)
+				goto out;
+			if (!(die.flags & TAG_FLAG_CHILDREN))
+				continue;
+			if (die.sibling && die.sibling <= enumerator) {
+				ptr = die.sibling;
+				continue;
+			}
+			/*
+			 * If this is the enumeration type, index all of its
+			 * enumerators. Otherwise, the enumerator may be nested
+			 * more deeply, in which case we don't index it.
+			 */
+			if ((err = skip_die_children(dindex, cu, &abbrev, &ptr,
+						     end, debug_str_buffer,
+						     debug_str_end,
+						     &file_name_table,
+						     (die.flags & TAG_MASK) ==
+						     DW_TAG_enumeration_type ?
+						     die_ptr - debug_info_buffer :
+						     0)))
+				goto out;
+			if (ptr > enumerator) {
+				enum_end = ptr;
+				break;
+			}
+		}
+	}
+
+	err = NULL;
+out:
+	uint64_vector_deinit(&file_name_table);
+	abbrev_table_deinit(&abbrev);
+	return err;
+
+scan:
+	/*
+	 * The name index didn't match the DIE tree. Scan the whole unit
+	 * instead; anything we already indexed is deduplicated.
+	 */
+	uint64_vector_deinit(&file_name_table);
+	abbrev_table_deinit(&abbrev);
+	return index_cu(dindex, cu);
+}
+
+/*
+ * Return whether a module in drgn_dwarf_index::indexed_modules was indexed by a
+ * previous update rather than by the update in progress.
+ */
+static bool indexed_module_is_committed(struct drgn_dwarf_index *dindex,
+					uint32_t module_id)
+{
+	Dwfl_Module *dwfl_module = dindex->indexed_modules.data[module_id];
+	void **userdatap;
+	struct drgn_dwfl_module_userdata *userdata;
+
+	/* Modules which couldn't be read are cleared by read_module_cus(). */
+	if (!dwfl_module)
+		return false;
+	dwfl_module_info(dwfl_module, &userdatap, NULL, NULL, NULL, NULL, NULL,
+			 NULL);
+	userdata = *userdatap;
+	return userdata->state == DRGN_DWARF_MODULE_INDEXED;
+}
+
 static void rollback_dwarf_index(struct drgn_dwarf_index *dindex)
 {
 	size_t i;
@@ -2189,14 +4174,8 @@ static void rollback_dwarf_index(struct drgn_dwarf_index *dindex)
 		 * entry that was added for this update.
 		 */
 		while (shard->dies.size) {
-			void **userdatap;
-			struct drgn_dwfl_module_userdata *userdata;
-
 			die = &shard->dies.data[shard->dies.size - 1];
-			dwfl_module_info(die->module, &userdatap, NULL,
-					 NULL, NULL, NULL, NULL, NULL);
-			userdata = *userdatap;
-			if (userdata->state == DRGN_DWARF_MODULE_INDEXED)
+			if (indexed_module_is_committed(dindex, die->module_id))
 				break;
 			else
 				shard->dies.size--;
@@ -2208,11 +4187,11 @@ static void rollback_dwarf_index(struct drgn_dwarf_index *dindex)
 		 * entries must also be new, so there's no need to preserve
 		 * them.
 		 */
-		for (index = 0; index < shard->dies.size; i++) {
+		for (index = 0; index < shard->dies.size; index++) {
 			die = &shard->dies.data[index];
-			if (die->next != SIZE_MAX &&
+			if (die->next != UINT32_MAX &&
 			    die->next >= shard->dies.size)
-				die->next = SIZE_MAX;
+				die->next = UINT32_MAX;
 		}
 
 		/* Finally, delete the new entries in the map. */
@@ -2226,6 +4205,12 @@ static void rollback_dwarf_index(struct drgn_dwarf_index *dindex)
 			}
 		}
 	}
+
+	/* New modules were all added after the committed ones. */
+	while (dindex->indexed_modules.size &&
+	       !indexed_module_is_committed(dindex,
+					    dindex->indexed_modules.size - 1))
+		dindex->indexed_modules.size--;
 }
 
 static struct drgn_error *index_cus(struct drgn_dwarf_index *dindex,
@@ -2235,14 +4220,23 @@ static struct drgn_error *index_cus(struct drgn_dwarf_index *dindex,
 	struct drgn_error *err = NULL;
 	size_t i;
 
-	#pragma omp parallel for schedule(dynamic)
+	#pragma omp parallel for schedule(dynamic) \
+		num_threads(drgn_dwarf_index_num_threads(dindex))
 	for (i = 0; i < num_cus; i++) {
 		struct drgn_error *cu_err;
+		uint64_t start, elapsed;
 
 		if (err)
 			continue;
 
-		cu_err = index_cu(dindex, &cus[i]);
+		start = monotonic_time_ns();
+		if (cus[i].from_debug_names)
+			cu_err = index_cu_from_debug_names(dindex, &cus[i]);
+		else
+			cu_err = index_cu(dindex, &cus[i]);
+		elapsed = monotonic_time_ns() - start;
+		#pragma omp atomic
+		dindex->index_cus_ns += elapsed;
 		if (cu_err) {
 			#pragma omp critical(drgn_index_cus)
 			if (err)
@@ -2265,7 +4259,12 @@ drgn_dwarf_index_report_end_internal(struct drgn_dwarf_index *dindex,
 	struct drgn_error *err;
 	struct drgn_dwarf_module_vector unindexed;
 	struct compilation_unit_vector cus;
+	struct drgn_dwarf_index_cache_writer_vector writers;
+	size_t i;
 
+	drgn_dwarf_module_vector_init(&unindexed);
+	compilation_unit_vector_init(&cus);
+	drgn_dwarf_index_cache_writer_vector_init(&writers);
 	dwfl_report_end(dindex->dwfl, NULL, NULL);
 	if (report_from_dwfl &&
 	    dwfl_getmodules(dindex->dwfl, drgn_dwarf_index_report_dwfl_module,
@@ -2273,25 +4272,32 @@ drgn_dwarf_index_report_end_internal(struct drgn_dwarf_index *dindex,
 		err = &drgn_enomem;
 		goto err;
 	}
-	drgn_dwarf_module_vector_init(&unindexed);
-	compilation_unit_vector_init(&cus);
 	err = drgn_dwarf_index_get_unindexed(dindex, &unindexed);
-	if (err)
-		goto err;
-	err = read_cus(dindex, unindexed.data, unindexed.size, &cus);
 	if (err)
 		goto err;
 	/*
 	 * After this point, if we hit an error, then we have to roll back the
-	 * index.
+	 * index (modules loaded from the cache are indexed by read_cus()).
 	 */
+	err = read_cus(dindex, unindexed.data, unindexed.size, &cus, &writers);
+	if (err) {
+		rollback_dwarf_index(dindex);
+		goto err;
+	}
 	err = index_cus(dindex, cus.data, cus.size);
 	if (err) {
 		rollback_dwarf_index(dindex);
 		goto err;
 	}
+	write_dwarf_index_caches(dindex, writers.data, writers.size, cus.data,
+				 cus.size);
 
 out:
+	for (i = 0; i < writers.size; i++)
+		drgn_dwarf_index_cache_writer_destroy(writers.data[i]);
+	drgn_dwarf_index_cache_writer_vector_deinit(&writers);
+	for (i = 0; i < cus.size; i++)
+		compilation_unit_deinit(&cus.data[i]);
 	compilation_unit_vector_deinit(&cus);
 	drgn_dwarf_module_vector_deinit(&unindexed);
 	return err;
@@ -2307,6 +4313,7 @@ struct drgn_error *drgn_dwarf_index_report_end(struct drgn_dwarf_index *dindex,
 {
 	struct drgn_error *err;
 
+	dindex->reporting = false;
 	err = drgn_dwarf_index_report_end_internal(dindex, report_from_dwfl);
 	if (err)
 		return err;
@@ -2335,6 +4342,7 @@ struct drgn_error *drgn_dwarf_index_flush(struct drgn_dwarf_index *dindex,
 
 void drgn_dwarf_index_report_abort(struct drgn_dwarf_index *dindex)
 {
+	dindex->reporting = false;
 	dwfl_report_end(dindex->dwfl, NULL, NULL);
 	drgn_dwarf_index_free_modules(dindex, false, false);
 	drgn_dwarf_index_reset_errors(dindex);
@@ -2346,6 +4354,71 @@ bool drgn_dwarf_index_is_indexed(struct drgn_dwarf_index *dindex,
 	return c_string_set_search(&dindex->names, &name).entry != NULL;
 }
 
+static bool undefer_module(struct drgn_dwarf_module *module,
+			   Dwfl_Module *dwfl_module)
+{
+	size_t i;
+
+	if (module->state != DRGN_DWARF_MODULE_DEFERRED)
+		return false;
+	if (dwfl_module) {
+		for (i = 0; i < module->dwfl_modules.size; i++) {
+			if (module->dwfl_modules.data[i] == dwfl_module)
+				break;
+		}
+		if (i == module->dwfl_modules.size)
+			return false;
+	}
+	drgn_dwarf_module_set_state(module, DRGN_DWARF_MODULE_NEW);
+	return true;
+}
+
+struct drgn_error *
+drgn_dwarf_index_index_deferred(struct drgn_dwarf_index *dindex,
+				Dwfl_Module *dwfl_module, bool *indexed_ret)
+{
+	struct drgn_error *err;
+	struct drgn_dwarf_module_table_iterator it;
+	size_t i;
+	bool found = false;
+
+	*indexed_ret = false;
+	if (dindex->reporting)
+		return NULL;
+	if (dwfl_module) {
+		void **userdatap;
+		struct drgn_dwfl_module_userdata *userdata;
+
+		/* Check this first so that the common case is fast. */
+		dwfl_module_info(dwfl_module, &userdatap, NULL, NULL, NULL,
+				 NULL, NULL, NULL);
+		userdata = *userdatap;
+		if (!userdata || userdata->state != DRGN_DWARF_MODULE_DEFERRED)
+			return NULL;
+	}
+
+	for (it = drgn_dwarf_module_table_first(&dindex->module_table);
+	     it.entry; it = drgn_dwarf_module_table_next(it)) {
+		if (undefer_module(*it.entry, dwfl_module))
+			found = true;
+	}
+	for (i = 0; i < dindex->no_build_id.size; i++) {
+		if (undefer_module(dindex->no_build_id.data[i], dwfl_module))
+			found = true;
+	}
+	if (!found)
+		return NULL;
+
+	*indexed_ret = true;
+	drgn_dwarf_index_report_begin(dindex);
+	err = drgn_dwarf_index_report_end(dindex, false);
+	if (err && err->code == DRGN_ERROR_MISSING_DEBUG_INFO) {
+		drgn_error_destroy(err);
+		err = NULL;
+	}
+	return err;
+}
+
 void drgn_dwarf_index_iterator_init(struct drgn_dwarf_index_iterator *it,
 				    struct drgn_dwarf_index *dindex,
 				    const char *name, size_t name_len,
@@ -2436,14 +4509,15 @@ drgn_dwarf_index_iterator_next(struct drgn_dwarf_index_iterator *it,
 			shard = &dindex->shards[it->shard];
 			die = &shard->dies.data[it->index];
 
-			it->index = die->next;
+			it->index = die->next == UINT32_MAX ? SIZE_MAX : die->next;
 
 			if (drgn_dwarf_index_iterator_matches_tag(it, die))
 				break;
 		}
 	}
 
-	dwarf = dwfl_module_getdwarf(die->module, &bias);
+	dwarf = dwfl_module_getdwarf(dindex->indexed_modules.data[die->module_id],
+				     &bias);
 	if (!dwarf)
 		return drgn_error_libdwfl();
 	if (!dwarf_offdie(dwarf, die->offset, die_ret))
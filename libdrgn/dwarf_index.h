@@ -38,9 +38,21 @@
  * highly optimized. This is implemented as a homegrown DWARF parser specialized
  * for the task of scanning over DIEs quickly.
  *
- * Although the DWARF standard defines ".debug_pubnames" and ".debug_names"
- * sections, GCC and Clang currently don't emit them by default, so we don't use
- * them.
+ * The DWARF standard also defines ".debug_pubnames" and ".debug_names"
+ * sections, but GCC and Clang don't emit them by default. If a file has a
+ * ".debug_names" section whose name index lists the parent of each entry (as
+ * Clang's does), we index the compilation units it covers by reading only the
+ * DIEs that it lists instead of scanning every DIE. Other compilation units are
+ * scanned as usual. ".debug_pubnames" and ".gdb_index" map names to compilation
+ * units rather than to DIEs, so they can't be used this way.
+ *
+ * The index of each module can also be cached on disk (see @ref
+ * drgn_dwarf_index::cache_dir), in which case later runs load it from the cache
+ * instead of parsing the DWARF again.
+ *
+ * Modules may also be reported as deferred, in which case they are not indexed
+ * until @ref drgn_dwarf_index_index_deferred() is called (e.g., once a lookup
+ * misses in the modules that are already indexed).
  *
  * @{
  */
@@ -70,6 +82,11 @@ struct drgn_dwarf_index_shard {
 enum drgn_dwarf_module_state {
 	/** Reported but not indexed. */
 	DRGN_DWARF_MODULE_NEW,
+	/**
+	 * Reported, but not indexed until @ref
+	 * drgn_dwarf_index_index_deferred() is called for it.
+	 */
+	DRGN_DWARF_MODULE_DEFERRED,
 	/** Reported and will be indexed on success. */
 	DRGN_DWARF_MODULE_INDEXING,
 	/** Indexed. Must not be freed until @ref drgn_dwarf_index_deinit(). */
@@ -149,6 +166,15 @@ DEFINE_HASH_TABLE_TYPE(drgn_dwarf_module_table, struct drgn_dwarf_module *,
 
 DEFINE_HASH_SET_TYPE(c_string_set, const char *)
 
+/** A cache file mapped by a @ref drgn_dwarf_index. */
+struct drgn_dwarf_index_cache_file {
+	void *map;
+	size_t size;
+};
+
+DEFINE_VECTOR_TYPE(drgn_dwarf_index_cache_file_vector,
+		   struct drgn_dwarf_index_cache_file)
+
 /**
  * Fast index of DWARF debugging information.
  *
@@ -193,6 +219,62 @@ struct drgn_dwarf_index {
 	 * should not be freed.
 	 */
 	struct c_string_set names;
+	/**
+	 * @c Dwfl_Module%s that indexed DIEs belong to.
+	 *
+	 * Indexed DIEs refer to their module by its index in this vector.
+	 */
+	struct dwfl_module_vector indexed_modules;
+	/**
+	 * Directory to cache the index of each module in, or @c NULL if
+	 * caching is disabled.
+	 *
+	 * This is set from the @c DRGN_DWARF_INDEX_CACHE_DIR environment
+	 * variable.
+	 */
+	char *cache_dir;
+	/**
+	 * Cache files that were loaded into the index.
+	 *
+	 * Names in the index point into these, so they are not unmapped until
+	 * @ref drgn_dwarf_index_deinit().
+	 */
+	struct drgn_dwarf_index_cache_file_vector cache_files;
+	/**
+	 * Number of threads to index with, or zero to use the OpenMP default.
+	 */
+	int num_threads;
+	/** Whether modules are currently being reported. */
+	bool reporting;
+	/**
+	 * Total time spent finding compilation units and loading cached
+	 * indexes, in nanoseconds.
+	 */
+	uint64_t cu_discovery_ns;
+	/** Total number of debugging sections that were decompressed. */
+	size_t num_decompressed_sections;
+	/**
+	 * Total time spent decompressing debugging sections, in nanoseconds,
+	 * summed over all threads. This is included in @ref cu_discovery_ns.
+	 */
+	uint64_t decompression_ns;
+	/**
+	 * Total time spent applying ELF relocations, in nanoseconds, summed
+	 * over all threads. This is included in @ref cu_discovery_ns.
+	 */
+	uint64_t relocation_ns;
+	/**
+	 * Total time spent parsing abbreviation tables, in nanoseconds, summed
+	 * over all threads.
+	 */
+	uint64_t abbrev_parsing_ns;
+	/**
+	 * Total time spent indexing compilation units, including @ref
+	 * abbrev_parsing_ns, in nanoseconds, summed over all threads.
+	 */
+	uint64_t index_cus_ns;
+	/** Total time spent writing cached indexes, in nanoseconds. */
+	uint64_t cache_write_ns;
 };
 
 /**
@@ -213,6 +295,21 @@ struct drgn_error *drgn_dwarf_index_init(struct drgn_dwarf_index *dindex,
  */
 void drgn_dwarf_index_deinit(struct drgn_dwarf_index *dindex);
 
+/** Get the number of bytes allocated by a @ref drgn_dwarf_index. */
+size_t drgn_dwarf_index_memory_usage(struct drgn_dwarf_index *dindex);
+
+/**
+ * Get the number of threads that a @ref drgn_dwarf_index indexes with.
+ *
+ * This is @ref drgn_dwarf_index::num_threads if it is set and the OpenMP
+ * default otherwise.
+ */
+int drgn_dwarf_index_num_threads(struct drgn_dwarf_index *dindex);
+
+/** Get statistics about the shards of a @ref drgn_dwarf_index. */
+void drgn_dwarf_index_stats(struct drgn_dwarf_index *dindex,
+			    struct drgn_dwarf_index_stats *ret);
+
 /**
  * Start reporting modules to a @ref drgn_dwarf_index.
  *
@@ -256,6 +353,9 @@ drgn_dwarf_index_report_error(struct drgn_dwarf_index *dindex, const char *name,
  * file is not loaded.
  * @param[in] name An optional name for the module. This is only used for @ref
  * drgn_dwarf_index_is_indexed().
+ * @param[in] defer Whether to defer indexing the module until @ref
+ * drgn_dwarf_index_index_deferred() is called for it. If the same module is
+ * also reported without deferring, then it is indexed as usual.
  * @param[out] new_ret Whether the module was newly created and reported. This
  * is @c false if a module with the same build ID and address range was already
  * indexed or a file with the same path and address range was already reported.
@@ -264,21 +364,21 @@ struct drgn_error *drgn_dwarf_index_report_elf(struct drgn_dwarf_index *dindex,
 					       const char *path, int fd,
 					       Elf *elf, uint64_t start,
 					       uint64_t end, const char *name,
-					       bool *new_ret);
+					       bool defer, bool *new_ret);
 
 /**
  * Stop reporting modules to a @ref drgn_dwarf_index and index new DWARF
  * information.
  *
  * This parses and indexes the debugging information for all modules that have
- * not yet been indexed.
+ * not yet been indexed, except for modules that were reported as deferred.
  *
  * If debug information was not available for one or more modules, a @ref
  * DRGN_ERROR_MISSING_DEBUG_INFO error is returned, those modules are freed, and
  * all other modules are added to the index.
  *
  * On any other error, no new debugging information is indexed and all unindexed
- * modules are freed.
+ * modules other than deferred modules are freed.
  *
  * @param[in] report_from_dwfl Whether any <tt>Dwfl_Module</tt>s were reported
  * to @ref drgn_dwarf_index::dwfl directly via libdwfl. In that case, we need to
@@ -301,7 +401,7 @@ struct drgn_error *drgn_dwarf_index_flush(struct drgn_dwarf_index *dindex,
 
 /**
  * Stop reporting modules to a @ref drgn_dwarf_index and free all unindexed
- * modules.
+ * modules other than deferred modules.
  *
  * This also clears all errors reported by @ref drgn_dwarf_index_report_error().
  *
@@ -317,6 +417,23 @@ void drgn_dwarf_index_report_abort(struct drgn_dwarf_index *dindex);
 bool drgn_dwarf_index_is_indexed(struct drgn_dwarf_index *dindex,
 				 const char *name);
 
+/**
+ * Index modules whose indexing was deferred.
+ *
+ * This is a no-op while modules are being reported. Deferred modules that can't
+ * be indexed are freed; since they weren't explicitly requested, no @ref
+ * DRGN_ERROR_MISSING_DEBUG_INFO error is returned for them.
+ *
+ * @param[in] dwfl_module If not @c NULL, only index the deferred module that
+ * this @c Dwfl_Module was reported for. Otherwise, index all deferred modules.
+ * @param[out] indexed_ret Whether there were any matching deferred modules. If
+ * so, lookups which failed before should be retried, and @p dwfl_module may
+ * have been freed.
+ */
+struct drgn_error *
+drgn_dwarf_index_index_deferred(struct drgn_dwarf_index *dindex,
+				Dwfl_Module *dwfl_module, bool *indexed_ret);
+
 /**
  * Iterator over DWARF debugging information.
  *
@@ -7,6 +7,7 @@
 #include <string.h>
 
 #include "internal.h"
+#include "arena.h"
 #include "dwarf_index.h"
 #include "dwarf_info_cache.h"
 #include "hash_table.h"
@@ -16,6 +17,8 @@
 
 DEFINE_HASH_TABLE_FUNCTIONS(dwarf_type_map, hash_pair_ptr_type,
 			    hash_table_scalar_eq)
+DEFINE_HASH_TABLE_FUNCTIONS(dwarf_type_signature_map, string_hash, string_eq)
+DEFINE_VECTOR(char_vector, char)
 
 struct drgn_type_from_dwarf_thunk {
 	struct drgn_type_thunk thunk;
@@ -24,45 +27,28 @@ struct drgn_type_from_dwarf_thunk {
 	bool can_be_incomplete_array;
 };
 
-static bool drgn_type_realloc(struct drgn_type **type, size_t capacity,
-			      size_t element_size)
-{
-	struct drgn_type *tmp;
-	size_t size;
-
-	if (__builtin_mul_overflow(capacity, element_size, &size) ||
-	    __builtin_add_overflow(size, sizeof(**type), &size))
-		return false;
-
-	tmp = realloc(*type, size);
-	if (!tmp)
-		return false;
-
-	*type = tmp;
-	return true;
-}
-
-static void drgn_dwarf_type_free(struct drgn_dwarf_type *dwarf_type)
+/*
+ * Count the children of a DIE with the given tag so that a type with a trailing
+ * array can be allocated with the exact size up front.
+ */
+static struct drgn_error *count_children(Dwarf_Die *die, int tag, size_t *ret)
 {
-	if (dwarf_type->should_free) {
-		struct drgn_type *type = dwarf_type->type;
-
-		if (drgn_type_has_members(type)) {
-			size_t num_members, i;
-
-			num_members = drgn_type_num_members(type);
-			for (i = 0; i < num_members; i++)
-				drgn_type_member_deinit(type, i);
-		}
-		if (drgn_type_has_parameters(type)) {
-			size_t num_parameters, i;
+	Dwarf_Die child;
+	size_t count = 0;
+	int r;
 
-			num_parameters = drgn_type_num_parameters(type);
-			for (i = 0; i < num_parameters; i++)
-				drgn_type_parameter_deinit(type, i);
-		}
-		free(type);
+	r = dwarf_child(die, &child);
+	while (r == 0) {
+		if (dwarf_tag(&child) == tag)
+			count++;
+		r = dwarf_siblingof(&child, &child);
+	}
+	if (r == -1) {
+		return drgn_error_create(DRGN_ERROR_OTHER,
+					 "libdw could not parse DIE children");
 	}
+	*ret = count;
+	return NULL;
 }
 
 static int dwarf_type(Dwarf_Die *die, Dwarf_Die *ret)
@@ -152,7 +138,7 @@ drgn_type_from_dwarf_thunk_evaluate_fn(struct drgn_type_thunk *thunk,
 
 static void drgn_type_from_dwarf_thunk_free_fn(struct drgn_type_thunk *thunk)
 {
-	free(container_of(thunk, struct drgn_type_from_dwarf_thunk, thunk));
+	/* Thunks are allocated from the arena. */
 }
 
 static struct drgn_error *
@@ -182,7 +168,7 @@ drgn_lazy_type_from_dwarf(struct drgn_dwarf_info_cache *dicache,
 					 "%s has invalid DW_AT_type", tag_name);
 	}
 
-	thunk = malloc(sizeof(*thunk));
+	thunk = drgn_arena_alloc(&dicache->arena, sizeof(*thunk));
 	if (!thunk)
 		return &drgn_enomem;
 
@@ -287,7 +273,7 @@ drgn_base_type_from_dwarf(struct drgn_dwarf_info_cache *dicache, Dwarf_Die *die,
 					 "DW_TAG_base_type has missing or invalid DW_AT_byte_size");
 	}
 
-	type = malloc(sizeof(*type));
+	type = drgn_arena_alloc(&dicache->arena, sizeof(*type));
 	if (!type)
 		return &drgn_enomem;
 	switch (encoding) {
@@ -531,10 +517,8 @@ static struct drgn_error *parse_member(struct drgn_dwarf_info_cache *dicache,
 
 	err = parse_member_offset(die, &member_type, bit_field_size,
 				  little_endian, &bit_offset);
-	if (err) {
-		drgn_lazy_type_deinit(&member_type);
+	if (err)
 		return err;
-	}
 
 	drgn_type_member_init(type, i, member_type, name, bit_offset,
 			      bit_field_size);
@@ -544,7 +528,7 @@ static struct drgn_error *parse_member(struct drgn_dwarf_info_cache *dicache,
 static struct drgn_error *
 drgn_compound_type_from_dwarf(struct drgn_dwarf_info_cache *dicache,
 			      Dwarf_Die *die, bool is_struct,
-			      struct drgn_type **ret, bool *should_free)
+			      struct drgn_type **ret)
 {
 	struct drgn_error *err;
 	struct drgn_type *type;
@@ -554,7 +538,7 @@ drgn_compound_type_from_dwarf(struct drgn_dwarf_info_cache *dicache,
 	bool declaration;
 	Dwarf_Die child;
 	int size;
-	size_t num_members = 0, capacity = 0;
+	size_t num_members, i = 0;
 	bool little_endian;
 	int r;
 
@@ -580,20 +564,14 @@ drgn_compound_type_from_dwarf(struct drgn_dwarf_info_cache *dicache,
 							  DW_TAG_structure_type :
 							  DW_TAG_union_type,
 							  tag, ret);
-		if (!err) {
-			*should_free = false;
-			return NULL;
-		} else if (err->code != DRGN_ERROR_STOP) {
+		if (!err || err->code != DRGN_ERROR_STOP)
 			return err;
-		}
 	}
 
-	*should_free = true;
-	type = malloc(sizeof(*type));
-	if (!type)
-		return &drgn_enomem;
-
 	if (declaration) {
+		type = drgn_arena_alloc(&dicache->arena, sizeof(*type));
+		if (!type)
+			return &drgn_enomem;
 		if (is_struct)
 			drgn_struct_type_init_incomplete(type, tag);
 		else
@@ -604,46 +582,31 @@ drgn_compound_type_from_dwarf(struct drgn_dwarf_info_cache *dicache,
 
 	size = dwarf_bytesize(die);
 	if (size == -1) {
-		err = drgn_error_format(DRGN_ERROR_OTHER,
-					"DW_TAG_%s_type has missing or invalid DW_AT_byte_size",
-					is_struct ? "structure" : "union");
-		goto err;
+		return drgn_error_format(DRGN_ERROR_OTHER,
+					 "DW_TAG_%s_type has missing or invalid DW_AT_byte_size",
+					 is_struct ? "structure" : "union");
 	}
 
+	err = count_children(die, DW_TAG_member, &num_members);
+	if (err)
+		return err;
+	type = drgn_arena_alloc_flex(&dicache->arena, sizeof(*type),
+				     num_members,
+				     sizeof(struct drgn_type_member));
+	if (!type)
+		return &drgn_enomem;
+
 	little_endian = dwarf_die_is_little_endian(die);
 	r = dwarf_child(die, &child);
 	while (r == 0) {
 		if (dwarf_tag(&child) == DW_TAG_member) {
-			if (num_members >= capacity) {
-				if (capacity == 0)
-					capacity = 1;
-				else
-					capacity *= 2;
-				if (!drgn_type_realloc(&type, capacity,
-						       sizeof(struct drgn_type_member))) {
-					err = &drgn_enomem;
-					goto err;
-				}
-			}
-
-			err = parse_member(dicache, &child, type, num_members,
+			err = parse_member(dicache, &child, type, i++,
 					   little_endian);
 			if (err)
-				goto err;
-			num_members++;
+				return err;
 		}
 		r = dwarf_siblingof(&child, &child);
 	}
-	if (r == -1) {
-		err = drgn_error_create(DRGN_ERROR_OTHER,
-					"libdw could not parse DIE children");
-		goto err;
-	}
-	if (capacity != num_members) {
-		/* We don't care if this fails. */
-		drgn_type_realloc(&type, num_members,
-				  sizeof(struct drgn_type_member));
-	}
 
 	if (is_struct) {
 		drgn_struct_type_init(type, tag, size, num_members);
@@ -676,12 +639,6 @@ drgn_compound_type_from_dwarf(struct drgn_dwarf_info_cache *dicache,
 	}
 	*ret = type;
 	return NULL;
-
-err:
-	while (num_members)
-		drgn_type_member_deinit(type, --num_members);
-	free(type);
-	return err;
 }
 
 static struct drgn_error *parse_enumerator(Dwarf_Die *die,
@@ -793,7 +750,7 @@ enum_compatible_type_fallback(struct drgn_dwarf_info_cache *dicache,
 
 static struct drgn_error *
 drgn_enum_type_from_dwarf(struct drgn_dwarf_info_cache *dicache, Dwarf_Die *die,
-			  struct drgn_type **ret, bool *should_free)
+			  struct drgn_type **ret)
 {
 	struct drgn_error *err;
 	struct drgn_type *type;
@@ -803,7 +760,7 @@ drgn_enum_type_from_dwarf(struct drgn_dwarf_info_cache *dicache, Dwarf_Die *die,
 	const char *tag;
 	bool declaration;
 	Dwarf_Die child;
-	size_t num_enumerators = 0, capacity = 0;
+	size_t num_enumerators, i = 0;
 	bool is_signed = false;
 	int r;
 
@@ -825,94 +782,64 @@ drgn_enum_type_from_dwarf(struct drgn_dwarf_info_cache *dicache, Dwarf_Die *die,
 		err = drgn_dwarf_info_cache_find_complete(dicache,
 							  DW_TAG_enumeration_type,
 							  tag, ret);
-		if (!err) {
-			*should_free = false;
-			return NULL;
-		} else if (err->code != DRGN_ERROR_STOP) {
+		if (!err || err->code != DRGN_ERROR_STOP)
 			return err;
-		}
 	}
 
-	*should_free = true;
-	type = malloc(sizeof(*type));
-	if (!type)
-		return &drgn_enomem;
-
 	if (declaration) {
+		type = drgn_arena_alloc(&dicache->arena, sizeof(*type));
+		if (!type)
+			return &drgn_enomem;
 		drgn_enum_type_init_incomplete(type, tag);
 		*ret = type;
 		return NULL;
 	}
 
+	err = count_children(die, DW_TAG_enumerator, &num_enumerators);
+	if (err)
+		return err;
+	type = drgn_arena_alloc_flex(&dicache->arena, sizeof(*type),
+				     num_enumerators,
+				     sizeof(struct drgn_type_enumerator));
+	if (!type)
+		return &drgn_enomem;
+
 	r = dwarf_child(die, &child);
 	while (r == 0) {
-		int tag;
-
-		tag = dwarf_tag(&child);
-		if (tag == DW_TAG_enumerator) {
-			if (num_enumerators >= capacity) {
-				if (capacity == 0)
-					capacity = 1;
-				else
-					capacity *= 2;
-				if (!drgn_type_realloc(&type, capacity,
-						       sizeof(struct drgn_type_enumerator))) {
-					err = &drgn_enomem;
-					goto err;
-				}
-			}
-
-			err = parse_enumerator(&child, type, num_enumerators,
-					       &is_signed);
+		if (dwarf_tag(&child) == DW_TAG_enumerator) {
+			err = parse_enumerator(&child, type, i++, &is_signed);
 			if (err)
-				goto err;
-			num_enumerators++;
+				return err;
 		}
 		r = dwarf_siblingof(&child, &child);
 	}
-	if (r == -1) {
-		err = drgn_error_create(DRGN_ERROR_OTHER,
-					"libdw could not parse DIE children");
-		goto err;
-	}
-	if (capacity != num_enumerators) {
-		/* We don't care if this fails. */
-		drgn_type_realloc(&type, num_enumerators,
-				  sizeof(struct drgn_type_enumerator));
-	}
 
 	r = dwarf_type(die, &child);
 	if (r == -1) {
-		err = drgn_error_create(DRGN_ERROR_OTHER,
-					"DW_TAG_enumeration_type has invalid DW_AT_type");
-		goto err;
+		return drgn_error_create(DRGN_ERROR_OTHER,
+					 "DW_TAG_enumeration_type has invalid DW_AT_type");
 	} else if (r) {
 		err = enum_compatible_type_fallback(dicache, die, is_signed,
 						    &compatible_type);
 		if (err)
-			goto err;
+			return err;
 	} else {
 		struct drgn_qualified_type qualified_compatible_type;
 
 		err = drgn_type_from_dwarf(dicache, &child,
 					   &qualified_compatible_type);
 		if (err)
-			goto err;
+			return err;
 		compatible_type = qualified_compatible_type.type;
 		if (drgn_type_kind(compatible_type) != DRGN_TYPE_INT) {
-			err = drgn_error_create(DRGN_ERROR_OTHER,
-						"DW_AT_type of DW_TAG_enumeration_type is not an integer type");
-			goto err;
+			return drgn_error_create(DRGN_ERROR_OTHER,
+						 "DW_AT_type of DW_TAG_enumeration_type is not an integer type");
 		}
 	}
 
 	drgn_enum_type_init(type, tag, compatible_type, num_enumerators);
 	*ret = type;
 	return NULL;
-
-err:
-	free(type);
-	return err;
 }
 
 static struct drgn_error *
@@ -932,7 +859,7 @@ drgn_typedef_type_from_dwarf(struct drgn_dwarf_info_cache *dicache,
 					 "DW_TAG_typedef has missing or invalid DW_AT_name");
 	}
 
-	type = malloc(sizeof(*type));
+	type = drgn_arena_alloc(&dicache->arena, sizeof(*type));
 	if (!type)
 		return &drgn_enomem;
 
@@ -941,10 +868,8 @@ drgn_typedef_type_from_dwarf(struct drgn_dwarf_info_cache *dicache,
 						  can_be_incomplete_array,
 						  is_incomplete_array_ret,
 						  &aliased_type);
-	if (err) {
-		free(type);
+	if (err)
 		return err;
-	}
 
 	drgn_typedef_type_init(type, name, aliased_type);
 	*ret = type;
@@ -1126,7 +1051,7 @@ drgn_function_type_from_dwarf(struct drgn_dwarf_info_cache *dicache,
 	struct drgn_type *type;
 	struct drgn_qualified_type return_type;
 	Dwarf_Die child;
-	size_t num_parameters = 0, capacity = 0;
+	size_t num_parameters, i = 0;
 	bool is_variadic = false;
 	int r;
 
@@ -1135,7 +1060,12 @@ drgn_function_type_from_dwarf(struct drgn_dwarf_info_cache *dicache,
 	else
 		tag_name = "DW_TAG_subprogram";
 
-	type = malloc(sizeof(*type));
+	err = count_children(die, DW_TAG_formal_parameter, &num_parameters);
+	if (err)
+		return err;
+	type = drgn_arena_alloc_flex(&dicache->arena, sizeof(*type),
+				     num_parameters,
+				     sizeof(struct drgn_type_parameter));
 	if (!type)
 		return &drgn_enomem;
 
@@ -1146,65 +1076,353 @@ drgn_function_type_from_dwarf(struct drgn_dwarf_info_cache *dicache,
 		tag = dwarf_tag(&child);
 		if (tag == DW_TAG_formal_parameter) {
 			if (is_variadic) {
-				err = drgn_error_format(DRGN_ERROR_OTHER,
-							"%s has DW_TAG_formal_parameter child after DW_TAG_unspecified_parameters child",
-							tag_name);
-				goto err;
-			}
-
-			if (num_parameters >= capacity) {
-				if (capacity == 0)
-					capacity = 1;
-				else
-					capacity *= 2;
-				if (!drgn_type_realloc(&type, capacity,
-						       sizeof(struct drgn_type_parameter))) {
-					err = &drgn_enomem;
-					goto err;
-				}
+				return drgn_error_format(DRGN_ERROR_OTHER,
+							 "%s has DW_TAG_formal_parameter child after DW_TAG_unspecified_parameters child",
+							 tag_name);
 			}
 
 			err = parse_formal_parameter(dicache, &child, type,
-						     num_parameters);
+						     i++);
 			if (err)
-				goto err;
-			num_parameters++;
+				return err;
 		} else if (tag == DW_TAG_unspecified_parameters) {
 			if (is_variadic) {
-				err = drgn_error_format(DRGN_ERROR_OTHER,
-							"%s has multiple DW_TAG_unspecified_parameters children",
-							tag_name);
-				goto err;
+				return drgn_error_format(DRGN_ERROR_OTHER,
+							 "%s has multiple DW_TAG_unspecified_parameters children",
+							 tag_name);
 			}
 			is_variadic = true;
 		}
 		r = dwarf_siblingof(&child, &child);
 	}
-	if (r == -1) {
-		err = drgn_error_create(DRGN_ERROR_OTHER,
-					"libdw could not parse DIE children");
-		goto err;
-	}
-	if (capacity != num_parameters) {
-		/* We don't care if this fails. */
-		drgn_type_realloc(&type, num_parameters,
-				  sizeof(struct drgn_type_parameter));
-	}
 
 	err = drgn_type_from_dwarf_child(dicache, die, tag_name, true,
 					 &return_type);
 	if (err)
-		goto err;
+		return err;
 
 	drgn_function_type_init(type, return_type, num_parameters, is_variadic);
 	*ret = type;
 	return NULL;
+}
 
-err:
-	while (num_parameters)
-		drgn_type_parameter_deinit(type, --num_parameters);
-	free(type);
-	return err;
+/*
+ * Identical types are usually defined in many compilation units (e.g., every
+ * file which includes a header), so we deduplicate them: before parsing a base
+ * type, complete structure, union, or enumerated type, or typedef, we compute
+ * a signature of the DIE and its children. If we have already parsed a type
+ * with the same signature, we use that type instead of parsing another copy.
+ *
+ * The signature describes everything that we parse from the DIE. Referenced
+ * types are described by their tag, name, and shape, except that referenced
+ * definitions of named compound types are not expanded, so computing a
+ * signature doesn't recurse through the entire type graph. Instead, they are
+ * identified by the type that they were parsed into (which all of their
+ * duplicates share) or, if they haven't been parsed yet, by the DIE itself.
+ * Types referring to different definitions with the same name therefore never
+ * get the same signature. These helpers return &drgn_stop if a DIE shouldn't
+ * be deduplicated.
+ */
+#define MAX_TYPE_SIGNATURE_DEPTH 32
+
+struct type_signature {
+	struct drgn_dwarf_info_cache *dicache;
+	/* DIE that the signature is for. */
+	Dwarf_Die *root;
+	struct char_vector buf;
+};
+
+static struct drgn_error *type_signature_append(struct type_signature *sig,
+						const void *buf, size_t len)
+{
+	size_t new_size;
+
+	if (__builtin_add_overflow(sig->buf.size, len, &new_size))
+		return &drgn_enomem;
+	if (new_size > sig->buf.capacity &&
+	    !char_vector_reserve(&sig->buf,
+				 max(new_size, 2 * sig->buf.capacity)))
+		return &drgn_enomem;
+	memcpy(sig->buf.data + sig->buf.size, buf, len);
+	sig->buf.size = new_size;
+	return NULL;
+}
+
+static struct drgn_error *type_signature_append_u64(struct type_signature *sig,
+						    uint64_t value)
+{
+	return type_signature_append(sig, &value, sizeof(value));
+}
+
+static struct drgn_error *type_signature_append_str(struct type_signature *sig,
+						    const char *str)
+{
+	struct drgn_error *err;
+	size_t len;
+
+	/* Distinguish a missing name from an empty one. */
+	if (!str)
+		return type_signature_append_u64(sig, 0);
+	len = strlen(str);
+	err = type_signature_append_u64(sig, len + 1);
+	if (err)
+		return err;
+	return type_signature_append(sig, str, len);
+}
+
+static struct drgn_error *type_signature_append_attr(struct type_signature *sig,
+						     Dwarf_Die *die,
+						     unsigned int name)
+{
+	struct drgn_error *err;
+	Dwarf_Attribute attr_mem;
+	Dwarf_Attribute *attr;
+	Dwarf_Word value;
+
+	if (!(attr = dwarf_attr_integrate(die, name, &attr_mem)))
+		return type_signature_append_u64(sig, 0);
+	/* Location expressions and the like aren't worth decoding here. */
+	if (dwarf_formudata(attr, &value))
+		return &drgn_stop;
+	err = type_signature_append_u64(sig, 1);
+	if (err)
+		return err;
+	return type_signature_append_u64(sig, value);
+}
+
+static struct drgn_error *
+type_signature_append_die(struct type_signature *sig, Dwarf_Die *die,
+			  bool expand, bool in_typedef, int depth);
+
+static struct drgn_error *
+type_signature_append_type(struct type_signature *sig, Dwarf_Die *die,
+			   bool in_typedef, int depth)
+{
+	Dwarf_Die type_die;
+	int r;
+
+	r = dwarf_type(die, &type_die);
+	if (r == -1)
+		return &drgn_stop;
+	else if (r)
+		return type_signature_append_u64(sig, 0);
+	return type_signature_append_die(sig, &type_die, false, in_typedef,
+					 depth + 1);
+}
+
+static struct drgn_error *
+type_signature_append_children(struct type_signature *sig, Dwarf_Die *die,
+			       int depth)
+{
+	struct drgn_error *err;
+	Dwarf_Die child;
+	int tag, r;
+
+	r = dwarf_child(die, &child);
+	while (r == 0) {
+		tag = dwarf_tag(&child);
+		switch (tag) {
+		case DW_TAG_member:
+			if ((err = type_signature_append_u64(sig, tag)) ||
+			    (err = type_signature_append_str(sig,
+							     dwarf_diename(&child))) ||
+			    (err = type_signature_append_attr(sig, &child,
+							      DW_AT_data_member_location)) ||
+			    (err = type_signature_append_attr(sig, &child,
+							      DW_AT_data_bit_offset)) ||
+			    (err = type_signature_append_attr(sig, &child,
+							      DW_AT_bit_offset)) ||
+			    (err = type_signature_append_attr(sig, &child,
+							      DW_AT_bit_size)) ||
+			    (err = type_signature_append_attr(sig, &child,
+							      DW_AT_byte_size)) ||
+			    (err = type_signature_append_type(sig, &child,
+							      false, depth)))
+				return err;
+			break;
+		case DW_TAG_enumerator:
+			if ((err = type_signature_append_u64(sig, tag)) ||
+			    (err = type_signature_append_str(sig,
+							     dwarf_diename(&child))) ||
+			    (err = type_signature_append_attr(sig, &child,
+							      DW_AT_const_value)))
+				return err;
+			break;
+		case DW_TAG_formal_parameter:
+			if ((err = type_signature_append_u64(sig, tag)) ||
+			    (err = type_signature_append_type(sig, &child,
+							      false, depth)))
+				return err;
+			break;
+		case DW_TAG_unspecified_parameters:
+		case DW_TAG_subrange_type:
+			if ((err = type_signature_append_u64(sig, tag)) ||
+			    (err = type_signature_append_attr(sig, &child,
+							      DW_AT_upper_bound)) ||
+			    (err = type_signature_append_attr(sig, &child,
+							      DW_AT_count)))
+				return err;
+			break;
+		default:
+			break;
+		}
+		r = dwarf_siblingof(&child, &child);
+	}
+	if (r == -1)
+		return &drgn_stop;
+	/* Terminate the list of children. */
+	return type_signature_append_u64(sig, 0);
+}
+
+/* Append the identity of a referenced definition of a named compound type. */
+static struct drgn_error *
+type_signature_append_definition(struct type_signature *sig, Dwarf_Die *die)
+{
+	struct drgn_error *err;
+	const void *key = die->addr;
+	struct dwarf_type_map_iterator it;
+
+	/* The type refers to itself. */
+	if (die->addr == sig->root->addr)
+		return type_signature_append_u64(sig, 1);
+	it = dwarf_type_map_search(&sig->dicache->map, &key);
+	if (it.entry) {
+		err = type_signature_append_u64(sig, 2);
+		if (err)
+			return err;
+		return type_signature_append_u64(sig,
+						 (uintptr_t)it.entry->value.type);
+	}
+	err = type_signature_append_u64(sig, 3);
+	if (err)
+		return err;
+	return type_signature_append_u64(sig, (uintptr_t)die->addr);
+}
+
+/*
+ * Append the signature of a type DIE. If expand is true or the type is an
+ * anonymous compound type, the children of the type are included. in_typedef
+ * is true if this DIE was reached from a typedef only through other typedefs
+ * and qualifiers.
+ */
+static struct drgn_error *
+type_signature_append_die(struct type_signature *sig, Dwarf_Die *die,
+			  bool expand, bool in_typedef, int depth)
+{
+	struct drgn_error *err;
+	const char *name;
+	bool declaration;
+	int tag;
+
+	if (depth > MAX_TYPE_SIGNATURE_DEPTH)
+		return &drgn_stop;
+
+	tag = dwarf_tag(die);
+	err = type_signature_append_u64(sig, tag);
+	if (err)
+		return err;
+	switch (tag) {
+	case DW_TAG_base_type:
+		if ((err = type_signature_append_str(sig, dwarf_diename(die))) ||
+		    (err = type_signature_append_attr(sig, die,
+						      DW_AT_encoding)) ||
+		    (err = type_signature_append_attr(sig, die,
+						      DW_AT_byte_size)))
+			return err;
+		/* Complex types also reference their real type. */
+		return type_signature_append_type(sig, die, false, depth);
+	case DW_TAG_structure_type:
+	case DW_TAG_union_type:
+	case DW_TAG_enumeration_type:
+		name = dwarf_diename(die);
+		if (dwarf_flag(die, DW_AT_declaration, &declaration))
+			return &drgn_stop;
+		if ((err = type_signature_append_str(sig, name)) ||
+		    (err = type_signature_append_u64(sig, declaration)))
+			return err;
+		if (declaration)
+			return NULL;
+		if (name && !expand)
+			return type_signature_append_definition(sig, die);
+		if ((err = type_signature_append_attr(sig, die,
+						      DW_AT_byte_size)) ||
+		    (err = type_signature_append_children(sig, die, depth)))
+			return err;
+		if (tag != DW_TAG_enumeration_type)
+			return NULL;
+		return type_signature_append_type(sig, die, false, depth);
+	case DW_TAG_typedef:
+		err = type_signature_append_str(sig, dwarf_diename(die));
+		if (err)
+			return err;
+		return type_signature_append_type(sig, die, true, depth);
+	case DW_TAG_const_type:
+	case DW_TAG_restrict_type:
+	case DW_TAG_volatile_type:
+	case DW_TAG_atomic_type:
+		return type_signature_append_type(sig, die, in_typedef, depth);
+	case DW_TAG_pointer_type:
+		err = type_signature_append_attr(sig, die, DW_AT_byte_size);
+		if (err)
+			return err;
+		return type_signature_append_type(sig, die, false, depth);
+	case DW_TAG_array_type:
+		/*
+		 * A typedef of an array type may be a typedef of an incomplete
+		 * array type, which is handled specially by
+		 * drgn_type_from_dwarf_internal(), so don't bother with it.
+		 */
+		if (in_typedef)
+			return &drgn_stop;
+		if ((err = type_signature_append_children(sig, die, depth)))
+			return err;
+		return type_signature_append_type(sig, die, false, depth);
+	case DW_TAG_subroutine_type:
+		if ((err = type_signature_append_attr(sig, die,
+						      DW_AT_prototyped)) ||
+		    (err = type_signature_append_children(sig, die, depth)))
+			return err;
+		return type_signature_append_type(sig, die, false, depth);
+	default:
+		return &drgn_stop;
+	}
+}
+
+/*
+ * Compute the signature used to deduplicate the type parsed from a DIE. Only
+ * types which we allocate ourselves are deduplicated, and incomplete types are
+ * not deduplicated since they may be resolved to a complete type by
+ * drgn_dwarf_info_cache_find_complete().
+ */
+static struct drgn_error *drgn_dwarf_type_signature(Dwarf_Die *die,
+						    struct type_signature *sig)
+{
+	struct drgn_error *err;
+	bool declaration;
+
+	switch (dwarf_tag(die)) {
+	case DW_TAG_structure_type:
+	case DW_TAG_union_type:
+	case DW_TAG_enumeration_type:
+		if (dwarf_flag(die, DW_AT_declaration, &declaration) ||
+		    declaration)
+			return &drgn_stop;
+		/* fallthrough */
+	case DW_TAG_base_type:
+	case DW_TAG_typedef:
+		break;
+	default:
+		return &drgn_stop;
+	}
+
+	/*
+	 * Named types in different files are probably distinct even if they
+	 * look the same.
+	 */
+	err = type_signature_append_str(sig, dwarf_decl_file(die));
+	if (err)
+		return err;
+	return type_signature_append_die(sig, die, true, false, 0);
 }
 
 static struct drgn_error *
@@ -1220,6 +1438,11 @@ drgn_type_from_dwarf_internal(struct drgn_dwarf_info_cache *dicache,
 	};
 	struct dwarf_type_map *map;
 	struct dwarf_type_map_iterator it;
+	struct type_signature sig;
+	struct dwarf_type_signature_map_entry sig_entry;
+	struct hash_pair sig_hp;
+	struct dwarf_type_signature_map_iterator sig_it;
+	bool have_sig;
 
 	if (dicache->depth >= 1000) {
 		return drgn_error_create(DRGN_ERROR_RECURSION,
@@ -1242,74 +1465,82 @@ drgn_type_from_dwarf_internal(struct drgn_dwarf_info_cache *dicache,
 	}
 
 	ret->qualifiers = 0;
-	dicache->depth++;
 	entry.value.is_incomplete_array = false;
+
+	sig.dicache = dicache;
+	sig.root = die;
+	char_vector_init(&sig.buf);
+	err = drgn_dwarf_type_signature(die, &sig);
+	if (err) {
+		char_vector_deinit(&sig.buf);
+		if (err != &drgn_stop)
+			return err;
+		have_sig = false;
+	} else {
+		have_sig = true;
+		sig_entry.key.str = sig.buf.data;
+		sig_entry.key.len = sig.buf.size;
+		sig_hp = dwarf_type_signature_map_hash(&sig_entry.key);
+		sig_it = dwarf_type_signature_map_search_hashed(&dicache->signature_map,
+								&sig_entry.key,
+								sig_hp);
+		if (sig_it.entry) {
+			char_vector_deinit(&sig.buf);
+			ret->type = sig_it.entry->value;
+			goto insert;
+		}
+	}
+
+	dicache->depth++;
 	switch (dwarf_tag(die)) {
 	case DW_TAG_const_type:
-		/*
-		 * Qualified types share the struct drgn_type with the
-		 * unqualified type.
-		 */
-		entry.value.should_free = false;
 		err = drgn_type_from_dwarf_child(dicache, die,
 						 "DW_TAG_const_type", true,
 						 ret);
 		ret->qualifiers |= DRGN_QUALIFIER_CONST;
 		break;
 	case DW_TAG_restrict_type:
-		entry.value.should_free = false;
 		err = drgn_type_from_dwarf_child(dicache, die,
 						 "DW_TAG_restrict_type", true,
 						 ret);
 		ret->qualifiers |= DRGN_QUALIFIER_RESTRICT;
 		break;
 	case DW_TAG_volatile_type:
-		entry.value.should_free = false;
 		err = drgn_type_from_dwarf_child(dicache, die,
 						 "DW_TAG_volatile_type", true,
 						 ret);
 		ret->qualifiers |= DRGN_QUALIFIER_VOLATILE;
 		break;
 	case DW_TAG_atomic_type:
-		entry.value.should_free = false;
 		err = drgn_type_from_dwarf_child(dicache, die,
 						 "DW_TAG_atomic_type", true,
 						 ret);
 		ret->qualifiers |= DRGN_QUALIFIER_ATOMIC;
 		break;
 	case DW_TAG_base_type:
-		entry.value.should_free = true;
 		err = drgn_base_type_from_dwarf(dicache, die, &ret->type);
 		break;
 	case DW_TAG_structure_type:
 		err = drgn_compound_type_from_dwarf(dicache, die, true,
-						    &ret->type,
-						    &entry.value.should_free);
+						    &ret->type);
 		break;
 	case DW_TAG_union_type:
 		err = drgn_compound_type_from_dwarf(dicache, die, false,
-						    &ret->type,
-						    &entry.value.should_free);
+						    &ret->type);
 		break;
 	case DW_TAG_enumeration_type:
-		err = drgn_enum_type_from_dwarf(dicache, die, &ret->type,
-						&entry.value.should_free);
+		err = drgn_enum_type_from_dwarf(dicache, die, &ret->type);
 		break;
 	case DW_TAG_typedef:
-		entry.value.should_free = true;
 		err = drgn_typedef_type_from_dwarf(dicache, die,
 						   can_be_incomplete_array,
 						   &entry.value.is_incomplete_array,
 						   &ret->type);
 		break;
 	case DW_TAG_pointer_type:
-		/* Pointer types are owned by the type index. */
-		entry.value.should_free = false;
 		err = drgn_pointer_type_from_dwarf(dicache, die, &ret->type);
 		break;
 	case DW_TAG_array_type:
-		/* Array types are owned by the type index. */
-		entry.value.should_free = false;
 		err = drgn_array_type_from_dwarf(dicache, die,
 						 can_be_incomplete_array,
 						 &entry.value.is_incomplete_array,
@@ -1317,7 +1548,6 @@ drgn_type_from_dwarf_internal(struct drgn_dwarf_info_cache *dicache,
 		break;
 	case DW_TAG_subroutine_type:
 	case DW_TAG_subprogram:
-		entry.value.should_free = true;
 		err = drgn_function_type_from_dwarf(dicache, die, &ret->type);
 		break;
 	default:
@@ -1327,31 +1557,49 @@ drgn_type_from_dwarf_internal(struct drgn_dwarf_info_cache *dicache,
 		break;
 	}
 	dicache->depth--;
-	if (err)
+	if (err) {
+		if (have_sig)
+			char_vector_deinit(&sig.buf);
 		return err;
+	}
+
+	if (have_sig) {
+		char *key;
 
+		/* We don't care if this fails. */
+		key = drgn_arena_alloc(&dicache->arena, sig.buf.size);
+		if (key) {
+			memcpy(key, sig.buf.data, sig.buf.size);
+			sig_entry.key.str = key;
+			sig_entry.value = ret->type;
+			dwarf_type_signature_map_insert_searched(&dicache->signature_map,
+								 &sig_entry,
+								 sig_hp, NULL);
+		}
+		char_vector_deinit(&sig.buf);
+	}
+
+insert:
 	entry.value.type = ret->type;
 	entry.value.qualifiers = ret->qualifiers;
 	if (!can_be_incomplete_array && entry.value.is_incomplete_array)
 		map = &dicache->cant_be_incomplete_array_map;
 	else
 		map = &dicache->map;
-	if (dwarf_type_map_insert_searched(map, &entry, hp, NULL) == -1) {
-		drgn_dwarf_type_free(&entry.value);
+	if (dwarf_type_map_insert_searched(map, &entry, hp, NULL) == -1)
 		return &drgn_enomem;
-	}
 	if (is_incomplete_array_ret)
 		*is_incomplete_array_ret = entry.value.is_incomplete_array;
 	return NULL;
 }
 
-struct drgn_error *drgn_dwarf_type_find(enum drgn_type_kind kind,
-					const char *name, size_t name_len,
-					const char *filename, void *arg,
-					struct drgn_qualified_type *ret)
+static struct drgn_error *
+drgn_dwarf_type_find_indexed(struct drgn_dwarf_info_cache *dicache,
+			     enum drgn_type_kind kind, const char *name,
+			     size_t name_len, const char *filename,
+			     struct drgn_qualified_type *ret)
 {
 	struct drgn_error *err;
-	struct drgn_dwarf_info_cache *dicache = arg;
 	struct drgn_dwarf_index_iterator it;
 	Dwarf_Die die;
 	uint64_t tag;
@@ -1398,6 +1646,30 @@ struct drgn_error *drgn_dwarf_type_find(enum drgn_type_kind kind,
 	return &drgn_not_found;
 }
 
+struct drgn_error *drgn_dwarf_type_find(enum drgn_type_kind kind,
+					const char *name, size_t name_len,
+					const char *filename, void *arg,
+					struct drgn_qualified_type *ret)
+{
+	struct drgn_error *err;
+	struct drgn_dwarf_info_cache *dicache = arg;
+	bool indexed;
+
+	err = drgn_dwarf_type_find_indexed(dicache, kind, name, name_len,
+					   filename, ret);
+	if (err != &drgn_not_found)
+		return err;
+	/* Index any deferred modules and try again. */
+	err = drgn_dwarf_index_index_deferred(&dicache->dindex, NULL,
+					      &indexed);
+	if (err)
+		return err;
+	if (!indexed)
+		return &drgn_not_found;
+	return drgn_dwarf_type_find_indexed(dicache, kind, name, name_len,
+					    filename, ret);
+}
+
 static struct drgn_error *
 drgn_object_from_dwarf_enumerator(struct drgn_dwarf_info_cache *dicache,
 				  Dwarf_Die *die, const char *name,
@@ -1482,13 +1754,13 @@ drgn_object_from_dwarf_variable(struct drgn_dwarf_info_cache *dicache,
 					 dwarf_die_byte_order(die));
 }
 
-struct drgn_error *
-drgn_dwarf_object_find(const char *name, size_t name_len, const char *filename,
-		       enum drgn_find_object_flags flags, void *arg,
-		       struct drgn_object *ret)
+static struct drgn_error *
+drgn_dwarf_object_find_indexed(struct drgn_dwarf_info_cache *dicache,
+			       const char *name, const char *filename,
+			       enum drgn_find_object_flags flags,
+			       struct drgn_object *ret)
 {
 	struct drgn_error *err;
-	struct drgn_dwarf_info_cache *dicache = arg;
 	uint64_t tags[3];
 	size_t num_tags;
 	struct drgn_dwarf_index_iterator it;
@@ -1528,6 +1800,30 @@ drgn_dwarf_object_find(const char *name, size_t name_len, const char *filename,
 	return &drgn_not_found;
 }
 
+struct drgn_error *
+drgn_dwarf_object_find(const char *name, size_t name_len, const char *filename,
+		       enum drgn_find_object_flags flags, void *arg,
+		       struct drgn_object *ret)
+{
+	struct drgn_error *err;
+	struct drgn_dwarf_info_cache *dicache = arg;
+	bool indexed;
+
+	err = drgn_dwarf_object_find_indexed(dicache, name, filename, flags,
+					     ret);
+	if (err != &drgn_not_found)
+		return err;
+	/* Index any deferred modules and try again. */
+	err = drgn_dwarf_index_index_deferred(&dicache->dindex, NULL,
+					      &indexed);
+	if (err)
+		return err;
+	if (!indexed)
+		return &drgn_not_found;
+	return drgn_dwarf_object_find_indexed(dicache, name, filename, flags,
+					      ret);
+}
+
 struct drgn_error *
 drgn_dwarf_info_cache_create(struct drgn_type_index *tindex,
 			     const Dwfl_Callbacks *dwfl_callbacks,
@@ -1546,26 +1842,35 @@ drgn_dwarf_info_cache_create(struct drgn_type_index *tindex,
 	}
 	dwarf_type_map_init(&dicache->map);
 	dwarf_type_map_init(&dicache->cant_be_incomplete_array_map);
+	dwarf_type_signature_map_init(&dicache->signature_map);
+	drgn_arena_init(&dicache->arena);
 	dicache->depth = 0;
 	dicache->tindex = tindex;
 	*ret = dicache;
 	return NULL;
 }
 
-void drgn_dwarf_info_cache_destroy(struct drgn_dwarf_info_cache *dicache)
+void
+drgn_dwarf_info_cache_memory_usage(struct drgn_dwarf_info_cache *dicache,
+				   struct drgn_program_memory_usage *usage)
 {
-	struct dwarf_type_map_iterator it;
+	usage->types += dicache->arena.capacity;
+	usage->dwarf_index += drgn_dwarf_index_memory_usage(&dicache->dindex);
+	usage->caches += dwarf_type_map_memory_usage(&dicache->map);
+	usage->caches +=
+		dwarf_type_map_memory_usage(&dicache->cant_be_incomplete_array_map);
+	usage->caches +=
+		dwarf_type_signature_map_memory_usage(&dicache->signature_map);
+}
 
+void drgn_dwarf_info_cache_destroy(struct drgn_dwarf_info_cache *dicache)
+{
 	if (!dicache)
 		return;
 
-	for (it = dwarf_type_map_first(&dicache->map); it.entry;
-	     it = dwarf_type_map_next(it))
-		drgn_dwarf_type_free(&it.entry->value);
-	/* Arrays don't need to be freed, but typedefs do. */
-	for (it = dwarf_type_map_first(&dicache->cant_be_incomplete_array_map);
-	     it.entry; it = dwarf_type_map_next(it))
-		drgn_dwarf_type_free(&it.entry->value);
+	/* All of the types are allocated from the arena. */
+	drgn_arena_deinit(&dicache->arena);
+	dwarf_type_signature_map_deinit(&dicache->signature_map);
 	dwarf_type_map_deinit(&dicache->cant_be_incomplete_array_map);
 	dwarf_type_map_deinit(&dicache->map);
 	drgn_dwarf_index_deinit(&dicache->dindex);
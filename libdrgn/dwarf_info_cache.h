@@ -12,6 +12,7 @@
 #ifndef DRGN_DWARF_INFO_CACHE_H
 #define DRGN_DWARF_INFO_CACHE_H
 
+#include "arena.h"
 #include "drgn.h"
 #include "hash_table.h"
 
@@ -40,11 +41,11 @@ struct drgn_dwarf_type {
 	 * drgn_type_from_dwarf_internal().
 	 */
 	bool is_incomplete_array;
-	/** Whether we need to free @c type. */
-	bool should_free;
 };
 
 DEFINE_HASH_MAP_TYPE(dwarf_type_map, const void *, struct drgn_dwarf_type);
+DEFINE_HASH_MAP_TYPE(dwarf_type_signature_map, struct string,
+		     struct drgn_type *);
 
 struct drgn_dwarf_index;
 
@@ -71,6 +72,21 @@ struct drgn_dwarf_info_cache {
 	 * See @ref drgn_type_from_dwarf_internal().
 	 */
 	struct dwarf_type_map cant_be_incomplete_array_map;
+	/**
+	 * Types which were parsed from DWARF, keyed by a signature of the DIE
+	 * they were parsed from.
+	 *
+	 * This is used to deduplicate identical types defined in multiple
+	 * compilation units so that they share a single @ref drgn_type.
+	 */
+	struct dwarf_type_signature_map signature_map;
+	/**
+	 * Arena which types parsed from DWARF (other than pointer and array
+	 * types, which are owned by the type index), their lazy member and
+	 * parameter types, and the keys of @ref
+	 * drgn_dwarf_info_cache::signature_map are allocated from.
+	 */
+	struct drgn_arena arena;
 	/** Current parsing recursion depth. */
 	int depth;
 	/** Type index. */
@@ -86,6 +102,14 @@ drgn_dwarf_info_cache_create(struct drgn_type_index *tindex,
 /** Destroy a @ref drgn_dwarf_info_cache. */
 void drgn_dwarf_info_cache_destroy(struct drgn_dwarf_info_cache *dicache);
 
+/**
+ * Add the memory used by a @ref drgn_dwarf_info_cache to a @ref
+ * drgn_program_memory_usage.
+ */
+void
+drgn_dwarf_info_cache_memory_usage(struct drgn_dwarf_info_cache *dicache,
+				   struct drgn_program_memory_usage *usage);
+
 /** @ref drgn_type_find_fn() that uses DWARF debugging information. */
 struct drgn_error *drgn_dwarf_type_find(enum drgn_type_kind kind,
 					const char *name, size_t name_len,
@@ -163,6 +163,13 @@ bool hash_table_empty(struct hash_table *table);
  */
 size_t hash_table_size(struct hash_table *table);
 
+/**
+ * Return the number of bytes allocated by a @ref hash_table.
+ *
+ * This does not include memory referenced by the entries. This is O(1).
+ */
+size_t hash_table_memory_usage(struct hash_table *table);
+
 /**
  * Delete all entries in a @ref hash_table.
  *
@@ -750,6 +757,15 @@ static size_t table##_max_size(struct table *table)				\
 }										\
 										\
 __attribute__((unused))								\
+static size_t table##_memory_usage(struct table *table)				\
+{										\
+	if (table->chunks == hash_table_empty_chunk)				\
+		return 0;							\
+	return table##_alloc_size(table->chunk_mask + 1,			\
+				  table##_max_size(table));			\
+}										\
+										\
+__attribute__((unused))								\
 static bool table##_reserve(struct table *table, size_t capacity)		\
 {										\
 	if (table->size > capacity)						\
@@ -16,6 +16,7 @@
 #include <stdbool.h>
 #include <stdint.h>
 #include <stdlib.h>
+#include <time.h>
 #include <elfutils/libdw.h>
 #include <elfutils/version.h>
 
@@ -176,6 +177,15 @@ static inline void *malloc64(uint64_t size)
 	return malloc(size);
 }
 
+/** Return the current value of the monotonic clock in nanoseconds. */
+static inline uint64_t monotonic_time_ns(void)
+{
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return (uint64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+}
+
 struct drgn_error *open_elf_file(const char *path, int *fd_ret, Elf **elf_ret);
 
 struct drgn_error *find_elf_file(char **path_ret, int *fd_ret, Elf **elf_ret,
@@ -0,0 +1,586 @@
+// Copyright 2019 - Omar Sandoval
+// SPDX-License-Identifier: GPL-3.0+
+
+#include <ctype.h>
+#include <errno.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "internal.h"
+#include "kallsyms.h"
+#include "program.h"
+#include "read.h"
+#include "string_builder.h"
+#include "symbol.h"
+#include "vector.h"
+
+DEFINE_VECTOR(kallsyms_entry_vector, struct drgn_symbol_table_entry)
+DEFINE_VECTOR(kallsyms_name_offset_vector, size_t)
+
+/*
+ * Symbols being loaded from kallsyms. The names are appended to a single
+ * string, so entries store their offset in the string until it is finalized.
+ */
+struct kallsyms_builder {
+	struct kallsyms_entry_vector entries;
+	struct kallsyms_name_offset_vector name_offsets;
+	struct string_builder strtab;
+};
+
+static void kallsyms_builder_init(struct kallsyms_builder *builder)
+{
+	kallsyms_entry_vector_init(&builder->entries);
+	kallsyms_name_offset_vector_init(&builder->name_offsets);
+	builder->strtab = (struct string_builder){};
+}
+
+static void kallsyms_builder_deinit(struct kallsyms_builder *builder)
+{
+	free(builder->strtab.str);
+	kallsyms_name_offset_vector_deinit(&builder->name_offsets);
+	kallsyms_entry_vector_deinit(&builder->entries);
+}
+
+/* Add a symbol. The address may be filled in later. */
+static struct drgn_error *
+kallsyms_builder_add(struct kallsyms_builder *builder, char type,
+		     const char *name, size_t name_len, uint64_t address)
+{
+	struct drgn_symbol_table_entry *entry;
+	size_t *name_offset;
+
+	entry = kallsyms_entry_vector_append_entry(&builder->entries);
+	if (!entry)
+		return &drgn_enomem;
+	name_offset =
+		kallsyms_name_offset_vector_append_entry(&builder->name_offsets);
+	if (!name_offset) {
+		builder->entries.size--;
+		return &drgn_enomem;
+	}
+	*name_offset = builder->strtab.len;
+	if (!string_builder_appendn(&builder->strtab, name, name_len) ||
+	    !string_builder_appendc(&builder->strtab, '\0')) {
+		builder->name_offsets.size--;
+		builder->entries.size--;
+		return &drgn_enomem;
+	}
+	entry->address = address;
+	entry->size = 0;
+	/*
+	 * The type is the same character as printed by nm(1): weak symbols are
+	 * 'v', 'V', 'w', or 'W', other global symbols are uppercase or 'u', and
+	 * local symbols are lowercase.
+	 */
+	if (type == 'v' || type == 'V' || type == 'w' || type == 'W')
+		entry->binding_rank = 1;
+	else if (isupper((unsigned char)type) || type == 'u')
+		entry->binding_rank = 0;
+	else
+		entry->binding_rank = 2;
+	return NULL;
+}
+
+/*
+ * Sort the symbols, guess their sizes, and hand them off to the symbol table.
+ */
+static struct drgn_error *
+kallsyms_builder_finish(struct kallsyms_builder *builder,
+			struct drgn_symbol_table *symtab)
+{
+	struct drgn_symbol_table_entry *entries = builder->entries.data;
+	size_t num_entries = builder->entries.size;
+	size_t strtab_size = builder->strtab.len;
+	char *strtab;
+	size_t i, j;
+
+	if (!string_builder_finalize(&builder->strtab, &strtab))
+		return &drgn_enomem;
+	builder->strtab = (struct string_builder){};
+	for (i = 0; i < num_entries; i++)
+		entries[i].name = strtab + builder->name_offsets.data[i];
+
+	qsort(entries, num_entries, sizeof(entries[0]),
+	      drgn_symbol_table_entry_cmp);
+	/*
+	 * kallsyms doesn't record symbol sizes, so assume that each symbol
+	 * extends to the next address with a symbol. The last symbol is left
+	 * without a size.
+	 */
+	for (i = 0, j = 0; i < num_entries; i++) {
+		uint64_t address = entries[i].address;
+
+		while (j < num_entries && entries[j].address <= address)
+			j++;
+		if (j < num_entries)
+			entries[i].size = entries[j].address - address;
+	}
+
+	kallsyms_entry_vector_shrink_to_fit(&builder->entries);
+	drgn_symbol_table_set_kallsyms(symtab, builder->entries.data,
+				       num_entries, strtab, strtab_size);
+	kallsyms_entry_vector_init(&builder->entries);
+	return NULL;
+}
+
+/*
+ * Memory read from the kernel on demand. Reads are done in large chunks, unless
+ * the rest of the chunk isn't readable, in which case only the requested data
+ * is read.
+ */
+struct kallsyms_memory {
+	struct drgn_program *prog;
+	uint64_t address;
+	char *buf;
+	size_t size;
+	size_t capacity;
+};
+
+static void kallsyms_memory_init(struct kallsyms_memory *mem,
+				 struct drgn_program *prog, uint64_t address)
+{
+	mem->prog = prog;
+	mem->address = address;
+	mem->buf = NULL;
+	mem->size = 0;
+	mem->capacity = 0;
+}
+
+static void kallsyms_memory_deinit(struct kallsyms_memory *mem)
+{
+	free(mem->buf);
+}
+
+/* Make sure that at least the first size bytes have been read. */
+static struct drgn_error *kallsyms_memory_ensure(struct kallsyms_memory *mem,
+						 size_t size)
+{
+	static const size_t chunk_size = 1024 * 1024;
+	struct drgn_error *err;
+	size_t new_size;
+
+	if (size <= mem->size)
+		return NULL;
+
+	new_size = max(size, mem->size + chunk_size);
+	if (new_size > mem->capacity) {
+		char *tmp;
+
+		tmp = realloc(mem->buf, new_size);
+		if (!tmp)
+			return &drgn_enomem;
+		mem->buf = tmp;
+		mem->capacity = new_size;
+	}
+	err = drgn_memory_reader_read(&mem->prog->reader,
+				      mem->buf + mem->size,
+				      mem->address + mem->size,
+				      new_size - mem->size, false);
+	if (err && err->code == DRGN_ERROR_FAULT && new_size > size) {
+		drgn_error_destroy(err);
+		new_size = size;
+		err = drgn_memory_reader_read(&mem->prog->reader,
+					      mem->buf + mem->size,
+					      mem->address + mem->size,
+					      new_size - mem->size, false);
+	}
+	if (err)
+		return err;
+	mem->size = new_size;
+	return NULL;
+}
+
+static inline bool kallsyms_bswap(struct drgn_program *prog)
+{
+	return (drgn_program_is_little_endian(prog) !=
+		(__BYTE_ORDER__ == __ORDER_LITTLE_ENDIAN__));
+}
+
+static struct drgn_error *kallsyms_read_u32(struct drgn_program *prog,
+					    uint64_t address, uint32_t *ret)
+{
+	struct drgn_error *err;
+	char buf[4];
+	const char *ptr = buf;
+
+	err = drgn_memory_reader_read(&prog->reader, buf, address, sizeof(buf),
+				      false);
+	if (err)
+		return err;
+	read_u32_nocheck(&ptr, kallsyms_bswap(prog), ret);
+	return NULL;
+}
+
+static struct drgn_error *kallsyms_read_word(struct drgn_program *prog,
+					     uint64_t address, uint64_t *ret)
+{
+	struct drgn_error *err;
+	char buf[8];
+	const char *ptr = buf;
+
+	if (drgn_program_is_64_bit(prog)) {
+		err = drgn_memory_reader_read(&prog->reader, buf, address, 8,
+					      false);
+		if (err)
+			return err;
+		read_u64_nocheck(&ptr, kallsyms_bswap(prog), ret);
+	} else {
+		err = drgn_memory_reader_read(&prog->reader, buf, address, 4,
+					      false);
+		if (err)
+			return err;
+		read_u32_into_u64_nocheck(&ptr, kallsyms_bswap(prog), ret);
+	}
+	return NULL;
+}
+
+static struct drgn_error *kallsyms_corrupt(const char *what)
+{
+	return drgn_error_format(DRGN_ERROR_OTHER, "kallsyms %s is invalid",
+				 what);
+}
+
+/*
+ * The token table is 256 null-terminated strings, and the token index is the
+ * offset of each one in the table.
+ */
+static struct drgn_error *
+kallsyms_read_tokens(struct drgn_program *prog,
+		     const struct kallsyms_locations *loc,
+		     struct kallsyms_memory *token_table,
+		     const char *tokens[256], uint8_t token_lens[256])
+{
+	struct drgn_error *err;
+	char index_buf[256 * 2];
+	const char *ptr = index_buf;
+	bool bswap = kallsyms_bswap(prog);
+	uint16_t offsets[256];
+	size_t max_offset = 0;
+	const char *nul;
+	int i;
+
+	err = drgn_memory_reader_read(&prog->reader, index_buf,
+				      loc->kallsyms_token_index,
+				      sizeof(index_buf), false);
+	if (err)
+		return err;
+	for (i = 0; i < 256; i++) {
+		read_u16_nocheck(&ptr, bswap, &offsets[i]);
+		max_offset = max(max_offset, (size_t)offsets[i]);
+	}
+
+	/* Read through the end of the last token. */
+	err = kallsyms_memory_ensure(token_table, max_offset + 1);
+	if (err)
+		return err;
+	while (!(nul = memchr(token_table->buf + max_offset, '\0',
+			      token_table->size - max_offset))) {
+		if (token_table->size - max_offset > UINT8_MAX)
+			return kallsyms_corrupt("token table");
+		err = kallsyms_memory_ensure(token_table,
+					     token_table->size + 1);
+		if (err)
+			return err;
+	}
+
+	for (i = 0; i < 256; i++) {
+		size_t len;
+
+		tokens[i] = token_table->buf + offsets[i];
+		nul = memchr(tokens[i], '\0', token_table->size - offsets[i]);
+		len = nul - tokens[i];
+		if (len > UINT8_MAX)
+			return kallsyms_corrupt("token table");
+		token_lens[i] = len;
+	}
+	return NULL;
+}
+
+/*
+ * Fill in the addresses of the decoded symbols, which are in the order that
+ * the kernel stores them.
+ */
+static struct drgn_error *
+kallsyms_read_addresses(struct drgn_program *prog,
+			const struct kallsyms_locations *loc,
+			struct kallsyms_builder *builder, size_t stext_index)
+{
+	struct drgn_error *err;
+	struct drgn_symbol_table_entry *entries = builder->entries.data;
+	size_t num_syms = builder->entries.size;
+	bool bswap = kallsyms_bswap(prog);
+	size_t word_size = drgn_program_is_64_bit(prog) ? 8 : 4;
+	char *buf;
+	const char *ptr;
+	size_t i;
+
+	if (!loc->kallsyms_offsets && !loc->kallsyms_addresses)
+		return kallsyms_corrupt("address table");
+
+	if (loc->kallsyms_offsets) {
+		if (!loc->kallsyms_relative_base)
+			return kallsyms_corrupt("relative base");
+		buf = malloc_array(num_syms, 4);
+	} else {
+		buf = malloc_array(num_syms, word_size);
+	}
+	if (!buf)
+		return &drgn_enomem;
+
+	if (loc->kallsyms_offsets) {
+		uint64_t relative_base;
+		bool absolute_percpu;
+
+		err = kallsyms_read_word(prog, loc->kallsyms_relative_base,
+					 &relative_base);
+		if (err)
+			goto out;
+		err = drgn_memory_reader_read(&prog->reader, buf,
+					      loc->kallsyms_offsets,
+					      num_syms * 4, false);
+		if (err)
+			goto out;
+
+		/*
+		 * With CONFIG_KALLSYMS_ABSOLUTE_PERCPU, non-negative offsets
+		 * are absolute addresses (for per-CPU symbols), and negative
+		 * offsets are relative to the base. Otherwise, all offsets are
+		 * unsigned and relative to the base. The configuration isn't
+		 * recorded anywhere, so check which interpretation gets the
+		 * address of _stext right. If we don't know, assume the
+		 * latter, since newer kernels only support that.
+		 */
+		absolute_percpu = false;
+		if (loc->_stext && stext_index < num_syms) {
+			uint32_t offset;
+
+			ptr = buf + stext_index * 4;
+			read_u32_nocheck(&ptr, bswap, &offset);
+			absolute_percpu = (uint64_t)(relative_base + offset) !=
+					  loc->_stext;
+		}
+
+		ptr = buf;
+		for (i = 0; i < num_syms; i++) {
+			uint32_t offset;
+
+			read_u32_nocheck(&ptr, bswap, &offset);
+			if (!absolute_percpu)
+				entries[i].address = relative_base + offset;
+			else if ((int32_t)offset >= 0)
+				entries[i].address = (int32_t)offset;
+			else
+				entries[i].address = relative_base - 1 -
+						     (int32_t)offset;
+			if (word_size == 4)
+				entries[i].address &= UINT32_MAX;
+		}
+	} else {
+		err = drgn_memory_reader_read(&prog->reader, buf,
+					      loc->kallsyms_addresses,
+					      num_syms * word_size, false);
+		if (err)
+			goto out;
+		ptr = buf;
+		for (i = 0; i < num_syms; i++) {
+			if (word_size == 8) {
+				read_u64_nocheck(&ptr, bswap,
+						 &entries[i].address);
+			} else {
+				read_u32_into_u64_nocheck(&ptr, bswap,
+							  &entries[i].address);
+			}
+		}
+	}
+	err = NULL;
+out:
+	free(buf);
+	return err;
+}
+
+/*
+ * Decode the symbols from the kernel's compressed tables. Each entry in
+ * kallsyms_names is a length followed by that many indices into the token
+ * table. The expanded tokens are the symbol type followed by the name.
+ */
+static struct drgn_error *
+kallsyms_read_memory(struct drgn_program *prog,
+		     const struct kallsyms_locations *loc,
+		     struct kallsyms_builder *builder)
+{
+	struct drgn_error *err;
+	struct kallsyms_memory token_table, names;
+	const char *tokens[256];
+	uint8_t token_lens[256];
+	struct string_builder name = {};
+	uint32_t num_syms;
+	size_t stext_index = SIZE_MAX;
+	size_t pos = 0;
+	uint32_t i;
+
+	kallsyms_memory_init(&token_table, prog, loc->kallsyms_token_table);
+	kallsyms_memory_init(&names, prog, loc->kallsyms_names);
+
+	err = kallsyms_read_u32(prog, loc->kallsyms_num_syms, &num_syms);
+	if (err)
+		goto out;
+	err = kallsyms_read_tokens(prog, loc, &token_table, tokens,
+				   token_lens);
+	if (err)
+		goto out;
+
+	for (i = 0; i < num_syms; i++) {
+		size_t len, j;
+
+		err = kallsyms_memory_ensure(&names, pos + 1);
+		if (err)
+			goto out;
+		len = (uint8_t)names.buf[pos++];
+		/* Since Linux 6.1, long entries have a two byte length. */
+		if (len & 0x80) {
+			err = kallsyms_memory_ensure(&names, pos + 1);
+			if (err)
+				goto out;
+			len = ((len & 0x7f) |
+			       ((size_t)(uint8_t)names.buf[pos++] << 7));
+		}
+		err = kallsyms_memory_ensure(&names, pos + len);
+		if (err)
+			goto out;
+
+		name.len = 0;
+		for (j = 0; j < len; j++) {
+			uint8_t token = names.buf[pos + j];
+
+			if (!string_builder_appendn(&name, tokens[token],
+						    token_lens[token])) {
+				err = &drgn_enomem;
+				goto out;
+			}
+		}
+		pos += len;
+		if (name.len < 2) {
+			err = kallsyms_corrupt("name table");
+			goto out;
+		}
+
+		if (name.len - 1 == strlen("_stext") &&
+		    memcmp(name.str + 1, "_stext", name.len - 1) == 0)
+			stext_index = i;
+		err = kallsyms_builder_add(builder, name.str[0], name.str + 1,
+					   name.len - 1, 0);
+		if (err)
+			goto out;
+	}
+
+	err = kallsyms_read_addresses(prog, loc, builder, stext_index);
+out:
+	free(name.str);
+	kallsyms_memory_deinit(&names);
+	kallsyms_memory_deinit(&token_table);
+	return err;
+}
+
+/*
+ * Parse /proc/kallsyms. Each line is "address type name", optionally followed
+ * by "[module]".
+ */
+static struct drgn_error *kallsyms_read_proc(struct kallsyms_builder *builder)
+{
+	struct drgn_error *err;
+	FILE *file;
+	char *line = NULL;
+	size_t n = 0;
+	bool have_address = false;
+
+	file = fopen("/proc/kallsyms", "r");
+	if (!file)
+		return drgn_error_create_os("fopen", errno, "/proc/kallsyms");
+
+	for (;;) {
+		char *addr_str, *type_str, *sym_str, *saveptr, *end;
+		unsigned long long address;
+
+		errno = 0;
+		if (getline(&line, &n, file) == -1) {
+			if (errno) {
+				err = drgn_error_create_os("getline", errno,
+							   "/proc/kallsyms");
+			} else {
+				err = NULL;
+			}
+			break;
+		}
+
+		addr_str = strtok_r(line, "\t ", &saveptr);
+		if (!addr_str || !*addr_str)
+			goto invalid;
+		type_str = strtok_r(NULL, "\t ", &saveptr);
+		if (!type_str || strlen(type_str) != 1)
+			goto invalid;
+		sym_str = strtok_r(NULL, "\t\n ", &saveptr);
+		if (!sym_str)
+			goto invalid;
+
+		errno = 0;
+		address = strtoull(addr_str, &end, 16);
+		if (errno || *end) {
+invalid:
+			err = drgn_error_create(DRGN_ERROR_OTHER,
+						"could not parse /proc/kallsyms");
+			break;
+		}
+		if (address)
+			have_address = true;
+		err = kallsyms_builder_add(builder, type_str[0], sym_str,
+					   strlen(sym_str), address);
+		if (err)
+			break;
+	}
+	free(line);
+	fclose(file);
+	if (!err && !have_address) {
+		/* This happens if we're not allowed to see addresses. */
+		err = drgn_error_create(DRGN_ERROR_OTHER,
+					"/proc/kallsyms does not contain addresses; check kernel.kptr_restrict");
+	}
+	return err;
+}
+
+LIBDRGN_PUBLIC struct drgn_error *
+drgn_program_load_kallsyms(struct drgn_program *prog)
+{
+	struct drgn_error *err;
+	const struct kallsyms_locations *loc = &prog->vmcoreinfo.kallsyms;
+	struct kallsyms_builder builder;
+
+	if (!(prog->flags & DRGN_PROGRAM_IS_LINUX_KERNEL)) {
+		return drgn_error_create(DRGN_ERROR_INVALID_ARGUMENT,
+					 "kallsyms is only available for the Linux kernel");
+	}
+	/* Symbols that were already returned point to the old names. */
+	if (prog->symtab.kallsyms_strtab) {
+		return drgn_error_create(DRGN_ERROR_INVALID_ARGUMENT,
+					 "kallsyms was already loaded");
+	}
+
+	kallsyms_builder_init(&builder);
+	if (loc->kallsyms_names && loc->kallsyms_token_table &&
+	    loc->kallsyms_token_index && loc->kallsyms_num_syms) {
+		err = kallsyms_read_memory(prog, loc, &builder);
+	} else if (prog->flags & DRGN_PROGRAM_IS_LIVE) {
+		err = kallsyms_read_proc(&builder);
+	} else {
+		err = drgn_error_create(DRGN_ERROR_OTHER,
+					"VMCOREINFO does not contain kallsyms symbols");
+	}
+	if (!err) {
+		err = kallsyms_builder_finish(&builder, &prog->symtab);
+		/* Objects found from symbols may be found now. */
+		if (!err)
+			drgn_object_index_clear_lookups(&prog->oindex);
+	}
+	kallsyms_builder_deinit(&builder);
+	return err;
+}
@@ -0,0 +1,56 @@
+// Copyright 2019 - Omar Sandoval
+// SPDX-License-Identifier: GPL-3.0+
+
+/**
+ * @file
+ *
+ * Linux kernel kallsyms.
+ *
+ * See @ref KallsymsInternals.
+ */
+
+#ifndef DRGN_KALLSYMS_H
+#define DRGN_KALLSYMS_H
+
+#include <stdint.h>
+
+/**
+ * @ingroup Internals
+ *
+ * @defgroup KallsymsInternals Kallsyms
+ *
+ * Symbols from the Linux kernel's kallsyms.
+ *
+ * The kernel keeps a compressed table of its symbols in memory for itself. We
+ * can decode it to get symbols without any debugging information. The
+ * locations of the tables are in VMCOREINFO since Linux 6.0. For older live
+ * kernels, we fall back to parsing @c /proc/kallsyms.
+ *
+ * @{
+ */
+
+/**
+ * Addresses of the kernel's kallsyms tables, or zero for tables which are not
+ * known.
+ */
+struct kallsyms_locations {
+	uint64_t kallsyms_names;
+	uint64_t kallsyms_token_table;
+	uint64_t kallsyms_token_index;
+	uint64_t kallsyms_num_syms;
+	/** Only present if @c CONFIG_KALLSYMS_BASE_RELATIVE. */
+	uint64_t kallsyms_offsets;
+	/** Only present if @c CONFIG_KALLSYMS_BASE_RELATIVE. */
+	uint64_t kallsyms_relative_base;
+	/** Only present if not @c CONFIG_KALLSYMS_BASE_RELATIVE. */
+	uint64_t kallsyms_addresses;
+	/**
+	 * Address of @c _stext. This is used to determine whether @c
+	 * CONFIG_KALLSYMS_ABSOLUTE_PERCPU is enabled.
+	 */
+	uint64_t _stext;
+};
+
+/** @} */
+
+#endif /* DRGN_KALLSYMS_H */
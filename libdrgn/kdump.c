@@ -2,6 +2,7 @@
 // SPDX-License-Identifier: GPL-3.0+
 
 #include <fcntl.h>
+#include <pthread.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
@@ -49,20 +50,26 @@ static struct drgn_error *drgn_platform_from_kdump(kdump_ctx_t *ctx,
 	return NULL;
 }
 
+/* A libkdumpfile context may not be used from multiple threads at once. */
+static pthread_mutex_t kdump_lock = PTHREAD_MUTEX_INITIALIZER;
+
 static struct drgn_error *drgn_read_kdump(void *buf, uint64_t address,
 					  size_t count, uint64_t offset,
 					  void *arg, bool physical)
 {
+	struct drgn_error *err = NULL;
 	kdump_ctx_t *ctx = arg;
 	kdump_status ks;
 
+	pthread_mutex_lock(&kdump_lock);
 	ks = kdump_read(ctx, physical ? KDUMP_KPHYSADDR : KDUMP_KVADDR, address,
 			buf, &count);
 	if (ks != KDUMP_OK) {
-		return drgn_error_format(DRGN_ERROR_FAULT, "kdump_read: %s",
-					 kdump_get_err(ctx));
+		err = drgn_error_format(DRGN_ERROR_FAULT, "kdump_read: %s",
+					kdump_get_err(ctx));
 	}
-	return NULL;
+	pthread_mutex_unlock(&kdump_lock);
+	return err;
 }
 
 struct drgn_error *drgn_program_set_kdump(struct drgn_program *prog)
@@ -117,6 +124,8 @@ struct drgn_error *drgn_program_set_kdump(struct drgn_program *prog)
 		goto err;
 	err = drgn_program_add_memory_segment(prog, 0, UINT64_MAX,
 					      drgn_read_kdump, ctx, true);
+	if (!err)
+		err = drgn_memory_reader_freeze(&prog->reader);
 	if (err) {
 		drgn_memory_reader_deinit(&prog->reader);
 		drgn_memory_reader_init(&prog->reader);
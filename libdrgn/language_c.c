@@ -848,6 +848,20 @@ c_pretty_print_character(unsigned char c, struct string_builder *sb)
 	return ret ? NULL : &drgn_enomem;
 }
 
+static struct drgn_error *c_pretty_print_string_chunk(const char *chunk,
+						       size_t len, void *arg)
+{
+	struct drgn_error *err;
+	size_t i;
+
+	for (i = 0; i < len; i++) {
+		err = c_pretty_print_character(chunk[i], arg);
+		if (err)
+			return err;
+	}
+	return NULL;
+}
+
 static struct drgn_error *
 c_pretty_print_string(struct drgn_memory_reader *reader, uint64_t address,
 		      uint64_t length, struct string_builder *sb)
@@ -856,22 +870,10 @@ c_pretty_print_string(struct drgn_memory_reader *reader, uint64_t address,
 
 	if (!string_builder_appendc(sb, '"'))
 		return &drgn_enomem;
-	while (length) {
-		unsigned char c;
-
-		err = drgn_memory_reader_read(reader, &c, address++, 1, false);
-		if (err)
-			return err;
-
-		if (c == '\0') {
-			break;
-		} else {
-			err = c_pretty_print_character(c, sb);
-			if (err)
-				return err;
-		}
-		length--;
-	}
+	err = drgn_memory_reader_read_c_string(reader, address, false, length,
+					       c_pretty_print_string_chunk, sb);
+	if (err)
+		return err;
 	if (!string_builder_appendc(sb, '"'))
 		return &drgn_enomem;
 	return NULL;
@@ -5,6 +5,7 @@
 #include <errno.h>
 #include <fcntl.h>
 #include <inttypes.h>
+#include <stddef.h>
 #include <stdlib.h>
 #include <string.h>
 #include <unistd.h>
@@ -49,6 +50,38 @@ static struct drgn_error *line_to_u64(const char *line, const char *newline,
 	return NULL;
 }
 
+static struct drgn_error *
+parse_vmcoreinfo_symbol(const char *line, const char *newline,
+			struct kallsyms_locations *ret)
+{
+	static const struct {
+		const char *name;
+		size_t offset;
+	} symbols[] = {
+#define X(name) { #name ")=", offsetof(struct kallsyms_locations, name) }
+		X(kallsyms_names),
+		X(kallsyms_token_table),
+		X(kallsyms_token_index),
+		X(kallsyms_num_syms),
+		X(kallsyms_offsets),
+		X(kallsyms_relative_base),
+		X(kallsyms_addresses),
+		X(_stext),
+#undef X
+	};
+	size_t i;
+
+	for (i = 0; i < ARRAY_SIZE(symbols); i++) {
+		if (linematch(&line, symbols[i].name)) {
+			return line_to_u64(line, newline, 16,
+					   (uint64_t *)((char *)ret +
+							symbols[i].offset));
+		}
+	}
+	/* We don't care about other symbols. */
+	return NULL;
+}
+
 struct drgn_error *parse_vmcoreinfo(const char *desc, size_t descsz,
 				    struct vmcoreinfo *ret)
 {
@@ -58,6 +91,7 @@ struct drgn_error *parse_vmcoreinfo(const char *desc, size_t descsz,
 	ret->osrelease[0] = '\0';
 	ret->page_size = 0;
 	ret->kaslr_offset = 0;
+	memset(&ret->kallsyms, 0, sizeof(ret->kallsyms));
 	while (line < end) {
 		const char *newline;
 
@@ -82,6 +116,11 @@ struct drgn_error *parse_vmcoreinfo(const char *desc, size_t descsz,
 					  &ret->kaslr_offset);
 			if (err)
 				return err;
+		} else if (linematch(&line, "SYMBOL(")) {
+			err = parse_vmcoreinfo_symbol(line, newline,
+						      &ret->kallsyms);
+			if (err)
+				return err;
 		}
 		line = newline + 1;
 	}
@@ -1041,7 +1080,7 @@ static struct drgn_error *
 report_loaded_kernel_module(struct drgn_program *prog,
 			    struct drgn_dwarf_index *dindex,
 			    struct kernel_module_iterator *kmod_it,
-			    struct kernel_module_table *kmod_table)
+			    struct kernel_module_table *kmod_table, bool lazy)
 {
 	struct drgn_error *err;
 	const char *name = kmod_it->name;
@@ -1073,7 +1112,7 @@ report_loaded_kernel_module(struct drgn_program *prog,
 
 		err = drgn_dwarf_index_report_elf(dindex, kmod->path, kmod->fd,
 						  kmod->elf, start, end,
-						  kmod->name, NULL);
+						  kmod->name, lazy, NULL);
 		kmod->elf = NULL;
 		kmod->fd = -1;
 		if (err)
@@ -1140,8 +1179,14 @@ report_default_kernel_module(struct drgn_program *prog,
 						     err);
 	}
 
+	/*
+	 * Indexing every loaded module is slow, and most of them are usually
+	 * never needed, so optionally defer indexing modules that weren't
+	 * explicitly requested until a lookup misses in the index.
+	 */
 	err = drgn_dwarf_index_report_elf(dindex, path, fd, elf, start, end,
-					  kmod_it->name, NULL);
+					  kmod_it->name,
+					  prog->lazy_kernel_modules, NULL);
 	free(path);
 	return err;
 }
@@ -1150,7 +1195,7 @@ static struct drgn_error *
 report_loaded_kernel_modules(struct drgn_program *prog,
 			     struct drgn_dwarf_index *dindex,
 			     struct kernel_module_table *kmod_table,
-			     struct depmod_index *depmod)
+			     struct depmod_index *depmod, bool lazy)
 {
 	struct drgn_error *err;
 	struct kernel_module_iterator kmod_it;
@@ -1175,7 +1220,8 @@ kernel_module_iterator_error:
 		/* Look for an explicitly-reported file first. */
 		if (kmod_table) {
 			err = report_loaded_kernel_module(prog, dindex,
-							  &kmod_it, kmod_table);
+							  &kmod_it, kmod_table,
+							  lazy);
 			if (!err)
 				continue;
 			else if (err != &drgn_not_found)
@@ -1219,7 +1265,7 @@ report_kernel_modules(struct drgn_program *prog,
 		      struct drgn_dwarf_index *dindex,
 		      struct kernel_module_file *kmods, size_t num_kmods,
 		      bool report_default, bool need_module_definition,
-		      bool vmlinux_is_pending)
+		      bool vmlinux_is_pending, bool lazy)
 {
 	struct drgn_error *err;
 	struct kernel_module_table kmod_table;
@@ -1312,7 +1358,8 @@ report_kernel_modules(struct drgn_program *prog,
 
 	err = report_loaded_kernel_modules(prog, dindex,
 					   num_kmods ? &kmod_table : NULL,
-					   report_default ? &depmod : NULL);
+					   report_default ? &depmod : NULL,
+					   lazy);
 	if (err)
 		goto out;
 
@@ -1325,7 +1372,7 @@ report_kernel_modules(struct drgn_program *prog,
 			err = drgn_dwarf_index_report_elf(dindex, kmod->path,
 							  kmod->fd, kmod->elf,
 							  0, 0, kmod->name,
-							  NULL);
+							  lazy, NULL);
 			kmod->elf = NULL;
 			kmod->fd = -1;
 			if (err)
@@ -1387,7 +1434,7 @@ report_default_vmlinux(struct drgn_program *prog,
 	}
 
 	err = drgn_dwarf_index_report_elf(dindex, path, fd, elf, start, end,
-					  "kernel", vmlinux_is_pending);
+					  "kernel", false, vmlinux_is_pending);
 	free(path);
 	return err;
 }
@@ -1396,7 +1443,7 @@ struct drgn_error *
 linux_kernel_report_debug_info(struct drgn_program *prog,
 			       struct drgn_dwarf_index *dindex,
 			       const char **paths, size_t n,
-			       bool report_default)
+			       bool report_default, bool lazy)
 {
 	struct drgn_error *err;
 	struct kernel_module_file *kmods;
@@ -1405,9 +1452,9 @@ linux_kernel_report_debug_info(struct drgn_program *prog,
 	bool vmlinux_is_pending = false;
 
 	if (report_default && !prog->added_vmcoreinfo_object_finder) {
-		err = drgn_program_add_object_finder(prog,
-						     vmcoreinfo_object_find,
-						     prog);
+		err = drgn_object_index_add_finder(&prog->oindex,
+						   vmcoreinfo_object_find,
+						   prog, true);
 		if (err)
 			return err;
 		prog->added_vmcoreinfo_object_finder = true;
@@ -1493,14 +1540,15 @@ linux_kernel_report_debug_info(struct drgn_program *prog,
 
 			err = drgn_dwarf_index_report_elf(dindex, path, fd, elf,
 							  start, end, "kernel",
-							  &is_new);
+							  false, &is_new);
 			if (err)
 				goto out;
 			if (is_new)
 				vmlinux_is_pending = true;
 		} else {
 			err = drgn_dwarf_index_report_elf(dindex, path, fd, elf,
-							  0, 0, NULL, NULL);
+							  0, 0, NULL, lazy,
+							  NULL);
 			if (err)
 				goto out;
 		}
@@ -1515,7 +1563,7 @@ linux_kernel_report_debug_info(struct drgn_program *prog,
 
 	err = report_kernel_modules(prog, dindex, kmods, num_kmods,
 				    report_default, need_module_definition,
-				    vmlinux_is_pending);
+				    vmlinux_is_pending, lazy);
 out:
 	for (i = 0; i < num_kmods; i++) {
 		elf_end(kmods[i].elf);
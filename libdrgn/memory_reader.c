@@ -2,6 +2,8 @@
 // SPDX-License-Identifier: GPL-3.0+
 
 #include <inttypes.h>
+#include <pthread.h>
+#include <stdlib.h>
 #include <string.h>
 #include <unistd.h>
 
@@ -10,11 +12,138 @@
 
 DEFINE_BINARY_SEARCH_TREE_FUNCTIONS(drgn_memory_segment_tree,
 				    binary_search_tree_scalar_cmp, splay)
+DEFINE_HASH_TABLE_FUNCTIONS(drgn_memory_cache_block_map, hash_pair_int_type,
+			    hash_table_scalar_eq)
+
+static void drgn_memory_cache_init(struct drgn_memory_cache *cache)
+{
+	drgn_memory_cache_block_map_init(&cache->blocks);
+	cache->newest = cache->oldest = NULL;
+}
+
+static void drgn_memory_cache_clear(struct drgn_memory_cache *cache)
+{
+	struct drgn_memory_cache_block *block = cache->newest;
+
+	while (block) {
+		struct drgn_memory_cache_block *next = block->older;
+
+		free(block);
+		block = next;
+	}
+	drgn_memory_cache_block_map_clear(&cache->blocks);
+	cache->newest = cache->oldest = NULL;
+}
+
+static void drgn_memory_cache_deinit(struct drgn_memory_cache *cache)
+{
+	drgn_memory_cache_clear(cache);
+	drgn_memory_cache_block_map_deinit(&cache->blocks);
+}
+
+static void drgn_memory_cache_unlink(struct drgn_memory_cache *cache,
+				     struct drgn_memory_cache_block *block)
+{
+	if (block->newer)
+		block->newer->older = block->older;
+	else
+		cache->newest = block->older;
+	if (block->older)
+		block->older->newer = block->newer;
+	else
+		cache->oldest = block->newer;
+}
+
+static void drgn_memory_cache_push(struct drgn_memory_cache *cache,
+				   struct drgn_memory_cache_block *block)
+{
+	block->newer = NULL;
+	block->older = cache->newest;
+	if (cache->newest)
+		cache->newest->newer = block;
+	else
+		cache->oldest = block;
+	cache->newest = block;
+}
+
+/*
+ * Build the index for a segment tree. The caller must hold the reader lock for
+ * reading and the index lock.
+ */
+static struct drgn_error *
+drgn_memory_segment_index_build(struct drgn_memory_segment_tree *tree,
+				struct drgn_memory_segment_index **ret)
+{
+	struct drgn_memory_segment_tree_iterator it;
+	struct drgn_memory_segment_index *index;
+	size_t num_segments = 0;
+
+	for (it = drgn_memory_segment_tree_first(tree); it.entry;
+	     it = drgn_memory_segment_tree_next(it))
+		num_segments++;
+	if (num_segments > (SIZE_MAX - sizeof(*index)) /
+	    sizeof(index->segments[0]))
+		return &drgn_enomem;
+	index = malloc(sizeof(*index) +
+		       num_segments * sizeof(index->segments[0]));
+	if (!index)
+		return &drgn_enomem;
+	num_segments = 0;
+	for (it = drgn_memory_segment_tree_first(tree); it.entry;
+	     it = drgn_memory_segment_tree_next(it))
+		index->segments[num_segments++] = it.entry;
+	index->num_segments = num_segments;
+	/* Pairs with the acquire in drgn_memory_reader_get_index(). */
+	__atomic_store_n(ret, index, __ATOMIC_RELEASE);
+	return NULL;
+}
+
+/*
+ * Get the index for an address space, building it if necessary. The caller
+ * must hold the reader lock for reading.
+ */
+static struct drgn_error *
+drgn_memory_reader_get_index(struct drgn_memory_reader *reader, bool physical,
+			     struct drgn_memory_segment_index **ret)
+{
+	struct drgn_error *err;
+	struct drgn_memory_segment_index **indexp = (physical ?
+						     &reader->physical_index :
+						     &reader->virtual_index);
+
+	*ret = __atomic_load_n(indexp, __ATOMIC_ACQUIRE);
+	if (*ret)
+		return NULL;
+	pthread_mutex_lock(&reader->index_lock);
+	*ret = *indexp;
+	if (*ret) {
+		err = NULL;
+	} else {
+		err = drgn_memory_segment_index_build(physical ?
+						      &reader->physical_segments :
+						      &reader->virtual_segments,
+						      indexp);
+		*ret = *indexp;
+	}
+	pthread_mutex_unlock(&reader->index_lock);
+	return err;
+}
 
 void drgn_memory_reader_init(struct drgn_memory_reader *reader)
 {
 	drgn_memory_segment_tree_init(&reader->virtual_segments);
 	drgn_memory_segment_tree_init(&reader->physical_segments);
+	reader->virtual_index = NULL;
+	reader->physical_index = NULL;
+	pthread_rwlock_init(&reader->lock, NULL);
+	pthread_mutex_init(&reader->index_lock, NULL);
+	pthread_mutex_init(&reader->cache_lock, NULL);
+	drgn_memory_cache_init(&reader->virtual_cache);
+	drgn_memory_cache_init(&reader->physical_cache);
+	reader->cache_block_size = 0;
+	reader->cache_max_blocks = 0;
+	reader->cache_num_blocks = 0;
+	reader->cache_max_age = 0;
 }
 
 static void free_memory_segment_tree(struct drgn_memory_segment_tree *tree)
@@ -32,21 +161,150 @@ static void free_memory_segment_tree(struct drgn_memory_segment_tree *tree)
 
 void drgn_memory_reader_deinit(struct drgn_memory_reader *reader)
 {
+	drgn_memory_cache_deinit(&reader->physical_cache);
+	drgn_memory_cache_deinit(&reader->virtual_cache);
+	free(reader->physical_index);
+	free(reader->virtual_index);
 	free_memory_segment_tree(&reader->physical_segments);
 	free_memory_segment_tree(&reader->virtual_segments);
+	pthread_mutex_destroy(&reader->cache_lock);
+	pthread_mutex_destroy(&reader->index_lock);
+	pthread_rwlock_destroy(&reader->lock);
+}
+
+struct drgn_error *drgn_memory_reader_freeze(struct drgn_memory_reader *reader)
+{
+	struct drgn_error *err;
+	struct drgn_memory_segment_index *index;
+
+	pthread_rwlock_rdlock(&reader->lock);
+	err = drgn_memory_reader_get_index(reader, false, &index);
+	if (!err)
+		err = drgn_memory_reader_get_index(reader, true, &index);
+	pthread_rwlock_unlock(&reader->lock);
+	return err;
+}
+
+/*
+ * Index of the segment which the last lookup in each address space on this
+ * thread found. Reads are often sequential or clustered, so this usually lets
+ * us skip the binary search. It is only a hint, so it is checked against the
+ * current index before it is used.
+ */
+static __thread size_t segment_hint[2];
+
+/*
+ * Find the segment containing the given address. The caller must hold the
+ * reader lock for reading.
+ */
+static struct drgn_error *
+drgn_memory_reader_find_segment(struct drgn_memory_reader *reader,
+				uint64_t address, bool physical,
+				struct drgn_memory_segment **ret)
+{
+	struct drgn_error *err;
+	struct drgn_memory_segment_index *index;
+	struct drgn_memory_segment *segment;
+	size_t lo, hi, hint;
+
+	err = drgn_memory_reader_get_index(reader, physical, &index);
+	if (err)
+		return err;
+
+	hint = segment_hint[physical];
+	if (hint < index->num_segments) {
+		segment = index->segments[hint];
+		if (address >= segment->address) {
+			if (address - segment->address < segment->size)
+				goto found;
+			/* Try the next segment for sequential reads. */
+			if (hint + 1 < index->num_segments) {
+				segment = index->segments[hint + 1];
+				if (address >= segment->address &&
+				    address - segment->address < segment->size) {
+					segment_hint[physical] = hint + 1;
+					goto found;
+				}
+			}
+		}
+	}
+
+	/* Find the last segment with address <= the given address. */
+	lo = 0;
+	hi = index->num_segments;
+	while (lo < hi) {
+		size_t mid = lo + (hi - lo) / 2;
+
+		if (index->segments[mid]->address <= address)
+			lo = mid + 1;
+		else
+			hi = mid;
+	}
+	if (lo == 0)
+		goto not_found;
+	segment = index->segments[lo - 1];
+	if (address - segment->address >= segment->size)
+		goto not_found;
+	segment_hint[physical] = lo - 1;
+found:
+	*ret = segment;
+	return NULL;
+
+not_found:
+	return drgn_error_format(DRGN_ERROR_FAULT,
+				 "could not find memory segment containing 0x%" PRIx64,
+				 address);
 }
 
 bool drgn_memory_reader_empty(struct drgn_memory_reader *reader)
 {
-	return (drgn_memory_segment_tree_empty(&reader->virtual_segments) &&
-		drgn_memory_segment_tree_empty(&reader->physical_segments));
+	bool ret;
+
+	pthread_rwlock_rdlock(&reader->lock);
+	ret = (drgn_memory_segment_tree_empty(&reader->virtual_segments) &&
+	       drgn_memory_segment_tree_empty(&reader->physical_segments));
+	pthread_rwlock_unlock(&reader->lock);
+	return ret;
 }
 
-struct drgn_error *
-drgn_memory_reader_add_segment(struct drgn_memory_reader *reader,
-			       uint64_t address, uint64_t size,
-			       drgn_memory_read_fn read_fn, void *arg,
-			       bool physical)
+/* The caller must hold the reader lock for writing. */
+static void drgn_memory_reader_flush_cache_locked(struct drgn_memory_reader *reader)
+{
+	drgn_memory_cache_clear(&reader->virtual_cache);
+	drgn_memory_cache_clear(&reader->physical_cache);
+	reader->cache_num_blocks = 0;
+}
+
+void drgn_memory_reader_flush_cache(struct drgn_memory_reader *reader)
+{
+	pthread_rwlock_wrlock(&reader->lock);
+	drgn_memory_reader_flush_cache_locked(reader);
+	pthread_rwlock_unlock(&reader->lock);
+}
+
+void drgn_memory_reader_set_cache(struct drgn_memory_reader *reader,
+				  size_t size, uint64_t block_size,
+				  uint64_t max_age)
+{
+	pthread_rwlock_wrlock(&reader->lock);
+	drgn_memory_reader_flush_cache_locked(reader);
+	if (size < block_size) {
+		reader->cache_block_size = 0;
+		reader->cache_max_blocks = 0;
+		reader->cache_max_age = 0;
+	} else {
+		reader->cache_block_size = block_size;
+		reader->cache_max_blocks = size / block_size;
+		reader->cache_max_age = max_age;
+	}
+	pthread_rwlock_unlock(&reader->lock);
+}
+
+static struct drgn_error *
+drgn_memory_reader_add_segment_locked(struct drgn_memory_reader *reader,
+				      uint64_t address, uint64_t size,
+				      drgn_memory_read_fn read_fn, void *arg,
+				      bool physical)
 {
 	struct drgn_memory_segment_tree *tree = (physical ?
 						 &reader->physical_segments :
@@ -64,6 +322,20 @@ drgn_memory_reader_add_segment(struct drgn_memory_reader *reader,
 					 "memory segment end is too large");
 	}
 
+	/* Cached blocks may have been read from the segments we're replacing. */
+	drgn_memory_reader_flush_cache_locked(reader);
+	/*
+	 * The index may point to segments which are about to be freed, so it
+	 * must be rebuilt.
+	 */
+	if (physical) {
+		free(reader->physical_index);
+		reader->physical_index = NULL;
+	} else {
+		free(reader->virtual_index);
+		reader->virtual_index = NULL;
+	}
+
 	/*
 	 * This is split into two steps: the first step handles an overlapping
 	 * segment with address <= new address, and the second step handles
@@ -223,13 +495,26 @@ insert:
 	return NULL;
 }
 
-struct drgn_error *drgn_memory_reader_read(struct drgn_memory_reader *reader,
-					   void *buf, uint64_t address,
-					   size_t count, bool physical)
+struct drgn_error *
+drgn_memory_reader_add_segment(struct drgn_memory_reader *reader,
+			       uint64_t address, uint64_t size,
+			       drgn_memory_read_fn read_fn, void *arg,
+			       bool physical)
+{
+	struct drgn_error *err;
+
+	pthread_rwlock_wrlock(&reader->lock);
+	err = drgn_memory_reader_add_segment_locked(reader, address, size,
+						    read_fn, arg, physical);
+	pthread_rwlock_unlock(&reader->lock);
+	return err;
+}
+
+static struct drgn_error *
+drgn_memory_reader_read_uncached(struct drgn_memory_reader *reader,
+				 void *buf, uint64_t address, size_t count,
+				 bool physical)
 {
-	struct drgn_memory_segment_tree *tree = (physical ?
-						 &reader->physical_segments :
-						 &reader->virtual_segments);
 	struct drgn_error *err;
 	size_t read = 0;
 
@@ -237,13 +522,10 @@ struct drgn_error *drgn_memory_reader_read(struct drgn_memory_reader *reader,
 		struct drgn_memory_segment *segment;
 		size_t n;
 
-		segment = drgn_memory_segment_tree_search_le(tree,
-							     &address).entry;
-		if (!segment || segment->address + segment->size <= address) {
-			return drgn_error_format(DRGN_ERROR_FAULT,
-						 "could not find memory segment containing 0x%" PRIx64,
-						 address);
-		}
+		err = drgn_memory_reader_find_segment(reader, address, physical,
+						      &segment);
+		if (err)
+			return err;
 
 		n = min(segment->address + segment->size - address,
 			(uint64_t)(count - read));
@@ -275,6 +557,11 @@ struct drgn_error *drgn_read_memory_file(void *buf, uint64_t address,
 	} else {
 		file_count = 0;
 	}
+	if (file_segment->map) {
+		memcpy(p, file_segment->map + offset, file_count);
+		p += file_count;
+		file_count = 0;
+	}
 	while (file_count) {
 		ssize_t ret;
 
@@ -294,3 +581,403 @@ struct drgn_error *drgn_read_memory_file(void *buf, uint64_t address,
 	memset(p, 0, count);
 	return NULL;
 }
+
+/*
+ * Copy part of the cached block at the given address, reading the block if it
+ * isn't cached or has expired. If the block isn't entirely readable, this
+ * returns an error with code DRGN_ERROR_FAULT and nothing is cached.
+ *
+ * The caller must hold the reader lock for reading. The cache lock is not held
+ * while the block is read so that read callbacks can block.
+ */
+static struct drgn_error *
+drgn_memory_reader_read_block(struct drgn_memory_reader *reader,
+			      struct drgn_memory_cache *cache, void *buf,
+			      uint64_t block_address, uint64_t block_offset,
+			      size_t count, bool physical)
+{
+	struct drgn_error *err;
+	struct hash_pair hp;
+	struct drgn_memory_cache_block_map_iterator it;
+	struct drgn_memory_cache_block *block, *old_block = NULL;
+	uint64_t now = reader->cache_max_age ? monotonic_time_ns() : 0;
+
+	hp = drgn_memory_cache_block_map_hash(&block_address);
+	pthread_mutex_lock(&reader->cache_lock);
+	it = drgn_memory_cache_block_map_search_hashed(&cache->blocks,
+						       &block_address, hp);
+	if (it.entry &&
+	    (!reader->cache_max_age ||
+	     now - it.entry->value->timestamp < reader->cache_max_age)) {
+		block = it.entry->value;
+		drgn_memory_cache_unlink(cache, block);
+		goto out;
+	}
+	pthread_mutex_unlock(&reader->cache_lock);
+
+	block = malloc(sizeof(*block) + reader->cache_block_size);
+	if (!block)
+		return &drgn_enomem;
+	err = drgn_memory_reader_read_uncached(reader, block->data,
+					       block_address,
+					       reader->cache_block_size,
+					       physical);
+	if (err) {
+		free(block);
+		return err;
+	}
+	block->address = block_address;
+	block->timestamp = now;
+
+	/* Another thread may have changed the cache while we were reading. */
+	pthread_mutex_lock(&reader->cache_lock);
+	it = drgn_memory_cache_block_map_search_hashed(&cache->blocks,
+						       &block_address, hp);
+	if (it.entry) {
+		/* Replace the expired (or concurrently read) block. */
+		old_block = it.entry->value;
+		drgn_memory_cache_unlink(cache, old_block);
+		it.entry->value = block;
+	} else {
+		struct drgn_memory_cache_block_map_entry entry = {
+			.key = block_address,
+			.value = block,
+		};
+
+		if (reader->cache_num_blocks >= reader->cache_max_blocks) {
+			/*
+			 * Evict the least recently used block, preferably from
+			 * the same address space.
+			 */
+			struct drgn_memory_cache *victim_cache = cache;
+
+			if (!victim_cache->oldest) {
+				victim_cache = (cache == &reader->virtual_cache ?
+						&reader->physical_cache :
+						&reader->virtual_cache);
+			}
+			old_block = victim_cache->oldest;
+			drgn_memory_cache_unlink(victim_cache, old_block);
+			drgn_memory_cache_block_map_delete(&victim_cache->blocks,
+							   &old_block->address);
+			reader->cache_num_blocks--;
+		}
+		if (drgn_memory_cache_block_map_insert_hashed(&cache->blocks,
+							      &entry, hp,
+							      NULL) == -1) {
+			pthread_mutex_unlock(&reader->cache_lock);
+			free(old_block);
+			free(block);
+			return &drgn_enomem;
+		}
+		reader->cache_num_blocks++;
+	}
+out:
+	drgn_memory_cache_push(cache, block);
+	memcpy(buf, block->data + block_offset, count);
+	pthread_mutex_unlock(&reader->cache_lock);
+	free(old_block);
+	return NULL;
+}
+
+static struct drgn_error *
+drgn_memory_reader_read_locked(struct drgn_memory_reader *reader, void *buf,
+			       uint64_t address, size_t count, bool physical)
+{
+	struct drgn_memory_cache *cache = (physical ?
+					   &reader->physical_cache :
+					   &reader->virtual_cache);
+	uint64_t block_size = reader->cache_block_size;
+	char *p = buf;
+
+	/* Reads which would evict the entire cache bypass it. */
+	if (!reader->cache_max_blocks ||
+	    count / block_size >= reader->cache_max_blocks) {
+		return drgn_memory_reader_read_uncached(reader, buf, address,
+							count, physical);
+	}
+
+	while (count) {
+		struct drgn_error *err;
+		uint64_t block_address = address & ~(block_size - 1);
+		uint64_t block_offset = address - block_address;
+		size_t n = min(block_size - block_offset, (uint64_t)count);
+
+		err = drgn_memory_reader_read_block(reader, cache, p,
+						    block_address, block_offset,
+						    n, physical);
+		if (err) {
+			if (err->code != DRGN_ERROR_FAULT)
+				return err;
+			/*
+			 * The block straddles the end of the readable memory,
+			 * so only read the requested part.
+			 */
+			drgn_error_destroy(err);
+			err = drgn_memory_reader_read_uncached(reader, p, address,
+							       n, physical);
+			if (err)
+				return err;
+		}
+		p += n;
+		address += n;
+		count -= n;
+	}
+	return NULL;
+}
+
+struct drgn_error *drgn_memory_reader_read(struct drgn_memory_reader *reader,
+					   void *buf, uint64_t address,
+					   size_t count, bool physical)
+{
+	struct drgn_error *err;
+
+	pthread_rwlock_rdlock(&reader->lock);
+	err = drgn_memory_reader_read_locked(reader, buf, address, count,
+					     physical);
+	pthread_rwlock_unlock(&reader->lock);
+	return err;
+}
+
+/*
+ * Requests which are at most this many bytes apart are read together, and the
+ * bytes in between are discarded. This is cheaper than another read callback.
+ */
+#define READ_MANY_MAX_GAP 256
+/* Limit on the size of a coalesced read. */
+#define READ_MANY_MAX_COALESCED (1024 * 1024)
+
+static int drgn_memory_read_request_cmp(const void *_a, const void *_b)
+{
+	const struct drgn_memory_read_request *a = *(void * const *)_a;
+	const struct drgn_memory_read_request *b = *(void * const *)_b;
+
+	if (a->address < b->address)
+		return -1;
+	else if (a->address > b->address)
+		return 1;
+	else
+		return 0;
+}
+
+/*
+ * Read a group of sorted requests covering [start, end) with one read, falling
+ * back to reading each request individually if that fails.
+ */
+static struct drgn_error *
+drgn_memory_reader_read_group(struct drgn_memory_reader *reader,
+			      struct drgn_memory_read_request **group,
+			      size_t n, uint64_t start, uint64_t end,
+			      bool physical, char *buf)
+{
+	struct drgn_error *err;
+	size_t i;
+
+	if (n > 1) {
+		err = drgn_memory_reader_read(reader, buf, start, end - start,
+					      physical);
+		if (!err) {
+			for (i = 0; i < n; i++) {
+				memcpy(group[i]->buf,
+				       buf + (group[i]->address - start),
+				       group[i]->count);
+				group[i]->err = NULL;
+			}
+			return NULL;
+		}
+		if (err->code != DRGN_ERROR_FAULT)
+			return err;
+		drgn_error_destroy(err);
+	}
+	for (i = 0; i < n; i++) {
+		err = drgn_memory_reader_read(reader, group[i]->buf,
+					      group[i]->address,
+					      group[i]->count, physical);
+		if (err && err->code != DRGN_ERROR_FAULT)
+			return err;
+		group[i]->err = err;
+	}
+	return NULL;
+}
+
+struct drgn_error *
+drgn_memory_reader_read_many(struct drgn_memory_reader *reader,
+			     struct drgn_memory_read_request *reqs, size_t n,
+			     bool physical)
+{
+	struct drgn_error *err;
+	struct drgn_memory_read_request **sorted;
+	char *buf = NULL;
+	size_t i, group_start;
+	uint64_t start, end;
+
+	for (i = 0; i < n; i++)
+		reqs[i].err = NULL;
+	if (!n)
+		return NULL;
+
+	sorted = malloc_array(n, sizeof(*sorted));
+	if (!sorted)
+		return &drgn_enomem;
+	for (i = 0; i < n; i++)
+		sorted[i] = &reqs[i];
+	qsort(sorted, n, sizeof(*sorted), drgn_memory_read_request_cmp);
+
+	group_start = 0;
+	start = sorted[0]->address;
+	end = start + sorted[0]->count;
+	for (i = 1; i <= n; i++) {
+		if (i < n) {
+			uint64_t address = sorted[i]->address;
+			uint64_t req_end = address + sorted[i]->count;
+
+			/*
+			 * Requests are sorted, so address >= start. Don't
+			 * coalesce anything that wraps around.
+			 */
+			if (end >= start && req_end >= address &&
+			    (address <= end ||
+			     address - end <= READ_MANY_MAX_GAP) &&
+			    max(end, req_end) - start <= READ_MANY_MAX_COALESCED) {
+				end = max(end, req_end);
+				continue;
+			}
+		}
+
+		if (i - group_start > 1 && !buf) {
+			buf = malloc(READ_MANY_MAX_COALESCED);
+			if (!buf) {
+				err = &drgn_enomem;
+				goto out;
+			}
+		}
+		err = drgn_memory_reader_read_group(reader,
+						    &sorted[group_start],
+						    i - group_start, start, end,
+						    physical, buf);
+		if (err)
+			goto out;
+
+		if (i < n) {
+			group_start = i;
+			start = sorted[i]->address;
+			end = start + sorted[i]->count;
+		}
+	}
+	err = NULL;
+out:
+	if (err) {
+		for (i = 0; i < n; i++) {
+			drgn_error_destroy(reqs[i].err);
+			reqs[i].err = NULL;
+		}
+	}
+	free(buf);
+	free(sorted);
+	return err;
+}
+
+struct drgn_error *drgn_memory_reader_borrow(struct drgn_memory_reader *reader,
+					     uint64_t address, size_t count,
+					     bool physical, const void **ret)
+{
+	struct drgn_error *err;
+	struct drgn_memory_segment *segment;
+	struct drgn_memory_file_segment *file_segment;
+	uint64_t offset;
+
+	pthread_rwlock_rdlock(&reader->lock);
+	err = drgn_memory_reader_find_segment(reader, address, physical,
+					      &segment);
+	if (err) {
+		if (err->code == DRGN_ERROR_FAULT) {
+			drgn_error_destroy(err);
+			err = &drgn_not_found;
+		}
+		goto out;
+	}
+	err = &drgn_not_found;
+	if (segment->read_fn != drgn_read_memory_file ||
+	    count > segment->size - (address - segment->address))
+		goto out;
+	file_segment = segment->arg;
+	offset = address - segment->orig_address;
+	if (!file_segment->map || offset > file_segment->file_size ||
+	    count > file_segment->file_size - offset)
+		goto out;
+	*ret = file_segment->map + offset;
+	err = NULL;
+out:
+	pthread_rwlock_unlock(&reader->lock);
+	return err;
+}
+
+/*
+ * Strings are read in chunks which never cross a boundary aligned to this size,
+ * which is the smallest page size we expect to encounter.
+ */
+#define C_STRING_MAX_CHUNK 4096
+/*
+ * Most strings are short, so the first chunk is small and subsequent chunks
+ * double in size up to C_STRING_MAX_CHUNK.
+ */
+#define C_STRING_MIN_CHUNK 64
+
+struct drgn_error *
+drgn_memory_reader_read_c_string(struct drgn_memory_reader *reader,
+				 uint64_t address, bool physical,
+				 uint64_t max_size, drgn_memory_string_fn fn,
+				 void *arg)
+{
+	struct drgn_error *err;
+	char buf[C_STRING_MAX_CHUNK];
+	uint64_t chunk_size = C_STRING_MIN_CHUNK;
+
+	while (max_size) {
+		size_t n, i;
+		char *nul;
+
+		n = min(chunk_size - (address & (chunk_size - 1)), max_size);
+		err = drgn_memory_reader_read(reader, buf, address, n,
+					      physical);
+		if (err) {
+			if (err->code != DRGN_ERROR_FAULT)
+				return err;
+			drgn_error_destroy(err);
+			/*
+			 * Part of the chunk is unreadable, but the string may
+			 * end before that part.
+			 */
+			for (i = 0; i < n; i++) {
+				err = drgn_memory_reader_read(reader, &buf[i],
+							      address + i, 1,
+							      physical);
+				if (err || !buf[i])
+					break;
+			}
+			if (i) {
+				struct drgn_error *fn_err;
+
+				fn_err = fn(buf, i, arg);
+				if (fn_err) {
+					drgn_error_destroy(err);
+					return fn_err;
+				}
+			}
+			if (err || i < n)
+				return err;
+		} else {
+			nul = memchr(buf, '\0', n);
+			if (nul)
+				return nul == buf ? NULL : fn(buf, nul - buf, arg);
+			err = fn(buf, n, arg);
+			if (err)
+				return err;
+		}
+		address += n;
+		max_size -= n;
+		if (chunk_size < C_STRING_MAX_CHUNK)
+			chunk_size *= 2;
+	}
+	return NULL;
+}
@@ -12,11 +12,13 @@
 #ifndef DRGN_MEMORY_READER_H
 #define DRGN_MEMORY_READER_H
 
+#include <pthread.h>
 #include <stdbool.h>
 #include <stddef.h>
 #include <stdint.h>
 
 #include "binary_search_tree.h"
+#include "hash_table.h"
 
 /**
  * @ingroup Internals
@@ -28,6 +30,11 @@
  * @ref drgn_memory_reader provides a common interface for registering regions
  * of memory in a program and reading from memory.
  *
+ * A @ref drgn_memory_reader can optionally cache memory in fixed-size blocks
+ * (see @ref drgn_memory_reader_set_cache()). This avoids calling the segment
+ * read callback for every small read, which is expensive when the callback
+ * does a system call.
+ *
  * @{
  */
 
@@ -61,17 +68,98 @@ DEFINE_BINARY_SEARCH_TREE_TYPE(drgn_memory_segment_tree, struct
 			       drgn_memory_segment, node,
 			       drgn_memory_segment_to_key)
 
+/**
+ * Sorted array of the segments in a @ref drgn_memory_segment_tree.
+ *
+ * Searching the splay tree restructures it, so reads search this array
+ * instead. It is built from the tree on demand and freed when the tree changes.
+ */
+struct drgn_memory_segment_index {
+	/** Number of segments. */
+	size_t num_segments;
+	/** Segments sorted by address. */
+	struct drgn_memory_segment *segments[];
+};
+
+/** Block of memory cached by a @ref drgn_memory_reader. */
+struct drgn_memory_cache_block {
+	/** Address of the block. This is aligned to the block size. */
+	uint64_t address;
+	/** Time when the block was read in nanoseconds (@c CLOCK_MONOTONIC). */
+	uint64_t timestamp;
+	/** Next more recently used block in the same cache. */
+	struct drgn_memory_cache_block *newer;
+	/** Next less recently used block in the same cache. */
+	struct drgn_memory_cache_block *older;
+	/** Cached memory. */
+	char data[];
+};
+
+DEFINE_HASH_MAP_TYPE(drgn_memory_cache_block_map, uint64_t,
+		     struct drgn_memory_cache_block *)
+
+/** Cache of memory blocks in one address space. */
+struct drgn_memory_cache {
+	/** Map from block address to block. */
+	struct drgn_memory_cache_block_map blocks;
+	/** Most recently used block. */
+	struct drgn_memory_cache_block *newest;
+	/** Least recently used block. This is evicted first. */
+	struct drgn_memory_cache_block *oldest;
+};
+
 /**
  * Memory reader.
  *
  * A memory reader maps the segments of memory in an address space to callbacks
  * which can be used to read memory from those segments.
+ *
+ * Memory may be read from multiple threads concurrently. Read callbacks may be
+ * called concurrently, so they must be thread-safe. Adding segments or
+ * configuring the cache waits for all reads in progress to finish.
  */
 struct drgn_memory_reader {
 	/** Virtual memory segments. */
 	struct drgn_memory_segment_tree virtual_segments;
 	/** Physical memory segments. */
 	struct drgn_memory_segment_tree physical_segments;
+	/**
+	 * Index of @ref drgn_memory_reader::virtual_segments, or @c NULL if it
+	 * needs to be built.
+	 */
+	struct drgn_memory_segment_index *virtual_index;
+	/**
+	 * Index of @ref drgn_memory_reader::physical_segments, or @c NULL if it
+	 * needs to be built.
+	 */
+	struct drgn_memory_segment_index *physical_index;
+	/**
+	 * Lock held for writing while segments are added or the cache is
+	 * configured and for reading while memory is read.
+	 */
+	pthread_rwlock_t lock;
+	/** Lock protecting building the segment indices. */
+	pthread_mutex_t index_lock;
+	/** Lock protecting the caches. */
+	pthread_mutex_t cache_lock;
+	/** Cache of virtual memory. */
+	struct drgn_memory_cache virtual_cache;
+	/** Cache of physical memory. */
+	struct drgn_memory_cache physical_cache;
+	/** Size of a cached block in bytes. This is a power of two. */
+	uint64_t cache_block_size;
+	/**
+	 * Maximum number of blocks in both caches combined, or zero if caching
+	 * is disabled.
+	 */
+	size_t cache_max_blocks;
+	/** Number of blocks in both caches combined. */
+	size_t cache_num_blocks;
+	/**
+	 * Time in nanoseconds after which a cached block must be read again, or
+	 * zero if cached blocks never expire.
+	 */
+	uint64_t cache_max_age;
 };
 
 /**
@@ -84,6 +172,15 @@ void drgn_memory_reader_init(struct drgn_memory_reader *reader);
 /** Deinitialize a @ref drgn_memory_reader. */
 void drgn_memory_reader_deinit(struct drgn_memory_reader *reader);
 
+/**
+ * Build the segment indices of a @ref drgn_memory_reader.
+ *
+ * Reads build the indices on demand if segments were added since they were
+ * last built. Calling this once all segments have been added moves that work
+ * out of the first read.
+ */
+struct drgn_error *drgn_memory_reader_freeze(struct drgn_memory_reader *reader);
+
 /** Return whether a @ref drgn_memory_reader has no segments. */
 bool drgn_memory_reader_empty(struct drgn_memory_reader *reader);
 
@@ -94,6 +191,26 @@ drgn_memory_reader_add_segment(struct drgn_memory_reader *reader,
 			       drgn_memory_read_fn read_fn, void *arg,
 			       bool physical);
 
+/**
+ * Configure the cache of a @ref drgn_memory_reader.
+ *
+ * This also flushes the cache.
+ *
+ * @param[in] reader Memory reader.
+ * @param[in] size Maximum number of bytes to cache, or zero to disable caching.
+ * This is rounded down to a multiple of @p block_size.
+ * @param[in] block_size Size of a cached block in bytes. Must be a power of
+ * two.
+ * @param[in] max_age Time in nanoseconds after which a cached block must be
+ * read again, or zero if cached blocks never expire.
+ */
+void drgn_memory_reader_set_cache(struct drgn_memory_reader *reader,
+				  size_t size, uint64_t block_size,
+				  uint64_t max_age);
+
+/** Remove all blocks from the cache of a @ref drgn_memory_reader. */
+void drgn_memory_reader_flush_cache(struct drgn_memory_reader *reader);
+
 /**
  * Read from a @ref drgn_memory_reader.
  *
@@ -108,6 +225,97 @@ struct drgn_error *drgn_memory_reader_read(struct drgn_memory_reader *reader,
 					   void *buf, uint64_t address,
 					   size_t count, bool physical);
 
+/** Request for @ref drgn_memory_reader_read_many(). */
+struct drgn_memory_read_request {
+	/** Buffer to read into. */
+	void *buf;
+	/** Starting address in memory to read. */
+	uint64_t address;
+	/** Number of bytes to read. */
+	size_t count;
+	/**
+	 * Returned @c NULL if the read succeeded or the @ref DRGN_ERROR_FAULT
+	 * error if it did not.
+	 */
+	struct drgn_error *err;
+};
+
+/**
+ * Read many ranges from a @ref drgn_memory_reader.
+ *
+ * This sorts the requests by address and coalesces nearby ranges so that
+ * memory is read in as few calls to the segment read callbacks as possible.
+ *
+ * @param[in] reader Memory reader.
+ * @param[in,out] reqs Requests. On return, @ref drgn_memory_read_request::err
+ * is set for each request, and it must be freed with @ref drgn_error_destroy().
+ * @param[in] n Number of requests.
+ * @param[in] physical Whether the addresses are physical.
+ * @return @c NULL if every request either succeeded or faulted, non-@c NULL
+ * on any other error, in which case the contents of @p reqs are undefined.
+ */
+struct drgn_error *
+drgn_memory_reader_read_many(struct drgn_memory_reader *reader,
+			     struct drgn_memory_read_request *reqs, size_t n,
+			     bool physical);
+
+/**
+ * Get a pointer to memory in a @ref drgn_memory_reader without copying it.
+ *
+ * This is only possible if the memory is entirely contained in a segment read
+ * by @ref drgn_read_memory_file() from a file which is mapped into memory (see
+ * @ref drgn_memory_file_segment::map).
+ *
+ * @param[in] reader Memory reader.
+ * @param[in] address Starting address in memory.
+ * @param[in] count Number of bytes.
+ * @param[in] physical Whether @c address is physical.
+ * @param[out] ret Returned pointer. This is valid as long as the segment is
+ * not replaced and the file is not unmapped.
+ * @return @c NULL on success, &@ref drgn_not_found if the memory cannot be
+ * borrowed (in which case it should be read with @ref
+ * drgn_memory_reader_read() instead).
+ */
+struct drgn_error *drgn_memory_reader_borrow(struct drgn_memory_reader *reader,
+					     uint64_t address, size_t count,
+					     bool physical, const void **ret);
+
+/**
+ * Callback for @ref drgn_memory_reader_read_c_string().
+ *
+ * @param[in] chunk Chunk of the string. This is @em not null-terminated.
+ * @param[in] len Length of @p chunk.
+ * @param[in] arg Argument passed to @ref drgn_memory_reader_read_c_string().
+ * @return @c NULL on success, non-@c NULL on error.
+ */
+typedef struct drgn_error *(*drgn_memory_string_fn)(const char *chunk,
+						    size_t len, void *arg);
+
+/**
+ * Read a null-terminated string from a @ref drgn_memory_reader.
+ *
+ * Rather than reading one byte at a time, this reads aligned chunks which
+ * never cross a page boundary and searches them for the null terminator. If a
+ * chunk can't be read, it falls back to reading one byte at a time so that a
+ * string ending right before unreadable memory can still be read.
+ *
+ * @param[in] reader Memory reader.
+ * @param[in] address Starting address in memory to read.
+ * @param[in] physical Whether @c address is physical.
+ * @param[in] max_size Stop after this many bytes are read, not including the
+ * null byte.
+ * @param[in] fn Callback called with each consecutive chunk of the string, not
+ * including the null byte. If a fault is encountered, this is called with the
+ * bytes before the fault before the error is returned.
+ * @param[in] arg Argument to pass to @p fn.
+ * @return @c NULL on success, non-@c NULL on error.
+ */
+struct drgn_error *
+drgn_memory_reader_read_c_string(struct drgn_memory_reader *reader,
+				 uint64_t address, bool physical,
+				 uint64_t max_size, drgn_memory_string_fn fn,
+				 void *arg);
+
 /** Argument for @ref drgn_read_memory_file(). */
 struct drgn_memory_file_segment {
 	/** Offset in the file where the segment starts. */
@@ -118,6 +326,15 @@ struct drgn_memory_file_segment {
 	 * as if they contained zeroes.
 	 */
 	uint64_t file_size;
+	/**
+	 * Contents of the segment in the file mapped into memory, or @c NULL
+	 * if the file is not mapped.
+	 *
+	 * If this is not @c NULL, then reads are copied from the mapping
+	 * instead of calling <tt>pread()</tt>, and @ref
+	 * drgn_memory_reader_borrow() can return pointers into it.
+	 */
+	const char *map;
 	/** File descriptor. */
 	int fd;
 };
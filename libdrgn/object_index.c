@@ -7,15 +7,73 @@
 #include "object_index.h"
 #include "type.h"
 
+static struct hash_pair
+drgn_object_lookup_hash_pair(const struct drgn_object_lookup_key *key)
+{
+	size_t hash;
+
+	hash = hash_combine(cityhash_size_t(key->name, strlen(key->name)),
+			    key->flags);
+	if (key->filename) {
+		hash = hash_combine(hash,
+				    cityhash_size_t(key->filename,
+						    strlen(key->filename)));
+	}
+	return hash_pair_from_avalanching_hash(hash);
+}
+
+static bool drgn_object_lookup_eq(const struct drgn_object_lookup_key *a,
+				  const struct drgn_object_lookup_key *b)
+{
+	return (a->flags == b->flags && strcmp(a->name, b->name) == 0 &&
+		(a->filename && b->filename ?
+		 strcmp(a->filename, b->filename) == 0 :
+		 a->filename == b->filename));
+}
+
+DEFINE_HASH_TABLE_FUNCTIONS(drgn_object_lookup_map,
+			    drgn_object_lookup_hash_pair, drgn_object_lookup_eq)
+
 void drgn_object_index_init(struct drgn_object_index *oindex)
 {
 	oindex->finders = NULL;
+	drgn_object_lookup_map_init(&oindex->lookups);
+}
+
+static void free_lookups(struct drgn_object_index *oindex)
+{
+	struct drgn_object_lookup_map_iterator it;
+
+	for (it = drgn_object_lookup_map_first(&oindex->lookups); it.entry;
+	     it = drgn_object_lookup_map_next(it)) {
+		free((char *)it.entry->key.name);
+		free((char *)it.entry->key.filename);
+		if (it.entry->value.not_found)
+			free(it.entry->value.not_found);
+		else
+			drgn_object_deinit(&it.entry->value.obj);
+	}
+	drgn_object_lookup_map_deinit(&oindex->lookups);
+}
+
+void drgn_object_index_clear_lookups(struct drgn_object_index *oindex)
+{
+	free_lookups(oindex);
+	drgn_object_lookup_map_init(&oindex->lookups);
+}
+
+void drgn_object_index_memory_usage(struct drgn_object_index *oindex,
+				    struct drgn_program_memory_usage *usage)
+{
+	usage->caches += drgn_object_lookup_map_memory_usage(&oindex->lookups);
 }
 
 void drgn_object_index_deinit(struct drgn_object_index *oindex)
 {
 	struct drgn_object_finder *finder;
 
+	free_lookups(oindex);
+
 	finder = oindex->finders;
 	while (finder) {
 		struct drgn_object_finder *next = finder->next;
@@ -27,7 +85,7 @@ void drgn_object_index_deinit(struct drgn_object_index *oindex)
 
 struct drgn_error *
 drgn_object_index_add_finder(struct drgn_object_index *oindex,
-			     drgn_object_find_fn fn, void *arg)
+			     drgn_object_find_fn fn, void *arg, bool cache)
 {
 	struct drgn_object_finder *finder;
 
@@ -36,30 +94,30 @@ drgn_object_index_add_finder(struct drgn_object_index *oindex,
 		return &drgn_enomem;
 	finder->fn = fn;
 	finder->arg = arg;
+	finder->cache = cache;
 	finder->next = oindex->finders;
 	oindex->finders = finder;
+	drgn_object_index_clear_lookups(oindex);
 	return NULL;
 }
 
-struct drgn_error *drgn_object_index_find(struct drgn_object_index *oindex,
-					  const char *name,
-					  const char *filename,
-					  enum drgn_find_object_flags flags,
-					  struct drgn_object *ret)
+static struct drgn_error *
+drgn_object_index_find_uncached(struct drgn_object_index *oindex,
+				const char *name, const char *filename,
+				enum drgn_find_object_flags flags,
+				struct drgn_object *ret, bool *cacheable_ret)
 {
 	struct drgn_error *err;
 	size_t name_len;
 	struct drgn_object_finder *finder;
 	const char *kind_str;
 
-	if ((flags & ~DRGN_FIND_OBJECT_ANY) || !flags) {
-		return drgn_error_create(DRGN_ERROR_INVALID_ARGUMENT,
-					 "invalid find object flags");
-	}
-
 	name_len = strlen(name);
+	*cacheable_ret = true;
 	finder = oindex->finders;
 	while (finder) {
+		if (!finder->cache)
+			*cacheable_ret = false;
 		err = finder->fn(name, name_len, filename, flags, finder->arg,
 				 ret);
 		if (err != &drgn_not_found)
@@ -91,3 +149,86 @@ struct drgn_error *drgn_object_index_find(struct drgn_object_index *oindex,
 					 name);
 	}
 }
+
+struct drgn_error *drgn_object_index_find(struct drgn_object_index *oindex,
+					  const char *name,
+					  const char *filename,
+					  enum drgn_find_object_flags flags,
+					  struct drgn_object *ret)
+{
+	struct drgn_error *err;
+	struct drgn_object_lookup_map_entry entry = {
+		.key = {
+			.name = name,
+			.filename = filename,
+			.flags = flags,
+		},
+	};
+	struct hash_pair hp;
+	struct drgn_object_lookup_map_iterator it;
+	bool cacheable;
+
+	if ((flags & ~DRGN_FIND_OBJECT_ANY) || !flags) {
+		return drgn_error_create(DRGN_ERROR_INVALID_ARGUMENT,
+					 "invalid find object flags");
+	}
+
+	hp = drgn_object_lookup_map_hash(&entry.key);
+	it = drgn_object_lookup_map_search_hashed(&oindex->lookups, &entry.key,
+						  hp);
+	if (it.entry) {
+		if (it.entry->value.not_found) {
+			return drgn_error_create(DRGN_ERROR_LOOKUP,
+						 it.entry->value.not_found);
+		}
+		return drgn_object_copy(ret, &it.entry->value.obj);
+	}
+
+	err = drgn_object_index_find_uncached(oindex, name, filename, flags,
+					      ret, &cacheable);
+	if (!cacheable)
+		return err;
+	if (!err) {
+		drgn_object_init(&entry.value.obj, ret->prog);
+		err = drgn_object_copy(&entry.value.obj, ret);
+		if (err) {
+			drgn_object_deinit(&entry.value.obj);
+			return err;
+		}
+		entry.value.not_found = NULL;
+	} else if (err->code == DRGN_ERROR_LOOKUP) {
+		/* Remember that it wasn't found, too. */
+		entry.value.not_found = strdup(err->message);
+		if (!entry.value.not_found)
+			goto err;
+	} else {
+		/* Don't cache any other errors. */
+		return err;
+	}
+
+	entry.key.name = strdup(name);
+	if (!entry.key.name)
+		goto err_value;
+	if (filename) {
+		entry.key.filename = strdup(filename);
+		if (!entry.key.filename)
+			goto err_name;
+	}
+	if (drgn_object_lookup_map_insert_searched(&oindex->lookups, &entry,
+						   hp, NULL) == -1)
+		goto err_filename;
+	return err;
+
+err_filename:
+	free((char *)entry.key.filename);
+err_name:
+	free((char *)entry.key.name);
+err_value:
+	if (entry.value.not_found)
+		free(entry.value.not_found);
+	else
+		drgn_object_deinit(&entry.value.obj);
+err:
+	drgn_error_destroy(err);
+	return &drgn_enomem;
+}
@@ -13,6 +13,7 @@
 #define DRGN_OBJECT_INDEX_H
 
 #include "drgn.h"
+#include "hash_table.h"
 
 /**
  * @ingroup Internals
@@ -27,12 +28,47 @@
  * @{
  */
 
+/** Object lookup passed to @ref drgn_object_index_find(). */
+struct drgn_object_lookup_key {
+	const char *name;
+	/** Filename, or @c NULL for any definition. */
+	const char *filename;
+	enum drgn_find_object_flags flags;
+};
+
+/** Cached result of an object lookup. */
+struct drgn_object_lookup_value {
+	/** Object which was found, if @c not_found is @c NULL. */
+	struct drgn_object obj;
+	/** Message of the @ref DRGN_ERROR_LOOKUP error if it wasn't found. */
+	char *not_found;
+};
+
+#ifdef DOXYGEN
+/**
+ * @struct drgn_object_lookup_map
+ *
+ * Map of object lookups to their results.
+ *
+ * The key is a @ref drgn_object_lookup_key, and the value is a @ref
+ * drgn_object_lookup_value. The strings in both are allocated with @c malloc().
+ */
+#else
+DEFINE_HASH_MAP_TYPE(drgn_object_lookup_map, struct drgn_object_lookup_key,
+		     struct drgn_object_lookup_value)
+#endif
+
 /** Registered callback in a @ref drgn_object_index. */
 struct drgn_object_finder {
 	/** The callback. */
 	drgn_object_find_fn fn;
 	/** Argument to pass to @ref drgn_object_finder::fn. */
 	void *arg;
+	/**
+	 * Whether results of this callback may be cached in @ref
+	 * drgn_object_index::lookups.
+	 */
+	bool cache;
 	/** Next callback to try. */
 	struct drgn_object_finder *next;
 };
@@ -48,6 +84,12 @@ struct drgn_object_finder {
 struct drgn_object_index {
 	/** Callbacks for finding objects. */
 	struct drgn_object_finder *finders;
+	/**
+	 * Cache for @ref drgn_object_index_find().
+	 *
+	 * This is invalidated with @ref drgn_object_index_clear_lookups().
+	 */
+	struct drgn_object_lookup_map lookups;
 };
 
 /** Initialize a @ref drgn_object_index. */
@@ -56,14 +98,43 @@ void drgn_object_index_init(struct drgn_object_index *oindex);
 /** Deinitialize a @ref drgn_object_index. */
 void drgn_object_index_deinit(struct drgn_object_index *oindex);
 
-/** @sa drgn_program_add_object_finder() */
+/**
+ * Clear the results of previous lookups with @ref drgn_object_index_find().
+ *
+ * This must be called whenever those results may have changed (e.g., when new
+ * debugging information is loaded).
+ */
+void drgn_object_index_clear_lookups(struct drgn_object_index *oindex);
+
+/**
+ * Add the memory used by a @ref drgn_object_index to a @ref
+ * drgn_program_memory_usage.
+ */
+void drgn_object_index_memory_usage(struct drgn_object_index *oindex,
+				    struct drgn_program_memory_usage *usage);
+
+/**
+ * Register an object finding callback.
+ *
+ * @param[in] cache Whether the results of @p fn may be cached by @ref
+ * drgn_object_index_find(). This should only be @c true if @p fn always returns
+ * the same object for the same arguments until @ref
+ * drgn_object_index_clear_lookups() is called. Note that this includes value
+ * objects, so it shouldn't be set for callbacks which read the value of an
+ * object from memory.
+ * @sa drgn_program_add_object_finder()
+ */
 struct drgn_error *
 drgn_object_index_add_finder(struct drgn_object_index *oindex,
-			     drgn_object_find_fn fn, void *arg);
+			     drgn_object_find_fn fn, void *arg, bool cache);
 
 /**
  * Find an object in a @ref drgn_object_index.
  *
+ * Results, including objects which weren't found, are cached until @ref
+ * drgn_object_index_clear_lookups() is called. A result is only cached if
+ * every finder which was called for it allows caching.
+ *
  * @param[in] oindex Object index.
  * @param[in] name Name of the object.
  * @param[in] filename Exact filename containing the object definition, or @c
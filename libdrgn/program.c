@@ -10,11 +10,13 @@
 #include <stdlib.h>
 #include <string.h>
 #include <unistd.h>
+#include <sys/mman.h>
 #include <sys/stat.h>
 #include <sys/types.h>
 #include <sys/vfs.h>
 
 #include "internal.h"
+#include "btf.h"
 #include "dwarf_index.h"
 #include "dwarf_info_cache.h"
 #include "language.h"
@@ -47,6 +49,30 @@ drgn_program_platform(struct drgn_program *prog)
 	return prog->has_platform ? &prog->platform : NULL;
 }
 
+LIBDRGN_PUBLIC void
+drgn_program_memory_usage(struct drgn_program *prog,
+			  struct drgn_program_memory_usage *ret)
+{
+	memset(ret, 0, sizeof(*ret));
+	drgn_type_index_memory_usage(&prog->tindex, ret);
+	drgn_object_index_memory_usage(&prog->oindex, ret);
+	drgn_symbol_table_memory_usage(&prog->symtab, ret);
+	if (prog->_dicache)
+		drgn_dwarf_info_cache_memory_usage(prog->_dicache, ret);
+	if (prog->_btf)
+		drgn_btf_memory_usage(prog->_btf, ret);
+}
+
+LIBDRGN_PUBLIC void
+drgn_program_dwarf_index_stats(struct drgn_program *prog,
+			       struct drgn_dwarf_index_stats *ret)
+{
+	if (prog->_dicache)
+		drgn_dwarf_index_stats(&prog->_dicache->dindex, ret);
+	else
+		memset(ret, 0, sizeof(*ret));
+}
+
 void drgn_program_set_platform(struct drgn_program *prog,
 			       const struct drgn_platform *platform)
 {
@@ -58,25 +84,56 @@ void drgn_program_set_platform(struct drgn_program *prog,
 	}
 }
 
+static uint64_t drgn_program_page_size(struct drgn_program *prog)
+{
+	if ((prog->flags & DRGN_PROGRAM_IS_LINUX_KERNEL) &&
+	    prog->vmcoreinfo.page_size)
+		return prog->vmcoreinfo.page_size;
+	return 4096;
+}
+
+/*
+ * Apply the memory cache configuration. This must be called whenever the
+ * program's memory or flags change, since the cache depends on both.
+ */
+static void drgn_program_update_memory_cache(struct drgn_program *prog)
+{
+	size_t size = prog->memory_cache_size;
+
+	if ((prog->flags & DRGN_PROGRAM_IS_LIVE) && !prog->memory_cache_max_age)
+		size = 0;
+	drgn_memory_reader_set_cache(&prog->reader, size,
+				     drgn_program_page_size(prog),
+				     prog->memory_cache_max_age);
+}
+
 void drgn_program_init(struct drgn_program *prog,
 		       const struct drgn_platform *platform)
 {
+	const char *env;
+
 	memset(prog, 0, sizeof(*prog));
 	drgn_memory_reader_init(&prog->reader);
 	drgn_type_index_init(&prog->tindex);
 	drgn_object_index_init(&prog->oindex);
+	drgn_symbol_table_init(&prog->symtab);
 	prog->core_fd = -1;
+	env = getenv("DRGN_LAZY_KERNEL_MODULES");
+	prog->lazy_kernel_modules = env && atoi(env);
 	if (platform)
 		drgn_program_set_platform(prog, platform);
 }
 
 void drgn_program_deinit(struct drgn_program *prog)
 {
+	drgn_symbol_table_deinit(&prog->symtab);
 	drgn_object_index_deinit(&prog->oindex);
 	drgn_type_index_deinit(&prog->tindex);
 	drgn_memory_reader_deinit(&prog->reader);
 
 	free(prog->file_segments);
+	if (prog->core_map)
+		munmap(prog->core_map, prog->core_map_size);
 
 #ifdef WITH_LIBKDUMPFILE
 	if (prog->kdump_ctx)
@@ -87,6 +144,7 @@ void drgn_program_deinit(struct drgn_program *prog)
 		close(prog->core_fd);
 
 	drgn_dwarf_info_cache_destroy(prog->_dicache);
+	drgn_btf_destroy(prog->_btf);
 }
 
 LIBDRGN_PUBLIC struct drgn_error *
@@ -124,14 +182,14 @@ LIBDRGN_PUBLIC struct drgn_error *
 drgn_program_add_type_finder(struct drgn_program *prog, drgn_type_find_fn fn,
 			     void *arg)
 {
-	return drgn_type_index_add_finder(&prog->tindex, fn, arg);
+	return drgn_type_index_add_finder(&prog->tindex, fn, arg, false);
 }
 
 LIBDRGN_PUBLIC struct drgn_error *
 drgn_program_add_object_finder(struct drgn_program *prog,
 			       drgn_object_find_fn fn, void *arg)
 {
-	return drgn_object_index_add_finder(&prog->oindex, fn, arg);
+	return drgn_object_index_add_finder(&prog->oindex, fn, arg, false);
 }
 
 static struct drgn_error *
@@ -200,6 +258,7 @@ set_kdump:
 		err = drgn_program_set_kdump(prog);
 		if (err)
 			goto out_fd;
+		drgn_program_update_memory_cache(prog);
 		return NULL;
 	}
 
@@ -320,11 +379,32 @@ set_kdump:
 		}
 	}
 
+	if (!is_proc_kcore) {
+		struct stat st;
+
+		/*
+		 * If the core dump is a regular file, map it so that reads are
+		 * a memcpy() rather than a pread(). If it can't be mapped, we
+		 * fall back to pread().
+		 */
+		if (fstat(prog->core_fd, &st) == 0 && S_ISREG(st.st_mode) &&
+		    st.st_size > 0 && (uint64_t)st.st_size <= SIZE_MAX) {
+			void *map;
+
+			map = mmap(NULL, st.st_size, PROT_READ, MAP_SHARED,
+				   prog->core_fd, 0);
+			if (map != MAP_FAILED) {
+				prog->core_map = map;
+				prog->core_map_size = st.st_size;
+			}
+		}
+	}
+
 	prog->file_segments = malloc_array(num_file_segments,
 					   sizeof(*prog->file_segments));
 	if (!prog->file_segments) {
 		err = &drgn_enomem;
-		goto out_elf;
+		goto out_segments;
 	}
 	prog->num_file_segments = num_file_segments;
 	current_file_segment = prog->file_segments;
@@ -350,6 +430,18 @@ set_kdump:
 				continue;
 			current_file_segment->file_offset = phdr->p_offset;
 			current_file_segment->file_size = phdr->p_filesz;
+			/*
+			 * Accessing a mapping past the end of the file raises
+			 * SIGBUS, so truncated segments must use pread().
+			 */
+			if (prog->core_map &&
+			    phdr->p_offset <= prog->core_map_size &&
+			    phdr->p_filesz <= prog->core_map_size - phdr->p_offset) {
+				current_file_segment->map =
+					(char *)prog->core_map + phdr->p_offset;
+			} else {
+				current_file_segment->map = NULL;
+			}
 			current_file_segment->fd = prog->core_fd;
 			err = drgn_program_add_memory_segment(prog,
 							      phdr->p_vaddr,
@@ -374,6 +466,9 @@ set_kdump:
 			current_file_segment++;
 		}
 	}
+	err = drgn_memory_reader_freeze(&prog->reader);
+	if (err)
+		goto out_segments;
 	if (vmcoreinfo_note) {
 		err = parse_vmcoreinfo(vmcoreinfo_note, vmcoreinfo_size,
 				       &prog->vmcoreinfo);
@@ -398,6 +493,7 @@ set_kdump:
 	}
 
 	drgn_program_set_platform(prog, &platform);
+	drgn_program_update_memory_cache(prog);
 	return NULL;
 
 out_segments:
@@ -406,6 +502,11 @@ out_segments:
 	free(prog->file_segments);
 	prog->file_segments = NULL;
 	prog->num_file_segments = 0;
+	if (prog->core_map) {
+		munmap(prog->core_map, prog->core_map_size);
+		prog->core_map = NULL;
+		prog->core_map_size = 0;
+	}
 out_elf:
 	elf_end(elf);
 out_fd:
@@ -442,17 +543,21 @@ drgn_program_set_pid(struct drgn_program *prog, pid_t pid)
 	}
 	prog->file_segments[0].file_offset = 0;
 	prog->file_segments[0].file_size = UINT64_MAX;
+	prog->file_segments[0].map = NULL;
 	prog->file_segments[0].fd = prog->core_fd;
 	prog->num_file_segments = 1;
 	err = drgn_program_add_memory_segment(prog, 0, UINT64_MAX,
 					      drgn_read_memory_file,
 					      prog->file_segments, false);
+	if (!err)
+		err = drgn_memory_reader_freeze(&prog->reader);
 	if (err)
 		goto out_segments;
 
 	prog->pid = pid;
 	prog->flags |= DRGN_PROGRAM_IS_LIVE;
 	drgn_program_set_platform(prog, &drgn_host_platform);
+	drgn_program_update_memory_cache(prog);
 	return NULL;
 
 out_segments:
@@ -487,20 +592,22 @@ static struct drgn_error *drgn_program_get_dindex(struct drgn_program *prog,
 						   dwfl_callbacks, &dicache);
 		if (err)
 			return err;
-		err = drgn_program_add_type_finder(prog, drgn_dwarf_type_find,
-						   dicache);
+		err = drgn_type_index_add_finder(&prog->tindex,
+						 drgn_dwarf_type_find, dicache,
+						 true);
 		if (err) {
 			drgn_dwarf_info_cache_destroy(dicache);
 			return err;
 		}
-		err = drgn_program_add_object_finder(prog,
-						     drgn_dwarf_object_find,
-						     dicache);
+		err = drgn_object_index_add_finder(&prog->oindex,
+						   drgn_dwarf_object_find,
+						   dicache, true);
 		if (err) {
 			drgn_type_index_remove_finder(&prog->tindex);
 			drgn_dwarf_info_cache_destroy(dicache);
 			return err;
 		}
+		dicache->dindex.num_threads = prog->num_threads;
 		prog->_dicache = dicache;
 	}
 	*ret = &prog->_dicache->dindex;
@@ -523,7 +630,7 @@ static struct drgn_error *
 userspace_report_debug_info(struct drgn_program *prog,
 			    struct drgn_dwarf_index *dindex,
 			    const char **paths, size_t n,
-			    bool report_default)
+			    bool report_default, bool lazy)
 {
 	struct drgn_error *err;
 	size_t i;
@@ -545,7 +652,7 @@ userspace_report_debug_info(struct drgn_program *prog,
 		 * anything reported here, so for now we report it as unloaded.
 		 */
 		err = drgn_dwarf_index_report_elf(dindex, paths[i], fd, elf, 0,
-						  0, NULL, NULL);
+						  0, NULL, lazy, NULL);
 		if (err)
 			return err;
 	}
@@ -599,7 +706,7 @@ static int drgn_set_platform_from_dwarf(Dwfl_Module *module, void **userdatap,
 
 LIBDRGN_PUBLIC struct drgn_error *
 drgn_program_load_debug_info(struct drgn_program *prog, const char **paths,
-			     size_t n, bool load_default)
+			     size_t n, bool load_default, bool lazy)
 {
 	struct drgn_error *err;
 	struct drgn_dwarf_index *dindex;
@@ -615,18 +722,26 @@ drgn_program_load_debug_info(struct drgn_program *prog, const char **paths,
 	drgn_dwarf_index_report_begin(dindex);
 	if (prog->flags & DRGN_PROGRAM_IS_LINUX_KERNEL) {
 		err = linux_kernel_report_debug_info(prog, dindex, paths, n,
-						     load_default);
+						     load_default, lazy);
 	} else {
 		err = userspace_report_debug_info(prog, dindex, paths, n,
-						  load_default);
+						  load_default, lazy);
 	}
 	if (err) {
 		drgn_dwarf_index_report_abort(dindex);
+		/* Some debugging information may have been indexed anyways. */
+		drgn_type_index_clear_lookups(&prog->tindex);
+		drgn_object_index_clear_lookups(&prog->oindex);
+		drgn_symbol_table_clear(&prog->symtab);
 		return err;
 	}
 	report_from_dwfl = (!(prog->flags & DRGN_PROGRAM_IS_LINUX_KERNEL) &&
 			    load_default);
 	err = drgn_dwarf_index_report_end(dindex, report_from_dwfl);
+	/* Previous lookups may find something different now. */
+	drgn_type_index_clear_lookups(&prog->tindex);
+	drgn_object_index_clear_lookups(&prog->oindex);
+	drgn_symbol_table_clear(&prog->symtab);
 	if ((!err || err->code == DRGN_ERROR_MISSING_DEBUG_INFO) &&
 	    !prog->has_platform) {
 		dwfl_getdwarf(prog->_dicache->dindex.dwfl,
@@ -643,7 +758,7 @@ struct drgn_error *drgn_program_init_core_dump(struct drgn_program *prog,
 	err = drgn_program_set_core_dump(prog, path);
 	if (err)
 		return err;
-	err = drgn_program_load_debug_info(prog, NULL, 0, true);
+	err = drgn_program_load_debug_info(prog, NULL, 0, true, false);
 	if (err && err->code == DRGN_ERROR_MISSING_DEBUG_INFO) {
 		drgn_error_destroy(err);
 		err = NULL;
@@ -658,7 +773,7 @@ struct drgn_error *drgn_program_init_kernel(struct drgn_program *prog)
 	err = drgn_program_set_kernel(prog);
 	if (err)
 		return err;
-	err = drgn_program_load_debug_info(prog, NULL, 0, true);
+	err = drgn_program_load_debug_info(prog, NULL, 0, true, false);
 	if (err && err->code == DRGN_ERROR_MISSING_DEBUG_INFO) {
 		drgn_error_destroy(err);
 		err = NULL;
@@ -673,7 +788,7 @@ struct drgn_error *drgn_program_init_pid(struct drgn_program *prog, pid_t pid)
 	err = drgn_program_set_pid(prog, pid);
 	if (err)
 		return err;
-	err = drgn_program_load_debug_info(prog, NULL, 0, true);
+	err = drgn_program_load_debug_info(prog, NULL, 0, true, false);
 	if (err && err->code == DRGN_ERROR_MISSING_DEBUG_INFO) {
 		drgn_error_destroy(err);
 		err = NULL;
@@ -755,8 +870,59 @@ drgn_program_read_memory(struct drgn_program *prog, void *buf, uint64_t address,
 				       physical);
 }
 
+LIBDRGN_PUBLIC void drgn_program_set_memory_cache(struct drgn_program *prog,
+						  size_t size,
+						  uint64_t max_age)
+{
+	prog->memory_cache_size = size;
+	prog->memory_cache_max_age = max_age;
+	drgn_program_update_memory_cache(prog);
+}
+
+LIBDRGN_PUBLIC void drgn_program_set_num_threads(struct drgn_program *prog,
+						  int num_threads)
+{
+	prog->num_threads = num_threads;
+	if (prog->_dicache)
+		prog->_dicache->dindex.num_threads = num_threads;
+}
+
+LIBDRGN_PUBLIC int drgn_program_num_threads(struct drgn_program *prog)
+{
+	return prog->num_threads;
+}
+
+LIBDRGN_PUBLIC void
+drgn_program_set_lazy_kernel_modules(struct drgn_program *prog, bool lazy)
+{
+	prog->lazy_kernel_modules = lazy;
+}
+
+LIBDRGN_PUBLIC bool
+drgn_program_lazy_kernel_modules(struct drgn_program *prog)
+{
+	return prog->lazy_kernel_modules;
+}
+
+LIBDRGN_PUBLIC void drgn_program_flush_memory_cache(struct drgn_program *prog)
+{
+	drgn_memory_reader_flush_cache(&prog->reader);
+}
+
 DEFINE_VECTOR(char_vector, char)
 
+static struct drgn_error *append_string_chunk(const char *chunk, size_t len,
+					      void *arg)
+{
+	struct char_vector *str = arg;
+
+	if (!char_vector_reserve(str, str->size + len))
+		return &drgn_enomem;
+	memcpy(str->data + str->size, chunk, len);
+	str->size += len;
+	return NULL;
+}
+
 LIBDRGN_PUBLIC struct drgn_error *
 drgn_program_read_c_string(struct drgn_program *prog, uint64_t address,
 			   bool physical, size_t max_size, char **ret)
@@ -765,32 +931,22 @@ drgn_program_read_c_string(struct drgn_program *prog, uint64_t address,
 	struct char_vector str;
 
 	char_vector_init(&str);
-	for (;;) {
-		char *c;
-
-		c = char_vector_append_entry(&str);
-		if (!c) {
-			char_vector_deinit(&str);
-			return &drgn_enomem;
-		}
-		if (str.size <= max_size) {
-			err = drgn_memory_reader_read(&prog->reader, c, address,
-						      1, physical);
-			if (err) {
-				char_vector_deinit(&str);
-				return err;
-			}
-			if (!*c)
-				break;
-		} else {
-			*c = '\0';
-			break;
-		}
-		address++;
+	err = drgn_memory_reader_read_c_string(&prog->reader, address,
+					       physical, max_size,
+					       append_string_chunk, &str);
+	if (err)
+		goto err;
+	if (!char_vector_append(&str, &(char){'\0'})) {
+		err = &drgn_enomem;
+		goto err;
 	}
 	char_vector_shrink_to_fit(&str);
 	*ret = str.data;
 	return NULL;
+
+err:
+	char_vector_deinit(&str);
+	return err;
 }
 
 LIBDRGN_PUBLIC struct drgn_error *
@@ -819,26 +975,32 @@ struct drgn_error *drgn_program_find_symbol_internal(struct drgn_program *prog,
 						     uint64_t address,
 						     struct drgn_symbol *sym)
 {
-	Dwfl_Module *module;
-	const char *name;
-	GElf_Off offset;
-	GElf_Sym elf_sym;
-
-	if (!prog->_dicache)
-		return &drgn_not_found;
-
-	module = dwfl_addrmodule(prog->_dicache->dindex.dwfl, address);
-	if (!module)
-		return &drgn_not_found;
-	name = dwfl_module_addrinfo(module, address, &offset, &elf_sym, NULL,
-				    NULL, NULL);
-	if (!name)
-		return &drgn_not_found;
-
-	sym->name = name;
-	sym->address = address - offset;
-	sym->size = elf_sym.st_size;
-	return NULL;
+	struct drgn_error *err;
+	Dwfl_Module *module = NULL;
+	bool indexed;
+
+	if (prog->_dicache)
+		module = dwfl_addrmodule(prog->_dicache->dindex.dwfl, address);
+	if (module) {
+		/* If indexing this module was deferred, index it now. */
+		err = drgn_dwarf_index_index_deferred(&prog->_dicache->dindex,
+						      module, &indexed);
+		if (err)
+			return err;
+		if (indexed) {
+			/*
+			 * The module was reported again, and previous lookups
+			 * may find something different now.
+			 */
+			drgn_type_index_clear_lookups(&prog->tindex);
+			drgn_object_index_clear_lookups(&prog->oindex);
+			drgn_symbol_table_clear(&prog->symtab);
+			module = dwfl_addrmodule(prog->_dicache->dindex.dwfl,
+						 address);
+		}
+	}
+	/* Without a module, this can still find a symbol from kallsyms. */
+	return drgn_symbol_table_find(&prog->symtab, module, address, sym);
 }
 
 LIBDRGN_PUBLIC struct drgn_error *
@@ -865,6 +1027,79 @@ drgn_program_find_symbol(struct drgn_program *prog, uint64_t address,
 	return NULL;
 }
 
+LIBDRGN_PUBLIC struct drgn_error *
+drgn_program_find_symbols(struct drgn_program *prog, const uint64_t *addresses,
+			  size_t num_addresses, struct drgn_symbol **ret)
+{
+	struct drgn_error *err;
+	size_t i;
+
+	for (i = 0; i < num_addresses; i++) {
+		struct drgn_symbol sym;
+
+		err = drgn_program_find_symbol_internal(prog, addresses[i],
+							&sym);
+		if (err == &drgn_not_found) {
+			ret[i] = NULL;
+			continue;
+		} else if (err) {
+			goto err;
+		}
+		ret[i] = malloc(sizeof(*ret[i]));
+		if (!ret[i]) {
+			err = &drgn_enomem;
+			goto err;
+		}
+		*ret[i] = sym;
+	}
+	return NULL;
+
+err:
+	while (i-- > 0)
+		drgn_symbol_destroy(ret[i]);
+	return err;
+}
+
+/* Get the Dwfl of a program if it has one, without creating it. */
+static Dwfl *drgn_program_dwfl(struct drgn_program *prog)
+{
+	return prog->_dicache ? prog->_dicache->dindex.dwfl : NULL;
+}
+
+LIBDRGN_PUBLIC struct drgn_error *
+drgn_program_find_symbol_by_name(struct drgn_program *prog, const char *name,
+				 struct drgn_symbol **ret)
+{
+	struct drgn_error *err;
+	struct drgn_symbol *sym;
+
+	sym = malloc(sizeof(*sym));
+	if (!sym)
+		return &drgn_enomem;
+	err = drgn_symbol_table_find_by_name(&prog->symtab,
+					     drgn_program_dwfl(prog), name,
+					     sym);
+	if (err) {
+		free(sym);
+		if (err == &drgn_not_found) {
+			err = drgn_error_format(DRGN_ERROR_LOOKUP,
+						"could not find symbol '%s'",
+						name);
+		}
+		return err;
+	}
+	*ret = sym;
+	return NULL;
+}
+
+LIBDRGN_PUBLIC struct drgn_error *
+drgn_program_search_symbols(struct drgn_program *prog, const char *pattern,
+			    struct drgn_symbol ***syms_ret, size_t *count_ret)
+{
+	return drgn_symbol_table_search(&prog->symtab, drgn_program_dwfl(prog),
+					pattern, syms_ret, count_ret);
+}
+
 LIBDRGN_PUBLIC struct drgn_error *
 drgn_program_element_info(struct drgn_program *prog, struct drgn_type *type,
 			  struct drgn_element_info *ret)
@@ -19,7 +19,9 @@
 
 #include "memory_reader.h"
 #include "object_index.h"
+#include "kallsyms.h"
 #include "platform.h"
+#include "symbol.h"
 #include "type_index.h"
 
 /**
@@ -46,8 +48,11 @@ struct vmcoreinfo {
 	 * is enabled.
 	 */
 	uint64_t kaslr_offset;
+	/** Locations of the kallsyms tables from @c SYMBOL() entries. */
+	struct kallsyms_locations kallsyms;
 };
 
+struct drgn_btf;
 struct drgn_dwarf_info_cache;
 struct drgn_dwarf_index;
 
@@ -56,8 +61,19 @@ struct drgn_program {
 	struct drgn_memory_reader reader;
 	struct drgn_type_index tindex;
 	struct drgn_object_index oindex;
+	struct drgn_symbol_table symtab;
 	struct drgn_memory_file_segment *file_segments;
 	size_t num_file_segments;
+	/* Mapping of core_fd, or NULL if it is not mapped. */
+	void *core_map;
+	size_t core_map_size;
+	/* See @ref drgn_program_set_memory_cache(). */
+	size_t memory_cache_size;
+	uint64_t memory_cache_max_age;
+	/* See @ref drgn_program_set_num_threads(). */
+	int num_threads;
+	/* See @ref drgn_program_set_lazy_kernel_modules(). */
+	bool lazy_kernel_modules;
 	/*
 	 * Valid iff <tt>flags & DRGN_PROGRAM_IS_LINUX_KERNEL</tt>.
 	 */
@@ -72,9 +88,12 @@ struct drgn_program {
 	kdump_ctx_t *kdump_ctx;
 #endif
 	struct drgn_dwarf_info_cache *_dicache;
+	/* See @ref drgn_program_load_btf(). */
+	struct drgn_btf *_btf;
 	/* See @ref drgn_object_stack_trace_next_thread(). */
-	const struct drgn_object *stack_trace_obj;
-	/* See @ref drgn_object_stack_trace(). */
+	const struct drgn_object * const *stack_trace_objs;
+	size_t num_stack_trace_objs;
+	/* See @ref drgn_program_stack_traces(). */
 	struct drgn_error *stack_trace_err;
 	int core_fd;
 	enum drgn_program_flags flags;
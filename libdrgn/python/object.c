@@ -790,8 +790,14 @@ static PyObject *DrgnObject_string(DrgnObject *self)
 	struct drgn_error *err;
 	char *str;
 	PyObject *ret;
+	bool clear;
 
+	clear = set_drgn_in_python();
+	Py_BEGIN_ALLOW_THREADS
 	err = drgn_object_read_c_string(&self->obj, &str);
+	Py_END_ALLOW_THREADS
+	if (clear)
+		clear_drgn_in_python();
 	if (err)
 		return set_drgn_error(err);
 
@@ -821,6 +827,7 @@ static DrgnObject *DrgnObject_read(DrgnObject *self)
 {
 	struct drgn_error *err;
 	DrgnObject *res;
+	bool clear;
 
 	if (!self->obj.is_reference) {
 		Py_INCREF(self);
@@ -831,7 +838,12 @@ static DrgnObject *DrgnObject_read(DrgnObject *self)
 	if (!res)
 		return NULL;
 
+	clear = set_drgn_in_python();
+	Py_BEGIN_ALLOW_THREADS
 	err = drgn_object_read(&res->obj, &self->obj);
+	Py_END_ALLOW_THREADS
+	if (clear)
+		clear_drgn_in_python();
 	if (err) {
 		Py_DECREF(res);
 		return set_drgn_error(err);
@@ -1419,25 +1431,26 @@ static DrgnObject *DrgnObject_member(DrgnObject *self, PyObject *args,
 static PyObject *DrgnObject_getattro(DrgnObject *self, PyObject *attr_name)
 {
 	struct drgn_error *err;
-	PyObject *attr;
-	PyObject *exc_type, *exc_value, *exc_traceback;
 	const char *name;
 	DrgnObject *res;
 
-	attr = PyObject_GenericGetAttr((PyObject *)self, attr_name);
-	if (attr || !PyErr_ExceptionMatches(PyExc_AttributeError))
-		return attr;
-	PyErr_Fetch(&exc_type, &exc_value, &exc_traceback);
+	/*
+	 * Attributes and methods take precedence over members. Objects don't
+	 * have an instance dictionary, so checking the type is enough, and it
+	 * avoids creating and discarding an AttributeError for every member
+	 * access.
+	 */
+	if (!PyUnicode_Check(attr_name) ||
+	    _PyType_Lookup(Py_TYPE(self), attr_name))
+		return PyObject_GenericGetAttr((PyObject *)self, attr_name);
 
 	name = PyUnicode_AsUTF8(attr_name);
-	if (!name) {
-		res = NULL;
-		goto out;
-	}
+	if (!name)
+		return NULL;
 
 	res = DrgnObject_alloc(DrgnObject_prog(self));
 	if (!res)
-		goto out;
+		return NULL;
 
 	if (self->obj.kind == DRGN_OBJECT_UNSIGNED) {
 		err = drgn_object_member_dereference(&res->obj, &self->obj,
@@ -1446,26 +1459,23 @@ static PyObject *DrgnObject_getattro(DrgnObject *self, PyObject *attr_name)
 		err = drgn_object_member(&res->obj, &self->obj, name);
 	}
 	if (err) {
-		Py_CLEAR(res);
+		Py_DECREF(res);
 		if (err->code == DRGN_ERROR_TYPE) {
 			/*
 			 * If the object isn't a structure or union, raise the
-			 * original AttributeError.
+			 * usual AttributeError.
 			 */
-			PyErr_Restore(exc_type, exc_value, exc_traceback);
-			return NULL;
+			drgn_error_destroy(err);
+			return PyObject_GenericGetAttr((PyObject *)self,
+						       attr_name);
 		} else if (err->code == DRGN_ERROR_LOOKUP) {
 			PyErr_SetString(PyExc_AttributeError, err->message);
 			drgn_error_destroy(err);
 		} else {
 			set_drgn_error(err);
 		}
-		goto out;
+		return NULL;
 	}
-out:
-	Py_XDECREF(exc_traceback);
-	Py_XDECREF(exc_value);
-	Py_DECREF(exc_type);
 	return (PyObject *)res;
 }
 
@@ -1685,6 +1695,57 @@ static PyNumberMethods DrgnObject_as_number = {
 	(unaryfunc)DrgnObject_index,	/* nb_index */
 };
 
+static int DrgnObject_getbuffer(DrgnObject *self, Py_buffer *view, int flags)
+{
+	struct drgn_error *err;
+	const struct drgn_object *obj = &self->obj;
+	const void *buf;
+	uint64_t size;
+
+	if (obj->is_reference) {
+		if (obj->reference.bit_offset || obj->bit_size % 8) {
+			PyErr_SetString(PyExc_BufferError,
+					"object is not byte-aligned");
+			return -1;
+		}
+		size = obj->bit_size / 8;
+		err = drgn_memory_reader_borrow(&obj->prog->reader,
+						obj->reference.address, size,
+						false, &buf);
+		if (err == &drgn_not_found) {
+			PyErr_SetString(PyExc_BufferError,
+					"object memory cannot be accessed without copying; use read_()");
+			return -1;
+		} else if (err) {
+			set_drgn_error(err);
+			return -1;
+		}
+	} else if (obj->kind == DRGN_OBJECT_BUFFER) {
+		if (obj->value.bit_offset || obj->bit_size % 8) {
+			PyErr_SetString(PyExc_BufferError,
+					"object is not byte-aligned");
+			return -1;
+		}
+		size = obj->bit_size / 8;
+		buf = drgn_object_buffer(obj);
+	} else {
+		PyErr_SetString(PyExc_BufferError,
+				"object does not have a buffer value");
+		return -1;
+	}
+	if (size > PY_SSIZE_T_MAX) {
+		PyErr_SetString(PyExc_BufferError, "object is too large");
+		return -1;
+	}
+	return PyBuffer_FillInfo(view, (PyObject *)self, (void *)buf, size, 1,
+				 flags);
+}
+
+static PyBufferProcs DrgnObject_as_buffer = {
+	(getbufferproc)DrgnObject_getbuffer,	/* bf_getbuffer */
+	NULL,					/* bf_releasebuffer */
+};
+
 static PyMappingMethods DrgnObject_as_mapping = {
 	(lenfunc)DrgnObject_length,		/* mp_length */
 	(binaryfunc)DrgnObject_subscript,	/* mp_subscript */
@@ -1709,7 +1770,7 @@ PyTypeObject DrgnObject_type = {
 	(reprfunc)DrgnObject_str,		/* tp_str */
 	(getattrofunc)DrgnObject_getattro,	/* tp_getattro */
 	NULL,					/* tp_setattro */
-	NULL,					/* tp_as_buffer */
+	&DrgnObject_as_buffer,			/* tp_as_buffer */
 	Py_TPFLAGS_DEFAULT,			/* tp_flags */
 	drgn_Object_DOC,			/* tp_doc */
 	NULL,					/* tp_traverse */
@@ -191,14 +191,74 @@ static PyObject *Program_add_memory_segment(Program *self, PyObject *args,
 
 	if (Program_hold_object(self, read_fn) == -1)
 		return NULL;
+	/*
+	 * This waits for reads in other threads, which may need the GIL for
+	 * their read callbacks.
+	 */
+	Py_BEGIN_ALLOW_THREADS
 	err = drgn_program_add_memory_segment(&self->prog, address, size,
 					      py_memory_read_fn, read_fn,
 					      physical);
+	Py_END_ALLOW_THREADS
 	if (err)
 		return set_drgn_error(err);
 	Py_RETURN_NONE;
 }
 
+/*
+ * The argument passed to py_type_find_fn() and py_object_find_fn() is a tuple
+ * of (prog, fn, names), where names is a frozenset of the names that the finder
+ * covers or None if it may find any name.
+ */
+static PyObject *Program_finder_arg(Program *self, PyObject *fn,
+				    PyObject *names_obj)
+{
+	PyObject *names, *arg;
+	int ret;
+
+	if (!PyCallable_Check(fn)) {
+		PyErr_SetString(PyExc_TypeError, "fn must be callable");
+		return NULL;
+	}
+
+	if (!names_obj || names_obj == Py_None) {
+		Py_INCREF(Py_None);
+		names = Py_None;
+	} else {
+		if (PyUnicode_Check(names_obj)) {
+			PyErr_SetString(PyExc_TypeError,
+					"names must be an iterable of str or None");
+			return NULL;
+		}
+		names = PyFrozenSet_New(names_obj);
+		if (!names)
+			return NULL;
+	}
+
+	arg = Py_BuildValue("OON", self, fn, names);
+	if (!arg)
+		return NULL;
+	ret = Program_hold_object(self, arg);
+	Py_DECREF(arg);
+	if (ret == -1)
+		return NULL;
+	return arg;
+}
+
+/*
+ * Check whether a finder may find the given name. Returns 1 if it may, 0 if it
+ * doesn't cover the name (so the Python callback can be skipped), and -1 on
+ * error.
+ */
+static int py_finder_covers(PyObject *arg, PyObject *name_obj)
+{
+	PyObject *names = PyTuple_GET_ITEM(arg, 2);
+
+	if (names == Py_None)
+		return 1;
+	return PySet_Contains(names, name_obj);
+}
+
 static struct drgn_error *py_type_find_fn(enum drgn_type_kind kind,
 					  const char *name, size_t name_len,
 					  const char *filename, void *arg,
@@ -206,22 +266,33 @@ static struct drgn_error *py_type_find_fn(enum drgn_type_kind kind,
 {
 	struct drgn_error *err;
 	PyGILState_STATE gstate;
-	PyObject *kind_obj, *name_obj;
+	PyObject *name_obj, *kind_obj;
 	PyObject *type_obj;
+	int r;
 
 	gstate = PyGILState_Ensure();
-	kind_obj = PyObject_CallFunction(TypeKind_class, "k", kind);
-	if (!kind_obj) {
+	name_obj = PyUnicode_FromStringAndSize(name, name_len);
+	if (!name_obj) {
 		err = drgn_error_from_python();
 		goto out_gstate;
 	}
-	name_obj = PyUnicode_FromStringAndSize(name, name_len);
-	if (!name_obj) {
+	r = py_finder_covers(arg, name_obj);
+	if (r == -1) {
+		err = drgn_error_from_python();
+		goto out_name_obj;
+	} else if (!r) {
+		err = &drgn_not_found;
+		goto out_name_obj;
+	}
+
+	kind_obj = PyObject_CallFunction(TypeKind_class, "k", kind);
+	if (!kind_obj) {
 		err = drgn_error_from_python();
-		goto out_kind_obj;
+		goto out_name_obj;
 	}
 	type_obj = PyObject_CallFunction(PyTuple_GET_ITEM(arg, 1), "OOs",
 					 kind_obj, name_obj, filename);
+	Py_DECREF(kind_obj);
 	if (!type_obj) {
 		err = drgn_error_from_python();
 		goto out_name_obj;
@@ -249,8 +320,6 @@ out_type_obj:
 	Py_DECREF(type_obj);
 out_name_obj:
 	Py_DECREF(name_obj);
-out_kind_obj:
-	Py_DECREF(kind_obj);
 out_gstate:
 	PyGILState_Release(gstate);
 	return err;
@@ -259,29 +328,21 @@ out_gstate:
 static PyObject *Program_add_type_finder(Program *self, PyObject *args,
 					 PyObject *kwds)
 {
-	static char *keywords[] = {"fn", NULL};
+	static char *keywords[] = {"fn", "names", "cache", NULL};
 	struct drgn_error *err;
-	PyObject *fn, *arg;
-	int ret;
+	PyObject *fn, *names = NULL, *arg;
+	int cache = 0;
 
-	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O:add_type_finder",
-					 keywords, &fn))
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|$Op:add_type_finder",
+					 keywords, &fn, &names, &cache))
 	    return NULL;
 
-	if (!PyCallable_Check(fn)) {
-		PyErr_SetString(PyExc_TypeError, "fn must be callable");
-		return NULL;
-	}
-
-	arg = Py_BuildValue("OO", self, fn);
+	arg = Program_finder_arg(self, fn, names);
 	if (!arg)
 		return NULL;
-	ret = Program_hold_object(self, arg);
-	Py_DECREF(arg);
-	if (ret == -1)
-		return NULL;
 
-	err = drgn_program_add_type_finder(&self->prog, py_type_find_fn, arg);
+	err = drgn_type_index_add_finder(&self->prog.tindex, py_type_find_fn,
+					 arg, cache);
 	if (err)
 		return set_drgn_error(err);
 	Py_RETURN_NONE;
@@ -296,6 +357,7 @@ static struct drgn_error *py_object_find_fn(const char *name, size_t name_len,
 	PyGILState_STATE gstate;
 	PyObject *name_obj, *flags_obj;
 	PyObject *obj;
+	int r;
 
 	gstate = PyGILState_Ensure();
 	name_obj = PyUnicode_FromStringAndSize(name, name_len);
@@ -303,6 +365,15 @@ static struct drgn_error *py_object_find_fn(const char *name, size_t name_len,
 		err = drgn_error_from_python();
 		goto out_gstate;
 	}
+	r = py_finder_covers(arg, name_obj);
+	if (r == -1) {
+		err = drgn_error_from_python();
+		goto out_name_obj;
+	} else if (!r) {
+		err = &drgn_not_found;
+		goto out_name_obj;
+	}
+
 	flags_obj = PyObject_CallFunction(FindObjectFlags_class, "i",
 					  (int)flags);
 	if (!flags_obj) {
@@ -312,9 +383,10 @@ static struct drgn_error *py_object_find_fn(const char *name, size_t name_len,
 	obj = PyObject_CallFunction(PyTuple_GET_ITEM(arg, 1), "OOOs",
 				    PyTuple_GET_ITEM(arg, 0), name_obj,
 				    flags_obj, filename);
+	Py_DECREF(flags_obj);
 	if (!obj) {
 		err = drgn_error_from_python();
-		goto out_flags_obj;
+		goto out_name_obj;
 	}
 	if (obj == Py_None) {
 		err = &drgn_not_found;
@@ -330,8 +402,6 @@ static struct drgn_error *py_object_find_fn(const char *name, size_t name_len,
 	err = drgn_object_copy(ret, &((DrgnObject *)obj)->obj);
 out_obj:
 	Py_DECREF(obj);
-out_flags_obj:
-	Py_DECREF(flags_obj);
 out_name_obj:
 	Py_DECREF(name_obj);
 out_gstate:
@@ -342,30 +412,21 @@ out_gstate:
 static PyObject *Program_add_object_finder(Program *self, PyObject *args,
 					   PyObject *kwds)
 {
-	static char *keywords[] = {"fn", NULL};
+	static char *keywords[] = {"fn", "names", "cache", NULL};
 	struct drgn_error *err;
-	PyObject *fn, *arg;
-	int ret;
+	PyObject *fn, *names = NULL, *arg;
+	int cache = 0;
 
-	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O:add_object_finder",
-					 keywords, &fn))
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|$Op:add_object_finder",
+					 keywords, &fn, &names, &cache))
 	    return NULL;
 
-	if (!PyCallable_Check(fn)) {
-		PyErr_SetString(PyExc_TypeError, "fn must be callable");
-		return NULL;
-	}
-
-	arg = Py_BuildValue("OO", self, fn);
+	arg = Program_finder_arg(self, fn, names);
 	if (!arg)
 		return NULL;
-	ret = Program_hold_object(self, arg);
-	Py_DECREF(arg);
-	if (ret == -1)
-		return NULL;
 
-	err = drgn_program_add_object_finder(&self->prog, py_object_find_fn,
-					     arg);
+	err = drgn_object_index_add_finder(&self->prog.oindex,
+					   py_object_find_fn, arg, cache);
 	if (err)
 		return set_drgn_error(err);
 	Py_RETURN_NONE;
@@ -382,6 +443,12 @@ static PyObject *Program_set_core_dump(Program *self, PyObject *args,
 					 keywords, path_converter, &path))
 		return NULL;
 
+	/*
+	 * This keeps the GIL, which serializes it with other uses of the
+	 * program. It fails unless the program has no memory segments, so no
+	 * read callback can be holding the memory reader lock while waiting for
+	 * the GIL.
+	 */
 	err = drgn_program_set_core_dump(&self->prog, path.path);
 	path_cleanup(&path);
 	if (err)
@@ -393,6 +460,7 @@ static PyObject *Program_set_kernel(Program *self)
 {
 	struct drgn_error *err;
 
+	/* This keeps the GIL; see Program_set_core_dump(). */
 	err = drgn_program_set_kernel(&self->prog);
 	if (err)
 		return set_drgn_error(err);
@@ -409,6 +477,7 @@ static PyObject *Program_set_pid(Program *self, PyObject *args, PyObject *kwds)
 					 &pid))
 		return NULL;
 
+	/* This keeps the GIL; see Program_set_core_dump(). */
 	err = drgn_program_set_pid(&self->prog, pid);
 	if (err)
 		return set_drgn_error(err);
@@ -418,17 +487,18 @@ static PyObject *Program_set_pid(Program *self, PyObject *args, PyObject *kwds)
 static PyObject *Program_load_debug_info(Program *self, PyObject *args,
 					 PyObject *kwds)
 {
-	static char *keywords[] = {"paths", "default", NULL};
+	static char *keywords[] = {"paths", "default", "lazy", NULL};
 	struct drgn_error *err;
 	PyObject *paths_obj, *it, *item;
 	struct path_arg *path_args = NULL;
 	Py_ssize_t length_hint;
 	size_t n = 0, i;
 	const char **paths;
-	int load_default = 0;
+	int load_default = 0, lazy = 0;
 
-	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|p:load_debug_info",
-					 keywords, &paths_obj, &load_default))
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|pp:load_debug_info",
+					 keywords, &paths_obj, &load_default,
+					 &lazy))
 		return NULL;
 
 	it = PyObject_GetIter(paths_obj);
@@ -474,7 +544,8 @@ static PyObject *Program_load_debug_info(Program *self, PyObject *args,
 	}
 	for (i = 0; i < n; i++)
 		paths[i] = path_args[i].path;
-	err = drgn_program_load_debug_info(&self->prog, paths, n, load_default);
+	err = drgn_program_load_debug_info(&self->prog, paths, n, load_default,
+					   lazy);
 	free(paths);
 	if (err)
 		set_drgn_error(err);
@@ -491,7 +562,35 @@ static PyObject *Program_load_default_debug_info(Program *self)
 {
 	struct drgn_error *err;
 
-	err = drgn_program_load_debug_info(&self->prog, NULL, 0, true);
+	err = drgn_program_load_debug_info(&self->prog, NULL, 0, true, false);
+	if (err)
+		return set_drgn_error(err);
+	Py_RETURN_NONE;
+}
+
+static PyObject *Program_load_kallsyms(Program *self)
+{
+	struct drgn_error *err;
+
+	err = drgn_program_load_kallsyms(&self->prog);
+	if (err)
+		return set_drgn_error(err);
+	Py_RETURN_NONE;
+}
+
+static PyObject *Program_load_btf(Program *self, PyObject *args,
+				  PyObject *kwds)
+{
+	static char *keywords[] = {"path", NULL};
+	struct drgn_error *err;
+	struct path_arg path = { .allow_none = true };
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "|O&:load_btf", keywords,
+					 path_converter, &path))
+		return NULL;
+
+	err = drgn_program_load_btf(&self->prog, path.path);
+	path_cleanup(&path);
 	if (err)
 		return set_drgn_error(err);
 	Py_RETURN_NONE;
@@ -519,8 +618,10 @@ static PyObject *Program_read(Program *self, PyObject *args, PyObject *kwds)
 	if (!buf)
 		return NULL;
 	clear = set_drgn_in_python();
+	Py_BEGIN_ALLOW_THREADS
 	err = drgn_program_read_memory(&self->prog, PyBytes_AS_STRING(buf),
 				       address, size, physical);
+	Py_END_ALLOW_THREADS
 	if (clear)
 		clear_drgn_in_python();
 	if (err) {
@@ -530,6 +631,248 @@ static PyObject *Program_read(Program *self, PyObject *args, PyObject *kwds)
 	return buf;
 }
 
+static PyObject *Program_read_into(Program *self, PyObject *args,
+				   PyObject *kwds)
+{
+	static char *keywords[] = {"buffer", "address", "physical", NULL};
+	struct drgn_error *err;
+	Py_buffer buffer;
+	unsigned long long address;
+	int physical = 0;
+	bool clear;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "w*K|p:read_into",
+					 keywords, &buffer, &address,
+					 &physical))
+		return NULL;
+
+	clear = set_drgn_in_python();
+	Py_BEGIN_ALLOW_THREADS
+	err = drgn_program_read_memory(&self->prog, buffer.buf, address,
+				       buffer.len, physical);
+	Py_END_ALLOW_THREADS
+	if (clear)
+		clear_drgn_in_python();
+	PyBuffer_Release(&buffer);
+	if (err)
+		return set_drgn_error(err);
+	Py_RETURN_NONE;
+}
+
+static Py_ssize_t read_many_size_arg(PyObject *obj)
+{
+	PyObject *index_obj;
+	Py_ssize_t size;
+
+	index_obj = PyNumber_Index(obj);
+	if (!index_obj)
+		return -1;
+	size = PyLong_AsSsize_t(index_obj);
+	Py_DECREF(index_obj);
+	if (size == -1 && PyErr_Occurred())
+		return -1;
+	if (size < 0) {
+		PyErr_SetString(PyExc_ValueError, "negative size");
+		return -1;
+	}
+	return size;
+}
+
+static PyObject *Program_read_many(Program *self, PyObject *args,
+				   PyObject *kwds)
+{
+	static char *keywords[] = {
+		"addresses", "size", "physical", "fault_ok", NULL,
+	};
+	struct drgn_error *err;
+	PyObject *addresses_obj, *size_obj;
+	int physical = 0, fault_ok = 0;
+	PyObject *addresses, *sizes = NULL;
+	Py_ssize_t n, i, size = 0;
+	struct drgn_memory_read_request *reqs = NULL;
+	PyObject *ret = NULL;
+	bool clear;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO|pp:read_many",
+					 keywords, &addresses_obj, &size_obj,
+					 &physical, &fault_ok))
+		return NULL;
+
+	addresses = PySequence_Fast(addresses_obj,
+				    "addresses must be sequence");
+	if (!addresses)
+		return NULL;
+	n = PySequence_Fast_GET_SIZE(addresses);
+	if (PyIndex_Check(size_obj)) {
+		size = read_many_size_arg(size_obj);
+		if (size == -1)
+			goto out;
+	} else {
+		sizes = PySequence_Fast(size_obj,
+					"size must be integer or sequence");
+		if (!sizes)
+			goto out;
+		if (PySequence_Fast_GET_SIZE(sizes) != n) {
+			PyErr_SetString(PyExc_ValueError,
+					"addresses and size must have the same length");
+			goto out;
+		}
+	}
+
+	reqs = calloc(n ? n : 1, sizeof(*reqs));
+	if (!reqs) {
+		PyErr_NoMemory();
+		goto out;
+	}
+	ret = PyList_New(n);
+	if (!ret)
+		goto out;
+	for (i = 0; i < n; i++) {
+		PyObject *buf;
+
+		reqs[i].address = index_arg(PySequence_Fast_GET_ITEM(addresses, i),
+					    "address must be integer");
+		if (reqs[i].address == (unsigned long long)-1 &&
+		    PyErr_Occurred())
+			goto err;
+		if (sizes) {
+			size = read_many_size_arg(PySequence_Fast_GET_ITEM(sizes,
+									   i));
+			if (size == -1)
+				goto err;
+		}
+		buf = PyBytes_FromStringAndSize(NULL, size);
+		if (!buf)
+			goto err;
+		PyList_SET_ITEM(ret, i, buf);
+		reqs[i].buf = PyBytes_AS_STRING(buf);
+		reqs[i].count = size;
+	}
+
+	clear = set_drgn_in_python();
+	Py_BEGIN_ALLOW_THREADS
+	err = drgn_memory_reader_read_many(&self->prog.reader, reqs, n,
+					   physical);
+	Py_END_ALLOW_THREADS
+	if (clear)
+		clear_drgn_in_python();
+	if (err) {
+		set_drgn_error(err);
+		goto err;
+	}
+	for (i = 0; i < n; i++) {
+		if (!reqs[i].err)
+			continue;
+		if (!fault_ok) {
+			set_drgn_error(reqs[i].err);
+			reqs[i].err = NULL;
+			goto err;
+		}
+		drgn_error_destroy(reqs[i].err);
+		reqs[i].err = NULL;
+		Py_INCREF(Py_None);
+		PyList_SetItem(ret, i, Py_None);
+	}
+	goto out;
+
+err:
+	Py_CLEAR(ret);
+out:
+	if (reqs) {
+		for (i = 0; i < n; i++)
+			drgn_error_destroy(reqs[i].err);
+		free(reqs);
+	}
+	Py_XDECREF(sizes);
+	Py_DECREF(addresses);
+	return ret;
+}
+
+static PyObject *Program_set_memory_cache(Program *self, PyObject *args,
+					  PyObject *kwds)
+{
+	static char *keywords[] = {"size", "max_age", NULL};
+	Py_ssize_t size;
+	PyObject *max_age_obj = Py_None;
+	uint64_t max_age;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "n|O:set_memory_cache",
+					 keywords, &size, &max_age_obj))
+		return NULL;
+
+	if (size < 0) {
+		PyErr_SetString(PyExc_ValueError, "negative size");
+		return NULL;
+	}
+	if (max_age_obj == Py_None) {
+		max_age = 0;
+	} else {
+		double seconds;
+
+		seconds = PyFloat_AsDouble(max_age_obj);
+		if (seconds == -1.0 && PyErr_Occurred())
+			return NULL;
+		if (!(seconds > 0.0)) {
+			PyErr_SetString(PyExc_ValueError,
+					"max_age must be positive");
+			return NULL;
+		}
+		if (seconds >= UINT64_MAX / 1000000000.0)
+			max_age = UINT64_MAX;
+		else if (seconds < 1e-9)
+			max_age = 1;
+		else
+			max_age = seconds * 1000000000.0;
+	}
+	Py_BEGIN_ALLOW_THREADS
+	drgn_program_set_memory_cache(&self->prog, size, max_age);
+	Py_END_ALLOW_THREADS
+	Py_RETURN_NONE;
+}
+
+static PyObject *Program_flush_memory_cache(Program *self)
+{
+	Py_BEGIN_ALLOW_THREADS
+	drgn_program_flush_memory_cache(&self->prog);
+	Py_END_ALLOW_THREADS
+	Py_RETURN_NONE;
+}
+
+static PyObject *Program_memory_usage(Program *self)
+{
+	struct drgn_program_memory_usage usage;
+
+	drgn_program_memory_usage(&self->prog, &usage);
+	return Py_BuildValue("{s:n,s:n,s:n}", "types", (Py_ssize_t)usage.types,
+			     "dwarf_index", (Py_ssize_t)usage.dwarf_index,
+			     "caches", (Py_ssize_t)usage.caches);
+}
+
+static PyObject *Program_dwarf_index_stats(Program *self)
+{
+	struct drgn_dwarf_index_stats stats;
+
+	drgn_program_dwarf_index_stats(&self->prog, &stats);
+	return Py_BuildValue("{s:n,s:n,s:n,s:n,s:n,s:n,s:n,s:i,s:n,s:d,s:d,s:d,s:d,s:d,s:d}",
+			     "num_shards", (Py_ssize_t)stats.num_shards,
+			     "num_names", (Py_ssize_t)stats.num_names,
+			     "num_dies", (Py_ssize_t)stats.num_dies,
+			     "min_shard_dies", (Py_ssize_t)stats.min_shard_dies,
+			     "max_shard_dies", (Py_ssize_t)stats.max_shard_dies,
+			     "die_size", (Py_ssize_t)stats.die_size,
+			     "shard_bytes", (Py_ssize_t)stats.shard_bytes,
+			     "num_threads", stats.num_threads,
+			     "num_decompressed_sections",
+			     (Py_ssize_t)stats.num_decompressed_sections,
+			     "cu_discovery_time", stats.cu_discovery_ns / 1e9,
+			     "decompression_time", stats.decompression_ns / 1e9,
+			     "relocation_time", stats.relocation_ns / 1e9,
+			     "abbrev_parsing_time",
+			     stats.abbrev_parsing_ns / 1e9,
+			     "die_scan_time", stats.die_scan_ns / 1e9,
+			     "cache_write_time", stats.cache_write_ns / 1e9);
+}
+
 static PyObject *Program_find_type(Program *self, PyObject *args, PyObject *kwds)
 {
 	static char *keywords[] = {"name", "filename", NULL};
@@ -671,6 +1014,21 @@ static DrgnObject *Program_variable(Program *self, PyObject *args,
 				   DRGN_FIND_OBJECT_VARIABLE);
 }
 
+/* Create a StackTrace object which takes ownership of trace. */
+static StackTrace *Program_wrap_stack_trace(Program *self,
+					    struct drgn_stack_trace *trace)
+{
+	StackTrace *ret;
+
+	ret = (StackTrace *)StackTrace_type.tp_alloc(&StackTrace_type, 0);
+	if (!ret)
+		return NULL;
+	ret->trace = trace;
+	ret->prog = self;
+	Py_INCREF(self);
+	return ret;
+}
+
 static StackTrace *Program_stack_trace(Program *self, PyObject *args,
 				       PyObject *kwds)
 {
@@ -687,26 +1045,115 @@ static StackTrace *Program_stack_trace(Program *self, PyObject *args,
 	err = drgn_object_stack_trace(&task->obj, &trace);
 	if (err)
 		return set_drgn_error(err);
-	ret = (StackTrace *)StackTrace_type.tp_alloc(&StackTrace_type, 0);
-	if (!ret) {
+	ret = Program_wrap_stack_trace(self, trace);
+	if (!ret)
 		drgn_stack_trace_destroy(trace);
+	return ret;
+}
+
+/* Convert an error to a new reference to a Python exception instance. */
+static PyObject *exception_from_drgn_error(struct drgn_error *err)
+{
+	PyObject *exc_type, *exc_value, *exc_traceback;
+
+	set_drgn_error(err);
+	PyErr_Fetch(&exc_type, &exc_value, &exc_traceback);
+	PyErr_NormalizeException(&exc_type, &exc_value, &exc_traceback);
+	Py_XDECREF(exc_traceback);
+	Py_XDECREF(exc_type);
+	return exc_value;
+}
+
+static PyObject *Program_stack_traces(Program *self, PyObject *args,
+				      PyObject *kwds)
+{
+	static char *keywords[] = {"threads", NULL};
+	struct drgn_error *err;
+	PyObject *threads_obj, *threads;
+	Py_ssize_t n, i;
+	const struct drgn_object **objs = NULL;
+	struct drgn_stack_trace **traces = NULL;
+	struct drgn_error **errs = NULL;
+	PyObject *ret = NULL;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O:stack_traces", keywords,
+					 &threads_obj))
+		return NULL;
+
+	threads = PySequence_Fast(threads_obj, "threads must be sequence");
+	if (!threads)
 		return NULL;
+	n = PySequence_Fast_GET_SIZE(threads);
+	objs = malloc((n ? n : 1) * sizeof(*objs));
+	traces = malloc((n ? n : 1) * sizeof(*traces));
+	errs = malloc((n ? n : 1) * sizeof(*errs));
+	if (!objs || !traces || !errs) {
+		PyErr_NoMemory();
+		goto out;
 	}
-	ret->trace = trace;
-	ret->prog = self;
-	Py_INCREF(self);
+	for (i = 0; i < n; i++) {
+		PyObject *item = PySequence_Fast_GET_ITEM(threads, i);
+
+		if (!PyObject_TypeCheck(item, &DrgnObject_type)) {
+			PyErr_SetString(PyExc_TypeError,
+					"thread must be Object");
+			goto out;
+		}
+		objs[i] = &((DrgnObject *)item)->obj;
+	}
+
+	err = drgn_program_stack_traces(&self->prog, objs, n, traces, errs);
+	if (err) {
+		set_drgn_error(err);
+		goto out;
+	}
+	ret = PyList_New(n);
+	if (!ret) {
+		i = 0;
+		goto err;
+	}
+	for (i = 0; i < n; i++) {
+		PyObject *item;
+
+		if (errs[i]) {
+			item = exception_from_drgn_error(errs[i]);
+			if (!item) {
+				i++;
+				goto err;
+			}
+		} else {
+			item = (PyObject *)Program_wrap_stack_trace(self,
+								    traces[i]);
+			if (!item)
+				goto err;
+		}
+		PyList_SET_ITEM(ret, i, item);
+	}
+	goto out;
+
+err:
+	/*
+	 * Free the traces and errors that weren't handed off to a Python
+	 * object.
+	 */
+	for (; i < n; i++) {
+		drgn_stack_trace_destroy(traces[i]);
+		drgn_error_destroy(errs[i]);
+	}
+	Py_CLEAR(ret);
+out:
+	free(errs);
+	free(traces);
+	free(objs);
+	Py_DECREF(threads);
 	return ret;
 }
 
-Symbol *Program_find_symbol(Program *self, uint64_t address)
+/* Create a Symbol object which takes ownership of sym. */
+static Symbol *Program_wrap_symbol(Program *self, struct drgn_symbol *sym)
 {
-	struct drgn_error *err;
-	struct drgn_symbol *sym;
 	Symbol *ret;
 
-	err = drgn_program_find_symbol(&self->prog, address, &sym);
-	if (err)
-		return set_drgn_error(err);
 	ret = (Symbol *)Symbol_type.tp_alloc(&Symbol_type, 0);
 	if (!ret) {
 		drgn_symbol_destroy(sym);
@@ -718,6 +1165,17 @@ Symbol *Program_find_symbol(Program *self, uint64_t address)
 	return ret;
 }
 
+Symbol *Program_find_symbol(Program *self, uint64_t address)
+{
+	struct drgn_error *err;
+	struct drgn_symbol *sym;
+
+	err = drgn_program_find_symbol(&self->prog, address, &sym);
+	if (err)
+		return set_drgn_error(err);
+	return Program_wrap_symbol(self, sym);
+}
+
 static Symbol *Program_symbol(Program *self, PyObject *args, PyObject *kwds)
 {
 	static char *keywords[] = {"address", NULL};
@@ -728,6 +1186,138 @@ static Symbol *Program_symbol(Program *self, PyObject *args, PyObject *kwds)
 	return Program_find_symbol(self, address);
 }
 
+static PyObject *Program_symbols(Program *self, PyObject *args, PyObject *kwds)
+{
+	static char *keywords[] = {"addresses", NULL};
+	struct drgn_error *err;
+	PyObject *addresses_obj, *addresses;
+	Py_ssize_t n, i;
+	uint64_t *values = NULL;
+	struct drgn_symbol **syms = NULL;
+	PyObject *ret = NULL;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O:symbols", keywords,
+					 &addresses_obj))
+		return NULL;
+
+	addresses = PySequence_Fast(addresses_obj,
+				    "addresses must be sequence");
+	if (!addresses)
+		return NULL;
+	n = PySequence_Fast_GET_SIZE(addresses);
+	values = malloc((n ? n : 1) * sizeof(*values));
+	syms = malloc((n ? n : 1) * sizeof(*syms));
+	if (!values || !syms) {
+		PyErr_NoMemory();
+		goto out;
+	}
+	for (i = 0; i < n; i++) {
+		values[i] = index_arg(PySequence_Fast_GET_ITEM(addresses, i),
+				      "address must be integer");
+		if (values[i] == (unsigned long long)-1 && PyErr_Occurred())
+			goto out;
+	}
+
+	err = drgn_program_find_symbols(&self->prog, values, n, syms);
+	if (err) {
+		set_drgn_error(err);
+		goto out;
+	}
+	ret = PyList_New(n);
+	if (!ret) {
+		i = 0;
+		goto err;
+	}
+	for (i = 0; i < n; i++) {
+		Symbol *sym_obj;
+
+		if (!syms[i]) {
+			Py_INCREF(Py_None);
+			PyList_SET_ITEM(ret, i, Py_None);
+			continue;
+		}
+		sym_obj = Program_wrap_symbol(self, syms[i]);
+		if (!sym_obj) {
+			i++;
+			goto err;
+		}
+		PyList_SET_ITEM(ret, i, (PyObject *)sym_obj);
+	}
+	goto out;
+
+err:
+	/* Free the symbols that weren't handed off to a Symbol object. */
+	for (; i < n; i++)
+		drgn_symbol_destroy(syms[i]);
+	Py_CLEAR(ret);
+out:
+	free(syms);
+	free(values);
+	Py_DECREF(addresses);
+	return ret;
+}
+
+static Symbol *Program_symbol_by_name(Program *self, PyObject *args,
+				      PyObject *kwds)
+{
+	static char *keywords[] = {"name", NULL};
+	struct drgn_error *err;
+	const char *name;
+	struct drgn_symbol *sym;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "s:symbol_by_name",
+					 keywords, &name))
+		return NULL;
+
+	err = drgn_program_find_symbol_by_name(&self->prog, name, &sym);
+	if (err)
+		return set_drgn_error(err);
+	return Program_wrap_symbol(self, sym);
+}
+
+static PyObject *Program_search_symbols(Program *self, PyObject *args,
+					PyObject *kwds)
+{
+	static char *keywords[] = {"pattern", NULL};
+	struct drgn_error *err;
+	const char *pattern;
+	struct drgn_symbol **syms;
+	size_t count, i;
+	PyObject *ret;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "s:search_symbols",
+					 keywords, &pattern))
+		return NULL;
+
+	err = drgn_program_search_symbols(&self->prog, pattern, &syms, &count);
+	if (err)
+		return set_drgn_error(err);
+	ret = PyList_New(count);
+	if (!ret) {
+		i = 0;
+		goto err;
+	}
+	for (i = 0; i < count; i++) {
+		Symbol *sym_obj;
+
+		sym_obj = Program_wrap_symbol(self, syms[i]);
+		if (!sym_obj) {
+			i++;
+			goto err;
+		}
+		PyList_SET_ITEM(ret, i, (PyObject *)sym_obj);
+	}
+	free(syms);
+	return ret;
+
+err:
+	for (; i < count; i++)
+		drgn_symbol_destroy(syms[i]);
+	free(syms);
+	Py_XDECREF(ret);
+	return NULL;
+}
+
 static DrgnObject *Program_subscript(Program *self, PyObject *key)
 {
 	struct drgn_error *err;
@@ -818,6 +1408,53 @@ static PyObject *Program_get_platform(Program *self, void *arg)
 		Py_RETURN_NONE;
 }
 
+static PyObject *Program_get_num_threads(Program *self, void *arg)
+{
+	return PyLong_FromLong(drgn_program_num_threads(&self->prog));
+}
+
+static int Program_set_num_threads(Program *self, PyObject *value, void *arg)
+{
+	int num_threads;
+
+	if (!value) {
+		PyErr_SetString(PyExc_AttributeError,
+				"cannot delete num_threads attribute");
+		return -1;
+	}
+	num_threads = _PyLong_AsInt(value);
+	if (num_threads == -1 && PyErr_Occurred())
+		return -1;
+	if (num_threads < 0) {
+		PyErr_SetString(PyExc_ValueError, "negative num_threads");
+		return -1;
+	}
+	drgn_program_set_num_threads(&self->prog, num_threads);
+	return 0;
+}
+
+static PyObject *Program_get_lazy_kernel_modules(Program *self, void *arg)
+{
+	return PyBool_FromLong(drgn_program_lazy_kernel_modules(&self->prog));
+}
+
+static int Program_set_lazy_kernel_modules(Program *self, PyObject *value,
+					   void *arg)
+{
+	int lazy;
+
+	if (!value) {
+		PyErr_SetString(PyExc_AttributeError,
+				"cannot delete lazy_kernel_modules attribute");
+		return -1;
+	}
+	lazy = PyObject_IsTrue(value);
+	if (lazy == -1)
+		return -1;
+	drgn_program_set_lazy_kernel_modules(&self->prog, lazy);
+	return 0;
+}
+
 static PyMethodDef Program_methods[] = {
 	{"add_memory_segment", (PyCFunction)Program_add_memory_segment,
 	 METH_VARARGS | METH_KEYWORDS, drgn_Program_add_memory_segment_DOC},
@@ -836,10 +1473,26 @@ static PyMethodDef Program_methods[] = {
 	{"load_default_debug_info",
 	 (PyCFunction)Program_load_default_debug_info, METH_NOARGS,
 	 drgn_Program_load_default_debug_info_DOC},
+	{"load_kallsyms", (PyCFunction)Program_load_kallsyms, METH_NOARGS,
+	 drgn_Program_load_kallsyms_DOC},
+	{"load_btf", (PyCFunction)Program_load_btf,
+	 METH_VARARGS | METH_KEYWORDS, drgn_Program_load_btf_DOC},
+	{"memory_usage", (PyCFunction)Program_memory_usage, METH_NOARGS,
+	 drgn_Program_memory_usage_DOC},
+	{"dwarf_index_stats", (PyCFunction)Program_dwarf_index_stats,
+	 METH_NOARGS, drgn_Program_dwarf_index_stats_DOC},
 	{"__getitem__", (PyCFunction)Program_subscript, METH_O | METH_COEXIST,
 	 drgn_Program___getitem___DOC},
 	{"read", (PyCFunction)Program_read, METH_VARARGS | METH_KEYWORDS,
 	 drgn_Program_read_DOC},
+	{"read_into", (PyCFunction)Program_read_into,
+	 METH_VARARGS | METH_KEYWORDS, drgn_Program_read_into_DOC},
+	{"read_many", (PyCFunction)Program_read_many,
+	 METH_VARARGS | METH_KEYWORDS, drgn_Program_read_many_DOC},
+	{"set_memory_cache", (PyCFunction)Program_set_memory_cache,
+	 METH_VARARGS | METH_KEYWORDS, drgn_Program_set_memory_cache_DOC},
+	{"flush_memory_cache", (PyCFunction)Program_flush_memory_cache,
+	 METH_NOARGS, drgn_Program_flush_memory_cache_DOC},
 	{"type", (PyCFunction)Program_find_type, METH_VARARGS | METH_KEYWORDS,
 	 drgn_Program_type_DOC},
 	{"pointer_type", (PyCFunction)Program_pointer_type,
@@ -854,8 +1507,16 @@ static PyMethodDef Program_methods[] = {
 	 METH_VARARGS | METH_KEYWORDS, drgn_Program_variable_DOC},
 	{"stack_trace", (PyCFunction)Program_stack_trace,
 	 METH_VARARGS | METH_KEYWORDS, drgn_Program_stack_trace_DOC},
+	{"stack_traces", (PyCFunction)Program_stack_traces,
+	 METH_VARARGS | METH_KEYWORDS, drgn_Program_stack_traces_DOC},
 	{"symbol", (PyCFunction)Program_symbol, METH_VARARGS | METH_KEYWORDS,
 	 drgn_Program_symbol_DOC},
+	{"symbols", (PyCFunction)Program_symbols,
+	 METH_VARARGS | METH_KEYWORDS, drgn_Program_symbols_DOC},
+	{"symbol_by_name", (PyCFunction)Program_symbol_by_name,
+	 METH_VARARGS | METH_KEYWORDS, drgn_Program_symbol_by_name_DOC},
+	{"search_symbols", (PyCFunction)Program_search_symbols,
+	 METH_VARARGS | METH_KEYWORDS, drgn_Program_search_symbols_DOC},
 	{},
 };
 
@@ -868,6 +1529,11 @@ static PyMemberDef Program_members[] = {
 static PyGetSetDef Program_getset[] = {
 	{"flags", (getter)Program_get_flags, NULL, drgn_Program_flags_DOC},
 	{"platform", (getter)Program_get_platform, NULL, drgn_Program_platform_DOC},
+	{"num_threads", (getter)Program_get_num_threads,
+	 (setter)Program_set_num_threads, drgn_Program_num_threads_DOC},
+	{"lazy_kernel_modules", (getter)Program_get_lazy_kernel_modules,
+	 (setter)Program_set_lazy_kernel_modules,
+	 drgn_Program_lazy_kernel_modules_DOC},
 	{},
 };
 
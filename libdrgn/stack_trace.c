@@ -4,12 +4,15 @@
 #include <elfutils/libdwfl.h>
 #include <endian.h>
 #include <inttypes.h>
+#include <limits.h>
 #include <stdlib.h>
+#include <string.h>
 
 #include "internal.h"
 #include "program.h"
 #include "string_builder.h"
 #include "symbol.h"
+#include "vector.h"
 
 struct drgn_stack_frame {
 	struct drgn_program *prog;
@@ -144,26 +147,33 @@ err:
 }
 
 /*
- * For drgn_object_stack_trace(), we only care about the thread
- * prog->stack_trace_obj. We return it with an arbitrary PID.
+ * For drgn_program_stack_traces(), the threads are the objects in
+ * prog->stack_trace_objs. The thread argument points to the object's entry in
+ * the array, and the PID is its index plus one.
  */
-#define STACK_TRACE_OBJ_PID 1
 static pid_t drgn_object_stack_trace_next_thread(Dwfl *dwfl, void *dwfl_arg,
 						 void **thread_argp)
 {
 	struct drgn_program *prog = dwfl_arg;
-
-	if (*thread_argp || !prog->stack_trace_obj)
+	const struct drgn_object * const *objp = *thread_argp;
+
+	if (objp)
+		objp++;
+	else
+		objp = prog->stack_trace_objs;
+	if (!objp ||
+	    objp >= prog->stack_trace_objs + prog->num_stack_trace_objs)
 		return 0;
-	*thread_argp = (void *)prog->stack_trace_obj;
-	return STACK_TRACE_OBJ_PID;
+	*thread_argp = (void *)objp;
+	return objp - prog->stack_trace_objs + 1;
 }
 
 static bool drgn_linux_kernel_set_initial_registers(Dwfl_Thread *thread,
 						    void *thread_arg)
 {
 	struct drgn_error *err;
-	struct drgn_object *task_obj = thread_arg;
+	const struct drgn_object * const *objp = thread_arg;
+	struct drgn_object *task_obj = (struct drgn_object *)*objp;
 	struct drgn_program *prog = task_obj->prog;
 
 	err = prog->platform.arch->linux_kernel_set_initial_registers(thread,
@@ -176,10 +186,19 @@ static bool drgn_linux_kernel_set_initial_registers(Dwfl_Thread *thread,
 	return true;
 }
 
+DEFINE_VECTOR(drgn_stack_frame_vector, struct drgn_stack_frame)
+
 struct drgn_stack_trace_builder {
 	struct drgn_program *prog;
-	struct drgn_stack_trace *trace;
-	size_t capacity;
+	/*
+	 * Frames of the thread currently being unwound. This is reused for
+	 * every thread, and each trace is copied out at its final size.
+	 */
+	struct drgn_stack_frame_vector frames;
+	/* Returned traces, indexed by PID minus one. */
+	struct drgn_stack_trace **traces;
+	/* Returned errors for threads which couldn't be unwound. */
+	struct drgn_error **errs;
 };
 
 static int drgn_append_stack_frame(Dwfl_Frame *dwfl_frame, void *arg)
@@ -187,7 +206,6 @@ static int drgn_append_stack_frame(Dwfl_Frame *dwfl_frame, void *arg)
 	struct drgn_error *err;
 	struct drgn_stack_trace_builder *builder = arg;
 	struct drgn_program *prog = builder->prog;
-	struct drgn_stack_trace *trace = builder->trace;
 	struct drgn_stack_frame *frame;
 	Dwarf_Addr pc;
 
@@ -196,22 +214,11 @@ static int drgn_append_stack_frame(Dwfl_Frame *dwfl_frame, void *arg)
 		goto err;
 	}
 
-	if (trace->num_frames >= builder->capacity) {
-		size_t new_capacity, bytes;
-
-		if (__builtin_mul_overflow(2U, builder->capacity,
-					   &new_capacity) ||
-		    __builtin_mul_overflow(new_capacity,
-					   sizeof(trace->frames[0]), &bytes) ||
-		    __builtin_add_overflow(bytes, sizeof(*trace), &bytes) ||
-		    !(trace = realloc(trace, bytes))) {
-			err = &drgn_enomem;
-			goto err;
-		}
-		builder->trace = trace;
-		builder->capacity = new_capacity;
+	frame = drgn_stack_frame_vector_append_entry(&builder->frames);
+	if (!frame) {
+		err = &drgn_enomem;
+		goto err;
 	}
-	frame = &trace->frames[trace->num_frames++];
 	frame->prog = prog;
 	frame->pc = pc;
 	return DWARF_CB_OK;
@@ -222,20 +229,64 @@ err:
 	return DWARF_CB_ABORT;
 }
 
+static int drgn_thread_stack_trace(Dwfl_Thread *thread, void *arg)
+{
+	struct drgn_stack_trace_builder *builder = arg;
+	struct drgn_program *prog = builder->prog;
+	struct drgn_stack_trace *trace;
+	size_t bytes;
+
+	builder->frames.size = 0;
+	dwfl_thread_getframes(thread, drgn_append_stack_frame, builder);
+	/*
+	 * The error reporting for dwfl_thread_getframes() is not great. The
+	 * documentation says that some of its unwinder implementations always
+	 * return an error. So, we do our own error reporting through
+	 * prog->stack_trace_err. Running out of memory stops the whole batch;
+	 * any other error is returned for this thread only.
+	 */
+	if (prog->stack_trace_err) {
+		if (prog->stack_trace_err->code == DRGN_ERROR_NO_MEMORY)
+			return DWARF_CB_ABORT;
+		builder->errs[dwfl_thread_tid(thread) - 1] =
+			prog->stack_trace_err;
+		prog->stack_trace_err = NULL;
+		return DWARF_CB_OK;
+	}
+
+	if (__builtin_mul_overflow(builder->frames.size,
+				   sizeof(trace->frames[0]), &bytes) ||
+	    __builtin_add_overflow(bytes, sizeof(*trace), &bytes) ||
+	    !(trace = malloc(bytes))) {
+		prog->stack_trace_err = &drgn_enomem;
+		return DWARF_CB_ABORT;
+	}
+	trace->num_frames = builder->frames.size;
+	if (trace->num_frames) {
+		memcpy(trace->frames, builder->frames.data,
+		       trace->num_frames * sizeof(trace->frames[0]));
+	}
+	builder->traces[dwfl_thread_tid(thread) - 1] = trace;
+	return DWARF_CB_OK;
+}
+
 static const Dwfl_Thread_Callbacks drgn_linux_kernel_thread_callbacks = {
 	.next_thread = drgn_object_stack_trace_next_thread,
 	.memory_read = drgn_thread_memory_read,
 	.set_initial_registers = drgn_linux_kernel_set_initial_registers,
 };
 
-struct drgn_error *drgn_object_stack_trace(const struct drgn_object *obj,
-					   struct drgn_stack_trace **ret)
+LIBDRGN_PUBLIC struct drgn_error *
+drgn_program_stack_traces(struct drgn_program *prog,
+			  const struct drgn_object * const *objs, size_t n,
+			  struct drgn_stack_trace **ret,
+			  struct drgn_error **errs)
 {
 	struct drgn_error *err;
-	struct drgn_program *prog = obj->prog;
 	Dwfl *dwfl;
 	struct drgn_stack_trace_builder builder;
-	struct drgn_stack_trace *trace;
+	size_t i;
+	int r;
 
 	if (!prog->has_platform) {
 		return drgn_error_create(DRGN_ERROR_INVALID_ARGUMENT,
@@ -250,6 +301,19 @@ struct drgn_error *drgn_object_stack_trace(const struct drgn_object *obj,
 					 "stack unwinding is not supported for %s architecture",
 					 prog->platform.arch->name);
 	}
+	for (i = 0; i < n; i++) {
+		if (objs[i]->prog != prog) {
+			return drgn_error_create(DRGN_ERROR_INVALID_ARGUMENT,
+						 "objects are from different programs");
+		}
+	}
+	/* Each thread is identified by its index plus one as a pid_t. */
+	if (n >= INT_MAX) {
+		return drgn_error_create(DRGN_ERROR_OVERFLOW,
+					 "too many threads");
+	}
+	if (!n)
+		return NULL;
 
 	err = drgn_program_get_dwfl(prog, &dwfl);
 	if (err)
@@ -262,41 +326,50 @@ struct drgn_error *drgn_object_stack_trace(const struct drgn_object *obj,
 		prog->attached_dwfl_state = true;
 	}
 
+	memset(ret, 0, n * sizeof(*ret));
+	memset(errs, 0, n * sizeof(*errs));
 	builder.prog = prog;
-	builder.trace = malloc(sizeof(*builder.trace) +
-			       sizeof(builder.trace->frames[0]));
-	if (!builder.trace)
-		return &drgn_enomem;
-	builder.trace->num_frames = 0;
-	builder.capacity = 1;
-
-	prog->stack_trace_obj = obj;
-	dwfl_getthread_frames(dwfl, STACK_TRACE_OBJ_PID,
-			      drgn_append_stack_frame, &builder);
-	prog->stack_trace_obj = NULL;
+	drgn_stack_frame_vector_init(&builder.frames);
+	builder.traces = ret;
+	builder.errs = errs;
+
 	/*
-	 * The error reporting for dwfl_getthread_frames() is not great. The
-	 * documentation says that some of its unwinder implementations always
-	 * return an error. So, we do our own error reporting for fatal errors
-	 * through prog->stack_trace_err.
+	 * Unwind all of the threads in one pass so that the attached state,
+	 * module lookups, and CFI are shared between them.
 	 */
+	prog->stack_trace_objs = objs;
+	prog->num_stack_trace_objs = n;
+	r = dwfl_getthreads(dwfl, drgn_thread_stack_trace, &builder);
+	prog->stack_trace_objs = NULL;
+	prog->num_stack_trace_objs = 0;
+	drgn_stack_frame_vector_deinit(&builder.frames);
+
 	if (prog->stack_trace_err) {
 		err = prog->stack_trace_err;
 		prog->stack_trace_err = NULL;
 		goto err;
 	}
-
-	/* Shrink the trace to fit if we can, but don't fail if we can't. */
-	trace = realloc(builder.trace,
-			sizeof(*builder.trace) +
-			builder.trace->num_frames *
-			sizeof(builder.trace->frames[0]));
-	if (!trace)
-		trace = builder.trace;
-	*ret = trace;
+	if (r) {
+		err = drgn_error_libdwfl();
+		goto err;
+	}
 	return NULL;
 
 err:
-	free(builder.trace);
+	for (i = 0; i < n; i++) {
+		drgn_stack_trace_destroy(ret[i]);
+		drgn_error_destroy(errs[i]);
+	}
 	return err;
 }
+
+struct drgn_error *drgn_object_stack_trace(const struct drgn_object *obj,
+					   struct drgn_stack_trace **ret)
+{
+	struct drgn_error *err, *thread_err;
+
+	err = drgn_program_stack_traces(obj->prog, &obj, 1, ret, &thread_err);
+	if (err)
+		return err;
+	return thread_err;
+}
@@ -1,10 +1,13 @@
 // Copyright 2019 - Omar Sandoval
 // SPDX-License-Identifier: GPL-3.0+
 
+#include <fnmatch.h>
+#include <gelf.h>
 #include <string.h>
 
 #include "internal.h"
 #include "symbol.h"
+#include "vector.h"
 
 LIBDRGN_PUBLIC void drgn_symbol_destroy(struct drgn_symbol *sym)
 {
@@ -31,3 +34,472 @@ LIBDRGN_PUBLIC bool drgn_symbol_eq(struct drgn_symbol *a, struct drgn_symbol *b)
 	return (strcmp(a->name, b->name) == 0 && a->address == b->address &&
 		a->size == b->size);
 }
+
+DEFINE_HASH_TABLE_FUNCTIONS(drgn_module_symbol_table_map, hash_pair_ptr_type,
+			    hash_table_scalar_eq)
+DEFINE_HASH_TABLE_FUNCTIONS(drgn_symbol_name_map, c_string_hash, c_string_eq)
+DEFINE_VECTOR(drgn_symbol_table_entry_vector, struct drgn_symbol_table_entry)
+DEFINE_VECTOR(drgn_symbol_vector, struct drgn_symbol *)
+
+void drgn_symbol_table_init(struct drgn_symbol_table *symtab)
+{
+	drgn_module_symbol_table_map_init(&symtab->modules);
+	drgn_symbol_name_map_init(&symtab->names);
+	symtab->names_built = false;
+	symtab->kallsyms.entries = NULL;
+	symtab->kallsyms.num_entries = 0;
+	symtab->kallsyms_strtab = NULL;
+	symtab->kallsyms_strtab_size = 0;
+}
+
+static void free_module_symbol_tables(struct drgn_symbol_table *symtab)
+{
+	struct drgn_module_symbol_table_map_iterator it;
+
+	for (it = drgn_module_symbol_table_map_first(&symtab->modules);
+	     it.entry; it = drgn_module_symbol_table_map_next(it))
+		free(it.entry->value.entries);
+}
+
+void drgn_symbol_table_deinit(struct drgn_symbol_table *symtab)
+{
+	free(symtab->kallsyms_strtab);
+	free(symtab->kallsyms.entries);
+	drgn_symbol_name_map_deinit(&symtab->names);
+	free_module_symbol_tables(symtab);
+	drgn_module_symbol_table_map_deinit(&symtab->modules);
+}
+
+void drgn_symbol_table_clear(struct drgn_symbol_table *symtab)
+{
+	drgn_symbol_name_map_clear(&symtab->names);
+	symtab->names_built = false;
+	free_module_symbol_tables(symtab);
+	drgn_module_symbol_table_map_clear(&symtab->modules);
+}
+
+void drgn_symbol_table_memory_usage(struct drgn_symbol_table *symtab,
+				    struct drgn_program_memory_usage *usage)
+{
+	struct drgn_module_symbol_table_map_iterator it;
+
+	usage->caches +=
+		drgn_module_symbol_table_map_memory_usage(&symtab->modules);
+	usage->caches += drgn_symbol_name_map_memory_usage(&symtab->names);
+	usage->caches += (symtab->kallsyms.num_entries *
+			  sizeof(struct drgn_symbol_table_entry) +
+			  symtab->kallsyms_strtab_size);
+	for (it = drgn_module_symbol_table_map_first(&symtab->modules);
+	     it.entry; it = drgn_module_symbol_table_map_next(it)) {
+		usage->caches += (it.entry->value.num_entries *
+				  sizeof(struct drgn_symbol_table_entry));
+	}
+}
+
+int drgn_symbol_table_entry_cmp(const void *_a, const void *_b)
+{
+	const struct drgn_symbol_table_entry *a = _a, *b = _b;
+
+	if (a->address < b->address)
+		return -1;
+	else if (a->address > b->address)
+		return 1;
+	else if (a->binding_rank < b->binding_rank)
+		return -1;
+	else if (a->binding_rank > b->binding_rank)
+		return 1;
+	else
+		return 0;
+}
+
+static unsigned int symbol_binding_rank(unsigned char binding)
+{
+	switch (binding) {
+	case STB_GLOBAL:
+		return 0;
+	case STB_WEAK:
+		return 1;
+	default:
+		return 2;
+	}
+}
+
+/* Initialize a table from entries which are already sorted. */
+static void init_module_symbol_table(struct drgn_module_symbol_table *table,
+				     struct drgn_symbol_table_entry *entries,
+				     size_t num_entries)
+{
+	uint64_t max_end = 0;
+	size_t i;
+
+	for (i = 0; i < num_entries; i++) {
+		struct drgn_symbol_table_entry *entry = &entries[i];
+		uint64_t end;
+
+		if (__builtin_add_overflow(entry->address, entry->size, &end))
+			end = UINT64_MAX;
+		max_end = max(max_end, end);
+		entry->max_end = max_end;
+	}
+	table->entries = entries;
+	table->num_entries = num_entries;
+}
+
+void drgn_symbol_table_set_kallsyms(struct drgn_symbol_table *symtab,
+				    struct drgn_symbol_table_entry *entries,
+				    size_t num_entries, char *strtab,
+				    size_t strtab_size)
+{
+	init_module_symbol_table(&symtab->kallsyms, entries, num_entries);
+	symtab->kallsyms_strtab = strtab;
+	symtab->kallsyms_strtab_size = strtab_size;
+	/* The index by name needs to include the new symbols. */
+	drgn_symbol_name_map_clear(&symtab->names);
+	symtab->names_built = false;
+}
+
+/*
+ * Build the sorted symbol table for a module. The same symbols are considered
+ * as by dwfl_module_addrinfo(). A module without an ELF symbol table simply has
+ * no symbols.
+ */
+static struct drgn_error *
+build_module_symbol_table(Dwfl_Module *module,
+			  struct drgn_module_symbol_table *ret)
+{
+	struct drgn_symbol_table_entry_vector entries;
+	int num_syms, i;
+
+	drgn_symbol_table_entry_vector_init(&entries);
+	num_syms = dwfl_module_getsymtab(module);
+	for (i = 0; i < num_syms; i++) {
+		struct drgn_symbol_table_entry *entry;
+		const char *name;
+		GElf_Sym elf_sym;
+		GElf_Addr addr;
+		GElf_Word shndx;
+
+		name = dwfl_module_getsym_info(module, i, &elf_sym, &addr,
+					       &shndx, NULL, NULL);
+		if (!name || !name[0] || shndx == SHN_UNDEF)
+			continue;
+		switch (GELF_ST_TYPE(elf_sym.st_info)) {
+		case STT_SECTION:
+		case STT_FILE:
+		case STT_TLS:
+			continue;
+		}
+
+		entry = drgn_symbol_table_entry_vector_append_entry(&entries);
+		if (!entry) {
+			drgn_symbol_table_entry_vector_deinit(&entries);
+			return &drgn_enomem;
+		}
+		entry->address = addr;
+		entry->size = elf_sym.st_size;
+		entry->name = name;
+		entry->binding_rank =
+			symbol_binding_rank(GELF_ST_BIND(elf_sym.st_info));
+	}
+	drgn_symbol_table_entry_vector_shrink_to_fit(&entries);
+
+	qsort(entries.data, entries.size, sizeof(entries.data[0]),
+	      drgn_symbol_table_entry_cmp);
+	init_module_symbol_table(ret, entries.data, entries.size);
+	return NULL;
+}
+
+static const struct drgn_symbol_table_entry *
+drgn_module_symbol_table_find(const struct drgn_module_symbol_table *table,
+			      uint64_t address)
+{
+	const struct drgn_symbol_table_entry *best = NULL, *sizeless = NULL;
+	size_t lo = 0, hi = table->num_entries, i;
+
+	/* Find the first symbol starting after the address. */
+	while (lo < hi) {
+		size_t mid = lo + (hi - lo) / 2;
+
+		if (table->entries[mid].address <= address)
+			lo = mid + 1;
+		else
+			hi = mid;
+	}
+
+	for (i = lo; i-- > 0;) {
+		const struct drgn_symbol_table_entry *entry =
+			&table->entries[i];
+
+		/* No symbol at or before this one contains the address. */
+		if (entry->max_end <= address) {
+			if (!entry->size &&
+			    entry->address == table->entries[lo - 1].address)
+				sizeless = entry;
+			break;
+		}
+		/*
+		 * Symbols with the same address are sorted by preference, so
+		 * keep going until the address changes and take the last one.
+		 */
+		if (best && entry->address != best->address)
+			break;
+		if (entry->size && address - entry->address < entry->size) {
+			best = entry;
+		} else if (!entry->size &&
+			   entry->address == table->entries[lo - 1].address) {
+			sizeless = entry;
+		}
+	}
+	return best ? best : sizeless;
+}
+
+static struct drgn_error *
+drgn_symbol_table_get_module(struct drgn_symbol_table *symtab,
+			     Dwfl_Module *module,
+			     const struct drgn_module_symbol_table **ret)
+{
+	struct drgn_error *err;
+	struct hash_pair hp;
+	struct drgn_module_symbol_table_map_iterator it;
+
+	hp = drgn_module_symbol_table_map_hash(&module);
+	it = drgn_module_symbol_table_map_search_hashed(&symtab->modules,
+							&module, hp);
+	if (!it.entry) {
+		struct drgn_module_symbol_table_map_entry new_entry = {
+			.key = module,
+		};
+
+		err = build_module_symbol_table(module, &new_entry.value);
+		if (err)
+			return err;
+		if (drgn_module_symbol_table_map_insert_searched(&symtab->modules,
+								 &new_entry,
+								 hp,
+								 &it) == -1) {
+			free(new_entry.value.entries);
+			return &drgn_enomem;
+		}
+	}
+	*ret = &it.entry->value;
+	return NULL;
+}
+
+static void drgn_symbol_from_entry(const struct drgn_symbol_table_entry *entry,
+				   struct drgn_symbol *ret)
+{
+	ret->name = entry->name;
+	ret->address = entry->address;
+	ret->size = entry->size;
+}
+
+struct drgn_error *drgn_symbol_table_find(struct drgn_symbol_table *symtab,
+					  Dwfl_Module *module,
+					  uint64_t address,
+					  struct drgn_symbol *ret)
+{
+	struct drgn_error *err;
+	const struct drgn_symbol_table_entry *entry = NULL;
+
+	if (module) {
+		const struct drgn_module_symbol_table *table;
+
+		err = drgn_symbol_table_get_module(symtab, module, &table);
+		if (err)
+			return err;
+		entry = drgn_module_symbol_table_find(table, address);
+	}
+	if (!entry)
+		entry = drgn_module_symbol_table_find(&symtab->kallsyms,
+						      address);
+	if (!entry)
+		return &drgn_not_found;
+	drgn_symbol_from_entry(entry, ret);
+	return NULL;
+}
+
+/*
+ * Add the symbols in a table to the index by name. If replace is true, then a
+ * symbol replaces an existing one with the same name and a worse binding.
+ * Otherwise, existing symbols are always kept.
+ */
+static struct drgn_error *
+add_symbol_names(struct drgn_symbol_table *symtab,
+		 const struct drgn_module_symbol_table *table, bool replace)
+{
+	size_t i;
+
+	for (i = 0; i < table->num_entries; i++) {
+		const struct drgn_symbol_table_entry *entry =
+			&table->entries[i];
+		struct drgn_symbol_name_map_entry new_entry = {
+			.key = entry->name,
+			.value = entry,
+		};
+		struct hash_pair hp;
+		struct drgn_symbol_name_map_iterator it;
+
+		hp = drgn_symbol_name_map_hash(&new_entry.key);
+		it = drgn_symbol_name_map_search_hashed(&symtab->names,
+							&new_entry.key, hp);
+		if (it.entry) {
+			/* Keep the first symbol with the best binding. */
+			if (replace &&
+			    entry->binding_rank < it.entry->value->binding_rank)
+				it.entry->value = entry;
+		} else if (drgn_symbol_name_map_insert_searched(&symtab->names,
+								&new_entry, hp,
+								NULL) == -1) {
+			return &drgn_enomem;
+		}
+	}
+	return NULL;
+}
+
+struct build_symbol_names_arg {
+	struct drgn_symbol_table *symtab;
+	struct drgn_error *err;
+};
+
+static int build_symbol_names_cb(Dwfl_Module *module, void **userdatap,
+				 const char *name, Dwarf_Addr base, void *_arg)
+{
+	struct build_symbol_names_arg *arg = _arg;
+	const struct drgn_module_symbol_table *table;
+
+	arg->err = drgn_symbol_table_get_module(arg->symtab, module, &table);
+	if (arg->err)
+		return DWARF_CB_ABORT;
+	arg->err = add_symbol_names(arg->symtab, table, true);
+	if (arg->err)
+		return DWARF_CB_ABORT;
+	return DWARF_CB_OK;
+}
+
+/*
+ * Build the symbol table of every module and index them and the symbols from
+ * kallsyms by name.
+ */
+static struct drgn_error *build_symbol_names(struct drgn_symbol_table *symtab,
+					     Dwfl *dwfl)
+{
+	struct build_symbol_names_arg arg = { .symtab = symtab };
+
+	if (symtab->names_built)
+		return NULL;
+	if (dwfl && dwfl_getmodules(dwfl, build_symbol_names_cb, &arg, 0))
+		goto err;
+	/* Symbols from modules take precedence. */
+	arg.err = add_symbol_names(symtab, &symtab->kallsyms, false);
+	if (arg.err)
+		goto err;
+	symtab->names_built = true;
+	return NULL;
+
+err:
+	drgn_symbol_name_map_clear(&symtab->names);
+	return arg.err;
+}
+
+struct drgn_error *drgn_symbol_table_find_by_name(struct drgn_symbol_table *symtab,
+						  Dwfl *dwfl, const char *name,
+						  struct drgn_symbol *ret)
+{
+	struct drgn_error *err;
+	struct drgn_symbol_name_map_iterator it;
+
+	err = build_symbol_names(symtab, dwfl);
+	if (err)
+		return err;
+	it = drgn_symbol_name_map_search(&symtab->names, &name);
+	if (!it.entry)
+		return &drgn_not_found;
+	drgn_symbol_from_entry(it.entry->value, ret);
+	return NULL;
+}
+
+/*
+ * Append the symbols in a table whose names match a pattern to a vector. If
+ * dwfl is not NULL, then symbols with an address in one of its modules are
+ * skipped.
+ */
+static struct drgn_error *
+search_symbol_table(const struct drgn_module_symbol_table *table,
+		    const char *pattern, Dwfl *dwfl,
+		    struct drgn_symbol_vector *syms)
+{
+	size_t i;
+
+	for (i = 0; i < table->num_entries; i++) {
+		const struct drgn_symbol_table_entry *entry =
+			&table->entries[i];
+		struct drgn_symbol *sym, **symp;
+
+		if (fnmatch(pattern, entry->name, 0) ||
+		    (dwfl && dwfl_addrmodule(dwfl, entry->address)))
+			continue;
+		sym = malloc(sizeof(*sym));
+		if (!sym)
+			return &drgn_enomem;
+		drgn_symbol_from_entry(entry, sym);
+		symp = drgn_symbol_vector_append_entry(syms);
+		if (!symp) {
+			free(sym);
+			return &drgn_enomem;
+		}
+		*symp = sym;
+	}
+	return NULL;
+}
+
+static int drgn_symbol_ptr_cmp(const void *_a, const void *_b)
+{
+	const struct drgn_symbol *a = *(struct drgn_symbol * const *)_a;
+	const struct drgn_symbol *b = *(struct drgn_symbol * const *)_b;
+
+	if (a->address < b->address)
+		return -1;
+	else if (a->address > b->address)
+		return 1;
+	else
+		return strcmp(a->name, b->name);
+}
+
+struct drgn_error *drgn_symbol_table_search(struct drgn_symbol_table *symtab,
+					    Dwfl *dwfl, const char *pattern,
+					    struct drgn_symbol ***syms_ret,
+					    size_t *count_ret)
+{
+	struct drgn_error *err;
+	struct drgn_symbol_vector syms;
+	struct drgn_module_symbol_table_map_iterator it;
+	size_t i;
+
+	/* This builds the table for every module. */
+	err = build_symbol_names(symtab, dwfl);
+	if (err)
+		return err;
+
+	drgn_symbol_vector_init(&syms);
+	for (it = drgn_module_symbol_table_map_first(&symtab->modules);
+	     it.entry; it = drgn_module_symbol_table_map_next(it)) {
+		err = search_symbol_table(&it.entry->value, pattern, NULL,
+					  &syms);
+		if (err)
+			goto err;
+	}
+	err = search_symbol_table(&symtab->kallsyms, pattern, dwfl, &syms);
+	if (err)
+		goto err;
+	drgn_symbol_vector_shrink_to_fit(&syms);
+	qsort(syms.data, syms.size, sizeof(syms.data[0]), drgn_symbol_ptr_cmp);
+	*syms_ret = syms.data;
+	*count_ret = syms.size;
+	return NULL;
+
+err:
+	for (i = 0; i < syms.size; i++)
+		drgn_symbol_destroy(syms.data[i]);
+	drgn_symbol_vector_deinit(&syms);
+	return err;
+}
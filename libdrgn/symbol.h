@@ -1,15 +1,191 @@
 // Copyright 2019 - Omar Sandoval
 // SPDX-License-Identifier: GPL-3.0+
 
+/**
+ * @file
+ *
+ * Symbol internals.
+ *
+ * See @ref SymbolInternals.
+ */
+
 #ifndef DRGN_SYMBOL_H
 #define DRGN_SYMBOL_H
 
+#include <elfutils/libdwfl.h>
 #include <stdint.h>
 
+#include "drgn.h"
+#include "hash_table.h"
+
+/**
+ * @ingroup Internals
+ *
+ * @defgroup SymbolInternals Symbols
+ *
+ * Symbol table internals.
+ *
+ * @{
+ */
+
 struct drgn_symbol {
 	const char *name;
 	uint64_t address;
 	uint64_t size;
 };
 
+/** Symbol in a @ref drgn_module_symbol_table. */
+struct drgn_symbol_table_entry {
+	uint64_t address;
+	uint64_t size;
+	/**
+	 * Maximum end address of this symbol and every symbol before it in the
+	 * table. This bounds the search for symbols containing an address.
+	 */
+	uint64_t max_end;
+	/** Name of the symbol. This points into the ELF string table. */
+	const char *name;
+	/**
+	 * Preference for this symbol when several contain an address: 0 for
+	 * global symbols, 1 for weak symbols, and 2 for local symbols.
+	 */
+	unsigned int binding_rank;
+};
+
+/** The symbols of one @c Dwfl_Module, sorted by address. */
+struct drgn_module_symbol_table {
+	struct drgn_symbol_table_entry *entries;
+	size_t num_entries;
+};
+
+DEFINE_HASH_MAP_TYPE(drgn_module_symbol_table_map, Dwfl_Module *,
+		     struct drgn_module_symbol_table)
+DEFINE_HASH_MAP_TYPE(drgn_symbol_name_map, const char *,
+		     const struct drgn_symbol_table_entry *)
+
+/**
+ * Cache of sorted symbol tables for looking up symbols by address or by name.
+ *
+ * The table for each module is built from its ELF symbol table the first time
+ * that an address in the module is looked up. The index by name covers every
+ * module and is built the first time that a name is looked up.
+ *
+ * Symbols may also be loaded from the Linux kernel's kallsyms. These are only
+ * used when the modules don't have a symbol.
+ */
+struct drgn_symbol_table {
+	struct drgn_module_symbol_table_map modules;
+	/**
+	 * Map from symbol name to the preferred symbol with that name, using
+	 * the same preference as for addresses.
+	 */
+	struct drgn_symbol_name_map names;
+	/** Whether @ref drgn_symbol_table::names has been built. */
+	bool names_built;
+	/** Symbols from kallsyms, or empty if they have not been loaded. */
+	struct drgn_module_symbol_table kallsyms;
+	/** Storage for the names in @ref drgn_symbol_table::kallsyms. */
+	char *kallsyms_strtab;
+	/** Size of @ref drgn_symbol_table::kallsyms_strtab. */
+	size_t kallsyms_strtab_size;
+};
+
+/** Initialize a @ref drgn_symbol_table. */
+void drgn_symbol_table_init(struct drgn_symbol_table *symtab);
+
+/** Deinitialize a @ref drgn_symbol_table. */
+void drgn_symbol_table_deinit(struct drgn_symbol_table *symtab);
+
+/**
+ * Discard every cached module symbol table.
+ *
+ * This must be called whenever modules are added to or removed from the @c
+ * Dwfl, since the cache is keyed by @c Dwfl_Module. Symbols from kallsyms are
+ * kept.
+ */
+void drgn_symbol_table_clear(struct drgn_symbol_table *symtab);
+
+/** Add the memory used by a @ref drgn_symbol_table to @p usage. */
+void drgn_symbol_table_memory_usage(struct drgn_symbol_table *symtab,
+				    struct drgn_program_memory_usage *usage);
+
+/** Compare two symbol table entries by address, then by preference. */
+int drgn_symbol_table_entry_cmp(const void *_a, const void *_b);
+
+/**
+ * Set the symbols from kallsyms.
+ *
+ * This may only be called once, since returned symbols refer to @p strtab until
+ * the symbol table is deinitialized.
+ *
+ * @param[in] entries Symbols, sorted by @ref drgn_symbol_table_entry_cmp().
+ * This takes ownership of the array.
+ * @param[in] num_entries Number of symbols.
+ * @param[in] strtab Storage for the symbol names. This takes ownership of the
+ * string.
+ * @param[in] strtab_size Size of @p strtab.
+ */
+void drgn_symbol_table_set_kallsyms(struct drgn_symbol_table *symtab,
+				    struct drgn_symbol_table_entry *entries,
+				    size_t num_entries, char *strtab,
+				    size_t strtab_size);
+
+/**
+ * Find the symbol containing an address in a module.
+ *
+ * Like @c dwfl_module_addrinfo(), this prefers the sized symbol with the
+ * closest start address, then global symbols over weak symbols over local
+ * symbols. If no sized symbol contains the address, then it falls back to a
+ * symbol without a size at the closest preceding address.
+ *
+ * If the module doesn't have a symbol containing the address, then this falls
+ * back to the symbols from kallsyms.
+ *
+ * @param[in] module Module containing @p address, or @c NULL if the address
+ * is not in any module.
+ * @param[out] ret Returned symbol.
+ * @return @c NULL on success, &@ref drgn_not_found if no symbol contains the
+ * address, non-@c NULL on other errors.
+ */
+struct drgn_error *drgn_symbol_table_find(struct drgn_symbol_table *symtab,
+					  Dwfl_Module *module,
+					  uint64_t address,
+					  struct drgn_symbol *ret);
+
+/**
+ * Find a symbol by name in any module.
+ *
+ * If multiple symbols have the name, then global symbols are preferred over weak
+ * symbols over local symbols. Symbols from kallsyms are only returned if no
+ * module has a symbol with the name.
+ *
+ * @param[in] dwfl Modules to search, or @c NULL to only search kallsyms.
+ * @param[out] ret Returned symbol.
+ * @return @c NULL on success, &@ref drgn_not_found if no symbol has the name,
+ * non-@c NULL on other errors.
+ */
+struct drgn_error *drgn_symbol_table_find_by_name(struct drgn_symbol_table *symtab,
+						  Dwfl *dwfl, const char *name,
+						  struct drgn_symbol *ret);
+
+/**
+ * Find every symbol whose name matches a shell wildcard pattern.
+ *
+ * Symbols from kallsyms are skipped if their address is in a module.
+ *
+ * @param[in] dwfl Modules to search, or @c NULL to only search kallsyms.
+ * @param[in] pattern Pattern to match as with @c fnmatch(3).
+ * @param[out] syms_ret Returned array of symbols, sorted by address. Each
+ * symbol should be freed with @ref drgn_symbol_destroy(), and the array should
+ * be freed with @c free().
+ * @param[out] count_ret Returned number of symbols.
+ * @return @c NULL on success, non-@c NULL on error.
+ */
+struct drgn_error *drgn_symbol_table_search(struct drgn_symbol_table *symtab,
+					    Dwfl *dwfl, const char *pattern,
+					    struct drgn_symbol ***syms_ret,
+					    size_t *count_ret);
+
+/** @} */
+
 #endif /* DRGN_SYMBOL_H */
@@ -75,6 +75,33 @@ DEFINE_HASH_TABLE_FUNCTIONS(drgn_member_map, drgn_member_hash_pair,
 DEFINE_HASH_TABLE_FUNCTIONS(drgn_type_set, hash_pair_ptr_type,
 			    hash_table_scalar_eq)
 
+static struct hash_pair
+drgn_type_lookup_hash_pair(const struct drgn_type_lookup_key *key)
+{
+	size_t hash;
+
+	hash = hash_combine((uintptr_t)key->lang,
+			    cityhash_size_t(key->name, strlen(key->name)));
+	if (key->filename) {
+		hash = hash_combine(hash,
+				    cityhash_size_t(key->filename,
+						    strlen(key->filename)));
+	}
+	return hash_pair_from_avalanching_hash(hash);
+}
+
+static bool drgn_type_lookup_eq(const struct drgn_type_lookup_key *a,
+				const struct drgn_type_lookup_key *b)
+{
+	return (a->lang == b->lang && strcmp(a->name, b->name) == 0 &&
+		(a->filename && b->filename ?
+		 strcmp(a->filename, b->filename) == 0 :
+		 a->filename == b->filename));
+}
+
+DEFINE_HASH_TABLE_FUNCTIONS(drgn_type_lookup_map, drgn_type_lookup_hash_pair,
+			    drgn_type_lookup_eq)
+
 void drgn_type_index_init(struct drgn_type_index *tindex)
 {
 	tindex->finders = NULL;
@@ -83,9 +110,45 @@ void drgn_type_index_init(struct drgn_type_index *tindex)
 	drgn_array_type_table_init(&tindex->array_types);
 	drgn_member_map_init(&tindex->members);
 	drgn_type_set_init(&tindex->members_cached);
+	drgn_type_lookup_map_init(&tindex->lookups);
+	tindex->lookup_cacheable = true;
 	tindex->word_size = 0;
 }
 
+static void free_lookups(struct drgn_type_index *tindex)
+{
+	struct drgn_type_lookup_map_iterator it;
+
+	for (it = drgn_type_lookup_map_first(&tindex->lookups); it.entry;
+	     it = drgn_type_lookup_map_next(it)) {
+		free((char *)it.entry->key.name);
+		free((char *)it.entry->key.filename);
+		free(it.entry->value.not_found);
+	}
+	drgn_type_lookup_map_deinit(&tindex->lookups);
+}
+
+void drgn_type_index_clear_lookups(struct drgn_type_index *tindex)
+{
+	free_lookups(tindex);
+	drgn_type_lookup_map_init(&tindex->lookups);
+}
+
+void drgn_type_index_memory_usage(struct drgn_type_index *tindex,
+				  struct drgn_program_memory_usage *usage)
+{
+	usage->types +=
+		(drgn_pointer_type_table_size(&tindex->pointer_types) +
+		 drgn_array_type_table_size(&tindex->array_types)) *
+		sizeof(struct drgn_type);
+	usage->types +=
+		drgn_pointer_type_table_memory_usage(&tindex->pointer_types);
+	usage->types += drgn_array_type_table_memory_usage(&tindex->array_types);
+	usage->caches += drgn_member_map_memory_usage(&tindex->members);
+	usage->caches += drgn_type_set_memory_usage(&tindex->members_cached);
+	usage->caches += drgn_type_lookup_map_memory_usage(&tindex->lookups);
+}
+
 static void free_pointer_types(struct drgn_type_index *tindex)
 {
 	struct drgn_pointer_type_table_iterator it;
@@ -110,6 +173,7 @@ void drgn_type_index_deinit(struct drgn_type_index *tindex)
 {
 	struct drgn_type_finder *finder;
 
+	free_lookups(tindex);
 	drgn_member_map_deinit(&tindex->members);
 	drgn_type_set_deinit(&tindex->members_cached);
 	free_array_types(tindex);
@@ -125,7 +189,8 @@ void drgn_type_index_deinit(struct drgn_type_index *tindex)
 }
 
 struct drgn_error *drgn_type_index_add_finder(struct drgn_type_index *tindex,
-					      drgn_type_find_fn fn, void *arg)
+					      drgn_type_find_fn fn, void *arg,
+					      bool cache)
 {
 	struct drgn_type_finder *finder;
 
@@ -134,8 +199,10 @@ struct drgn_error *drgn_type_index_add_finder(struct drgn_type_index *tindex,
 		return &drgn_enomem;
 	finder->fn = fn;
 	finder->arg = arg;
+	finder->cache = cache;
 	finder->next = tindex->finders;
 	tindex->finders = finder;
+	drgn_type_index_clear_lookups(tindex);
 	return NULL;
 }
 
@@ -146,6 +213,7 @@ void drgn_type_index_remove_finder(struct drgn_type_index *tindex)
 	finder = tindex->finders->next;
 	free(tindex->finders);
 	tindex->finders = finder;
+	drgn_type_index_clear_lookups(tindex);
 }
 
 /* Default long and unsigned long are 64 bits. */
@@ -239,6 +307,8 @@ drgn_type_index_find_parsed_internal(struct drgn_type_index *tindex,
 
 	finder = tindex->finders;
 	while (finder) {
+		if (!finder->cache)
+			tindex->lookup_cacheable = false;
 		err = finder->fn(kind, name, name_len, filename, finder->arg,
 				 ret);
 		if (!err) {
@@ -386,6 +456,87 @@ drgn_type_index_find_parsed(struct drgn_type_index *tindex,
 	}
 }
 
+struct drgn_error *drgn_type_index_find(struct drgn_type_index *tindex,
+					const char *name, const char *filename,
+					const struct drgn_language *lang,
+					struct drgn_qualified_type *ret)
+{
+	struct drgn_error *err;
+	struct drgn_type_lookup_map_entry entry = {
+		.key = {
+			.lang = lang,
+			.name = name,
+			.filename = filename,
+		},
+	};
+	struct hash_pair hp;
+	struct drgn_type_lookup_map_iterator it;
+	bool outer_cacheable;
+
+	hp = drgn_type_lookup_map_hash(&entry.key);
+	it = drgn_type_lookup_map_search_hashed(&tindex->lookups, &entry.key,
+						hp);
+	if (it.entry) {
+		if (it.entry->value.not_found) {
+			return drgn_error_create(DRGN_ERROR_LOOKUP,
+						 it.entry->value.not_found);
+		}
+		*ret = it.entry->value.type;
+		return NULL;
+	}
+
+	/*
+	 * A finder may look up other types, so save whether the enclosing
+	 * lookup is cacheable.
+	 */
+	outer_cacheable = tindex->lookup_cacheable;
+	tindex->lookup_cacheable = true;
+	err = lang->find_type(tindex, name, filename, &entry.value.type);
+	if (!tindex->lookup_cacheable) {
+		/* The enclosing lookup isn't cacheable either. */
+		if (!err)
+			*ret = entry.value.type;
+		return err;
+	}
+	tindex->lookup_cacheable = outer_cacheable;
+	if (!err) {
+		entry.value.not_found = NULL;
+	} else if (err->code == DRGN_ERROR_LOOKUP) {
+		/* Remember that it wasn't found, too. */
+		entry.value.not_found = strdup(err->message);
+		if (!entry.value.not_found)
+			goto err;
+	} else {
+		/* Don't cache any other errors. */
+		return err;
+	}
+
+	entry.key.name = strdup(name);
+	if (!entry.key.name)
+		goto err_not_found;
+	if (filename) {
+		entry.key.filename = strdup(filename);
+		if (!entry.key.filename)
+			goto err_name;
+	}
+	if (drgn_type_lookup_map_insert_searched(&tindex->lookups, &entry, hp,
+						 NULL) == -1)
+		goto err_filename;
+	if (!err)
+		*ret = entry.value.type;
+	return err;
+
+err_filename:
+	free((char *)entry.key.filename);
+err_name:
+	free((char *)entry.key.name);
+err_not_found:
+	free(entry.value.not_found);
+err:
+	drgn_error_destroy(err);
+	return &drgn_enomem;
+}
+
 struct drgn_error *
 drgn_type_index_pointer_type(struct drgn_type_index *tindex,
 			     struct drgn_qualified_type referenced_type,
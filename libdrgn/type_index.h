@@ -94,12 +94,47 @@ DEFINE_HASH_MAP_TYPE(drgn_member_map, struct drgn_member_key,
 DEFINE_HASH_SET_TYPE(drgn_type_set, struct drgn_type *)
 #endif
 
+/** Type name lookup passed to @ref drgn_type_index_find(). */
+struct drgn_type_lookup_key {
+	const struct drgn_language *lang;
+	const char *name;
+	/** Filename, or @c NULL for any definition. */
+	const char *filename;
+};
+
+/** Cached result of a type name lookup. */
+struct drgn_type_lookup_value {
+	/** Type which was found, if @c not_found is @c NULL. */
+	struct drgn_qualified_type type;
+	/** Message of the @ref DRGN_ERROR_LOOKUP error if it wasn't found. */
+	char *not_found;
+};
+
+#ifdef DOXYGEN
+/**
+ * @struct drgn_type_lookup_map
+ *
+ * Map of type name lookups to their results.
+ *
+ * The key is a @ref drgn_type_lookup_key, and the value is a @ref
+ * drgn_type_lookup_value. The strings in both are allocated with @c malloc().
+ */
+#else
+DEFINE_HASH_MAP_TYPE(drgn_type_lookup_map, struct drgn_type_lookup_key,
+		     struct drgn_type_lookup_value)
+#endif
+
 /** Registered callback in a @ref drgn_type_index. */
 struct drgn_type_finder {
 	/** The callback. */
 	drgn_type_find_fn fn;
 	/** Argument to pass to @ref drgn_type_finder::fn. */
 	void *arg;
+	/**
+	 * Whether results of this callback may be cached in @ref
+	 * drgn_type_index::lookups.
+	 */
+	bool cache;
 	/** Next callback to try. */
 	struct drgn_type_finder *next;
 };
@@ -135,6 +170,17 @@ struct drgn_type_index {
 	 * drgn_type_index::members.
 	 */
 	struct drgn_type_set members_cached;
+	/**
+	 * Cache for @ref drgn_type_index_find().
+	 *
+	 * This is invalidated with @ref drgn_type_index_clear_lookups().
+	 */
+	struct drgn_type_lookup_map lookups;
+	/**
+	 * Whether the lookup in progress only called finders which allow
+	 * caching.
+	 */
+	bool lookup_cacheable;
 	/**
 	 * Size of a pointer in bytes.
 	 *
@@ -153,9 +199,33 @@ void drgn_type_index_init(struct drgn_type_index *tindex);
 /** Deinitialize a @ref drgn_type_index. */
 void drgn_type_index_deinit(struct drgn_type_index *tindex);
 
-/** @sa drgn_program_add_type_finder() */
+/**
+ * Clear the results of previous lookups with @ref drgn_type_index_find().
+ *
+ * This must be called whenever those results may have changed (e.g., when new
+ * debugging information is loaded).
+ */
+void drgn_type_index_clear_lookups(struct drgn_type_index *tindex);
+
+/**
+ * Add the memory used by a @ref drgn_type_index to a @ref
+ * drgn_program_memory_usage.
+ */
+void drgn_type_index_memory_usage(struct drgn_type_index *tindex,
+				  struct drgn_program_memory_usage *usage);
+
+/**
+ * Register a type finding callback.
+ *
+ * @param[in] cache Whether the results of @p fn may be cached by @ref
+ * drgn_type_index_find(). This should only be @c true if @p fn always returns
+ * the same result for the same arguments until @ref
+ * drgn_type_index_clear_lookups() is called.
+ * @sa drgn_program_add_type_finder()
+ */
 struct drgn_error *drgn_type_index_add_finder(struct drgn_type_index *tindex,
-					      drgn_type_find_fn fn, void *arg);
+					      drgn_type_find_fn fn, void *arg,
+					      bool cache);
 
 /**
  * Remove the most recently added type finding callback.
@@ -196,6 +266,11 @@ drgn_type_index_find_parsed(struct drgn_type_index *tindex,
  *
  * The returned type is valid for the lifetime of the @ref drgn_type_index.
  *
+ * Results, including types which weren't found, are cached until @ref
+ * drgn_type_index_clear_lookups() is called, so repeated lookups of the same
+ * name don't need to parse it and call the type finders again. A result is
+ * only cached if every finder which was called for it allows caching.
+ *
  * @param[in] tindex Type index.
  * @param[in] name Name of the type.
  * @param[in] filename Exact filename containing the type definition, or @c NULL
@@ -204,13 +279,10 @@ drgn_type_index_find_parsed(struct drgn_type_index *tindex,
  * @param[out] ret Returned type.
  * @return @c NULL on success, non-@c NULL on error.
  */
-static inline struct drgn_error *
-drgn_type_index_find(struct drgn_type_index *tindex, const char *name,
-		     const char *filename, const struct drgn_language *lang,
-		     struct drgn_qualified_type *ret)
-{
-	return lang->find_type(tindex, name, filename, ret);
-}
+struct drgn_error *drgn_type_index_find(struct drgn_type_index *tindex,
+					const char *name, const char *filename,
+					const struct drgn_language *lang,
+					struct drgn_qualified_type *ret);
 
 /**
  * Create a pointer type.
@@ -1,7 +1,9 @@
 from collections import namedtuple
 import os.path
+import struct
+import zlib
 
-from tests.elf import ET, PT, SHT
+from tests.elf import ET, PT, SHF, SHT, STB
 from tests.elfwriter import ElfSection, create_elf_file
 from tests.dwarf import DW_AT, DW_FORM, DW_TAG
 
@@ -55,7 +57,7 @@ def _compile_debug_abbrev(cu_die):
     return buf
 
 
-def _compile_debug_info(cu_die, little_endian, bits):
+def _compile_debug_info(cu_die, little_endian, bits, all_dies=None):
     buf = bytearray()
     byteorder = 'little' if little_endian else 'big'
 
@@ -68,10 +70,14 @@ def _compile_debug_info(cu_die, little_endian, bits):
     relocations = []
     code = 1
     decl_file = 1
-    def aux(die, depth):
+    def aux(die, depth, parent):
         nonlocal code, decl_file
         if depth == 1:
             die_offsets.append(len(buf))
+        if all_dies is not None:
+            # (DIE, offset, index of parent in all_dies)
+            all_dies.append((die, len(buf), parent))
+        index = len(all_dies) - 1 if all_dies is not None else None
         _append_uleb128(buf, code)
         code += 1
         for attrib in die.attribs:
@@ -105,9 +111,9 @@ def _compile_debug_info(cu_die, little_endian, bits):
                 assert False, attrib.form
         if die.children:
             for child in die.children:
-                aux(child, depth + 1)
+                aux(child, depth + 1, index)
             buf.append(0)
-    aux(cu_die, 0)
+    aux(cu_die, 0, None)
 
     unit_length = len(buf) - 4
     buf[:4] = unit_length.to_bytes(4, byteorder)
@@ -177,7 +183,212 @@ def _compile_debug_line(cu_die, little_endian):
     return buf
 
 
-def compile_dwarf(dies, little_endian=True, bits=64):
+_DEBUG_NAMES_TAGS = {
+    DW_TAG.base_type,
+    DW_TAG.class_type,
+    DW_TAG.enumeration_type,
+    DW_TAG.enumerator,
+    DW_TAG.structure_type,
+    DW_TAG.subprogram,
+    DW_TAG.typedef,
+    DW_TAG.union_type,
+    DW_TAG.variable,
+}
+_DW_IDX_die_offset = 3
+_DW_IDX_parent = 4
+
+
+def _compile_debug_names(all_dies, debug_str, little_endian, predicate):
+    byteorder = 'little' if little_endian else 'big'
+
+    # Like LLVM, index every named DIE. DW_IDX_parent is omitted for children
+    # of the unit, refers to the parent's entry if the parent is also indexed,
+    # and is DW_FORM_flag_present otherwise.
+    indexed = {}
+    names = {}
+    for i, (die, offset, parent) in enumerate(all_dies):
+        if die.tag not in _DEBUG_NAMES_TAGS or not predicate(die):
+            continue
+        for attrib in die.attribs:
+            if attrib.name == DW_AT.name:
+                indexed[i] = attrib.value
+                names.setdefault(attrib.value, []).append(i)
+                break
+
+    def parent_form(i):
+        parent = all_dies[i][2]
+        if parent == 0:
+            return None
+        elif parent in indexed:
+            return DW_FORM.ref4
+        else:
+            return DW_FORM.flag_present
+
+    abbrevs = {}
+    def abbrev(i):
+        key = (all_dies[i][0].tag, parent_form(i))
+        return abbrevs.setdefault(key, len(abbrevs) + 1)
+
+    entry_offsets = {}
+    name_offsets = []
+    offset = 0
+    for name, entries in names.items():
+        name_offsets.append(offset)
+        for i in entries:
+            entry_offsets[i] = offset
+            offset += 1 + 4 + (4 if parent_form(i) == DW_FORM.ref4 else 0)
+        offset += 1
+    entry_pool = bytearray()
+    for name, entries in names.items():
+        for i in entries:
+            _append_uleb128(entry_pool, abbrev(i))
+            entry_pool.extend(all_dies[i][1].to_bytes(4, byteorder))
+            if parent_form(i) == DW_FORM.ref4:
+                entry_pool.extend(
+                    entry_offsets[all_dies[i][2]].to_bytes(4, byteorder))
+        entry_pool.append(0)
+
+    abbrev_table = bytearray()
+    for (tag, form), code in abbrevs.items():
+        _append_uleb128(abbrev_table, code)
+        _append_uleb128(abbrev_table, tag)
+        _append_uleb128(abbrev_table, _DW_IDX_die_offset)
+        _append_uleb128(abbrev_table, DW_FORM.ref4)
+        if form is not None:
+            _append_uleb128(abbrev_table, _DW_IDX_parent)
+            _append_uleb128(abbrev_table, form)
+        abbrev_table.extend(b'\0\0')
+    abbrev_table.append(0)
+
+    buf = bytearray()
+    buf.extend(b'\0\0\0\0')  # unit_length
+    buf.extend((5).to_bytes(2, byteorder))  # version
+    buf.extend(b'\0\0')  # padding
+    buf.extend((1).to_bytes(4, byteorder))  # comp_unit_count
+    buf.extend((0).to_bytes(4, byteorder))  # local_type_unit_count
+    buf.extend((0).to_bytes(4, byteorder))  # foreign_type_unit_count
+    buf.extend((0).to_bytes(4, byteorder))  # bucket_count
+    buf.extend(len(names).to_bytes(4, byteorder))  # name_count
+    buf.extend(len(abbrev_table).to_bytes(4, byteorder))  # abbrev_table_size
+    buf.extend((0).to_bytes(4, byteorder))  # augmentation_string_size
+    buf.extend((0).to_bytes(4, byteorder))  # CU offset
+    for name in names:
+        buf.extend(len(debug_str).to_bytes(4, byteorder))
+        debug_str.extend(name.encode())
+        debug_str.append(0)
+    for offset in name_offsets:
+        buf.extend(offset.to_bytes(4, byteorder))
+    buf.extend(abbrev_table)
+    buf.extend(entry_pool)
+    buf[:4] = (len(buf) - 4).to_bytes(4, byteorder)
+    return buf
+
+
+def _compile_build_id_note(build_id, little_endian):
+    byteorder = 'little' if little_endian else 'big'
+    buf = bytearray()
+    buf.extend((4).to_bytes(4, byteorder))  # n_namesz
+    buf.extend(len(build_id).to_bytes(4, byteorder))  # n_descsz
+    buf.extend((3).to_bytes(4, byteorder))  # n_type = NT_GNU_BUILD_ID
+    buf.extend(b'GNU\0')
+    buf.extend(build_id)
+    buf.extend(bytes(-len(build_id) % 4))
+    return buf
+
+
+def _compress_section(section, compress, little_endian, bits):
+    if section.name is None or not section.name.startswith('.debug_'):
+        return section
+    data = zlib.compress(section.data)
+    if compress == 'zlib-gnu':
+        section.name = '.z' + section.name[1:]
+        section.data = b'ZLIB' + struct.pack('>Q', len(section.data)) + data
+    else:
+        assert compress == 'zlib-gabi'
+        endian = '<' if little_endian else '>'
+        if bits == 64:
+            # ch_type = ELFCOMPRESS_ZLIB, ch_reserved, ch_size, ch_addralign
+            chdr = struct.pack(endian + 'IIQQ', 1, 0, len(section.data), 1)
+        else:
+            # ch_type = ELFCOMPRESS_ZLIB, ch_size, ch_addralign
+            chdr = struct.pack(endian + 'III', 1, len(section.data), 1)
+        section.sh_flags |= SHF.COMPRESSED
+        section.data = chdr + data
+    return section
+
+
+def _relocate_debug_abbrev_offset(sections, debug_info):
+    # Section indices start after the SHT_NULL section and .shstrtab.
+    indices = {section.name: i for i, section in enumerate(sections, 2)}
+    # Clobber the offset so that it's only correct once relocated.
+    debug_info[6:10] = b'\xff\xff\xff\xff'
+    symtab = bytearray(24)  # The null symbol.
+    # st_name, st_info = STT_SECTION, st_other, st_shndx, st_value, st_size
+    symtab.extend(struct.pack('<IBBHQQ', 0, 3, 0, indices['.debug_abbrev'],
+                              0, 0))
+    sections.append(ElfSection(
+        name='.symtab',
+        sh_type=SHT.SYMTAB,
+        data=symtab,
+        sh_link=1,
+        sh_info=2,
+        sh_entsize=24,
+    ))
+    sections.append(ElfSection(
+        name='.rela.debug_info',
+        sh_type=SHT.RELA,
+        # r_offset = debug_abbrev_offset,
+        # r_info = symbol 1 and R_X86_64_32, r_addend
+        data=struct.pack('<QQq', 6, (1 << 32) | 10, 0),
+        sh_link=len(sections) + 1,
+        sh_info=indices['.debug_info'],
+        sh_entsize=24,
+    ))
+
+
+def _compile_symtab(sections, symbols, little_endian, bits):
+    # Section indices start after the SHT_NULL section and .shstrtab, and
+    # .strtab comes after .symtab.
+    strtab_index = sum(section.name is not None for section in sections) + 3
+    endian = '<' if little_endian else '>'
+    if bits == 64:
+        sym_struct = struct.Struct(endian + 'IBBHQQ')
+    else:
+        sym_struct = struct.Struct(endian + 'IIIBBH')
+    strtab = bytearray(1)
+    symtab = bytearray(sym_struct.size)  # The null symbol.
+    # Local symbols must come first.
+    symbols = sorted(symbols, key=lambda symbol: symbol[3] != STB.LOCAL)
+    num_local = 1 + sum(symbol[3] == STB.LOCAL for symbol in symbols)
+    for name, value, size, binding in symbols:
+        st_info = (binding << 4) | 2  # STT_FUNC
+        st_shndx = 0xfff1  # SHN_ABS
+        if bits == 64:
+            symtab.extend(sym_struct.pack(len(strtab), st_info, 0, st_shndx,
+                                          value, size))
+        else:
+            symtab.extend(sym_struct.pack(len(strtab), value, size, st_info,
+                                          0, st_shndx))
+        strtab.extend(name.encode())
+        strtab.append(0)
+    sections.append(ElfSection(
+        name='.symtab',
+        sh_type=SHT.SYMTAB,
+        data=symtab,
+        sh_link=strtab_index,
+        sh_info=num_local,
+        sh_entsize=sym_struct.size,
+    ))
+    sections.append(ElfSection(
+        name='.strtab',
+        sh_type=SHT.STRTAB,
+        data=strtab,
+    ))
+
+
+def compile_dwarf(dies, little_endian=True, bits=64, build_id=None,
+                  debug_names=False, compress=None, relocatable=False,
+                  symbols=(), sections=()):
     if isinstance(dies, DwarfDie):
         dies = (dies,)
     assert all(isinstance(die, DwarfDie) for die in dies)
@@ -186,11 +397,37 @@ def compile_dwarf(dies, little_endian=True, bits=64):
         DwarfAttrib(DW_AT.stmt_list, DW_FORM.sec_offset, 0),
     ], dies)
 
-    return create_elf_file(ET.EXEC, [
+    all_dies = []
+    debug_info = _compile_debug_info(cu_die, little_endian, bits, all_dies)
+    debug_str = bytearray(1)
+    extra_sections = sections
+    sections = []
+    if debug_names:
+        # debug_names may also be a function which returns whether to index
+        # a DIE.
+        predicate = debug_names if callable(debug_names) else lambda die: True
+        sections.append(ElfSection(
+            name='.debug_names',
+            sh_type=SHT.PROGBITS,
+            data=_compile_debug_names(all_dies, debug_str, little_endian,
+                                      predicate),
+        ))
+    if build_id is not None:
+        sections.append(ElfSection(
+            name='.note.gnu.build-id',
+            sh_type=SHT.NOTE,
+            data=_compile_build_id_note(build_id, little_endian),
+        ))
+    # The segment covers the symbols so that they can be looked up by
+    # address.
+    memsz = max((value + max(size, 1) - 0xffff0000
+                 for _, value, size, _ in symbols), default=0)
+    sections.extend([
         ElfSection(
             p_type=PT.LOAD,
             vaddr=0xffff0000,
             data=b'',
+            memsz=memsz,
         ),
         ElfSection(
             name='.debug_abbrev',
@@ -200,7 +437,7 @@ def compile_dwarf(dies, little_endian=True, bits=64):
         ElfSection(
             name='.debug_info',
             sh_type=SHT.PROGBITS,
-            data=_compile_debug_info(cu_die, little_endian, bits),
+            data=debug_info,
         ),
         ElfSection(
             name='.debug_line',
@@ -210,6 +447,25 @@ def compile_dwarf(dies, little_endian=True, bits=64):
         ElfSection(
             name='.debug_str',
             sh_type=SHT.PROGBITS,
-            data=b'\0',
+            data=debug_str,
         ),
-    ], little_endian=little_endian, bits=bits)
+    ])
+    sections.extend(extra_sections)
+    if relocatable:
+        # Create an x86-64 relocatable file, like a Linux kernel module, in
+        # which .debug_info refers to .debug_abbrev through a relocation.
+        assert little_endian and bits == 64
+        sections = [section for section in sections
+                    if section.name is not None]
+        _relocate_debug_abbrev_offset(sections, debug_info)
+    if symbols:
+        # symbols is a sequence of (name, value, size, binding) tuples.
+        assert not relocatable
+        _compile_symtab(sections, symbols, little_endian, bits)
+    if compress is not None:
+        # compress may be 'zlib-gabi' (SHF_COMPRESSED) or 'zlib-gnu'
+        # (.zdebug_*).
+        sections = [_compress_section(section, compress, little_endian, bits)
+                    for section in sections]
+    return create_elf_file(ET.REL if relocatable else ET.EXEC, sections,
+                           little_endian=little_endian, bits=bits)
@@ -38,3 +38,23 @@ class SHT(enum.IntEnum):
     PREINIT_ARRAY = 16
     GROUP = 17
     SYMTAB_SHNDX = 18
+
+
+class STB(enum.IntEnum):
+    LOCAL = 0
+    GLOBAL = 1
+    WEAK = 2
+
+
+class SHF(enum.IntFlag):
+    WRITE = 0x1
+    ALLOC = 0x2
+    EXECINSTR = 0x4
+    MERGE = 0x10
+    STRINGS = 0x20
+    INFO_LINK = 0x40
+    LINK_ORDER = 0x80
+    OS_NONCONFORMING = 0x100
+    GROUP = 0x200
+    TLS = 0x400
+    COMPRESSED = 0x800
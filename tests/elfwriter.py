@@ -1,13 +1,17 @@
 import struct
 from typing import Optional, Sequence
 
-from tests.elf import ET, PT, SHT
+from tests.elf import ET, PT, SHF, SHT
 
 
 class ElfSection:
     def __init__(self, data: bytes,
                  name: Optional[str] = None,
                  sh_type: Optional[SHT] = None,
+                 sh_flags: SHF = SHF(0),
+                 sh_link: int = 0,
+                 sh_info: int = 0,
+                 sh_entsize: int = 0,
                  p_type: Optional[PT] = None,
                  vaddr: int = 0,
                  paddr: int = 0,
@@ -16,6 +20,10 @@ class ElfSection:
         self.data = data
         self.name = name
         self.sh_type = sh_type
+        self.sh_flags = sh_flags
+        self.sh_link = sh_link
+        self.sh_info = sh_info
+        self.sh_entsize = sh_entsize
         self.p_type = p_type
         self.vaddr = vaddr
         self.paddr = paddr
@@ -105,14 +113,14 @@ def create_elf_file(type: ET, sections: Sequence[ElfSection],
                 buf, shdr_offset,
                 shstrtab.data.index(section.name.encode()),  # sh_name
                 section.sh_type,  # sh_type
-                0,  # sh_flags
+                section.sh_flags,  # sh_flags
                 section.vaddr,  # sh_addr
                 len(buf),  # sh_offset
                 len(section.data),  # sh_size
-                0,  # sh_link
-                0,  # sh_info
+                section.sh_link,  # sh_link
+                section.sh_info,  # sh_info
                 1 if section.p_type is None else bits // 8,  # sh_addralign
-                0,  # sh_entsize
+                section.sh_entsize,  # sh_entsize
             )
             shdr_offset += shdr_struct.size
         if section.p_type is not None:
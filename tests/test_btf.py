@@ -0,0 +1,513 @@
+import struct
+import tempfile
+import unittest
+
+from drgn import (
+    FindObjectFlags,
+    Object,
+    Program,
+    Qualifiers,
+    array_type,
+    bool_type,
+    enum_type,
+    float_type,
+    function_type,
+    int_type,
+    pointer_type,
+    struct_type,
+    typedef_type,
+    union_type,
+    void_type,
+)
+from tests import (
+    MOCK_PLATFORM,
+    color_type,
+    option_type,
+    pid_type,
+    point_type,
+)
+from tests.dwarf import DW_AT, DW_FORM, DW_TAG
+from tests.dwarfwriter import DwarfAttrib, DwarfDie, compile_dwarf
+from tests.elf import ET, SHT
+from tests.elfwriter import ElfSection, create_elf_file
+from tests.test_dwarf import int_die
+from tests.test_kallsyms import SYMBOLS, kallsyms_core, kallsyms_program
+
+
+class BTF_KIND:
+    INT = 1
+    PTR = 2
+    ARRAY = 3
+    STRUCT = 4
+    UNION = 5
+    ENUM = 6
+    FWD = 7
+    TYPEDEF = 8
+    VOLATILE = 9
+    CONST = 10
+    RESTRICT = 11
+    FUNC = 12
+    FUNC_PROTO = 13
+    VAR = 14
+    DATASEC = 15
+    FLOAT = 16
+    DECL_TAG = 17
+    TYPE_TAG = 18
+    ENUM64 = 19
+
+
+class BtfBuilder:
+    """Build a BTF blob. Each method adds a type and returns its type ID."""
+
+    def __init__(self):
+        self._types = []
+        self._strs = bytearray(b'\0')
+
+    def _str(self, s):
+        if not s:
+            return 0
+        offset = len(self._strs)
+        self._strs.extend(s.encode() + b'\0')
+        return offset
+
+    def add(self, kind, name=None, size_or_type=0, vlen=0, kflag=False,
+            words=()):
+        self._types.append((self._str(name), kind, vlen, kflag,
+                            size_or_type, [word & 0xffffffff
+                                           for word in words]))
+        return len(self._types)
+
+    def int(self, name, size, signed=False, bool=False, bits=None,
+            offset=0):
+        encoding = (1 if signed else 0) | (4 if bool else 0)
+        if bits is None:
+            bits = size * 8
+        return self.add(BTF_KIND.INT, name, size,
+                        words=[encoding << 24 | offset << 16 | bits])
+
+    def float(self, name, size):
+        return self.add(BTF_KIND.FLOAT, name, size)
+
+    def ptr(self, type):
+        return self.add(BTF_KIND.PTR, size_or_type=type)
+
+    def array(self, type, nelems):
+        return self.add(BTF_KIND.ARRAY, words=[type, type, nelems])
+
+    def _compound(self, kind, name, size, members, kflag):
+        words = []
+        for member in members:
+            member_name, type, bit_offset = member[:3]
+            if kflag:
+                bit_field_size = member[3] if len(member) > 3 else 0
+                bit_offset |= bit_field_size << 24
+            words.extend([self._str(member_name), type, bit_offset])
+        return self.add(kind, name, size, len(members), kflag, words)
+
+    def struct(self, name, size, members, kflag=False):
+        return self._compound(BTF_KIND.STRUCT, name, size, members, kflag)
+
+    def union(self, name, size, members, kflag=False):
+        return self._compound(BTF_KIND.UNION, name, size, members, kflag)
+
+    def enum(self, name, size, enumerators, signed=False):
+        words = []
+        for enumerator_name, value in enumerators:
+            words.extend([self._str(enumerator_name), value])
+        return self.add(BTF_KIND.ENUM, name, size, len(enumerators), signed,
+                        words)
+
+    def enum64(self, name, size, enumerators, signed=False):
+        words = []
+        for enumerator_name, value in enumerators:
+            value &= 0xffffffffffffffff
+            words.extend([self._str(enumerator_name), value & 0xffffffff,
+                          value >> 32])
+        return self.add(BTF_KIND.ENUM64, name, size, len(enumerators),
+                        signed, words)
+
+    def fwd(self, name, union=False):
+        return self.add(BTF_KIND.FWD, name, kflag=union)
+
+    def typedef(self, name, type):
+        return self.add(BTF_KIND.TYPEDEF, name, type)
+
+    def const(self, type):
+        return self.add(BTF_KIND.CONST, size_or_type=type)
+
+    def volatile(self, type):
+        return self.add(BTF_KIND.VOLATILE, size_or_type=type)
+
+    def func_proto(self, return_type, params, variadic=False):
+        words = []
+        for param_name, type in params:
+            words.extend([self._str(param_name), type])
+        if variadic:
+            words.extend([0, 0])
+        return self.add(BTF_KIND.FUNC_PROTO, size_or_type=return_type,
+                        vlen=len(words) // 2, words=words)
+
+    def func(self, name, proto):
+        return self.add(BTF_KIND.FUNC, name, proto)
+
+    def build(self, little_endian=True):
+        endian = '<' if little_endian else '>'
+        types = bytearray()
+        for name_off, kind, vlen, kflag, size_or_type, words in self._types:
+            types.extend(struct.pack(
+                endian + 'III', name_off,
+                kflag << 31 | kind << 24 | vlen, size_or_type))
+            types.extend(struct.pack(f'{endian}{len(words)}I', *words))
+        header = struct.pack(endian + 'HBBIIIII', 0xeb9f, 1, 0, 24, 0,
+                             len(types), len(types), len(self._strs))
+        return header + types + self._strs
+
+
+def btf_program(builder, prog=None, little_endian=True):
+    if prog is None:
+        prog = Program(MOCK_PLATFORM)
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(builder.build(little_endian))
+        f.flush()
+        prog.load_btf(f.name)
+    return prog
+
+
+class TestTypes(unittest.TestCase):
+    def test_base_types(self):
+        btf = BtfBuilder()
+        btf.int('int', 4, signed=True)
+        btf.int('unsigned int', 4)
+        btf.int('_Bool', 1, bool=True)
+        btf.float('double', 8)
+        prog = btf_program(btf)
+        self.assertEqual(prog.type('int'), int_type('int', 4, True))
+        self.assertEqual(prog.type('unsigned int'),
+                         int_type('unsigned int', 4, False))
+        self.assertEqual(prog.type('_Bool'), bool_type('_Bool', 1))
+        self.assertEqual(prog.type('double'), float_type('double', 8))
+
+    def test_struct(self):
+        btf = BtfBuilder()
+        int_id = btf.int('int', 4, signed=True)
+        btf.struct('point', 8, [('x', int_id, 0), ('y', int_id, 32)])
+        self.assertEqual(btf_program(btf).type('struct point'), point_type)
+
+    def test_union(self):
+        btf = BtfBuilder()
+        int_id = btf.int('int', 4, signed=True)
+        float_id = btf.float('float', 4)
+        btf.union('option', 4, [('i', int_id, 0), ('f', float_id, 0)])
+        self.assertEqual(btf_program(btf).type('union option'), option_type)
+
+    def test_anonymous_member(self):
+        btf = BtfBuilder()
+        int_id = btf.int('int', 4, signed=True)
+        union_id = btf.union(None, 4, [('x', int_id, 0), ('y', int_id, 0)])
+        btf.struct('foo', 8, [(None, union_id, 0), ('z', int_id, 32)])
+        int_t = int_type('int', 4, True)
+        self.assertEqual(
+            btf_program(btf).type('struct foo'),
+            struct_type('foo', 8, (
+                (union_type(None, 4, ((int_t, 'x'), (int_t, 'y'))), None, 0),
+                (int_t, 'z', 32),
+            )))
+
+    def test_bit_field(self):
+        btf = BtfBuilder()
+        int_id = btf.int('int', 4, signed=True)
+        btf.struct('point', 4, [('x', int_id, 0, 4), ('y', int_id, 4, 8)],
+                   kflag=True)
+        int_t = int_type('int', 4, True)
+        self.assertEqual(btf_program(btf).type('struct point'),
+                         struct_type('point', 4, (
+                             (int_t, 'x', 0, 4),
+                             (int_t, 'y', 4, 8),
+                         )))
+
+    def test_bit_field_without_kind_flag(self):
+        btf = BtfBuilder()
+        int_id = btf.int('int', 4, signed=True)
+        x_id = btf.int('int', 4, signed=True, bits=4)
+        y_id = btf.int('int', 4, signed=True, bits=8, offset=4)
+        btf.struct('point', 8, [('x', x_id, 0), ('y', y_id, 0),
+                                ('z', int_id, 32)])
+        int_t = int_type('int', 4, True)
+        self.assertEqual(btf_program(btf).type('struct point'),
+                         struct_type('point', 8, (
+                             (int_t, 'x', 0, 4),
+                             (int_t, 'y', 4, 8),
+                             (int_t, 'z', 32),
+                         )))
+
+    def test_self_referential(self):
+        btf = BtfBuilder()
+        ptr_id = btf.ptr(2)
+        btf.struct('foo', 8, [('next', ptr_id, 0)])
+        type_ = btf_program(btf).type('struct foo')
+        self.assertEqual(type_, struct_type('foo', 8, (
+            (lambda: pointer_type(8, type_), 'next'),
+        )))
+
+    def test_flexible_array_member(self):
+        btf = BtfBuilder()
+        int_id = btf.int('int', 4, signed=True)
+        array_id = btf.array(int_id, 0)
+        btf.struct('foo', 4, [('n', int_id, 0), ('values', array_id, 32)])
+        btf.struct('bar', 0, [('values', array_id, 0)])
+        prog = btf_program(btf)
+        int_t = int_type('int', 4, True)
+        self.assertEqual(prog.type('struct foo'),
+                         struct_type('foo', 4, (
+                             (int_t, 'n'),
+                             (array_type(None, int_t), 'values', 32),
+                         )))
+        self.assertEqual(prog.type('struct bar'),
+                         struct_type('bar', 0, (
+                             (array_type(0, int_t), 'values'),
+                         )))
+
+    def test_enum(self):
+        btf = BtfBuilder()
+        btf.int('unsigned int', 4)
+        btf.enum('color', 4, [('RED', 0), ('GREEN', 1), ('BLUE', 2)])
+        self.assertEqual(btf_program(btf).type('enum color'), color_type)
+
+    def test_signed_enum(self):
+        btf = BtfBuilder()
+        btf.int('int', 4, signed=True)
+        btf.enum('foo', 4, [('NEG', -1), ('POS', 1)])
+        btf.enum('bar', 4, [('ONE', 1)], signed=True)
+        prog = btf_program(btf)
+        int_t = int_type('int', 4, True)
+        self.assertEqual(prog.type('enum foo'),
+                         enum_type('foo', int_t, (('NEG', -1), ('POS', 1))))
+        self.assertEqual(prog.type('enum bar'),
+                         enum_type('bar', int_t, (('ONE', 1),)))
+
+    def test_enum64(self):
+        btf = BtfBuilder()
+        btf.int('long long unsigned int', 8)
+        btf.enum64('big', 8, [('HUGE', 2**63)])
+        self.assertEqual(
+            btf_program(btf).type('enum big'),
+            enum_type('big', int_type('long long unsigned int', 8, False),
+                      (('HUGE', 2**63),)))
+
+    def test_typedef(self):
+        btf = BtfBuilder()
+        int_id = btf.int('int', 4, signed=True)
+        btf.typedef('pid_t', int_id)
+        self.assertEqual(btf_program(btf).type('pid_t'), pid_type)
+
+    def test_qualifiers(self):
+        btf = BtfBuilder()
+        int_id = btf.int('int', 4, signed=True)
+        btf.typedef('cvint', btf.const(btf.volatile(int_id)))
+        self.assertEqual(
+            btf_program(btf).type('cvint'),
+            typedef_type('cvint', int_type('int', 4, True,
+                                           Qualifiers.CONST |
+                                           Qualifiers.VOLATILE)))
+
+    def test_function_pointer(self):
+        btf = BtfBuilder()
+        int_id = btf.int('int', 4, signed=True)
+        proto_id = btf.func_proto(int_id, [('x', int_id), (None, int_id)],
+                                  variadic=True)
+        btf.typedef('callback_t', btf.ptr(proto_id))
+        btf.typedef('void_fn', btf.func_proto(0, []))
+        prog = btf_program(btf)
+        int_t = int_type('int', 4, True)
+        self.assertEqual(
+            prog.type('callback_t'),
+            typedef_type('callback_t', pointer_type(8, function_type(
+                int_t, ((int_t, 'x'), (int_t,)), True))))
+        self.assertEqual(prog.type('void_fn'),
+                         typedef_type('void_fn',
+                                      function_type(void_type(), ())))
+
+    def test_incomplete(self):
+        btf = BtfBuilder()
+        btf.fwd('foo')
+        btf.fwd('bar', union=True)
+        btf.enum('baz', 4, [])
+        prog = btf_program(btf)
+        self.assertEqual(prog.type('struct foo'), struct_type('foo'))
+        self.assertEqual(prog.type('union bar'), union_type('bar'))
+        self.assertEqual(prog.type('enum baz'), enum_type('baz'))
+
+    def test_fwd_completed(self):
+        btf = BtfBuilder()
+        fwd_id = btf.fwd('point')
+        btf.typedef('point_t', fwd_id)
+        int_id = btf.int('int', 4, signed=True)
+        btf.struct('point', 8, [('x', int_id, 0), ('y', int_id, 32)])
+        prog = btf_program(btf)
+        self.assertEqual(prog.type('struct point'), point_type)
+        self.assertEqual(prog.type('point_t'),
+                         typedef_type('point_t', point_type))
+
+    def test_big_endian(self):
+        btf = BtfBuilder()
+        int_id = btf.int('int', 4, signed=True)
+        btf.struct('point', 8, [('x', int_id, 0), ('y', int_id, 32)])
+        self.assertEqual(
+            btf_program(btf, little_endian=False).type('struct point'),
+            point_type)
+
+    def test_not_found(self):
+        btf = BtfBuilder()
+        btf.int('int', 4, signed=True)
+        btf.struct('point', 8, [('x', 1, 0), ('y', 1, 32)])
+        prog = btf_program(btf)
+        self.assertRaises(LookupError, prog.type, 'struct foo')
+        self.assertRaises(LookupError, prog.type, 'union point')
+        # BTF doesn't record filenames.
+        self.assertRaises(LookupError, prog.type, 'struct point', 'foo.c')
+
+    def test_bad_type_id(self):
+        btf = BtfBuilder()
+        btf.typedef('foo', 100)
+        self.assertRaisesRegex(Exception, 'out of bounds',
+                               btf_program(btf).type, 'foo')
+
+    def test_not_a_type(self):
+        btf = BtfBuilder()
+        var_id = btf.add(BTF_KIND.VAR, 'x', 0, words=[0])
+        btf.typedef('foo', var_id)
+        self.assertRaisesRegex(Exception, 'not a type',
+                               btf_program(btf).type, 'foo')
+
+
+class TestObjects(unittest.TestCase):
+    def test_enumerator(self):
+        btf = BtfBuilder()
+        btf.int('unsigned int', 4)
+        btf.enum('color', 4, [('RED', 0), ('GREEN', 1), ('BLUE', 2)])
+        prog = btf_program(btf)
+        self.assertEqual(prog['GREEN'], Object(prog, color_type, value=1))
+        self.assertRaises(LookupError, prog.object, 'GREEN',
+                          FindObjectFlags.FUNCTION)
+
+    def test_function(self):
+        btf = BtfBuilder()
+        proto_id = btf.func_proto(0, [])
+        btf.func('start_kernel', proto_id)
+        btf.func('not_in_kallsyms', proto_id)
+        prog = btf_program(
+            btf, kallsyms_program(SYMBOLS, stext=SYMBOLS[0][2]))
+        self.assertEqual(
+            prog['start_kernel'],
+            Object(prog, function_type(void_type(), ()),
+                   address=0xffffffff81000100))
+        self.assertRaisesRegex(LookupError, 'could not find address',
+                               prog.function, 'not_in_kallsyms')
+
+    def test_function_after_kallsyms(self):
+        btf = BtfBuilder()
+        btf.func('start_kernel', btf.func_proto(0, []))
+        prog = Program()
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(kallsyms_core(SYMBOLS, stext=SYMBOLS[0][2]))
+            f.flush()
+            prog.set_core_dump(f.name)
+        btf_program(btf, prog)
+        self.assertRaises(LookupError, prog.function, 'start_kernel')
+        # The failed lookup must not be remembered once the symbols are
+        # available.
+        prog.load_kallsyms()
+        self.assertEqual(
+            prog.function('start_kernel'),
+            Object(prog, function_type(void_type(), ()),
+                   address=0xffffffff81000100))
+
+
+class TestLoad(unittest.TestCase):
+    def test_elf_section(self):
+        btf = BtfBuilder()
+        int_id = btf.int('int', 4, signed=True)
+        btf.typedef('pid_t', int_id)
+        prog = Program(MOCK_PLATFORM)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(create_elf_file(ET.EXEC, [
+                ElfSection(name='.BTF', sh_type=SHT.PROGBITS,
+                           data=btf.build()),
+            ]))
+            f.flush()
+            prog.load_btf(f.name)
+        self.assertEqual(prog.type('pid_t'), pid_type)
+
+    def test_no_elf_section(self):
+        prog = Program(MOCK_PLATFORM)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(create_elf_file(ET.EXEC, [
+                ElfSection(name='.data', sh_type=SHT.PROGBITS, data=b'foo'),
+            ]))
+            f.flush()
+            self.assertRaisesRegex(Exception, 'no .BTF section',
+                                   prog.load_btf, f.name)
+
+    def test_invalid(self):
+        prog = Program(MOCK_PLATFORM)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'\0' * 32)
+            f.flush()
+            self.assertRaisesRegex(Exception, 'invalid BTF header',
+                                   prog.load_btf, f.name)
+
+    def test_truncated(self):
+        btf = BtfBuilder()
+        btf.int('int', 4, signed=True)
+        data = bytearray(btf.build())
+        # Shrink the type section so that it cuts off the integer encoding.
+        struct.pack_into('<II', data, 12, 12, 12)
+        prog = Program(MOCK_PLATFORM)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            self.assertRaisesRegex(Exception, 'BTF type 1 is truncated',
+                                   prog.load_btf, f.name)
+
+    def test_already_loaded(self):
+        btf = BtfBuilder()
+        btf.int('int', 4, signed=True)
+        prog = btf_program(btf)
+        self.assertRaisesRegex(ValueError, 'already loaded', btf_program, btf,
+                               prog)
+
+    def test_default_path(self):
+        self.assertRaisesRegex(ValueError, 'running kernel',
+                               Program(MOCK_PLATFORM).load_btf)
+
+    def test_precedence(self):
+        btf = BtfBuilder()
+        btf.typedef('INT', btf.int('unsigned int', 4))
+        dies = [
+            int_die,
+            DwarfDie(
+                DW_TAG.typedef,
+                [
+                    DwarfAttrib(DW_AT.name, DW_FORM.string, 'INT'),
+                    DwarfAttrib(DW_AT.type, DW_FORM.ref4, 0),
+                ],
+            ),
+        ]
+
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(compile_dwarf(dies))
+            f.flush()
+
+            # Debugging information loaded after BTF takes precedence.
+            prog = btf_program(btf)
+            prog.load_debug_info([f.name])
+            self.assertEqual(prog.type('INT'),
+                             typedef_type('INT', int_type('int', 4, True)))
+
+            # BTF loaded after debugging information takes precedence.
+            prog = Program(MOCK_PLATFORM)
+            prog.load_debug_info([f.name])
+            btf_program(btf, prog)
+            self.assertEqual(prog.type('INT'),
+                             typedef_type('INT',
+                                          int_type('unsigned int', 4, False)))
@@ -1,6 +1,9 @@
+import os
 import os.path
+import sys
 import tempfile
 import unittest
+import unittest.mock
 
 from drgn import (
     FindObjectFlags,
@@ -709,6 +712,186 @@ class TestTypes(unittest.TestCase):
                                self.type_from_dwarf, dies)
         dies[0].attribs.insert(1, size)
 
+    def test_duplicate(self):
+        struct_die = DwarfDie(
+            DW_TAG.structure_type,
+            [
+                DwarfAttrib(DW_AT.name, DW_FORM.string, 'point'),
+                DwarfAttrib(DW_AT.byte_size, DW_FORM.data1, 8),
+            ],
+            [
+                DwarfDie(
+                    DW_TAG.member,
+                    [
+                        DwarfAttrib(DW_AT.name, DW_FORM.string, 'x'),
+                        DwarfAttrib(DW_AT.data_member_location, DW_FORM.data1, 0),
+                        DwarfAttrib(DW_AT.type, DW_FORM.ref4, 2),
+                    ],
+                ),
+                DwarfDie(
+                    DW_TAG.member,
+                    [
+                        DwarfAttrib(DW_AT.name, DW_FORM.string, 'y'),
+                        DwarfAttrib(DW_AT.data_member_location, DW_FORM.data1, 4),
+                        DwarfAttrib(DW_AT.type, DW_FORM.ref4, 3),
+                    ],
+                ),
+            ],
+        )
+        dies = [
+            struct_die,
+            struct_die,
+            int_die,
+            int_die,
+            DwarfDie(
+                DW_TAG.typedef,
+                [
+                    DwarfAttrib(DW_AT.name, DW_FORM.string, 'point0_t'),
+                    DwarfAttrib(DW_AT.type, DW_FORM.ref4, 0),
+                ],
+            ),
+            DwarfDie(
+                DW_TAG.typedef,
+                [
+                    DwarfAttrib(DW_AT.name, DW_FORM.string, 'point1_t'),
+                    DwarfAttrib(DW_AT.type, DW_FORM.ref4, 1),
+                ],
+            ),
+        ]
+
+        prog = dwarf_program(dies)
+        type0 = prog.type('point0_t').type
+        type1 = prog.type('point1_t').type
+        self.assertEqual(type0, point_type)
+        self.assertEqual(type0._ptr, type1._ptr)
+        self.assertEqual(type0.members[0][0]._ptr,
+                         type1.members[1][0]._ptr)
+
+        dies[1] = DwarfDie(struct_die.tag, struct_die.attribs,
+                           struct_die.children[:1])
+        prog = dwarf_program(dies)
+        type0 = prog.type('point0_t').type
+        type1 = prog.type('point1_t').type
+        self.assertEqual(type0, point_type)
+        self.assertEqual(type1, struct_type('point', 8, point_type.members[:1]))
+        self.assertNotEqual(type0._ptr, type1._ptr)
+
+    def test_duplicate_referencing_different_types(self):
+        def struct_die(name, member, type_):
+            return DwarfDie(
+                DW_TAG.structure_type,
+                [
+                    DwarfAttrib(DW_AT.name, DW_FORM.string, name),
+                    DwarfAttrib(DW_AT.byte_size, DW_FORM.data1, 8),
+                ],
+                [
+                    DwarfDie(
+                        DW_TAG.member,
+                        [
+                            DwarfAttrib(DW_AT.name, DW_FORM.string, member),
+                            DwarfAttrib(DW_AT.data_member_location, DW_FORM.data1, 0),
+                            DwarfAttrib(DW_AT.type, DW_FORM.ref4, type_),
+                        ],
+                    ),
+                ],
+            )
+
+        def typedef_die(name, type_):
+            return DwarfDie(
+                DW_TAG.typedef,
+                [
+                    DwarfAttrib(DW_AT.name, DW_FORM.string, name),
+                    DwarfAttrib(DW_AT.type, DW_FORM.ref4, type_),
+                ],
+            )
+
+        def pointer_die(type_):
+            return DwarfDie(
+                DW_TAG.pointer_type,
+                [
+                    DwarfAttrib(DW_AT.byte_size, DW_FORM.data1, 8),
+                    DwarfAttrib(DW_AT.type, DW_FORM.ref4, type_),
+                ],
+            )
+
+        # Two identical looking struct foos whose members point to different
+        # struct bars.
+        dies = [
+            struct_die('foo', 'b', 2),
+            struct_die('foo', 'b', 3),
+            pointer_die(4),
+            pointer_die(5),
+            struct_die('bar', 'x', 6),
+            struct_die('bar', 'y', 6),
+            int_die,
+            typedef_die('foo0_t', 0),
+            typedef_die('foo1_t', 1),
+            typedef_die('bar0_t', 4),
+            typedef_die('bar1_t', 5),
+        ]
+        for bars_first in (False, True):
+            with self.subTest(bars_first=bars_first):
+                prog = dwarf_program(dies)
+                if bars_first:
+                    prog.type('bar0_t')
+                    prog.type('bar1_t')
+                type0 = prog.type('foo0_t').type
+                type1 = prog.type('foo1_t').type
+                self.assertNotEqual(type0._ptr, type1._ptr)
+                self.assertEqual(type0.members[0][0].type.members[0][1], 'x')
+                self.assertEqual(type1.members[0][0].type.members[0][1], 'y')
+
+        # Once the struct bars are deduplicated, so are the struct foos that
+        # refer to them.
+        dies[5] = dies[4]
+        prog = dwarf_program(dies)
+        self.assertEqual(prog.type('bar0_t').type._ptr,
+                         prog.type('bar1_t').type._ptr)
+        self.assertEqual(prog.type('foo0_t').type._ptr,
+                         prog.type('foo1_t').type._ptr)
+
+    def test_memory_usage(self):
+        prog = dwarf_program((int_die,))
+        usage = prog.memory_usage()
+        self.assertEqual(set(usage), {'types', 'dwarf_index', 'caches'})
+        self.assertGreater(usage['dwarf_index'], 0)
+        self.assertEqual(usage['types'], 0)
+
+        prog.type('int')
+        usage = prog.memory_usage()
+        self.assertGreater(usage['types'], 0)
+        self.assertGreater(usage['caches'], 0)
+
+    def test_dwarf_index_stats(self):
+        stats = Program().dwarf_index_stats()
+        self.assertEqual(stats['num_dies'], 0)
+
+        prog = dwarf_program((int_die, unsigned_int_die, int_die))
+        stats = prog.dwarf_index_stats()
+        self.assertGreater(stats['num_shards'], 0)
+        self.assertEqual(stats['num_names'], 2)
+        self.assertEqual(stats['num_dies'], 2)
+        self.assertEqual(stats['min_shard_dies'], 0)
+        self.assertEqual(stats['max_shard_dies'], 1)
+        self.assertEqual(stats['die_size'], 24)
+        self.assertGreaterEqual(stats['shard_bytes'], 2 * stats['die_size'])
+        self.assertGreater(stats['num_threads'], 0)
+        for key in ('cu_discovery_time', 'decompression_time',
+                    'relocation_time', 'abbrev_parsing_time', 'die_scan_time',
+                    'cache_write_time'):
+            self.assertGreaterEqual(stats[key], 0)
+
+    def test_num_threads(self):
+        prog = Program()
+        prog.num_threads = 1
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(compile_dwarf((int_die, unsigned_int_die)))
+            f.flush()
+            prog.load_debug_info([f.name])
+        self.assertEqual(prog.dwarf_index_stats()['num_threads'], 1)
+        self.assertEqual(prog.type('unsigned int'),
+                         int_type('unsigned int', 4, False))
+
     def test_lazy_cycle(self):
         dies = [
             DwarfDie(
@@ -1699,3 +1882,372 @@ class TestObjects(ObjectTestCase):
     def test_not_found(self):
         prog = dwarf_program([int_die])
         self.assertRaisesRegex(LookupError, 'could not find', prog.object, 'y')
+
+
+
+def enumerator_die(name, value):
+    return DwarfDie(
+        DW_TAG.enumerator,
+        [
+            DwarfAttrib(DW_AT.name, DW_FORM.string, name),
+            DwarfAttrib(DW_AT.const_value, DW_FORM.data1, value),
+        ],
+    )
+
+
+class TestDebugNames(unittest.TestCase):
+    dies = [
+        int_die,
+        DwarfDie(
+            DW_TAG.typedef,
+            [
+                DwarfAttrib(DW_AT.name, DW_FORM.string, 'INT'),
+                DwarfAttrib(DW_AT.type, DW_FORM.ref4, 0),
+            ],
+        ),
+        DwarfDie(
+            DW_TAG.enumeration_type,
+            [
+                DwarfAttrib(DW_AT.name, DW_FORM.string, 'color'),
+                DwarfAttrib(DW_AT.type, DW_FORM.ref4, 0),
+                DwarfAttrib(DW_AT.byte_size, DW_FORM.data1, 4),
+            ],
+            [enumerator_die('RED', 0), enumerator_die('GREEN', 1)],
+        ),
+        DwarfDie(
+            DW_TAG.enumeration_type,
+            [
+                DwarfAttrib(DW_AT.type, DW_FORM.ref4, 0),
+                DwarfAttrib(DW_AT.byte_size, DW_FORM.data1, 4),
+            ],
+            [enumerator_die('ONE', 1), enumerator_die('TWO', 2)],
+        ),
+        DwarfDie(
+            DW_TAG.structure_type,
+            [
+                DwarfAttrib(DW_AT.name, DW_FORM.string, 'point'),
+                DwarfAttrib(DW_AT.byte_size, DW_FORM.data1, 8),
+            ],
+            [
+                DwarfDie(
+                    DW_TAG.member,
+                    [
+                        DwarfAttrib(DW_AT.name, DW_FORM.string, 'x'),
+                        DwarfAttrib(DW_AT.data_member_location,
+                                    DW_FORM.data1, 0),
+                        DwarfAttrib(DW_AT.type, DW_FORM.ref4, 0),
+                    ],
+                ),
+            ],
+        ),
+        DwarfDie(
+            DW_TAG.subprogram,
+            [DwarfAttrib(DW_AT.name, DW_FORM.string, 'main')],
+            [
+                DwarfDie(
+                    DW_TAG.variable,
+                    [
+                        DwarfAttrib(DW_AT.name, DW_FORM.string, 'x'),
+                        DwarfAttrib(DW_AT.type, DW_FORM.ref4, 0),
+                        DwarfAttrib(DW_AT.location, DW_FORM.exprloc,
+                                    b'\x03\x04\x03\x02\x01\xff\xff\xff\xff'),
+                    ],
+                ),
+                DwarfDie(
+                    DW_TAG.enumeration_type,
+                    [
+                        DwarfAttrib(DW_AT.type, DW_FORM.ref4, 0),
+                        DwarfAttrib(DW_AT.byte_size, DW_FORM.data1, 4),
+                    ],
+                    [enumerator_die('LOCAL', 0)],
+                ),
+                DwarfDie(
+                    DW_TAG.lexical_block,
+                    [],
+                    [
+                        DwarfDie(
+                            DW_TAG.variable,
+                            [
+                                DwarfAttrib(DW_AT.name, DW_FORM.string,
+                                            'block_local'),
+                                DwarfAttrib(DW_AT.type, DW_FORM.ref4, 0),
+                            ],
+                        ),
+                    ],
+                ),
+            ],
+        ),
+        DwarfDie(
+            DW_TAG.enumeration_type,
+            [
+                DwarfAttrib(DW_AT.type, DW_FORM.ref4, 0),
+                DwarfAttrib(DW_AT.byte_size, DW_FORM.data1, 4),
+            ],
+            [enumerator_die('THREE', 3)],
+        ),
+    ]
+
+    @staticmethod
+    def program(dies, debug_names=True, compress=None):
+        prog = Program()
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(compile_dwarf(dies, debug_names=debug_names,
+                                  compress=compress))
+            f.flush()
+            prog.load_debug_info([f.name])
+        return prog
+
+    def assert_program(self, prog):
+        int_t = int_type('int', 4, True)
+        self.assertEqual(prog.type('INT'), typedef_type('INT', int_t))
+        self.assertEqual(prog.type('struct point'),
+                         struct_type('point', 8, [(int_t, 'x')]))
+        color = enum_type('color', int_t, [('RED', 0), ('GREEN', 1)])
+        self.assertEqual(prog['GREEN'], Object(prog, color, value=1))
+        anon = enum_type(None, int_t, [('ONE', 1), ('TWO', 2)])
+        self.assertEqual(prog['ONE'], Object(prog, anon, value=1))
+        self.assertEqual(prog['TWO'], Object(prog, anon, value=2))
+        anon = enum_type(None, int_t, [('THREE', 3)])
+        self.assertEqual(prog['THREE'], Object(prog, anon, value=3))
+        # Nested DIEs aren't indexed, even if their parent isn't in the name
+        # index.
+        self.assertRaises(LookupError, prog.object, 'x')
+        self.assertRaises(LookupError, prog.object, 'LOCAL')
+        self.assertRaises(LookupError, prog.object, 'block_local')
+
+    def test_debug_names(self):
+        self.assert_program(self.program(self.dies))
+
+    def test_no_debug_names(self):
+        self.assert_program(self.program(self.dies, debug_names=False))
+
+    def test_compressed(self):
+        for compress in ('zlib-gabi', 'zlib-gnu'):
+            for debug_names in (True, False):
+                with self.subTest(compress=compress, debug_names=debug_names):
+                    prog = self.program(self.dies, debug_names=debug_names,
+                                        compress=compress)
+                    self.assert_program(prog)
+                    # libdw decompresses .zdebug sections itself when it
+                    # opens the file, so only check the SHF_COMPRESSED ones.
+                    if compress == 'zlib-gabi':
+                        stats = prog.dwarf_index_stats()
+                        self.assertGreater(
+                            stats['num_decompressed_sections'], 0)
+                        self.assertGreater(stats['decompression_time'], 0)
+
+    def test_debug_names_used(self):
+        # A DIE missing from the name index isn't found, since the unit isn't
+        # scanned.
+        prog = self.program(
+            self.dies,
+            lambda die: die.tag != DW_TAG.typedef)
+        self.assertRaises(LookupError, prog.type, 'INT')
+        self.assertEqual(prog['TWO'].value_(), 2)
+
+    def test_debug_names_without_enumerators(self):
+        # The name index can't be trusted to include anonymous enumeration
+        # types, so the unit is scanned.
+        prog = self.program(
+            self.dies,
+            lambda die: die.tag not in (DW_TAG.typedef, DW_TAG.enumerator))
+        self.assertEqual(prog.type('INT'),
+                         typedef_type('INT', int_type('int', 4, True)))
+        self.assertEqual(prog['TWO'].value_(), 2)
+
+
+class TestIndexCache(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.cache_dir = os.path.join(self._tmp.name, 'cache')
+        self.path = os.path.join(self._tmp.name, 'file')
+        self.build_id = b'\x01\x23\x45\x67\x89\xab\xcd\xef'
+        self.cache_path = os.path.join(self.cache_dir, self.build_id.hex())
+        patcher = unittest.mock.patch.dict(
+            os.environ, {'DRGN_DWARF_INDEX_CACHE_DIR': self.cache_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def typedef_die(name):
+        return DwarfDie(
+            DW_TAG.typedef,
+            [
+                DwarfAttrib(DW_AT.name, DW_FORM.string, name),
+                DwarfAttrib(DW_AT.type, DW_FORM.ref4, 0),
+            ],
+        )
+
+    def load(self, dies, **kwargs):
+        with open(self.path, 'wb') as f:
+            f.write(compile_dwarf(dies, build_id=self.build_id, **kwargs))
+        return self.program()
+
+    def program(self):
+        prog = Program()
+        prog.load_debug_info([self.path])
+        return prog
+
+    def test_cache(self):
+        dies = [int_die, self.typedef_die('INT'), self.typedef_die('I')]
+        prog = self.load(dies)
+        self.assertEqual(prog.type('INT'),
+                         typedef_type('INT', int_type('int', 4, True)))
+        ino = os.stat(self.cache_path).st_ino
+
+        prog = self.program()
+        self.assertEqual(prog.type('INT'),
+                         typedef_type('INT', int_type('int', 4, True)))
+        self.assertEqual(prog.type('I'),
+                         typedef_type('I', int_type('int', 4, True)))
+        self.assertRaises(LookupError, prog.type, 'LONG')
+        # The cache was hit, so it shouldn't have been rewritten.
+        self.assertEqual(os.stat(self.cache_path).st_ino, ino)
+
+    def test_stale(self):
+        self.load([int_die, self.typedef_die('INT')])
+        prog = self.load([long_die, self.typedef_die('LONG')])
+        self.assertEqual(prog.type('LONG'),
+                         typedef_type('LONG', int_type('long', 8, True)))
+        self.assertRaises(LookupError, prog.type, 'INT')
+
+        prog = self.program()
+        self.assertEqual(prog.type('LONG'),
+                         typedef_type('LONG', int_type('long', 8, True)))
+        self.assertRaises(LookupError, prog.type, 'INT')
+
+    def test_corrupted(self):
+        self.load([int_die, self.typedef_die('INT')])
+        with open(self.cache_path, 'r+b') as f:
+            f.truncate(os.stat(self.cache_path).st_size - 1)
+        for i in range(2):
+            prog = self.program()
+            self.assertEqual(prog.type('INT'),
+                             typedef_type('INT', int_type('int', 4, True)))
+
+    def test_corrupted_entry(self):
+        # The entries start after the 56-byte header and the build ID. Each
+        # one is 32 bytes with the DIE offset first and the tag last.
+        for field, offset, value in (('offset', 64, 1 << 48),
+                                     ('tag', 92, 0x10000)):
+            with self.subTest(field=field):
+                self.load([int_die, self.typedef_die('INT')])
+                with open(self.cache_path, 'r+b') as f:
+                    f.seek(offset)
+                    f.write(value.to_bytes(8 if field == 'offset' else 4,
+                                           sys.byteorder))
+                prog = self.program()
+                self.assertEqual(prog.type('INT'),
+                                 typedef_type('INT', int_type('int', 4, True)))
+                self.assertEqual(prog.type('int'), int_type('int', 4, True))
+
+    def test_disabled(self):
+        del os.environ['DRGN_DWARF_INDEX_CACHE_DIR']
+        prog = self.load([int_die, self.typedef_die('INT')])
+        self.assertEqual(prog.type('INT'),
+                         typedef_type('INT', int_type('int', 4, True)))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_relocation_cache(self):
+        for compress in (None, 'zlib-gabi'):
+            with self.subTest(compress=compress):
+                dies = [int_die, self.typedef_die('INT')]
+                prog = self.load(dies, relocatable=True, compress=compress)
+                self.assertEqual(prog.type('INT'),
+                                 typedef_type('INT', int_type('int', 4, True)))
+                reloc_cache_path = self.cache_path + '.rel'
+                ino = os.stat(reloc_cache_path).st_ino
+
+                prog = self.program()
+                self.assertEqual(prog.type('INT'),
+                                 typedef_type('INT', int_type('int', 4, True)))
+                # The cache was hit, so it shouldn't have been rewritten.
+                self.assertEqual(os.stat(reloc_cache_path).st_ino, ino)
+
+    def test_relocation_cache_corrupted(self):
+        self.load([int_die, self.typedef_die('INT')], relocatable=True)
+        reloc_cache_path = self.cache_path + '.rel'
+        with open(reloc_cache_path, 'r+b') as f:
+            f.truncate(os.stat(reloc_cache_path).st_size - 1)
+        for i in range(2):
+            prog = self.program()
+            self.assertEqual(prog.type('INT'),
+                             typedef_type('INT', int_type('int', 4, True)))
+
+    def test_relocation_cache_disabled(self):
+        del os.environ['DRGN_DWARF_INDEX_CACHE_DIR']
+        prog = self.load([int_die, self.typedef_die('INT')], relocatable=True)
+        self.assertEqual(prog.type('INT'),
+                         typedef_type('INT', int_type('int', 4, True)))
+        self.assertGreater(prog.dwarf_index_stats()['relocation_time'], 0)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+class TestLazyDebugInfo(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.eager_path = os.path.join(self._tmp.name, 'eager')
+        with open(self.eager_path, 'wb') as f:
+            f.write(compile_dwarf([int_die,
+                                   TestIndexCache.typedef_die('INT')],
+                                  build_id=b'\x01' * 8))
+        self.lazy_path = os.path.join(self._tmp.name, 'lazy')
+        with open(self.lazy_path, 'wb') as f:
+            f.write(compile_dwarf(
+                [
+                    int_die,
+                    TestIndexCache.typedef_die('LAZY'),
+                    DwarfDie(
+                        DW_TAG.enumeration_type,
+                        [
+                            DwarfAttrib(DW_AT.type, DW_FORM.ref4, 0),
+                            DwarfAttrib(DW_AT.byte_size, DW_FORM.data1, 4),
+                        ],
+                        [enumerator_die('LAZY_ONE', 1)],
+                    ),
+                ],
+                build_id=b'\x02' * 8))
+
+    def num_dies(self, prog):
+        return prog.dwarf_index_stats()['num_dies']
+
+    def program(self):
+        prog = Program()
+        prog.load_debug_info([self.eager_path])
+        num_dies = self.num_dies(prog)
+        prog.load_debug_info([self.lazy_path], lazy=True)
+        # The deferred file isn't indexed yet.
+        self.assertEqual(self.num_dies(prog), num_dies)
+        return prog, num_dies
+
+    def test_indexed_on_type_miss(self):
+        prog, num_dies = self.program()
+        # Lookups that hit in the indexed file don't index the deferred file.
+        self.assertEqual(prog.type('INT'),
+                         typedef_type('INT', int_type('int', 4, True)))
+        self.assertEqual(self.num_dies(prog), num_dies)
+        self.assertEqual(prog.type('LAZY'),
+                         typedef_type('LAZY', int_type('int', 4, True)))
+        self.assertGreater(self.num_dies(prog), num_dies)
+
+    def test_indexed_on_object_miss(self):
+        prog, num_dies = self.program()
+        self.assertEqual(prog['LAZY_ONE'].value_(), 1)
+        self.assertGreater(self.num_dies(prog), num_dies)
+
+    def test_indexed_on_not_found(self):
+        prog, num_dies = self.program()
+        self.assertRaises(LookupError, prog.type, 'LONG')
+        self.assertGreater(self.num_dies(prog), num_dies)
+        self.assertEqual(prog.type('LAZY'),
+                         typedef_type('LAZY', int_type('int', 4, True)))
+
+    def test_reported_eagerly(self):
+        prog, num_dies = self.program()
+        # Loading the same file without deferring indexes it immediately.
+        prog.load_debug_info([self.lazy_path])
+        self.assertGreater(self.num_dies(prog), num_dies)
+        self.assertEqual(prog.type('LAZY'),
+                         typedef_type('LAZY', int_type('int', 4, True)))
@@ -0,0 +1,219 @@
+import struct
+import tempfile
+import unittest
+
+from drgn import Program
+from tests.elf import ET, PT
+from tests.elfwriter import ElfSection, create_elf_file
+
+
+KALLSYMS_ADDRESS = 0xffffffff82000000
+# Token 0xff is a multi-character token; every other token is the character
+# with the same value.
+LONG_TOKEN = 'kallsyms_'
+
+
+def _tokenize(s):
+    tokens = bytearray()
+    i = 0
+    while i < len(s):
+        if s.startswith(LONG_TOKEN, i):
+            tokens.append(0xff)
+            i += len(LONG_TOKEN)
+        else:
+            tokens.append(ord(s[i]))
+            i += 1
+    return tokens
+
+
+def _note(name, desc):
+    name = name.encode() + b'\0'
+    return (struct.pack('<III', len(name), len(desc), 0) +
+            name + bytes(-len(name) % 4) +
+            desc + bytes(-len(desc) % 4))
+
+
+def kallsyms_core(symbols, mode='offsets', relative_base=0xffffffff81000000,
+                  stext=None, segments=()):
+    """
+    Create a core dump with kallsyms tables for the given symbols, which are
+    (name, type, address) tuples. mode is 'offsets' for
+    CONFIG_KALLSYMS_BASE_RELATIVE, 'absolute_percpu' for that plus
+    CONFIG_KALLSYMS_ABSOLUTE_PERCPU, or 'addresses' for neither. segments is a
+    sequence of additional (address, data) tuples to put in memory.
+    """
+    tables = {}
+
+    token_table = bytearray()
+    token_index = bytearray()
+    for i in range(256):
+        token_index.extend(struct.pack('<H', len(token_table)))
+        if i == 0xff:
+            token_table.extend(LONG_TOKEN.encode())
+        elif i:
+            token_table.append(i)
+        token_table.append(0)
+    tables['kallsyms_token_table'] = token_table
+    tables['kallsyms_token_index'] = token_index
+
+    names = bytearray()
+    for name, type_, _ in symbols:
+        tokens = _tokenize(type_ + name)
+        if len(tokens) >= 0x80:
+            names.append(0x80 | (len(tokens) & 0x7f))
+            names.append(len(tokens) >> 7)
+        else:
+            names.append(len(tokens))
+        names.extend(tokens)
+    tables['kallsyms_names'] = names
+    tables['kallsyms_num_syms'] = struct.pack('<I', len(symbols))
+
+    if mode == 'addresses':
+        tables['kallsyms_addresses'] = b''.join(
+            struct.pack('<Q', address) for _, _, address in symbols)
+    else:
+        offsets = bytearray()
+        for _, _, address in symbols:
+            if mode == 'absolute_percpu' and address < 2**31:
+                offsets.extend(struct.pack('<i', address))
+            elif mode == 'absolute_percpu':
+                offsets.extend(struct.pack('<i',
+                                           relative_base - 1 - address))
+            else:
+                offsets.extend(struct.pack('<I', address - relative_base))
+        tables['kallsyms_offsets'] = offsets
+        tables['kallsyms_relative_base'] = struct.pack('<Q', relative_base)
+
+    data = bytearray()
+    vmcoreinfo = 'OSRELEASE=6.0.0\nPAGESIZE=4096\n'
+    for name, table in tables.items():
+        data.extend(bytes(-len(data) % 8))
+        vmcoreinfo += f'SYMBOL({name})={KALLSYMS_ADDRESS + len(data):x}\n'
+        data.extend(table)
+    if stext is not None:
+        vmcoreinfo += f'SYMBOL(_stext)={stext:x}\n'
+
+    return create_elf_file(ET.CORE, [
+        ElfSection(
+            p_type=PT.NOTE,
+            data=_note('VMCOREINFO', vmcoreinfo.encode()),
+        ),
+        ElfSection(
+            p_type=PT.LOAD,
+            vaddr=KALLSYMS_ADDRESS,
+            data=data,
+        ),
+        *(ElfSection(p_type=PT.LOAD, vaddr=address, data=segment_data)
+          for address, segment_data in segments),
+    ])
+
+
+def kallsyms_program(*args, **kwds):
+    prog = Program()
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(kallsyms_core(*args, **kwds))
+        f.flush()
+        prog.set_core_dump(f.name)
+    prog.load_kallsyms()
+    return prog
+
+
+SYMBOLS = [
+    ('_stext', 'T', 0xffffffff81000000),
+    ('start_kernel', 'T', 0xffffffff81000100),
+    ('do_something', 't', 0xffffffff81000180),
+    ('maybe', 'W', 0xffffffff81000180),
+    ('kallsyms_lookup', 'T', 0xffffffff81000200),
+    ('x' * 200, 't', 0xffffffff81000300),
+    ('jiffies', 'D', 0xffffffff81002000),
+]
+
+
+class TestKallsyms(unittest.TestCase):
+    def assert_symbol(self, sym, name, address, size):
+        self.assertEqual((sym.name, sym.address, sym.size),
+                         (name, address, size))
+
+    def assert_symbols(self, prog):
+        self.assert_symbol(prog.symbol(0xffffffff81000000), '_stext',
+                           0xffffffff81000000, 0x100)
+        self.assert_symbol(prog.symbol(0xffffffff81000150), 'start_kernel',
+                           0xffffffff81000100, 0x80)
+        # The global symbol is preferred.
+        self.assert_symbol(prog.symbol(0xffffffff81000180), 'maybe',
+                           0xffffffff81000180, 0x80)
+        self.assert_symbol(prog.symbol(0xffffffff81000200), 'kallsyms_lookup',
+                           0xffffffff81000200, 0x100)
+        self.assert_symbol(prog.symbol(0xffffffff81000400), 'x' * 200,
+                           0xffffffff81000300, 0x1d00)
+        # The last symbol doesn't have a size.
+        self.assert_symbol(prog.symbol(0xffffffff81003000), 'jiffies',
+                           0xffffffff81002000, 0)
+        self.assertRaises(LookupError, prog.symbol, 0xffffffff80000000)
+
+    def test_offsets(self):
+        self.assert_symbols(kallsyms_program(SYMBOLS, stext=SYMBOLS[0][2]))
+
+    def test_offsets_without_stext(self):
+        self.assert_symbols(kallsyms_program(SYMBOLS))
+
+    def test_absolute_percpu(self):
+        prog = kallsyms_program(
+            SYMBOLS + [('fixed_percpu_data', 'A', 0x0),
+                       ('runqueues', 'A', 0x2c000)],
+            mode='absolute_percpu', relative_base=0xffffffff81000000,
+            stext=SYMBOLS[0][2])
+        self.assert_symbol(prog.symbol(0x10), 'fixed_percpu_data', 0x0,
+                           0x2c000)
+        self.assertEqual(prog.symbol_by_name('runqueues').address, 0x2c000)
+        self.assertEqual(prog.symbol_by_name('_stext').address,
+                         0xffffffff81000000)
+
+    def test_addresses(self):
+        self.assert_symbols(kallsyms_program(SYMBOLS, mode='addresses'))
+
+    def test_by_name(self):
+        prog = kallsyms_program(SYMBOLS, stext=SYMBOLS[0][2])
+        self.assert_symbol(prog.symbol_by_name('do_something'),
+                           'do_something', 0xffffffff81000180, 0x80)
+        self.assertRaises(LookupError, prog.symbol_by_name, 'foo')
+        self.assertEqual(
+            [sym.name for sym in prog.search_symbols('*kernel')],
+            ['start_kernel'])
+        self.assertEqual(
+            [sym.name for sym in prog.search_symbols('[km]*')],
+            ['maybe', 'kallsyms_lookup'])
+
+    def test_symbols(self):
+        prog = kallsyms_program(SYMBOLS, stext=SYMBOLS[0][2])
+        syms = prog.symbols([0xffffffff81000100, 0])
+        self.assertEqual(syms[0].name, 'start_kernel')
+        self.assertIsNone(syms[1])
+
+    def test_already_loaded(self):
+        prog = kallsyms_program(SYMBOLS, stext=SYMBOLS[0][2])
+        sym = prog.symbol(0xffffffff81000100)
+        self.assertRaisesRegex(ValueError, 'already loaded',
+                               prog.load_kallsyms)
+        # Symbols from the first load must still be valid.
+        self.assertEqual(sym.name, 'start_kernel')
+        self.assertEqual(prog.symbol(0xffffffff81000100), sym)
+
+    def test_not_kernel(self):
+        self.assertRaisesRegex(ValueError, 'only available for the Linux kernel',
+                               Program().load_kallsyms)
+
+    def test_no_kallsyms(self):
+        prog = Program()
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(create_elf_file(ET.CORE, [
+                ElfSection(
+                    p_type=PT.NOTE,
+                    data=_note('VMCOREINFO',
+                               b'OSRELEASE=4.19.0\nPAGESIZE=4096\n'),
+                ),
+            ]))
+            f.flush()
+            prog.set_core_dump(f.name)
+        self.assertRaisesRegex(Exception, 'VMCOREINFO does not contain kallsyms',
+                               prog.load_kallsyms)
@@ -1773,6 +1773,19 @@ class TestGenericOperators(ObjectTestCase):
         self.assertRaisesRegex(AttributeError, 'no attribute', getattr, obj,
                                'x')
 
+    def test_member_attribute_conflict(self):
+        type_ = struct_type('foo', 8, (
+            (int_type('int', 4, True), 'type_', 0),
+            (int_type('int', 4, True), 'read_', 32),
+        ))
+        obj = Object(self.prog, type_, address=0xffff0000)
+        self.assertEqual(obj.type_, type_)
+        self.assertTrue(callable(obj.read_))
+        self.assertEqual(obj.member_('type_'),
+                         Object(self.prog, 'int', address=0xffff0000))
+        self.assertEqual(obj.member_('read_'),
+                         Object(self.prog, 'int', address=0xffff0004))
+
     def test_bit_field_member(self):
         segment = b'\x07\x10\x5e\x5f\x1f\0\0\0'
         prog = mock_program(segments=[
@@ -1830,8 +1843,38 @@ class TestGenericOperators(ObjectTestCase):
         self.assertRaisesRegex(TypeError, 'must be an array or pointer',
                                Object(prog, 'int', value=1).string_)
 
+    def test_long_string(self):
+        data = b'x' * 10000 + b'\0'
+        prog = mock_program(segments=[
+            MockMemorySegment(data, virt_addr=0xffff0fc0),
+        ])
+        self.assertEqual(Object(prog, 'char *', value=0xffff0fc0).string_(),
+                         data[:-1])
+        self.assertEqual(Object(prog, 'char *', value=0xffff3000).string_(),
+                         data[0x2040:-1])
+        self.assertEqual(
+            Object(prog, 'char [5000]', address=0xffff0fc3).string_(),
+            data[:5000])
+        prog = mock_program(segments=[
+            MockMemorySegment(b'x' * 100, virt_addr=0xffff0fc0),
+        ])
+        self.assertRaisesRegex(FaultError, 'could not find memory segment',
+                               Object(prog, 'char *', value=0xffff0fc0).string_)
+
 
 class TestSpecialMethods(ObjectTestCase):
+    def test_buffer(self):
+        obj = Object(self.prog, point_type, value={'x': 1, 'y': -2})
+        self.assertEqual(memoryview(obj), struct.pack('<ii', 1, -2))
+        obj = Object(self.prog, 'int [2]', value=[3, 4])
+        self.assertEqual(memoryview(obj).tobytes(), struct.pack('<ii', 3, 4))
+        self.assertRaisesRegex(BufferError, 'does not have a buffer value',
+                               memoryview, Object(self.prog, 'int', value=1))
+        # Mock memory can't be accessed without copying.
+        self.assertRaisesRegex(BufferError, 'without copying', memoryview,
+                               Object(self.prog, point_type,
+                                      address=0xffff0000))
+
     def test_dir(self):
         obj = Object(self.prog, 'int', value=0)
         self.assertEqual(dir(obj), sorted(object.__dir__(obj)))
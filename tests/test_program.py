@@ -1,7 +1,11 @@
+import concurrent.futures
 import ctypes
+import functools
 import itertools
 import os
+import struct
 import tempfile
+import time
 import unittest
 import unittest.mock
 
@@ -32,13 +36,18 @@ from tests import (
     MockObject,
     ObjectTestCase,
     color_type,
+    mock_memory_read,
     mock_program,
     option_type,
     pid_type,
     point_type,
 )
-from tests.elf import ET, PT
+from tests.dwarf import DW_AT, DW_FORM, DW_TAG
+from tests.dwarfwriter import DwarfAttrib, DwarfDie, compile_dwarf
+from tests.elf import ET, PT, SHT, STB
 from tests.elfwriter import ElfSection, create_elf_file
+from tests.test_dwarf import unsigned_long_die
+from tests.test_kallsyms import SYMBOLS, kallsyms_core, kallsyms_program
 
 
 def zero_memory_read(address, count, offset, physical):
@@ -103,6 +112,26 @@ class TestProgram(unittest.TestCase):
     def test_debug_info(self):
         Program().load_debug_info([])
 
+    def test_num_threads(self):
+        prog = Program()
+        self.assertEqual(prog.num_threads, 0)
+        prog.num_threads = 2
+        self.assertEqual(prog.num_threads, 2)
+        self.assertRaises(ValueError, setattr, prog, 'num_threads', -1)
+        self.assertRaises(TypeError, setattr, prog, 'num_threads', 'foo')
+
+    def test_lazy_kernel_modules(self):
+        with unittest.mock.patch.dict(os.environ,
+                                      {'DRGN_LAZY_KERNEL_MODULES': '0'}):
+            prog = Program()
+        self.assertFalse(prog.lazy_kernel_modules)
+        prog.lazy_kernel_modules = True
+        self.assertTrue(prog.lazy_kernel_modules)
+        self.assertRaises(AttributeError, delattr, prog, 'lazy_kernel_modules')
+        with unittest.mock.patch.dict(os.environ,
+                                      {'DRGN_LAZY_KERNEL_MODULES': '1'}):
+            self.assertTrue(Program().lazy_kernel_modules)
+
 
 class TestMemory(unittest.TestCase):
     def test_simple_read(self):
@@ -136,6 +165,56 @@ class TestMemory(unittest.TestCase):
         ])
         self.assertEqual(prog.read(0xffff0000, 14), data[:14])
 
+    def test_add_segment_after_read(self):
+        prog = mock_program(segments=[
+            MockMemorySegment(b'hello, world', 0xffff0000),
+            MockMemorySegment(b'foobar', 0xfffff000),
+        ])
+        self.assertEqual(prog.read(0xffff0000, 5), b'hello')
+        self.assertEqual(prog.read(0xfffff000, 3), b'foo')
+        prog.add_memory_segment(0xffff0000, 5,
+                                functools.partial(mock_memory_read, b'HELLO'))
+        self.assertEqual(prog.read(0xffff0000, 12), b'HELLO, world')
+        self.assertEqual(prog.read(0xfffff000, 6), b'foobar')
+        self.assertRaises(FaultError, prog.read, 0xffff000c, 1)
+
+    def test_threads(self):
+        data = bytes(range(256)) * 48
+        segment = unittest.mock.Mock(
+            side_effect=functools.partial(mock_memory_read, data))
+        prog = Program(MOCK_PLATFORM)
+        prog.add_memory_segment(0xffff0000, len(data), segment)
+        # Two blocks for three pages of data, so reads hit, miss, evict, and
+        # cross block boundaries concurrently.
+        prog.set_memory_cache(2 * 4096)
+
+        def read(i):
+            address = 0xffff0000 + (i * 24) % (len(data) - 16)
+            return prog.read(address, 16)
+
+        num_reads = 2000
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            for i, buf in enumerate(executor.map(read, range(num_reads))):
+                offset = (i * 24) % (len(data) - 16)
+                self.assertEqual(buf, data[offset:offset + 16])
+        # Most of the reads were served from the cache.
+        self.assertLess(segment.call_count, num_reads // 2)
+
+    def test_read_into(self):
+        data = b'hello, world'
+        prog = mock_program(segments=[
+            MockMemorySegment(data, 0xffff0000, 0xa0),
+        ])
+        buf = bytearray(5)
+        self.assertIsNone(prog.read_into(buf, 0xffff0000))
+        self.assertEqual(buf, b'hello')
+        view = memoryview(buf)
+        prog.read_into(view[1:4], 0xa7, True)
+        self.assertEqual(buf, b'hworo')
+        self.assertRaisesRegex(FaultError, 'could not find memory segment',
+                               prog.read_into, buf, 0xffff0008)
+        self.assertRaises(TypeError, prog.read_into, b'hello', 0xffff0000)
+
     def test_overlap_same_address_smaller_size(self):
         # Existing segment: |_______|
         # New segment:      |___|
@@ -283,6 +362,146 @@ class TestMemory(unittest.TestCase):
             prog.read, 0xffff0000, 8)
 
 
+class TestReadMany(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = bytes(range(256)) * 16
+        self.segment = unittest.mock.Mock(
+            side_effect=functools.partial(mock_memory_read, self.data))
+        self.prog = Program(MOCK_PLATFORM)
+        self.prog.add_memory_segment(0xffff0000, len(self.data), self.segment)
+
+    def test_read_many(self):
+        addresses = [0xffff0000 + i for i in range(0, 1024, 8)]
+        random_order = addresses[1::2] + addresses[::2]
+        self.assertEqual(
+            self.prog.read_many(random_order, 8),
+            [self.data[address - 0xffff0000:address - 0xffff0000 + 8]
+             for address in random_order])
+        self.assertEqual(self.segment.call_count, 1)
+
+    def test_sizes(self):
+        self.assertEqual(
+            self.prog.read_many([0xffff0100, 0xffff0000, 0xffff0102],
+                                [4, 2, 0]),
+            [self.data[0x100:0x104], self.data[:2], b''])
+        self.assertEqual(self.segment.call_count, 1)
+        self.assertRaises(ValueError, self.prog.read_many, [0xffff0000],
+                          [1, 2])
+        self.assertRaises(ValueError, self.prog.read_many, [0xffff0000], -1)
+        self.assertRaises(ValueError, self.prog.read_many, [0xffff0000],
+                          [-1])
+
+    def test_far_apart(self):
+        self.assertEqual(self.prog.read_many([0xffff0000, 0xffff0f00], 4),
+                         [self.data[:4], self.data[0xf00:0xf04]])
+        self.assertEqual(self.segment.call_count, 2)
+
+    def test_empty(self):
+        self.assertEqual(self.prog.read_many([], 8), [])
+        self.segment.assert_not_called()
+
+    def test_fault(self):
+        addresses = [0xffff0000, 0xfffeffff, 0xdeadbeef, 0xffff0010]
+        self.assertRaisesRegex(FaultError, 'could not find memory segment',
+                               self.prog.read_many, addresses, 4)
+        self.assertEqual(self.prog.read_many(addresses, 4, fault_ok=True),
+                         [self.data[:4], None, None, self.data[0x10:0x14]])
+
+    def test_physical(self):
+        prog = mock_program(segments=[
+            MockMemorySegment(self.data, 0xffff0000, 0xa0),
+        ])
+        self.assertEqual(prog.read_many([0xa0, 0xa8], 8, True),
+                         [self.data[:8], self.data[8:16]])
+
+
+class TestMemoryCache(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = bytes(range(256)) * 48
+        self.segment = unittest.mock.Mock(
+            side_effect=functools.partial(mock_memory_read, self.data))
+        self.prog = Program(MOCK_PLATFORM)
+        self.prog.add_memory_segment(0xffff0000, len(self.data), self.segment)
+
+    def test_disabled(self):
+        self.prog.read(0xffff0010, 8)
+        self.prog.read(0xffff0010, 8)
+        self.assertEqual(self.segment.call_count, 2)
+
+    def test_cached(self):
+        self.prog.set_memory_cache(4096)
+        self.assertEqual(self.prog.read(0xffff0010, 8), self.data[16:24])
+        self.assertEqual(self.prog.read(0xffff0020, 8), self.data[32:40])
+        self.segment.assert_called_once_with(0xffff0000, 4096, 0, False)
+
+    def test_read_across_blocks(self):
+        self.prog.set_memory_cache(3 * 4096)
+        self.assertEqual(self.prog.read(0xffff0ff0, 32),
+                         self.data[0xff0:0x1010])
+        self.assertEqual(self.prog.read(0xffff1000, 8), self.data[0x1000:0x1008])
+        self.segment.assert_has_calls([
+            unittest.mock.call(0xffff0000, 4096, 0, False),
+            unittest.mock.call(0xffff1000, 4096, 4096, False),
+        ])
+        self.assertEqual(self.segment.call_count, 2)
+
+    def test_lru_eviction(self):
+        self.prog.set_memory_cache(2 * 4096)
+        self.prog.read(0xffff0000, 8)
+        self.prog.read(0xffff1000, 8)
+        self.prog.read(0xffff0000, 8)
+        self.prog.read(0xffff2000, 8)
+        self.assertEqual(self.segment.call_count, 3)
+        self.prog.read(0xffff0000, 8)
+        self.assertEqual(self.segment.call_count, 3)
+        self.prog.read(0xffff1000, 8)
+        self.assertEqual(self.segment.call_count, 4)
+
+    def test_flush(self):
+        self.prog.set_memory_cache(4096)
+        self.prog.read(0xffff0000, 8)
+        self.prog.flush_memory_cache()
+        self.prog.read(0xffff0000, 8)
+        self.assertEqual(self.segment.call_count, 2)
+
+    def test_add_segment_flushes(self):
+        self.prog.set_memory_cache(4096)
+        self.prog.read(0xffff0000, 8)
+        self.prog.add_memory_segment(0xffff0000, 8, zero_memory_read)
+        self.assertEqual(self.prog.read(0xffff0000, 8), bytes(8))
+
+    def test_partial_block(self):
+        prog = Program(MOCK_PLATFORM)
+        prog.set_memory_cache(4096)
+        data = b'hello, world!'
+        prog.add_memory_segment(0xffff0000, len(data),
+                                functools.partial(mock_memory_read, data))
+        self.assertEqual(prog.read(0xffff0000, len(data)), data)
+        self.assertRaisesRegex(FaultError, 'could not find memory segment',
+                               prog.read, 0xffff0000, len(data) + 1)
+
+    def test_physical(self):
+        self.prog.add_memory_segment(0xffff0000, len(self.data), zero_memory_read,
+                                     True)
+        self.prog.set_memory_cache(4096)
+        self.assertEqual(self.prog.read(0xffff0000, 8), self.data[:8])
+        self.assertEqual(self.prog.read(0xffff0000, 8, True), bytes(8))
+        self.assertEqual(self.prog.read(0xffff0000, 8), self.data[:8])
+
+    def test_max_age(self):
+        self.prog.set_memory_cache(4096, max_age=0.001)
+        self.prog.read(0xffff0000, 8)
+        time.sleep(0.01)
+        self.prog.read(0xffff0000, 8)
+        self.assertEqual(self.segment.call_count, 2)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.prog.set_memory_cache, -1)
+        self.assertRaises(ValueError, self.prog.set_memory_cache, 4096, 0)
+
+
 class TestTypes(unittest.TestCase):
     def test_invalid_finder(self):
         self.assertRaises(TypeError, mock_program().add_type_finder, 'foo')
@@ -302,6 +521,76 @@ class TestTypes(unittest.TestCase):
         prog.add_type_finder(lambda kind, name, filename: None)
         self.assertRaises(LookupError, prog.type, 'struct foo')
 
+    def test_cached(self):
+        prog = mock_program()
+        calls = []
+
+        def finder(kind, name, filename):
+            calls.append(name)
+            return point_type if name == 'point' else None
+
+        prog.add_type_finder(finder, cache=True)
+        for _ in range(2):
+            self.assertEqual(prog.type('struct point'), point_type)
+            self.assertRaisesRegex(LookupError, "could not find 'struct foo'",
+                                   prog.type, 'struct foo')
+        self.assertEqual(calls, ['point', 'foo'])
+        self.assertEqual(prog.type('struct point *'),
+                         pointer_type(8, point_type))
+        self.assertEqual(calls, ['point', 'foo', 'point'])
+
+    def test_not_cached(self):
+        prog = mock_program()
+        calls = []
+
+        def finder(kind, name, filename):
+            calls.append(name)
+            return point_type if name == 'point' else None
+
+        prog.add_type_finder(finder)
+        for _ in range(2):
+            self.assertEqual(prog.type('struct point'), point_type)
+            self.assertRaises(LookupError, prog.type, 'struct foo')
+        self.assertEqual(calls, ['point', 'foo', 'point', 'foo'])
+
+    def test_cached_with_uncached_finder(self):
+        prog = mock_program()
+        calls = []
+
+        def finder(kind, name, filename):
+            calls.append(name)
+            return None
+
+        prog.add_type_finder(
+            lambda kind, name, filename: point_type if name == 'point' else None,
+            cache=True)
+        prog.add_type_finder(finder)
+        for _ in range(2):
+            self.assertEqual(prog.type('struct point'), point_type)
+        self.assertEqual(calls, ['point', 'point'])
+
+    def test_add_finder_clears_cache(self):
+        prog = mock_program()
+        self.assertRaises(LookupError, prog.type, 'struct point')
+        prog.add_type_finder(
+            lambda kind, name, filename: point_type if name == 'point' else None)
+        self.assertEqual(prog.type('struct point'), point_type)
+
+    def test_finder_names(self):
+        prog = mock_program()
+        calls = []
+
+        def finder(kind, name, filename):
+            calls.append(name)
+            return point_type if name == 'point' else None
+
+        prog.add_type_finder(finder, names=['point'])
+        self.assertEqual(prog.type('struct point'), point_type)
+        self.assertRaises(LookupError, prog.type, 'struct foo')
+        self.assertEqual(calls, ['point'])
+        self.assertRaises(TypeError, prog.add_type_finder, finder,
+                          names='point')
+
     def test_default_primitive_types(self):
         def spellings(tokens, num_optional=0):
             for i in range(len(tokens) - num_optional, len(tokens) + 1):
@@ -490,6 +779,70 @@ class TestObjects(ObjectTestCase):
         self.assertRaises(LookupError, prog.object, 'foo')
         self.assertFalse('foo' in prog)
 
+    def test_cached(self):
+        prog = mock_program()
+        calls = []
+
+        def finder(prog, name, flags, filename):
+            calls.append(name)
+            if name == 'counter':
+                return Object(prog, 'int', address=0xffff0000)
+            return None
+
+        prog.add_object_finder(finder, cache=True)
+        for _ in range(2):
+            self.assertEqual(prog['counter'],
+                             Object(prog, 'int', address=0xffff0000))
+            self.assertRaisesRegex(LookupError, "could not find 'foo'",
+                                   prog.object, 'foo')
+        self.assertEqual(calls, ['counter', 'foo'])
+        prog.variable('counter')
+        self.assertEqual(calls, ['counter', 'foo', 'counter'])
+
+    def test_not_cached(self):
+        prog = mock_program()
+        count = 0
+
+        def finder(prog, name, flags, filename):
+            nonlocal count
+            if name == 'counter':
+                count += 1
+                return Object(prog, 'int', value=count)
+            return None
+
+        prog.add_object_finder(finder)
+        self.assertEqual(prog['counter'], Object(prog, 'int', value=1))
+        self.assertEqual(prog['counter'], Object(prog, 'int', value=2))
+        self.assertFalse('foo' in prog)
+
+    def test_add_finder_clears_cache(self):
+        prog = mock_program()
+        self.assertRaises(LookupError, prog.object, 'foo')
+        prog.add_object_finder(
+            lambda prog, name, flags, filename: Object(prog, 'int', value=1))
+        self.assertEqual(prog['foo'], Object(prog, 'int', value=1))
+
+    def test_finder_names(self):
+        prog = mock_program()
+        calls = []
+
+        def finder(prog, name, flags, filename):
+            calls.append(name)
+            if name == 'counter':
+                return Object(prog, 'int', address=0xffff0000)
+            return None
+
+        prog.add_object_finder(finder, names={'counter', 'foo'})
+        self.assertEqual(prog.variable('counter'),
+                         Object(prog, 'int', address=0xffff0000))
+        self.assertEqual(prog['counter'],
+                         Object(prog, 'int', address=0xffff0000))
+        self.assertEqual(prog['counter'],
+                         Object(prog, 'int', address=0xffff0000))
+        self.assertFalse('foo' in prog)
+        self.assertFalse('bar' in prog)
+        self.assertEqual(calls, ['counter', 'counter', 'counter', 'foo'])
+
     def test_constant(self):
         mock_obj = MockObject('PAGE_SIZE', int_type('int', 4, True),
                               value=4096)
@@ -523,6 +876,279 @@ class TestObjects(ObjectTestCase):
         self.assertTrue('counter' in prog)
 
 
+def vmlinux_program(dies=(), symbols=(), segments=()):
+    # Load the debugging information as vmlinux for a kernel core dump. Other
+    # files are reported as not loaded, so their symbols couldn't be found by
+    # address.
+    prog = Program()
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(kallsyms_core((), segments=segments))
+        f.flush()
+        prog.set_core_dump(f.name)
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(compile_dwarf(dies, symbols=symbols, sections=[
+            ElfSection(name='.init.text', sh_type=SHT.PROGBITS, data=b''),
+        ]))
+        f.flush()
+        prog.load_debug_info([f.name])
+    return prog
+
+
+def symbol_program(symbols):
+    return vmlinux_program(symbols=symbols)
+
+
+class TestSymbols(unittest.TestCase):
+    def test_not_found(self):
+        prog = Program()
+        self.assertRaises(LookupError, prog.symbol, 0xffff0000)
+        self.assertEqual(prog.symbols([0xffff0000, 0]), [None, None])
+
+    def test_symbols_args(self):
+        prog = Program()
+        self.assertEqual(prog.symbols([]), [])
+        self.assertEqual(prog.symbols(iter([0xffff0000])), [None])
+        self.assertEqual(prog.symbols(addresses=(0xffff0000,)), [None])
+        self.assertRaises(TypeError, prog.symbols, None)
+        self.assertRaises(TypeError, prog.symbols, ['foo'])
+        self.assertRaises(OverflowError, prog.symbols, [-1])
+
+    def assert_symbol(self, sym, name, address, size):
+        self.assertEqual((sym.name, sym.address, sym.size),
+                         (name, address, size))
+
+    def test_symbol(self):
+        prog = symbol_program([
+            ('foo', 0xffff0000, 0x10, STB.GLOBAL),
+            ('bar', 0xffff0010, 0x20, STB.LOCAL),
+            ('baz', 0xffff0040, 0x10, STB.GLOBAL),
+        ])
+        for address in (0xffff0000, 0xffff000f):
+            self.assert_symbol(prog.symbol(address), 'foo', 0xffff0000, 0x10)
+        for address in (0xffff0010, 0xffff002f):
+            self.assert_symbol(prog.symbol(address), 'bar', 0xffff0010, 0x20)
+        self.assertRaisesRegex(LookupError,
+                               'could not find symbol containing 0xffff0030',
+                               prog.symbol, 0xffff0030)
+        self.assert_symbol(prog.symbol(0xffff004f), 'baz', 0xffff0040, 0x10)
+
+    def test_symbol_binding(self):
+        prog = symbol_program([
+            ('local', 0xffff0000, 0x10, STB.LOCAL),
+            ('weak', 0xffff0000, 0x10, STB.WEAK),
+            ('global', 0xffff0000, 0x10, STB.GLOBAL),
+            ('local2', 0xffff0010, 0x10, STB.LOCAL),
+            ('weak2', 0xffff0010, 0x10, STB.WEAK),
+        ])
+        self.assertEqual(prog.symbol(0xffff0008).name, 'global')
+        self.assertEqual(prog.symbol(0xffff0018).name, 'weak2')
+
+    def test_symbol_enclosing(self):
+        prog = symbol_program([
+            ('outer', 0xffff0000, 0x100, STB.GLOBAL),
+            ('inner', 0xffff0010, 0x10, STB.GLOBAL),
+        ])
+        self.assertEqual(prog.symbol(0xffff0008).name, 'outer')
+        self.assertEqual(prog.symbol(0xffff0018).name, 'inner')
+        self.assertEqual(prog.symbol(0xffff0020).name, 'outer')
+        self.assertEqual(prog.symbol(0xffff00ff).name, 'outer')
+
+    def test_symbol_sizeless(self):
+        prog = symbol_program([
+            ('sized', 0xffff0000, 0x10, STB.GLOBAL),
+            ('sizeless', 0xffff0020, 0, STB.GLOBAL),
+            ('end', 0xffff0040, 0x10, STB.GLOBAL),
+        ])
+        # A sizeless symbol only matches if no symbol contains the address
+        # and it is the closest symbol before the address.
+        self.assertRaises(LookupError, prog.symbol, 0xffff0018)
+        self.assert_symbol(prog.symbol(0xffff0020), 'sizeless', 0xffff0020, 0)
+        self.assert_symbol(prog.symbol(0xffff0030), 'sizeless', 0xffff0020, 0)
+        self.assertEqual(prog.symbol(0xffff0040).name, 'end')
+
+    def test_symbols(self):
+        prog = symbol_program([
+            ('foo', 0xffff0000, 0x10, STB.GLOBAL),
+            ('bar', 0xffff0020, 0x10, STB.GLOBAL),
+        ])
+        syms = prog.symbols([0xffff0020, 0xffff0010, 0xffff0008, 0xffff0020])
+        self.assertEqual([sym and sym.name for sym in syms],
+                         ['bar', None, 'foo', 'bar'])
+        self.assertEqual(syms[0], prog.symbol(0xffff0020))
+        self.assertEqual(syms[2], prog.symbol(0xffff0008))
+
+    def test_symbol_by_name(self):
+        prog = symbol_program([
+            ('foo', 0xffff0000, 0x10, STB.GLOBAL),
+            ('bar', 0xffff0010, 0x20, STB.LOCAL),
+        ])
+        sym = prog.symbol_by_name('foo')
+        self.assertEqual((sym.name, sym.address, sym.size),
+                         ('foo', 0xffff0000, 0x10))
+        self.assertEqual(prog.symbol_by_name('bar').address, 0xffff0010)
+        self.assertRaisesRegex(LookupError, "could not find symbol 'baz'",
+                               prog.symbol_by_name, 'baz')
+        self.assertRaises(LookupError, Program().symbol_by_name, 'foo')
+
+    def test_symbol_by_name_binding(self):
+        prog = symbol_program([
+            ('foo', 0xffff0000, 0x10, STB.LOCAL),
+            ('foo', 0xffff0010, 0x10, STB.WEAK),
+            ('foo', 0xffff0020, 0x10, STB.GLOBAL),
+            ('bar', 0xffff0030, 0x10, STB.LOCAL),
+            ('bar', 0xffff0040, 0x10, STB.WEAK),
+        ])
+        self.assertEqual(prog.symbol_by_name('foo').address, 0xffff0020)
+        self.assertEqual(prog.symbol_by_name('bar').address, 0xffff0040)
+
+    def test_search_symbols(self):
+        prog = symbol_program([
+            ('foo', 0xffff0020, 0x10, STB.GLOBAL),
+            ('foo', 0xffff0000, 0x10, STB.LOCAL),
+            ('foobar', 0xffff0010, 0x10, STB.GLOBAL),
+            ('bar', 0xffff0030, 0x10, STB.GLOBAL),
+        ])
+        self.assertEqual(
+            [(sym.name, sym.address) for sym in prog.search_symbols('foo*')],
+            [('foo', 0xffff0000), ('foobar', 0xffff0010),
+             ('foo', 0xffff0020)])
+        self.assertEqual(
+            [sym.name for sym in prog.search_symbols('*bar')],
+            ['foobar', 'bar'])
+        self.assertEqual(
+            [sym.name for sym in prog.search_symbols('b?r')], ['bar'])
+        self.assertEqual(prog.search_symbols('baz*'), [])
+        self.assertEqual(Program().search_symbols('*'), [])
+
+
+class TestStackTraces(unittest.TestCase):
+    def test_not_kernel(self):
+        prog = mock_program()
+        thread = Object(prog, 'int', value=0)
+        self.assertRaisesRegex(ValueError, 'only supported for the Linux kernel',
+                               prog.stack_traces, [thread])
+
+    def test_args(self):
+        prog = kallsyms_program(SYMBOLS)
+        self.assertEqual(prog.stack_traces([]), [])
+        self.assertEqual(prog.stack_traces(threads=iter(())), [])
+        self.assertRaises(TypeError, prog.stack_traces, None)
+        self.assertRaises(TypeError, prog.stack_traces, [0])
+        other = kallsyms_program(SYMBOLS)
+        self.assertRaisesRegex(ValueError, 'different programs',
+                               prog.stack_traces,
+                               [Object(other, 'void *', value=0)])
+
+    STACKS_ADDRESS = 0xffffc90000000000
+    TASKS_ADDRESS = 0xffffc90000010000
+
+    @staticmethod
+    def struct_die(name, members):
+        return DwarfDie(
+            DW_TAG.structure_type,
+            [
+                DwarfAttrib(DW_AT.name, DW_FORM.string, name),
+                DwarfAttrib(DW_AT.byte_size, DW_FORM.data1, 8 * len(members)),
+            ],
+            [
+                DwarfDie(
+                    DW_TAG.member,
+                    [
+                        DwarfAttrib(DW_AT.name, DW_FORM.string, member),
+                        DwarfAttrib(DW_AT.data_member_location, DW_FORM.data1,
+                                    8 * i),
+                        DwarfAttrib(DW_AT.type, DW_FORM.ref4, type_),
+                    ],
+                )
+                for i, (member, type_) in enumerate(members)
+            ],
+        )
+
+    def stack_trace_program(self, traces):
+        """
+        Create a kernel program with a task for each of the given lists of
+        return addresses and return the program and the tasks. Each task's
+        inactive_task_frame returns to the first address, and the rest are
+        found by following frame pointers.
+        """
+        dies = [
+            unsigned_long_die,
+            self.struct_die('inactive_task_frame', [
+                (reg, 0) for reg in ('r15', 'r14', 'r13', 'r12', 'bx', 'bp',
+                                     'ret_addr')
+            ]),
+            self.struct_die('thread_struct', [('sp', 0)]),
+            self.struct_die('task_struct', [('thread', 2)]),
+        ]
+        stacks = bytearray()
+        tasks = bytearray()
+        for pcs in traces:
+            frame = self.STACKS_ADDRESS + len(stacks)
+            # Each frame record is the saved frame pointer and the return
+            # address, and the records follow the 56-byte frame.
+            records = [frame + 56 + 16 * i for i in range(len(pcs) - 1)]
+            stacks.extend(struct.pack('<7Q', 0, 0, 0, 0, 0,
+                                      records[0] if records else 0, pcs[0]))
+            for i, pc in enumerate(pcs[1:]):
+                stacks.extend(struct.pack(
+                    '<QQ', records[i + 1] if i + 1 < len(records) else 0, pc))
+            tasks.extend(struct.pack('<Q', frame))
+        prog = vmlinux_program(
+            dies,
+            symbols=[(f'func{i}', 0xffff0000 + 0x100 * i, 0x100, STB.GLOBAL)
+                     for i in range(1, 8)],
+            segments=[(self.STACKS_ADDRESS, stacks),
+                      (self.TASKS_ADDRESS, tasks)])
+        return prog, [Object(prog, 'struct task_struct *',
+                             value=self.TASKS_ADDRESS + 8 * i)
+                      for i in range(len(traces))]
+
+    @staticmethod
+    def pcs(trace):
+        return [frame.pc for frame in trace]
+
+    def test_stack_traces(self):
+        expected = [
+            [0xffff0100, 0xffff0200, 0xffff0300],
+            [0xffff0400],
+            [0xffff0500, 0xffff0600, 0xffff0700, 0xffff0100],
+        ]
+        prog, tasks = self.stack_trace_program(expected)
+        traces = prog.stack_traces(tasks)
+        self.assertEqual([self.pcs(trace) for trace in traces], expected)
+        for task, trace in zip(tasks, traces):
+            self.assertEqual(self.pcs(trace), self.pcs(prog.stack_trace(task)))
+            self.assertEqual(str(trace), str(prog.stack_trace(task)))
+        self.assertIn('func1', str(traces[0]))
+
+    def test_order(self):
+        expected = [[0xffff0100, 0xffff0200], [0xffff0300], [0xffff0400]]
+        prog, tasks = self.stack_trace_program(expected)
+        order = [2, 0, 1, 0]
+        traces = prog.stack_traces([tasks[i] for i in order])
+        self.assertEqual([self.pcs(trace) for trace in traces],
+                         [expected[i] for i in order])
+
+    def test_error(self):
+        prog, tasks = self.stack_trace_program([[0xffff0100], [0xffff0200]])
+        # A task whose saved stack pointer isn't mapped.
+        bad_task = Object(prog, 'struct task_struct *',
+                          value=self.STACKS_ADDRESS)
+        traces = prog.stack_traces([tasks[0], bad_task, tasks[1]])
+        self.assertEqual(self.pcs(traces[0]), [0xffff0100])
+        self.assertIsInstance(traces[1], FaultError)
+        self.assertEqual(self.pcs(traces[2]), [0xffff0200])
+        traces = prog.stack_traces([bad_task, tasks[1], bad_task])
+        self.assertIsInstance(traces[0], FaultError)
+        self.assertEqual(self.pcs(traces[1]), [0xffff0200])
+        self.assertIsInstance(traces[2], FaultError)
+        self.assertRaises(FaultError, prog.stack_trace, bad_task)
+        # The error doesn't affect later calls.
+        self.assertEqual([self.pcs(trace) for trace in
+                          prog.stack_traces(tasks)],
+                         [[0xffff0100], [0xffff0200]])
+
+
 class TestCoreDump(unittest.TestCase):
     def test_not_core_dump(self):
         prog = Program()
@@ -544,6 +1170,33 @@ class TestCoreDump(unittest.TestCase):
                                    'program memory was already initialized',
                                    prog.set_core_dump, f.name)
 
+    def test_concurrent(self):
+        prog = Program()
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(create_elf_file(ET.CORE, [
+                ElfSection(
+                    p_type=PT.LOAD,
+                    vaddr=0xffff0000,
+                    data=b'hello, world',
+                ),
+            ]))
+            f.flush()
+            expected = Program()
+            expected.set_core_dump(f.name)
+
+            def set_core_dump(_):
+                try:
+                    prog.set_core_dump(f.name)
+                    return True
+                except ValueError:
+                    return False
+
+            with concurrent.futures.ThreadPoolExecutor(4) as executor:
+                results = list(executor.map(set_core_dump, range(8)))
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(prog.platform, expected.platform)
+        self.assertEqual(prog.read(0xffff0000, 12), b'hello, world')
+
     def test_simple(self):
         data = b'hello, world'
         prog = Program()
@@ -592,3 +1245,46 @@ class TestCoreDump(unittest.TestCase):
             f.flush()
             prog.set_core_dump(f.name)
         self.assertEqual(prog.read(0xffff0000, len(data) + 4), data + bytes(4))
+
+    def test_truncated(self):
+        data = b'hello, world'
+        prog = Program()
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(create_elf_file(ET.CORE, [
+                ElfSection(
+                    p_type=PT.LOAD,
+                    vaddr=0xffff0000,
+                    data=data,
+                ),
+            ]))
+            f.flush()
+            f.truncate(f.tell() - 4)
+            prog.set_core_dump(f.name)
+        self.assertEqual(prog.read(0xffff0000, 4), data[:4])
+        self.assertRaisesRegex(FaultError, 'short read', prog.read,
+                               0xffff0000, len(data))
+
+    def test_buffer(self):
+        data = b'hello, world'
+        prog = Program()
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(create_elf_file(ET.CORE, [
+                ElfSection(
+                    p_type=PT.LOAD,
+                    vaddr=0xffff0000,
+                    data=data,
+                    memsz=len(data) + 4,
+                ),
+            ]))
+            f.flush()
+            prog.set_core_dump(f.name)
+        char_type = int_type('char', 1, True)
+        obj = Object(prog, array_type(5, char_type), address=0xffff0007)
+        view = memoryview(obj)
+        self.assertTrue(view.readonly)
+        self.assertEqual(view, b'world')
+        # The zero-filled part of the segment isn't in the file.
+        obj = Object(prog, array_type(len(data) + 4, char_type),
+                     address=0xffff0000)
+        self.assertRaises(BufferError, memoryview, obj)
+        self.assertEqual(memoryview(obj.read_()), data + bytes(4))